@@ -0,0 +1,247 @@
+"""
+上传和媒体处理的准入控制
+
+大文件提交会长时间占用worker并写满磁盘，同一批worker上的画廊读取随之超时。
+准入控制器在读取请求体之前决定是否接收：
+
+- 并发上限：槽位是 data/admission/<阶段>/slot-<n> 文件，持有者对文件加排他锁（fcntl），
+  所有worker进程共享；进程退出时锁自动释放，不会留下占用的槽位
+- 磁盘预留：持有槽位时在槽位文件中写入预留的字节数（请求的Content-Length），
+  新请求的预留加上其他持有者的预留和最低空闲空间超过磁盘的空闲空间时不接收；
+  持有者每把一部分数据写入磁盘就从预留中扣除（Ticket.consume），已经写入的字节只体现在空闲空间中，
+  不会被重复计算。请求体解析时暂存的临时文件不扣除，这部分仍按保守的方式计算
+- 有界等待：没有空闲槽位时在 wait-<n> 文件上排队（同样用文件锁计数），排队已满或等待超时返回429，
+  响应带Retry-After；新请求在有人排队时不插队
+
+非POSIX平台没有fcntl时只在进程内计数。
+"""
+import os
+import time
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+
+import metrics
+from logging_setup import fields
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只在进程内计数
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+def _reservation(reserve_bytes):
+    """槽位文件的内容：定长，更新预留时一次写入覆盖旧值，读取方不会读到拼接的数字"""
+    return f"{reserve_bytes:<20d}"
+
+
+class AdmissionRejected(Exception):
+    """请求未被接收：status为429（稍后重试）或507（磁盘空间不足以接收该请求）"""
+
+    def __init__(self, message, retry_after, status=429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+class Ticket:
+    """持有的槽位（排队位置），release() 可以重复调用"""
+
+    def __init__(self, controller, kind, index, handle, reserved=0):
+        self.controller = controller
+        self.kind = kind
+        self.index = index
+        self.reserved = reserved
+        self._handle = handle
+
+    def consume(self, written):
+        """written字节已经写入磁盘：从预留中扣除（磁盘的空闲空间已经减少，不再重复计算）"""
+        if self._handle is None or not self.reserved:
+            return
+        self.reserved = max(0, self.reserved - written)
+        if fcntl:
+            self._handle.seek(0)
+            self._handle.write(_reservation(self.reserved))
+            self._handle.flush()
+
+    def release(self):
+        handle, self._handle = self._handle, None
+        if handle is not None:
+            self.controller._release(self.kind, self.index, handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """一个处理阶段（如提交、视频转码）的并发上限、磁盘预留和等待队列"""
+
+    def __init__(self, folder, slots, queue_size, wait_seconds=10, disk_path=None, min_free_bytes=0,
+                 retry_after=5, poll_seconds=0.2, name='ingest'):
+        """
+        folder: 槽位文件所在目录（所有worker共享）
+        slots: 同时处理的请求数上限；queue_size: 排队等待的请求数上限（0表示不排队）
+        wait_seconds: 排队等待的最长秒数
+        disk_path: 需要预留空间的目录（上传目录），None表示不检查磁盘
+        min_free_bytes: 接收请求后磁盘上至少保留的空闲字节数
+        retry_after: 拒绝时Retry-After的秒数
+        """
+        self.folder = folder
+        self.slots = max(1, slots)
+        self.queue_size = max(0, queue_size)
+        self.wait_seconds = wait_seconds
+        self.disk_path = disk_path
+        self.min_free_bytes = min_free_bytes
+        self.retry_after = retry_after
+        self.poll_seconds = poll_seconds
+        self.name = name
+        self.lock_file = os.path.join(folder, '.lock')
+        self._lock = threading.Lock()
+        # 没有fcntl时进程内持有的槽位：{(类型, 序号)}
+        self._held = set()
+        os.makedirs(folder, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """分配槽位期间互斥（线程之间和进程之间）"""
+        with self._lock:
+            with open(self.lock_file, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _path(self, kind, index):
+        return os.path.join(self.folder, f"{kind}-{index}")
+
+    def _scan(self, kind, count):
+        """返回 (空闲的序号列表, 被占用槽位的预留字节数之和)"""
+        free, reserved = [], 0
+        for index in range(count):
+            if not fcntl:
+                if (kind, index) not in self._held:
+                    free.append(index)
+                continue
+            with open(self._path(kind, index), 'a+') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    f.seek(0)
+                    try:
+                        reserved += int(f.read() or 0)
+                    except ValueError:
+                        pass
+                    continue
+                fcntl.flock(f, fcntl.LOCK_UN)
+                free.append(index)
+        return free, reserved
+
+    def _take(self, kind, index, reserve_bytes=0):
+        """占用一个槽位（调用方持有分配锁）"""
+        handle = None
+        if fcntl:
+            handle = open(self._path(kind, index), 'r+')
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            handle.truncate(0)
+            handle.write(_reservation(reserve_bytes))
+            handle.flush()
+        else:
+            self._held.add((kind, index))
+            handle = True
+        return Ticket(self, kind, index, handle, reserve_bytes)
+
+    def _release(self, kind, index, handle):
+        if fcntl:
+            # 先清空预留再解锁，其他进程不会读到已经失效的预留
+            handle.truncate(0)
+            handle.flush()
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+        else:
+            with self._lock:
+                self._held.discard((kind, index))
+
+    def try_acquire(self, reserve_bytes=0, queued=False):
+        """
+        不等待地申请一个槽位，返回Ticket；没有空闲槽位（或有人排队而自己不在队列中）时返回None
+
+        reserve_bytes: 需要预留的磁盘空间；磁盘空闲空间在所有持有者都完成后也不够时抛出AdmissionRejected(507)
+        """
+        with self._locked():
+            if not queued and self.queue_size and len(self._scan('wait', self.queue_size)[0]) < self.queue_size:
+                return None  # 已经有人排队，不插队
+            free, reserved = self._scan('slot', self.slots)
+            if self.disk_path is not None and reserve_bytes:
+                available = shutil.disk_usage(self.disk_path).free - self.min_free_bytes
+                if reserve_bytes > available:
+                    metrics.inc('admission_requests_total', stage=self.name, result='insufficient_storage')
+                    raise AdmissionRejected('磁盘空间不足，无法接收该上传', self.retry_after, status=507)
+                if reserve_bytes + reserved > available:
+                    return None  # 其他上传完成、预留释放后再接收
+            if not free:
+                return None
+            return self._take('slot', free[0], reserve_bytes)
+
+    def enqueue(self):
+        """占用一个排队位置，返回Ticket；队列已满时抛出AdmissionRejected(429)"""
+        with self._locked():
+            free, _ = self._scan('wait', self.queue_size)
+            if not free:
+                metrics.inc('admission_requests_total', stage=self.name, result='queue_full')
+                raise AdmissionRejected('当前上传人数过多，请稍后重试', self.retry_after)
+            return self._take('wait', free[0])
+
+    def acquire(self, reserve_bytes=0, timeout=None):
+        """
+        申请一个槽位，必要时排队等待，返回Ticket
+
+        timeout: 最长等待秒数，默认为wait_seconds；排队已满或等待超时时抛出AdmissionRejected(429)
+        """
+        started = time.monotonic()
+        ticket = self.try_acquire(reserve_bytes)
+        if ticket is not None:
+            return self.admitted(ticket)
+        with self.enqueue():
+            deadline = started + (self.wait_seconds if timeout is None else timeout)
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_seconds)
+                ticket = self.try_acquire(reserve_bytes, queued=True)
+                if ticket is not None:
+                    return self.admitted(ticket, started)
+        raise self.timed_out(started)
+
+    def admitted(self, ticket, queued_at=None):
+        """记录接收的请求（queued_at: 开始排队的时间，直接接收时为None），返回ticket"""
+        if queued_at is None:
+            metrics.inc('admission_requests_total', stage=self.name, result='admitted')
+        else:
+            metrics.inc('admission_requests_total', stage=self.name, result='admitted_after_wait')
+            metrics.observe('admission_wait_seconds', time.monotonic() - queued_at, stage=self.name)
+        return ticket
+
+    def timed_out(self, queued_at):
+        """排队等待超时：记录并返回要抛出的AdmissionRejected"""
+        metrics.inc('admission_requests_total', stage=self.name, result='timeout')
+        log.info('排队等待超时', extra=fields(stage=self.name, waited=round(time.monotonic() - queued_at, 1)))
+        return AdmissionRejected('当前上传人数过多，请稍后重试', self.retry_after)
+
+    def status(self):
+        """当前的占用情况（管理后台和排查问题使用）"""
+        with self._locked():
+            free, reserved = self._scan('slot', self.slots)
+            waiting = self.queue_size - len(self._scan('wait', self.queue_size)[0])
+        result = {'slots': self.slots, 'active': self.slots - len(free), 'queue_size': self.queue_size,
+                  'waiting': waiting, 'reserved_bytes': reserved}
+        if self.disk_path is not None:
+            result['free_bytes'] = shutil.disk_usage(self.disk_path).free
+            result['min_free_bytes'] = self.min_free_bytes
+        return result
@@ -1,6 +1,9 @@
-from flask import Flask, request, render_template, jsonify, send_from_directory, session, redirect, url_for
-from werkzeug.exceptions import RequestEntityTooLarge
+from flask import Flask, Blueprint, current_app, request, render_template, jsonify, send_from_directory, send_file, session, redirect, url_for, g, Response, has_request_context, has_app_context, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge, NotFound
+from werkzeug.security import safe_join
 import os
+import gzip
+import shutil
 import json
 from datetime import datetime
 from werkzeug.utils import secure_filename
@@ -9,53 +12,113 @@ import uuid
 import subprocess
 import functools
 import hashlib
+import hmac
 import base64
+import time
+import logging
+import click
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from flask.cli import with_appcontext
+
+import metrics
+from logging_setup import fields, setup_from_env
+from media_gc import MediaGC, media_key
+from media_tiering import MediaTiering
+from fragment_cache import FragmentCache
+from static_site import StaticSite, IndexSource
+from duplicates import DuplicateIndex
+from moderation_queue import ModerationQueue
+from events import EventLog
+from compression import ResponseCompressor, precompress_folder, find_precompressed, choose_encoding
+import fsck
+from replication import ChangeLog, Replica, make_source, index_delta, apply_index_delta, snapshot_lines
+from admission import AdmissionController, AdmissionRejected
+from compact_index import MISSING as INDEX_MISSING
+from index_partitions import IndexPartitions, partition_key, split as split_partitions, merge as merge_partitions
+from profiling import Profiler, FORMATS as PROFILE_FORMATS
+
+# 默认配置，create_app(config) 传入的配置会覆盖这些值
+DEFAULT_CONFIG = {
+    'UPLOAD_FOLDER': 'uploads',
+    'GENERATED_FOLDER': 'generated',
+    'OUTPUT_FOLDER': 'output',
+    'DATA_FOLDER': 'data',
+    'THUMBNAIL_FOLDER': 'thumbnails',
+    'MAX_CONTENT_LENGTH': 2 * 1024 * 1024 * 1024,  # 2GB max file size
+    'SECRET_KEY': 'your-secret-key-change-this-in-production',  # 用于session加密
+    'AUTH_FILE': os.path.join(os.path.dirname(os.path.abspath(__file__)), '.auth'),  # .auth文件路径
+    # worker角色：all=全部路由，api=只读画廊/API/媒体（不加载媒体处理流水线和OpenCV），manage=表单提交和管理后台
+    'APP_ROLE': os.environ.get('APP_ROLE', 'all'),
+    'GC_GRACE_SECONDS': 24 * 3600,  # 孤立媒体文件的回收宽限期
+    'COLD_FOLDER': 'cold',  # 冷存储目录（可以挂载到大容量的慢盘或网络卷）
+    'TIER_IDLE_SECONDS': 30 * 86400,  # 超过该时间没有被访问的媒体文件迁移到冷存储（待审核记录的文件除外）
+    'TIER_REJECTED_IDLE_SECONDS': 86400,  # 所属记录都已被拒绝的文件使用的空闲时间
+    'TIER_PROMOTE_HITS': 3,  # 冷存储中的文件被访问这么多次后迁回热存储
+    'SSR_GALLERY': True,  # 画廊首屏和详情页数据在服务端渲染（片段缓存），False时由浏览器通过API加载
+    'SSR_PER_PAGE': 12,  # 服务端渲染的首屏卡片数（与gallery.html中的perPage一致）
+    'VIDEO_RENDITIONS': True,  # 提交后在后台为视频生成低码率预览（详情页优先播放），存量视频由 flask rebuild-previews 补齐
+    'RENDITION_MAX_WIDTH': 640,  # 视频预览的最大宽度
+    'RENDITION_MAX_FPS': 15,  # 视频预览的最大帧率
+    'RENDITION_WORKERS': 1,  # 每个worker进程中生成视频预览、计算感知哈希的后台线程数
+    # 准入控制：限制同时处理的提交数（所有worker合计）并预留磁盘空间，保证上传高峰时读请求仍有worker可用
+    'ADMISSION_INGEST_SLOTS': 2,  # 同时处理的提交数，应小于worker线程总数
+    'ADMISSION_QUEUE': 8,  # 排队等待的提交数上限，超过时直接返回429
+    'ADMISSION_WAIT_SECONDS': 10,  # 排队等待的最长时间，超时返回429
+    'ADMISSION_MIN_FREE_BYTES': 1024 * 1024 * 1024,  # 接收上传后上传目录所在磁盘至少保留的空闲空间
+    'ADMISSION_RETRY_AFTER': 5,  # 返回429时Retry-After的秒数
+    'ADMISSION_MEDIA_SLOTS': 1,  # 同时执行的视频转码数（所有worker合计）
+    'DUPLICATE_MAX_DISTANCE': 8,  # 生成结果的pHash汉明距离不超过该值视为近似重复（0-64）
+    'REVIEW_LEASE_SECONDS': 300,  # 审核队列租约时长，超时未提交的记录回到队列
+    'REVIEW_CLAIM_MAX': 50,  # 审核员一次最多持有的记录数
+    'BATCH_FETCH_MAX': 100,  # POST /api/records/batch 一次最多获取的记录数
+    'BATCH_FETCH_WORKERS': 8,  # 批量获取时并发读取记录文件的线程数
+    'SSE_POLL_SECONDS': 1.0,  # SSE连接检查新事件的间隔
+    'SSE_KEEPALIVE_SECONDS': 15,  # 没有事件时发送注释行的间隔（防止代理断开空闲连接）
+    'SSE_RESYNC_SECONDS': 300,  # SSE连接重新发送完整统计的间隔（校正增量的累计误差）
+    'SSE_MAX_SECONDS': 600,  # 单个SSE连接的最长时间，到期结束响应由浏览器重连（断开后没被发现的连接最多占用线程这么久）
+    'STATIC_EXPORT': False,  # 审核/删除记录时增量更新 OUTPUT_FOLDER 中的静态站点（首次使用前执行 flask export-static）
+    'ASGI_IO_THREADS': 32,  # ASGI模式：读取文件、索引和记录的线程数
+    'ASGI_WSGI_THREADS': 16,  # ASGI模式：执行其余Flask路由的线程数
+    'COMPRESS_MIN_SIZE': 1024,  # JSON/HTML响应超过该字节数时按Accept-Encoding压缩
+    'COMPRESS_CACHE_BYTES': 32 * 1024 * 1024,  # 压缩结果缓存（按内容摘要）的最大字节数
+    'PRECOMPRESS_STATIC': True,  # 启动时为static/下的文件生成.gz/.br预压缩版本（也可用 flask compress-static）
+    # 只读副本：主节点开启REPLICATION_LOG后发布变更日志，副本设置REPLICA_SOURCE（主节点的data目录或http地址）
+    'REPLICATION_LOG': False,  # 主节点：写索引和记录时追加变更日志（data/changelog/）
+    'REPLICATION_TOKEN': '',  # 访问 /replication/ 接口的令牌（为空时不提供HTTP接口，副本只能从data目录同步）
+    'CHANGELOG_SEGMENT_BYTES': 8 * 1024 * 1024,  # 变更日志单段大小
+    'CHANGELOG_KEEP_SEGMENTS': 8,  # 保留的变更日志段数，落后更多的副本重新复制快照
+    'REPLICA_SOURCE': None,  # 副本：主节点的data目录或 http://主节点地址（只能与APP_ROLE=api一起使用）
+    'REPLICA_MAX_LAG': 30,  # 副本超过该秒数没有同步成功时，读接口返回503
+    'REPLICA_POLL_SECONDS': 1.0,  # flask replicate --follow 拉取变更的间隔
+    'METRICS_DIR': None,  # 多进程指标快照目录（默认 <DATA_FOLDER>/metrics）
+    'PROFILE_POLL_SECONDS': 1.0,  # 各worker检查剖析开关（data/profiling/settings.json）的间隔
+    'LOG_LEVEL': 'INFO',  # 默认日志级别（环境变量LOG_LEVEL优先）
+    'LOG_LEVELS': {},  # 按模块设置级别，如 {'app.media': 'DEBUG'}（环境变量LOG_LEVELS优先）
+    'LOG_SAMPLE_RATES': {'preview': 0.1, 'thumbnail': 0.1, 'api.record': 0.01},  # 高频日志的采样比例
+    'LOG_FORMAT': 'text',  # text 或 json（环境变量LOG_FORMAT优先）
+}
 
-try:
-    import cv2
-    CV2_AVAILABLE = True
-    print(f"OpenCV导入成功，版本: {cv2.__version__}")
-except ImportError as e:
-    CV2_AVAILABLE = False
-    print(f"警告: OpenCV导入失败: {e}")
-    print("视频缩略图功能将被禁用。")
-    print("诊断信息:")
-    import sys
-    print(f"Python版本: {sys.version}")
-    try:
-        import importlib.util
-        spec = importlib.util.find_spec("cv2")
-        if spec:
-            print(f"cv2模块位置: {spec.origin}")
-        else:
-            print("cv2模块未找到")
-    except Exception as e2:
-        print(f"查找cv2模块失败: {e2}")
-
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['GENERATED_FOLDER'] = 'generated'
-app.config['OUTPUT_FOLDER'] = 'output'
-app.config['DATA_FOLDER'] = 'data'
-app.config['THUMBNAIL_FOLDER'] = 'thumbnails'
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB max file size
-app.config['SECRET_KEY'] = 'your-secret-key-change-this-in-production'  # 用于session加密
-
-# .auth文件路径
-AUTH_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.auth')
-
-# 确保必要的文件夹存在
-for folder in [app.config['UPLOAD_FOLDER'], app.config['GENERATED_FOLDER'],
-               app.config['OUTPUT_FOLDER'], app.config['DATA_FOLDER'],
-               app.config['THUMBNAIL_FOLDER']]:
-    os.makedirs(folder, exist_ok=True)
-
-DATA_FILE = os.path.join(app.config['DATA_FOLDER'], 'records.json')
-INDEX_FILE = os.path.join(app.config['DATA_FOLDER'], 'index.json')
-RECORDS_DIR = os.path.join(app.config['DATA_FOLDER'], 'records')
-
-# 确保记录目录存在
-os.makedirs(RECORDS_DIR, exist_ok=True)
+APP_ROLES = ('all', 'api', 'manage')
+
+auth_log = logging.getLogger('app.auth')
+storage_log = logging.getLogger('app.storage')
+api_log = logging.getLogger('app.api')
+
+# 只读路由（画廊页面、公开API、媒体文件）和管理路由（表单提交、管理后台）
+# 分属两个蓝图，便于按角色部署只处理读请求的worker
+api_bp = Blueprint('api', __name__)
+manage_bp = Blueprint('manage', __name__, cli_group=None)
+
+# 存储路径，由 create_app() 根据配置设置（一个进程只服务一个应用实例）
+AUTH_FILE = DEFAULT_CONFIG['AUTH_FILE']
+DATA_FILE = os.path.join(DEFAULT_CONFIG['DATA_FOLDER'], 'records.json')
+# 旧的单文件索引，第一次访问时拆分为 data/index/ 下按app_id的分区（INDEX_PARTITIONS）
+INDEX_FILE = os.path.join(DEFAULT_CONFIG['DATA_FOLDER'], 'index.json')
+INDEX_PARTITIONS = None
+RECORDS_DIR = os.path.join(DEFAULT_CONFIG['DATA_FOLDER'], 'records')
+
+# 记录文件按id的哈希分片：data/records/<app_id>/<md5(id)前两位>/<id>.json（每个app_id最多256个子目录）
+RECORD_SHARD_CHARS = 2
 
 # 允许的文件类型
 ALLOWED_EXTENSIONS = {
@@ -82,7 +145,7 @@ def load_auth_data():
             with open(AUTH_FILE, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except Exception as e:
-            print(f"[Auth] 读取.auth文件失败: {e}")
+            auth_log.error('读取.auth文件失败', extra=fields(error=e))
             return None
     return None
 
@@ -95,7 +158,7 @@ def save_auth_data(auth_data):
         os.chmod(AUTH_FILE, 0o600)
         return True
     except Exception as e:
-        print(f"[Auth] 保存.auth文件失败: {e}")
+        auth_log.error('保存.auth文件失败', extra=fields(error=e))
         return False
 
 def check_admin_exists():
@@ -125,7 +188,7 @@ def create_admin_account(username, password):
     }
 
     if save_auth_data(auth_data):
-        print(f"[Auth] 管理员账号创建成功: {username}")
+        auth_log.info('管理员账号创建成功', extra=fields(username=username))
         return True
     return False
 
@@ -139,7 +202,7 @@ def update_admin_password(new_password):
     auth_data['updated_at'] = datetime.now().isoformat()
 
     if save_auth_data(auth_data):
-        print(f"[Auth] 密码更新成功: {auth_data['username']}")
+        auth_log.info('密码更新成功', extra=fields(username=auth_data['username']))
         return True
     return False
 
@@ -157,57 +220,273 @@ def allowed_file(filename):
     all_extensions = [ext for extensions in ALLOWED_EXTENSIONS.values() for ext in extensions]
     return ext in all_extensions
 
+def write_json_atomic(path, data):
+    """先写临时文件再原子替换，并发读取时不会读到写了一半的JSON；返回写入文件的stat（替换不改变inode和mtime）"""
+    tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            stat = os.fstat(f.fileno())
+        os.replace(tmp_path, path)
+        return stat
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@metrics.timed('index_load_seconds')
 def load_records():
-    """加载记录索引（轻量级）"""
-    # 优先使用新的索引文件
-    if os.path.exists(INDEX_FILE):
-        with open(INDEX_FILE, 'r', encoding='utf-8') as f:
-            index_data = json.load(f)
-            return index_data.get('records', [])
-
+    """加载记录索引（轻量级，按创建时间合并所有app_id分区）"""
     # 兼容旧的单文件模式
-    if os.path.exists(DATA_FILE):
+    if not INDEX_PARTITIONS.exists() and not os.path.exists(INDEX_FILE) and os.path.exists(DATA_FILE):
         with open(DATA_FILE, 'r', encoding='utf-8') as f:
             old_records = json.load(f)
             # 迁移到新格式
             migrate_to_index(old_records)
             return old_records
 
-    return []
-
+    return INDEX_PARTITIONS.read_all()
+
+def load_partition(app_id):
+    """加载一个app_id分区的索引条目（最新的在前），只读取该应用的分区文件"""
+    return INDEX_PARTITIONS.read(partition_key(app_id))
+
+def get_changelog():
+    """主节点的变更日志（未开启复制或不在应用上下文中时为None）"""
+    return current_app.extensions.get('changelog') if has_app_context() else None
+
+def read_index_file():
+    """直接读取所有分区中的条目（不兼容旧的单文件格式，供计算变更使用）"""
+    return INDEX_PARTITIONS.read_all()
+
+def update_index_partition(app_id, update):
+    """
+    在分区锁内读取、修改并保存app_id所在的分区，返回新的条目列表
+
+    update接收分区当前的条目列表（不要修改其中的条目），返回新的条目列表；内容没有变化时不写文件。
+    不同app_id的分区互不等待（开启复制时追加变更仍在变更日志的锁内）。
+    """
+    key = partition_key(app_id)
+    with INDEX_PARTITIONS.locked(key):
+        old = INDEX_PARTITIONS.read(key)
+        records = update(old)
+        if records == old:
+            return records
+        changelog = get_changelog()
+        if changelog is None:
+            INDEX_PARTITIONS.write(key, records)
+        else:
+            with changelog.transaction() as changes:
+                INDEX_PARTITIONS.write(key, records)
+                delta = index_delta(old, records)
+                if delta:
+                    op, data = delta
+                    changes.append((op, dict(data, partition=key)))
+    return records
+
+def update_index_entries(changed=(), removed=()):
+    """把修改过的索引条目（按id替换）和删除的条目写回各自app_id的分区，只重写涉及的分区，每个分区保存一次"""
+    partitions = {}
+    for entry in changed:
+        partitions.setdefault(partition_key(entry.get('app_id')), ({}, set()))[0][entry['id']] = entry
+    for entry in removed:
+        partitions.setdefault(partition_key(entry.get('app_id')), ({}, set()))[1].add(entry['id'])
+    for key, (updates, removed_ids) in partitions.items():
+        update_index_partition(key, lambda records, updates=updates, removed_ids=removed_ids: [
+            updates.get(entry['id'], entry) for entry in records if entry['id'] not in removed_ids])
+
+@metrics.timed('index_save_seconds')
 def save_records(records):
-    """保存记录索引"""
-    index_data = {
-        'records': records,
-        'updated_at': datetime.now().isoformat(),
-        'total_count': len(records)
-    }
-    with open(INDEX_FILE, 'w', encoding='utf-8') as f:
-        json.dump(index_data, f, ensure_ascii=False, indent=2)
-
+    """保存完整的记录索引：按app_id拆分，只重写内容有变化的分区（开启复制时同时追加各分区的变更）"""
+    groups = split_partitions(records)
+    for key in sorted(set(INDEX_PARTITIONS.keys()) | set(groups)):
+        update_index_partition(key, lambda _, entries=groups.get(key, []): entries)
+
+def load_index_view(app_id=None):
+    """
+    与索引分区一致的紧凑索引（只读的列表、筛选和查找使用，不为每个请求解析索引文件）
+
+    指定app_id时只映射该应用的分区，否则返回所有分区的合并视图。
+    """
+    if not INDEX_PARTITIONS.exists() and not os.path.exists(INDEX_FILE) and os.path.exists(DATA_FILE):
+        load_records()  # 兼容旧的单文件模式：先迁移
+    if app_id is not None:
+        return INDEX_PARTITIONS.view(partition_key(app_id))
+    return INDEX_PARTITIONS.merged_view()
+
+def record_shard(record_id):
+    """记录id对应的分片目录名（id本身以时间戳开头，直接取前缀会集中在少数目录，所以取哈希）"""
+    return hashlib.md5(record_id.encode('utf-8')).hexdigest()[:RECORD_SHARD_CHARS]
+
+def record_file_path(record_id, app_id):
+    """记录文件在分片布局下的路径"""
+    return os.path.join(RECORDS_DIR, app_id, record_shard(record_id), f"{record_id}.json")
+
+def legacy_record_file_path(record_id, app_id):
+    """记录文件在旧的平铺布局（data/records/<app_id>/<id>.json）下的路径"""
+    return os.path.join(RECORDS_DIR, app_id, f"{record_id}.json")
+
+@metrics.timed('record_io_seconds', op='load')
 def load_record(record_id, app_id):
-    """加载单个完整记录"""
-    app_dir = os.path.join(RECORDS_DIR, app_id)
-    record_file = os.path.join(app_dir, f"{record_id}.json")
-    if os.path.exists(record_file):
-        with open(record_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+    """加载单个完整记录（先查分片目录，找不到时兼容尚未迁移的平铺布局）"""
+    sharded_file = record_file_path(record_id, app_id)
+    # 最后再查一次分片目录：两次查找之间文件可能刚被在线迁移工具移走
+    for record_file in (sharded_file, legacy_record_file_path(record_id, app_id), sharded_file):
+        try:
+            with open(record_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            continue
     return None
 
+def find_record(record_id, app_id=None):
+    """加载完整记录；旧的索引条目缺少app_id时在所有app_id目录中查找（只用于后台任务）"""
+    if app_id:
+        return load_record(record_id, app_id)
+    try:
+        app_ids = sorted(os.listdir(RECORDS_DIR))
+    except FileNotFoundError:
+        return None
+    for candidate in app_ids:
+        if os.path.isdir(os.path.join(RECORDS_DIR, candidate)):
+            record = load_record(record_id, candidate)
+            if record:
+                return record
+    return None
+
+@metrics.timed('record_io_seconds', op='save')
 def save_record(record):
-    """保存单个记录到app_id对应的子目录"""
+    """保存单个记录到app_id下的分片目录"""
     app_id = record.get('app_id', 'default')
-    app_dir = os.path.join(RECORDS_DIR, app_id)
-    os.makedirs(app_dir, exist_ok=True)
-
-    record_file = os.path.join(app_dir, f"{record['id']}.json")
-    with open(record_file, 'w', encoding='utf-8') as f:
-        json.dump(record, f, ensure_ascii=False, indent=2)
+    record_file = record_file_path(record['id'], app_id)
+    os.makedirs(os.path.dirname(record_file), exist_ok=True)
+    legacy_file = legacy_record_file_path(record['id'], app_id)
+    if not os.path.exists(legacy_file):
+        write_record_file(record_file, record)
+        return record
+    # 旧布局下还有副本：与reshard_app_records互斥，迁移不会用旧版本覆盖刚写入的分片文件
+    with record_files_locked(app_id):
+        write_record_file(record_file, record)
+        # 分片文件已是最新版本，旧布局下的副本不再需要
+        try:
+            os.remove(legacy_file)
+        except FileNotFoundError:
+            pass
     return record
 
+def write_record_file(record_file, record):
+    changelog = get_changelog()
+    if changelog is None:
+        write_json_atomic(record_file, record)
+        return
+    with changelog.transaction() as changes:
+        write_json_atomic(record_file, record)
+        changes.append(('record', record))
+
+def record_files_locked(app_id):
+    """
+    修改app_id下记录文件布局期间持有的锁（即该app_id的索引分区锁）
+
+    删除记录、覆盖旧布局下的记录和在线迁移互斥。开启复制时要在变更日志的事务之外获取，
+    与update_index_partition的加锁顺序一致。
+    """
+    return INDEX_PARTITIONS.locked(partition_key(app_id))
+
+def delete_record_file(record_id, app_id):
+    """删除记录文件（分片布局和旧布局下的都删除）"""
+    with record_files_locked(app_id):
+        changelog = get_changelog()
+        if changelog is not None:
+            with changelog.transaction() as changes:
+                remove_record_files(record_id, app_id)
+                changes.append(('delete', {'id': record_id, 'app_id': app_id}))
+            return
+        remove_record_files(record_id, app_id)
+
+def remove_record_files(record_id, app_id):
+    for record_file in (record_file_path(record_id, app_id), legacy_record_file_path(record_id, app_id)):
+        try:
+            os.remove(record_file)
+        except FileNotFoundError:
+            pass
+
+def reshard_app_records(app_id, limit=None, dry_run=False):
+    """
+    把一个app_id下平铺的记录文件迁移到分片目录，返回 {'moved', 'skipped', 'unindexed', 'remaining'}
+
+    可以在服务运行时执行：在分区锁内确认记录仍在索引中，先把文件链接（不支持硬链接时复制）到分片路径
+    （目标已存在时不覆盖，说明save_record已写入更新的版本），再删除旧路径。任意时刻load_record都能找到记录，
+    并发删除的记录也不会被迁移复活。不在索引中的文件原样保留（unindexed），由 flask fsck 处理。
+    limit: 本次最多迁移的文件数（None为全部），剩余的下次调用继续
+    """
+    app_dir = os.path.join(RECORDS_DIR, app_id)
+    result = {'moved': 0, 'skipped': 0, 'unindexed': 0, 'remaining': 0}
+    with os.scandir(app_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.json') or not entry.is_file():
+                continue
+            record_id = entry.name[:-len('.json')]
+            if load_index_view(app_id).find(record_id) is None:
+                result['unindexed'] += 1
+                continue
+            if limit is not None and result['moved'] + result['skipped'] >= limit:
+                result['remaining'] += 1
+                continue
+            if dry_run:
+                result['moved'] += 1
+                continue
+            result['moved' if move_legacy_record(record_id, app_id) else 'skipped'] += 1
+    return result
+
+def move_legacy_record(record_id, app_id):
+    """把一个旧布局下的记录文件移到分片路径，返回是否移动（分片目录已有更新的版本、记录已删除时返回False）"""
+    source = legacy_record_file_path(record_id, app_id)
+    target = record_file_path(record_id, app_id)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with record_files_locked(app_id):
+        # 加锁前记录可能刚被删除：删除时先删文件再移除索引条目，两者都要确认
+        if load_index_view(app_id).find(record_id) is None or not os.path.exists(source):
+            return False
+        moved = True
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            moved = False
+        except OSError:
+            # 文件系统不支持硬链接（EPERM/ENOTSUP/EXDEV等）：复制后原子替换；锁内save_record不会同时写入
+            if os.path.exists(target):
+                moved = False
+            else:
+                tmp_path = f"{target}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+                try:
+                    shutil.copy2(source, tmp_path)
+                    os.replace(tmp_path, target)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        try:
+            os.remove(source)
+        except FileNotFoundError:
+            pass
+        return moved
+
+def build_index_entry(record):
+    """根据完整记录生成轻量级索引条目"""
+    main_preview = get_main_preview(record)
+    return {
+        'id': record['id'],
+        'created_at': record['created_at'],
+        'title': record['title'],
+        'app_id': record.get('app_id'),
+        'generation_time': record['generation_time'],
+        'has_preview': bool(main_preview),
+        'preview_type': main_preview['type'] if main_preview else None,
+        'status': record.get('status', STATUS_PENDING)  # 索引中也保存状态
+    }
+
 def migrate_to_index(old_records):
     """将旧的单文件数据迁移到新的分文件格式"""
-    print("正在迁移数据到新的分文件格式...")
+    storage_log.info('正在迁移数据到新的分文件格式')
 
     for record in old_records:
         # 保存完整记录到独立文件
@@ -236,9 +515,9 @@ def migrate_to_index(old_records):
     if os.path.exists(DATA_FILE):
         backup_file = DATA_FILE + '.backup'
         os.rename(DATA_FILE, backup_file)
-        print(f"旧数据已备份到: {backup_file}")
+        storage_log.info('旧数据已备份', extra=fields(backup=backup_file))
 
-    print(f"已迁移 {len(old_records)} 条记录到新格式")
+    storage_log.info('数据迁移完成', extra=fields(records=len(old_records)))
 
 def parse_parameters(params_text):
     """解析参数信息文本，转换为结构化数据"""
@@ -340,113 +619,6 @@ def format_parameters(parameters):
 
     return '\n'.join(lines)
 
-def generate_video_thumbnail(video_path, filename):
-    """从视频中提取第一帧作为缩略图"""
-    print(f"[DEBUG] generate_video_thumbnail called: filename={filename}, path={video_path}")
-    print(f"[DEBUG] CV2_AVAILABLE: {CV2_AVAILABLE}")
-
-    if not CV2_AVAILABLE:
-        print("[DEBUG] OpenCV not available, returning None")
-        return None
-
-    try:
-        # 生成缩略图文件名
-        thumbnail_name = f"thumb_{os.path.splitext(filename)[0]}.jpg"
-        thumbnail_path = os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_name)
-
-        print(f"[DEBUG] Thumbnail name: {thumbnail_name}")
-        print(f"[DEBUG] Thumbnail path: {thumbnail_path}")
-        print(f"[DEBUG] Video file exists: {os.path.exists(video_path)}")
-
-        # 如果缩略图已存在，直接返回
-        if os.path.exists(thumbnail_path):
-            print(f"[DEBUG] Thumbnail already exists, returning: /thumbnails/{thumbnail_name}")
-            return f"/thumbnails/{thumbnail_name}"
-
-        # 使用OpenCV读取视频第一帧
-        print(f"[DEBUG] Attempting to read video with cv2.VideoCapture...")
-        video = cv2.VideoCapture(video_path)
-        print(f"[DEBUG] VideoCapture opened: {video.isOpened()}")
-
-        success, frame = video.read()
-        print(f"[DEBUG] Frame read success: {success}, frame shape: {frame.shape if success else 'N/A'}")
-
-        if success:
-            # 调整大小为宽度300px
-            height, width = frame.shape[:2]
-            new_width = 300
-            new_height = int(height * (new_width / width))
-            resized_frame = cv2.resize(frame, (new_width, new_height))
-
-            # 保存为JPEG
-            cv2.imwrite(thumbnail_path, resized_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            print(f"[DEBUG] Thumbnail saved to: {thumbnail_path}")
-            print(f"[DEBUG] Thumbnail file exists after save: {os.path.exists(thumbnail_path)}")
-            video.release()
-            return f"/thumbnails/{thumbnail_name}"
-
-        video.release()
-        print(f"[DEBUG] Failed to read video frame, returning None")
-        return None
-    except Exception as e:
-        print(f"[DEBUG] 生成视频缩略图失败: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
-
-def extract_text_preview(file_path):
-    """从文本文件中提取前100个字符作为预览"""
-    try:
-        # 尝试不同编码读取
-        encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1']
-
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    content = f.read(100)
-                    return content
-            except UnicodeDecodeError:
-                continue
-
-        return None
-    except Exception as e:
-        print(f"提取文本预览失败: {e}")
-        return None
-
-def generate_preview_info(file_info, folder_type):
-    """为文件生成预览信息"""
-    print(f"[DEBUG] generate_preview_info called: category={file_info['category']}, filename={file_info['filename']}")
-
-    preview = {
-        'type': file_info['category'],
-        'filename': file_info['filename']
-    }
-
-    file_path = file_info['path']
-
-    if file_info['category'] == 'image':
-        # 图像直接使用文件路径
-        preview['url'] = f"/{folder_type}/{file_info['filename']}"
-        print(f"[DEBUG] Image preview: {preview['url']}")
-    elif file_info['category'] == 'video':
-        # 视频生成缩略图
-        print(f"[DEBUG] Video file detected, calling generate_video_thumbnail...")
-        print(f"[DEBUG] Video full_path: {file_info.get('full_path', 'N/A')}")
-        thumbnail_url = generate_video_thumbnail(file_info['full_path'], file_info['filename'])
-        print(f"[DEBUG] Video thumbnail result: {thumbnail_url}")
-        if thumbnail_url:
-            preview['thumbnail'] = thumbnail_url
-        else:
-            preview['thumbnail'] = None
-    elif file_info['category'] == 'text':
-        # 文本提取预览
-        text_preview = extract_text_preview(file_path)
-        preview['text'] = text_preview if text_preview else ''
-        print(f"[DEBUG] Text preview length: {len(preview['text']) if preview['text'] else 0}")
-
-    print(f"[DEBUG] Final preview object: {preview}")
-    return preview
-
 def get_cover_image(record):
     """获取记录的封面图片"""
     # 优先使用生成的结果图片
@@ -461,62 +633,170 @@ def get_cover_image(record):
 
 def get_main_preview(record):
     """获取记录的主预览信息"""
-    print(f"[DEBUG] get_main_preview called for record: {record.get('title', 'N/A')}")
-
     # 优先使用生成结果
-    results = record.get('files', {}).get('results', [])
-    print(f"[DEBUG] Record has {len(results)} result files")
-
-    for i, result in enumerate(results):
-        print(f"[DEBUG] Checking result {i}: category={result.get('category')}, has_preview={'preview' in result}")
+    for result in record.get('files', {}).get('results', []):
         if 'preview' in result:
-            print(f"[DEBUG] Found preview in result {i}: {result['preview']}")
             return {
                 'type': result['category'],
                 'data': result['preview']
             }
 
     # 如果没有生成结果，使用素材
-    materials = record.get('files', {}).get('materials', [])
-    print(f"[DEBUG] Record has {len(materials)} material files")
-
-    for i, material in enumerate(materials):
-        print(f"[DEBUG] Checking material {i}: category={material.get('category')}, has_preview={'preview' in material}")
+    for material in record.get('files', {}).get('materials', []):
         if 'preview' in material:
-            print(f"[DEBUG] Found preview in material {i}: {material['preview']}")
             return {
                 'type': material['category'],
                 'data': material['preview']
             }
 
-    print(f"[DEBUG] No preview found, returning None")
     return None
 
-@app.errorhandler(RequestEntityTooLarge)
+# ==================== 应用级钩子（由create_app注册，与worker角色无关） ====================
+
+def start_request_timer():
+    """记录请求开始时间，用于统计路由延迟"""
+    g.request_started = time.perf_counter()
+
+def record_request_metrics(response):
+    """按路由模板（而不是具体URL）统计延迟，避免指标基数随记录数增长"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                        method=request.method, route=route)
+        metrics.inc('http_requests_total', method=request.method, route=route,
+                    status=str(response.status_code))
+    return response
+
+def serve_precompressed_static():
+    """static/ 下的文件有预压缩版本且客户端接受时，直接发送预压缩文件"""
+    if request.endpoint != 'static' or not request.view_args:
+        return None
+    filename = request.view_args.get('filename', '')
+    path = safe_join(current_app.static_folder, filename)
+    found = find_precompressed(path, request.headers.get('Accept-Encoding')) if path else None
+    if found is None:
+        return None
+    variant, encoding = found
+    response = send_file(variant, mimetype=mimetypes.guess_type(filename)[0], conditional=True,
+                         max_age=current_app.get_send_file_max_age(filename))
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Disposition', None)  # send_file按预压缩文件名生成，不需要
+    response.vary.add('Accept-Encoding')
+    return response
+
+def compress_response(response):
+    """按Accept-Encoding压缩JSON和HTML响应"""
+    return current_app.extensions['compressor'].process(response, request.headers.get('Accept-Encoding'))
+
+def metrics_endpoint():
+    """Prometheus指标（汇总所有worker进程）"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+def get_ingest_admission():
+    """当前应用的提交准入控制器"""
+    return current_app.extensions['ingest_admission']
+
+def admission_rejected(e):
+    """准入控制拒绝的响应：429（稍后重试）或507（磁盘空间不足），带Retry-After"""
+    response = jsonify({'error': str(e)})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def admit_submission():
+    """表单提交：读取请求体之前申请上传槽位并预留磁盘空间，没有空闲槽位时排队，排队已满或超时返回429"""
+    if request.endpoint != 'manage.submit_record':
+        return None
+    # ASGI模式在接收请求体之前已经申请（排队在协程中等待，不占用线程）
+    ticket = request.environ.get('admission.ticket')
+    if ticket is None:
+        try:
+            # 没有Content-Length（分块上传）时按上限预留
+            ticket = get_ingest_admission().acquire(request.content_length or current_app.config['MAX_CONTENT_LENGTH'])
+        except AdmissionRejected as e:
+            api_log.info('提交未被接收', extra=fields(status=e.status, bytes=request.content_length))
+            return admission_rejected(e)
+    g.admission_ticket = ticket
+
+def admission_written(written):
+    """提交已经把written字节写入磁盘：从上传槽位的磁盘预留中扣除"""
+    ticket = g.get('admission_ticket')
+    if ticket is not None:
+        ticket.consume(written)
+
+def release_admission(exc=None):
+    """请求结束时释放上传槽位和磁盘预留"""
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        ticket.release()
+
+def start_profiling():
+    """管理员开启剖析后，按比例剖析匹配的请求（关闭时只比较一次时间）"""
+    handle = current_app.extensions['profiler'].begin(request.endpoint)
+    if handle is not None:
+        g.profile = handle
+
+def stop_profiling(exc=None):
+    """请求结束时停止剖析，结果累加到本进程（定期写到data/profiling）"""
+    handle = g.pop('profile', None)
+    if handle is not None:
+        current_app.extensions['profiler'].end(handle)
+
 def handle_file_too_large(e):
     """处理文件过大错误"""
     return jsonify({
         'error': f'文件过大！最大允许上传2GB，如果需要更大的文件限制，请修改配置。'
     }), 413
 
-@app.route('/')
+@api_bp.route('/')
 def gallery():
-    """显示案例画廊首页"""
-    return render_template('gallery.html')
+    """显示案例画廊首页（SSR_GALLERY开启时直接输出首屏卡片和应用筛选列表）"""
+    if not current_app.config['SSR_GALLERY']:
+        return render_template('gallery.html', ssr=None)
+
+    per_page = current_app.config['SSR_PER_PAGE']
+    cache = get_fragment_cache()
+
+    def render_cards():
+        records, total = list_public_records(1, per_page)
+        return {
+            'html': render_template('_gallery_cards.html', records=records),
+            'count': len(records),
+            'total': total
+        }
 
-@app.route('/record/<record_id>')
+    cards = cache.get_or_render(f"gallery:cards:{per_page}", render_cards)
+    filters = cache.get_or_render('gallery:apps', lambda: render_template(
+        '_app_filters.html', app_ids=list_public_apps()))
+    return render_template('gallery.html', ssr={
+        'cards_html': cards['html'],
+        'filters_html': filters,
+        'state': {'count': cards['count'], 'total': cards['total'], 'per_page': per_page}
+    })
+
+@api_bp.route('/record/<record_id>')
 def record_detail(record_id):
-    """显示案例详情页"""
-    return render_template('detail.html', record_id=record_id)
+    """显示案例详情页（SSR_GALLERY开启时内嵌已审核通过记录的数据，省去一次API请求）"""
+    initial_record = None
+    if current_app.config['SSR_GALLERY']:
+        def render_record():
+            record, status = load_display_record(record_id)
+            return record if status == STATUS_APPROVED else None
+
+        initial_record = get_fragment_cache().get_or_render(f"record:{record_id}", render_record)
+    return render_template('detail.html', record_id=record_id, initial_record=initial_record)
 
-@app.route('/form')
+@manage_bp.route('/form')
 def form():
     """显示表单提交页面"""
     return render_template('form.html')
 
-@app.route('/submit', methods=['POST'])
+@manage_bp.route('/submit', methods=['POST'])
 def submit_record():
     """处理表单提交"""
+    import media  # 媒体处理流水线（含OpenCV）只在第一次提交时加载
+
     try:
         # 获取表单数据
         title = request.form.get('title', '').strip()
@@ -539,13 +819,16 @@ def submit_record():
             if file and file.filename:
                 if allowed_file(file.filename):
                     filename = secure_filename(file.filename)
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
                     file.save(filepath)
 
                     # 获取文件信息
                     category = get_file_category(filename)
                     mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
                     file_size = os.path.getsize(filepath)
+                    metrics.inc('upload_bytes_total', file_size, kind='materials')
+                    admission_written(file_size)
+                    metrics.observe('upload_size_bytes', file_size, kind='materials')
 
                     file_info = {
                         'id': str(uuid.uuid4()),
@@ -558,7 +841,7 @@ def submit_record():
                     }
 
                     # 生成预览信息
-                    file_info['preview'] = generate_preview_info(file_info, 'uploads')
+                    file_info['preview'] = media.generate_preview_info(file_info, 'uploads')
 
                     materials_list.append(file_info)
                 else:
@@ -572,13 +855,16 @@ def submit_record():
             if file and file.filename:
                 if allowed_file(file.filename):
                     filename = secure_filename(file.filename)
-                    filepath = os.path.join(app.config['GENERATED_FOLDER'], filename)
+                    filepath = os.path.join(current_app.config['GENERATED_FOLDER'], filename)
                     file.save(filepath)
 
                     # 获取文件信息
                     category = get_file_category(filename)
                     mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
                     file_size = os.path.getsize(filepath)
+                    metrics.inc('upload_bytes_total', file_size, kind='results')
+                    admission_written(file_size)
+                    metrics.observe('upload_size_bytes', file_size, kind='results')
 
                     file_info = {
                         'id': str(uuid.uuid4()),
@@ -591,7 +877,7 @@ def submit_record():
                     }
 
                     # 生成预览信息
-                    file_info['preview'] = generate_preview_info(file_info, 'generated')
+                    file_info['preview'] = media.generate_preview_info(file_info, 'generated')
 
                     results_list.append(file_info)
                 else:
@@ -602,7 +888,6 @@ def submit_record():
 
         # 构建新的数据结构
         record_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
-        print(f"[DEBUG] Generated record_id: {record_id}")  # 调试日志
         record = {
             'id': record_id,
             'created_at': datetime.now().isoformat(),
@@ -622,30 +907,23 @@ def submit_record():
             'status': STATUS_PENDING,  # 新案例默认为待审核状态
             'review_status': 'pending'  # 兼容字段
         }
-        print(f"[DEBUG] Record object ID: {record['id']}")  # 调试日志
 
         # 保存完整记录到独立文件
         save_record(record)
+        get_media_gc().add_record(record)
+        index_duplicates(record)
+        schedule_renditions(record)
 
         # 更新索引（只保存元信息）
-        main_preview = get_main_preview(record)
-        index_entry = {
-            'id': record['id'],
-            'created_at': record['created_at'],
-            'title': record['title'],
-            'app_id': record.get('app_id'),
-            'generation_time': record['generation_time'],
-            'has_preview': bool(main_preview),
-            'preview_type': main_preview['type'] if main_preview else None,
-            'status': STATUS_PENDING  # 索引中也保存状态
-        }
+        index_entry = build_index_entry(record)
 
-        records = load_records()
-        records.insert(0, index_entry)  # 最新的记录在前
-        save_records(records)
+        # 只修改该应用的分区（最新的记录在前），不同应用的提交互不等待
+        update_index_partition(app_id, lambda records: [index_entry] + records)
+        notify_admin([(index_entry, None, STATUS_PENDING)])
 
-        print(f"[DEBUG] Returning record_id: {record['id']}")  # 调试日志
-        print(f"[DEBUG] Full response data keys: {record.keys()}")  # 调试日志
+        api_log.info('记录已保存', extra=fields(
+            record_id=record['id'], app_id=app_id, materials=len(materials_list),
+            results=len(results_list), bytes=total_size))
         return jsonify({
             'success': True,
             'message': '记录保存成功',
@@ -657,27 +935,154 @@ def submit_record():
     except Exception as e:
         return jsonify({'error': f'处理失败: {str(e)}'}), 500
 
-@app.route('/output/<filename>')
+@api_bp.route('/output/<path:filename>')
 def view_output(filename):
     """查看生成的HTML页面"""
-    return send_from_directory(app.config['OUTPUT_FOLDER'], filename)
+    return send_from_directory(current_app.config['OUTPUT_FOLDER'], filename)
+
+# 媒体路由前缀 -> 热存储目录的配置项
+MEDIA_FOLDER_KEYS = {
+    'uploads': 'UPLOAD_FOLDER',
+    'generated': 'GENERATED_FOLDER',
+    'thumbnails': 'THUMBNAIL_FOLDER'
+}
 
-@app.route('/uploads/<filename>')
+def send_media(folder, filename):
+    """发送媒体文件并记录访问：热存储中不存在时从冷存储读取（压缩保存的文件按需解压）"""
+    key = media_key(f"/{folder}/{filename}")
+    tiering = get_media_tiering()
+    try:
+        response = send_from_directory(current_app.config[MEDIA_FOLDER_KEYS[folder]], filename)
+    except NotFound:
+        cold = tiering.locate_cold(key) if key else None
+        if cold is None:
+            raise
+        path, compressed = cold
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if not compressed:
+            response = send_file(path, mimetype=mimetype, conditional=True)
+        else:
+            # 压缩保存的冷文件：gzip文件的字节范围和校验值都与原文件不同，不支持Range和条件请求
+            if choose_encoding(request.headers.get('Accept-Encoding'), ['gzip']):
+                # 客户端接受gzip时直接发送压缩文件
+                response = send_file(path, mimetype=mimetype, conditional=False, etag=False, last_modified=None)
+                response.headers['Content-Encoding'] = 'gzip'
+            else:
+                def generate():
+                    with gzip.open(path, 'rb') as f:
+                        while True:
+                            chunk = f.read(256 * 1024)
+                            if not chunk:
+                                break
+                            yield chunk
+                response = Response(generate(), mimetype=mimetype)
+            response.headers.pop('Last-Modified', None)
+            response.headers['Accept-Ranges'] = 'none'
+            response.vary.add('Accept-Encoding')
+        response.headers.pop('Content-Disposition', None)
+    if key:
+        tiering.record_access(key)
+    return response
+
+@api_bp.route('/uploads/<filename>')
 def uploaded_file(filename):
     """访问上传的素材文件"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_media('uploads', filename)
 
-@app.route('/generated/<filename>')
+@api_bp.route('/generated/<filename>')
 def generated_file(filename):
     """访问生成的结果文件"""
-    return send_from_directory(app.config['GENERATED_FOLDER'], filename)
+    return send_media('generated', filename)
 
-@app.route('/thumbnails/<filename>')
+@api_bp.route('/thumbnails/<filename>')
 def thumbnail_file(filename):
     """访问视频缩略图"""
-    return send_from_directory(app.config['THUMBNAIL_FOLDER'], filename)
+    return send_media('thumbnails', filename)
+
+def list_public_records(page, per_page, app_id_filter=''):
+    """已审核通过的记录（分页），返回 (带展示字段的记录列表, 总数)"""
+    # 按app_id过滤时只读取该应用的分区
+    index = load_index_view(app_id_filter or None)
+
+    # 只显示已审核通过的案例（公开API），按app_id过滤
+    rows = index.rows(status=STATUS_APPROVED, app_id=app_id_filter or None)
+
+    # 分页（只为当前页还原索引条目）
+    total = len(rows)
+    start = (page - 1) * per_page
+    end = start + per_page
+    paginated_index = index.entries(rows[start:end])
+
+    # 为每条记录加载完整数据并添加所需字段
+    result_records = []
+    for index_entry in paginated_index:
+        # 尝试加载完整记录（需要app_id）
+        record_app_id = index_entry.get('app_id')
+        if record_app_id:
+            full_record = load_record(index_entry['id'], record_app_id)
+        else:
+            full_record = None
 
-@app.route('/api/records')
+        if full_record:
+            # 使用完整记录的数据
+            record = full_record
+            record['cover'] = get_cover_image(record)
+            record['preview'] = get_main_preview(record)
+        else:
+            # 如果完整记录不存在（旧格式），使用索引数据
+            record = index_entry.copy()
+            # 为前端提供兼容字段
+            record['datetime'] = record.get('generation_time', '')
+            if not record.get('title'):
+                record['title'] = '未命名记录'
+            api_log.debug('完整记录不存在，使用索引数据',
+                          extra=fields(sample='api.record', record_id=index_entry.get('id')))
+
+        # 确保详情链接存在（使用新的动态详情页）
+        if not record.get('detail_url'):
+            record['detail_url'] = f"/record/{record['id']}"
+
+        result_records.append(record)
+
+    return result_records, total
+
+def list_public_apps():
+    """所有包含已审核通过案例的app_id（排序）"""
+    return sorted(app_id for app_id in load_index_view().app_ids(STATUS_APPROVED) if isinstance(app_id, str) and app_id)
+
+def find_index_entry(record_id):
+    """按id在紧凑索引中查找索引条目，不存在时返回None"""
+    index = load_index_view()
+    row = index.find(record_id)
+    return index.entry(row) if row is not None else None
+
+def load_display_record(record_id):
+    """加载完整记录并添加展示字段，返回 (record, status)；记录不存在时返回 (None, None)"""
+    # 从索引中查找记录的app_id和状态
+    app_id = None
+    record_status = None
+    index_entry = find_index_entry(record_id)
+    if index_entry is not None:
+        app_id = index_entry.get('app_id')
+        record_status = index_entry.get('status', STATUS_PENDING)
+
+    if not app_id:
+        return None, None
+
+    record = load_record(record_id, app_id)
+    if not record:
+        return None, None
+    return add_display_fields(record, record_id), record_status
+
+def add_display_fields(record, record_id):
+    """添加详情页和API使用的额外展示字段"""
+    record['datetime'] = record.get('generation_time', '')
+    record['detail_url'] = f"/record/{record_id}"
+    record['cover'] = get_cover_image(record)
+    record['preview'] = get_main_preview(record)
+    return record
+
+@api_bp.route('/api/records')
 def api_records():
     """API: 获取记录列表（分页）"""
     try:
@@ -685,56 +1090,7 @@ def api_records():
         per_page = int(request.args.get('per_page', 12))
         app_id_filter = request.args.get('app_id', '')
 
-        # 加载索引（轻量级）
-        index_records = load_records()
-
-        # 只显示已审核通过的案例（公开API）
-        index_records = [r for r in index_records if r.get('status') == STATUS_APPROVED]
-
-        # 按app_id过滤
-        if app_id_filter:
-            index_records = [r for r in index_records if r.get('app_id') == app_id_filter]
-
-        # 分页
-        total = len(index_records)
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_index = index_records[start:end]
-
-        # 为每条记录加载完整数据并添加所需字段
-        result_records = []
-        for index_entry in paginated_index:
-            print(f"[DEBUG API] Processing record: {index_entry.get('id')}")
-            # 尝试加载完整记录（需要app_id）
-            record_app_id = index_entry.get('app_id')
-            print(f"[DEBUG API] Record app_id: {record_app_id}")
-            if record_app_id:
-                full_record = load_record(index_entry['id'], record_app_id)
-                print(f"[DEBUG API] Full record loaded: {full_record is not None}")
-            else:
-                full_record = None
-                print(f"[DEBUG API] No app_id, full_record is None")
-
-            if full_record:
-                # 使用完整记录的数据
-                record = full_record
-                record['cover'] = get_cover_image(record)
-                record['preview'] = get_main_preview(record)
-                print(f"[DEBUG API] Record preview: {record.get('preview')}")
-            else:
-                # 如果完整记录不存在（旧格式），使用索引数据
-                record = index_entry.copy()
-                # 为前端提供兼容字段
-                record['datetime'] = record.get('generation_time', '')
-                if not record.get('title'):
-                    record['title'] = '未命名记录'
-                print(f"[DEBUG API] Using index entry (no full record)")
-
-            # 确保详情链接存在（使用新的动态详情页）
-            if not record.get('detail_url'):
-                record['detail_url'] = f"/record/{record['id']}"
-
-            result_records.append(record)
+        result_records, total = list_public_records(page, per_page, app_id_filter)
 
         return jsonify({
             'success': True,
@@ -749,38 +1105,23 @@ def api_records():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/apps')
+@api_bp.route('/api/apps')
 def api_apps():
     """API: 获取所有app_id列表（仅已审核通过的案例）"""
     try:
-        records = load_records()
-        app_ids = set()
-        for record in records:
-            # 只统计已审核通过的案例
-            if record.get('app_id') and record.get('status') == STATUS_APPROVED:
-                app_ids.add(record['app_id'])
         return jsonify({
             'success': True,
-            'data': sorted(list(app_ids))
+            'data': list_public_apps()
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/record/<record_id>')
+@api_bp.route('/api/record/<record_id>')
 def api_record_detail(record_id):
     """API: 获取单个记录的完整详情"""
     try:
-        # 从索引中查找记录的app_id和状态
-        index_records = load_records()
-        app_id = None
-        record_status = None
-        for index_entry in index_records:
-            if index_entry['id'] == record_id:
-                app_id = index_entry.get('app_id')
-                record_status = index_entry.get('status', STATUS_PENDING)
-                break
-
-        if not app_id:
+        record, record_status = load_display_record(record_id)
+        if not record:
             return jsonify({'success': False, 'error': '记录不存在'}), 404
 
         # 检查审核状态和用户权限
@@ -792,20 +1133,70 @@ def api_record_detail(record_id):
                 'error': '该案例正在审核中，暂不可查看'
             }), 403
 
-        # 加载完整记录
-        record = load_record(record_id, app_id)
-        if not record:
-            return jsonify({'success': False, 'error': '记录不存在'}), 404
+        return jsonify({
+            'success': True,
+            'data': record
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def load_display_records(record_ids, workers):
+    """
+    批量加载完整记录并添加展示字段，返回 {record_id: (record, status)}（与load_display_record相同，不存在的记录不在结果中）
+
+    紧凑索引只映射一次，记录文件在线程池中并发读取。
+    """
+    index = load_index_view()
+    located = {}
+    for record_id in record_ids:
+        row = index.find(record_id)
+        if row is not None:
+            index_entry = index.entry(row)
+            if index_entry.get('app_id'):
+                located[record_id] = (index_entry['app_id'], index_entry.get('status', STATUS_PENDING))
+    if not located:
+        return {}
+
+    with ThreadPoolExecutor(min(workers, len(located))) as pool:
+        records = pool.map(lambda item: load_record(item[0], item[1][0]), located.items())
+        result = {}
+        for (record_id, (_, record_status)), record in zip(located.items(), records):
+            if record:
+                result[record_id] = (add_display_fields(record, record_id), record_status)
+    return result
+
+@api_bp.route('/api/records/batch', methods=['POST'])
+def api_records_batch():
+    """API: 一次获取多个记录的完整详情（审核状态和权限规则与 /api/record/<id> 相同）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        record_ids = data.get('ids')
+        if not isinstance(record_ids, list) or not all(isinstance(record_id, str) for record_id in record_ids):
+            return jsonify({'success': False, 'error': 'ids必须是记录ID的列表'}), 400
+        record_ids = list(dict.fromkeys(record_ids))  # 去重并保持顺序
+        if len(record_ids) > current_app.config['BATCH_FETCH_MAX']:
+            return jsonify({'success': False,
+                            'error': f"一次最多获取 {current_app.config['BATCH_FETCH_MAX']} 条记录"}), 400
 
-        # 添加额外的展示字段
-        record['datetime'] = record.get('generation_time', '')
-        record['detail_url'] = f"/record/{record_id}"
-        record['cover'] = get_cover_image(record)
-        record['preview'] = get_main_preview(record)
+        loaded = load_display_records(record_ids, current_app.config['BATCH_FETCH_WORKERS'])
+
+        # 管理员可以查看所有状态的案例，普通用户只能查看已审核通过的
+        is_admin = session.get('logged_in', False)
+        records = []
+        errors = {}
+        for record_id in record_ids:
+            record, record_status = loaded.get(record_id, (None, None))
+            if not record:
+                errors[record_id] = {'status': 404, 'error': '记录不存在'}
+            elif not is_admin and record_status != STATUS_APPROVED:
+                errors[record_id] = {'status': 403, 'error': '该案例正在审核中，暂不可查看'}
+            else:
+                records.append(record)
 
         return jsonify({
             'success': True,
-            'data': record
+            'data': records,
+            'errors': errors
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -821,11 +1212,11 @@ def login_required(f):
     @functools.wraps(f)
     def decorated_function(*args, **kwargs):
         if 'logged_in' not in session or not session['logged_in']:
-            return redirect(url_for('admin_login'))
+            return redirect(url_for('manage.admin_login'))
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/admin/login', methods=['GET', 'POST'])
+@manage_bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     """管理员登录页面"""
     if request.method == 'GET':
@@ -892,25 +1283,25 @@ def admin_login():
     else:
         return jsonify({'success': False, 'error': '无效的操作'}), 400
 
-@app.route('/admin/logout')
+@manage_bp.route('/admin/logout')
 def admin_logout():
     """管理员登出"""
     session.clear()
-    return redirect(url_for('admin_login'))
+    return redirect(url_for('manage.admin_login'))
 
-@app.route('/admin/dashboard')
+@manage_bp.route('/admin/dashboard')
 @login_required
 def admin_dashboard():
     """管理员控制台"""
     return render_template('admin_layout_new.html')
 
-@app.route('/admin')
+@manage_bp.route('/admin')
 @login_required
 def admin_index():
     """管理后台首页（重定向到dashboard）"""
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('manage.admin_dashboard'))
 
-@app.route('/admin/api/records')
+@manage_bp.route('/admin/api/records')
 @login_required
 def admin_api_records():
     """API: 获取所有案例列表（包括待审核的）"""
@@ -920,22 +1311,15 @@ def admin_api_records():
         status_filter = request.args.get('status', '')
         app_id_filter = request.args.get('app_id', '')
 
-        # 加载索引
-        index_records = load_records()
-
-        # 按状态过滤
-        if status_filter:
-            index_records = [r for r in index_records if r.get('status') == status_filter]
-
-        # 按app_id过滤
-        if app_id_filter:
-            index_records = [r for r in index_records if r.get('app_id') == app_id_filter]
+        # 按状态和app_id过滤（紧凑索引中预先分好组）
+        index = load_index_view(app_id_filter or None)
+        rows = index.rows(status=status_filter or None, app_id=app_id_filter or None)
 
         # 分页
-        total = len(index_records)
+        total = len(rows)
         start = (page - 1) * per_page
         end = start + per_page
-        paginated_index = index_records[start:end]
+        paginated_index = index.entries(rows[start:end])
 
         # 加载完整数据
         result_records = []
@@ -950,6 +1334,13 @@ def admin_api_records():
                 record = index_entry.copy()
                 result_records.append(record)
 
+        # 标记可能的近似重复（生成结果的感知哈希相近）
+        duplicate_index = get_duplicate_index()
+        for record in result_records:
+            similar = duplicate_index.find_similar(record['id'])
+            record['possible_duplicate'] = bool(similar)
+            record['duplicates'] = similar[:5]
+
         return jsonify({
             'success': True,
             'data': result_records,
@@ -963,21 +1354,14 @@ def admin_api_records():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/admin/api/record/<record_id>', methods=['GET', 'DELETE'])
+@manage_bp.route('/admin/api/record/<record_id>', methods=['GET', 'DELETE'])
 @login_required
 def admin_api_record_detail(record_id):
     """API: 获取或删除单个案例"""
     try:
-        # 从索引中查找记录的app_id
-        index_records = load_records()
-        app_id = None
-        index_entry = None
-
-        for entry in index_records:
-            if entry['id'] == record_id:
-                app_id = entry.get('app_id')
-                index_entry = entry
-                break
+        # 从紧凑索引中查找记录的app_id
+        index_entry = find_index_entry(record_id)
+        app_id = index_entry.get('app_id') if index_entry else None
 
         if not app_id:
             return jsonify({'success': False, 'error': '记录不存在'}), 404
@@ -985,14 +1369,18 @@ def admin_api_record_detail(record_id):
         if request.method == 'DELETE':
             # 删除记录
             # 1. 删除完整记录文件
-            app_dir = os.path.join(RECORDS_DIR, app_id)
-            record_file = os.path.join(app_dir, f"{record_id}.json")
-            if os.path.exists(record_file):
-                os.remove(record_file)
+            record = load_record(record_id, app_id)
+            delete_record_file(record_id, app_id)
 
-            # 2. 从索引中移除
-            index_records.remove(index_entry)
-            save_records(index_records)
+            # 2. 从该应用的索引分区中移除
+            update_index_entries(removed=[index_entry])
+
+            # 3. 释放媒体文件引用，交由垃圾回收器在宽限期后清理
+            if record:
+                get_media_gc().release_record(record)
+            get_duplicate_index().remove_record(record_id)
+            notify_records_changed([index_entry])
+            notify_admin([(index_entry, index_entry.get('status', STATUS_PENDING), None)])
 
             return jsonify({
                 'success': True,
@@ -1011,7 +1399,19 @@ def admin_api_record_detail(record_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/admin/api/review/<record_id>', methods=['POST'])
+def review_record(record, action, reason=''):
+    """更新完整记录的审核状态并保存，返回新状态（索引条目由调用方更新）"""
+    new_status = STATUS_APPROVED if action == 'approve' else STATUS_REJECTED
+    record['status'] = new_status
+    record['review_status'] = new_status  # 兼容字段
+
+    if action == 'reject' and reason:
+        record['reject_reason'] = reason
+
+    save_record(record)
+    return new_status
+
+@manage_bp.route('/admin/api/review/<record_id>', methods=['POST'])
 @login_required
 def admin_api_review(record_id):
     """API: 审核案例（通过/拒绝）"""
@@ -1023,16 +1423,9 @@ def admin_api_review(record_id):
         if action not in ['approve', 'reject']:
             return jsonify({'success': False, 'error': '无效的操作'}), 400
 
-        # 从索引中查找记录
-        index_records = load_records()
-        app_id = None
-        index_entry = None
-
-        for entry in index_records:
-            if entry['id'] == record_id:
-                app_id = entry.get('app_id')
-                index_entry = entry
-                break
+        # 从紧凑索引中查找记录
+        index_entry = find_index_entry(record_id)
+        app_id = index_entry.get('app_id') if index_entry else None
 
         if not app_id:
             return jsonify({'success': False, 'error': '记录不存在'}), 404
@@ -1042,20 +1435,15 @@ def admin_api_review(record_id):
         if not record:
             return jsonify({'success': False, 'error': '记录不存在'}), 404
 
-        # 更新状态
-        new_status = STATUS_APPROVED if action == 'approve' else STATUS_REJECTED
-        record['status'] = new_status
-        record['review_status'] = new_status  # 兼容字段
-
-        if action == 'reject' and reason:
-            record['reject_reason'] = reason
-
-        # 保存完整记录
-        save_record(record)
+        # 更新状态并保存完整记录
+        new_status = review_record(record, action, reason)
 
-        # 更新索引
+        # 更新该应用的索引分区
+        old_status = index_entry.get('status', STATUS_PENDING)
         index_entry['status'] = new_status
-        save_records(index_records)
+        update_index_entries([index_entry])
+        notify_records_changed([index_entry])
+        notify_admin([(index_entry, old_status, new_status)])
 
         return jsonify({
             'success': True,
@@ -1068,39 +1456,64 @@ def admin_api_review(record_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/admin/api/stats')
+def compute_admin_stats(index):
+    """按状态和应用统计紧凑索引中的记录（只累加每个 (状态, 应用) 分组的记录数）"""
+    stats = {
+        'total': len(index),
+        'pending': 0,
+        'approved': 0,
+        'rejected': 0,
+        'by_app': {}
+    }
+
+    for status, app_id, count in index.counts():
+        if status == INDEX_MISSING:
+            status = STATUS_PENDING
+        if status == STATUS_PENDING:
+            stats['pending'] += count
+        elif status == STATUS_APPROVED:
+            stats['approved'] += count
+        elif status == STATUS_REJECTED:
+            stats['rejected'] += count
+
+        # 按应用统计
+        if app_id == INDEX_MISSING:
+            app_id = 'unknown'
+        if app_id not in stats['by_app']:
+            stats['by_app'][app_id] = {'total': 0, 'pending': 0, 'approved': 0}
+        stats['by_app'][app_id]['total'] += count
+        if status == STATUS_PENDING:
+            stats['by_app'][app_id]['pending'] += count
+        elif status == STATUS_APPROVED:
+            stats['by_app'][app_id]['approved'] += count
+    return stats
+
+def stats_delta(changes):
+    """
+    状态变化对应的统计增量（结构与 compute_admin_stats 相同）
+
+    changes: [(索引条目, 原状态, 新状态)]，状态为None表示记录不存在（新提交的记录、被删除的记录）
+    """
+    delta = {'total': 0, 'pending': 0, 'approved': 0, 'rejected': 0, 'by_app': {}}
+    for entry, old_status, new_status in changes:
+        app_delta = delta['by_app'].setdefault(entry.get('app_id', 'unknown'), {'total': 0, 'pending': 0, 'approved': 0})
+        for status, sign in ((old_status, -1), (new_status, 1)):
+            if status is None:
+                continue
+            delta['total'] += sign
+            app_delta['total'] += sign
+            if status in delta:
+                delta[status] += sign
+            if status in app_delta:
+                app_delta[status] += sign
+    return delta
+
+@manage_bp.route('/admin/api/stats')
 @login_required
 def admin_api_stats():
     """API: 获取统计信息"""
     try:
-        index_records = load_records()
-
-        stats = {
-            'total': len(index_records),
-            'pending': 0,
-            'approved': 0,
-            'rejected': 0,
-            'by_app': {}
-        }
-
-        for record in index_records:
-            status = record.get('status', STATUS_PENDING)
-            if status == STATUS_PENDING:
-                stats['pending'] += 1
-            elif status == STATUS_APPROVED:
-                stats['approved'] += 1
-            elif status == STATUS_REJECTED:
-                stats['rejected'] += 1
-
-            # 按应用统计
-            app_id = record.get('app_id', 'unknown')
-            if app_id not in stats['by_app']:
-                stats['by_app'][app_id] = {'total': 0, 'pending': 0, 'approved': 0}
-            stats['by_app'][app_id]['total'] += 1
-            if status == STATUS_PENDING:
-                stats['by_app'][app_id]['pending'] += 1
-            elif status == STATUS_APPROVED:
-                stats['by_app'][app_id]['approved'] += 1
+        stats = compute_admin_stats(load_index_view())
 
         return jsonify({
             'success': True,
@@ -1109,7 +1522,67 @@ def admin_api_stats():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/admin/api/change-password', methods=['POST'])
+# ASGI模式下客户端断开时被set的threading.Event（asgi.py放入WSGI environ）
+CLIENT_DISCONNECTED = 'app.client_disconnected'
+
+def sse_message(event_type, data):
+    """一条SSE消息"""
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+@manage_bp.route('/admin/api/events')
+@login_required
+def admin_api_events():
+    """
+    SSE: 推送管理后台事件，连接建立时先发送完整统计（stats），之后推送
+    stats_delta（统计增量）、record_submitted（新提交）、record_status（审核/删除）
+
+    每个连接占用一个worker线程，部署时使用多线程worker（如 gunicorn -k gthread）。
+    连接最长保持 SSE_MAX_SECONDS 秒，之后结束响应，浏览器按retry间隔重连并重新收到完整统计；
+    ASGI模式下客户端断开时立即结束。
+    """
+    # 先定位到事件日志末尾再统计，连接建立期间写入的事件不会丢失
+    reader = get_event_log().reader()
+    stats = compute_admin_stats(load_index_view())
+    # 流在请求上下文之外执行，先取出当前应用的索引分区
+    partitions = INDEX_PARTITIONS
+    poll_seconds = current_app.config['SSE_POLL_SECONDS']
+    keepalive_seconds = current_app.config['SSE_KEEPALIVE_SECONDS']
+    resync_seconds = current_app.config['SSE_RESYNC_SECONDS']
+    max_seconds = current_app.config['SSE_MAX_SECONDS']
+    disconnected = request.environ.get(CLIENT_DISCONNECTED)
+    wait = disconnected.wait if disconnected is not None else time.sleep
+
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            yield sse_message('stats', stats)
+            opened = last_sent = last_sync = time.monotonic()
+            while True:
+                if wait(poll_seconds):
+                    break  # 客户端已断开
+                now = time.monotonic()
+                if now - opened >= max_seconds:
+                    break
+                events = reader.read()
+                if events:
+                    last_sent = now
+                    yield ''.join(sse_message(event['type'], event['data']) for event in events)
+                if now - last_sync >= resync_seconds:
+                    # 定期发送完整统计，覆盖增量的累计误差（如连接建立瞬间写入的事件被重复计入）
+                    last_sync = last_sent = now
+                    yield sse_message('stats', compute_admin_stats(partitions.merged_view()))
+                elif not events and now - last_sent >= keepalive_seconds:
+                    last_sent = now
+                    yield ': keepalive\n\n'
+        finally:
+            reader.close()
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 关闭nginx的响应缓冲
+    })
+
+@manage_bp.route('/admin/api/change-password', methods=['POST'])
 @login_required
 def admin_change_password():
     """API: 修改管理员密码"""
@@ -1143,7 +1616,7 @@ def admin_change_password():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/admin/api/batch', methods=['POST'])
+@manage_bp.route('/admin/api/batch', methods=['POST'])
 @login_required
 def admin_batch_operation():
     """API: 批量操作（审核、删除）"""
@@ -1162,9 +1635,6 @@ def admin_batch_operation():
         if len(record_ids) == 0:
             return jsonify({'success': False, 'error': '记录ID列表为空'}), 400
 
-        # 加载索引
-        index_records = load_records()
-
         results = {
             'success': True,
             'total': len(record_ids),
@@ -1173,15 +1643,18 @@ def admin_batch_operation():
             'errors': []
         }
 
+        # 被删除的完整记录，索引保存后释放其媒体引用
+        deleted_records = []
+        # 状态发生变化或被删除的索引条目
+        changed_entries = []
+        # (索引条目, 原状态, 新状态)，推送给管理后台
+        status_changes = []
+
         # 执行批量操作
         for record_id in record_ids:
             try:
-                # 查找索引中的记录
-                index_entry = None
-                for entry in index_records:
-                    if entry['id'] == record_id:
-                        index_entry = entry
-                        break
+                # 在紧凑索引中查找记录
+                index_entry = find_index_entry(record_id)
 
                 if not index_entry:
                     results['errors'].append(f"{record_id}: 记录不存在")
@@ -1194,14 +1667,14 @@ def admin_batch_operation():
                     results['failed'] += 1
                     continue
 
+                old_status = index_entry.get('status', STATUS_PENDING)
                 if action == 'delete':
                     # 删除操作
-                    app_dir = os.path.join(RECORDS_DIR, app_id)
-                    record_file = os.path.join(app_dir, f"{record_id}.json")
-                    if os.path.exists(record_file):
-                        os.remove(record_file)
+                    record = load_record(record_id, app_id)
+                    delete_record_file(record_id, app_id)
 
-                    index_records.remove(index_entry)
+                    if record:
+                        deleted_records.append(record)
 
                 elif action in ['approve', 'reject']:
                     # 审核操作
@@ -1211,25 +1684,29 @@ def admin_batch_operation():
                         results['failed'] += 1
                         continue
 
-                    new_status = STATUS_APPROVED if action == 'approve' else STATUS_REJECTED
-                    record['status'] = new_status
-                    record['review_status'] = new_status
-
-                    if action == 'reject' and reason:
-                        record['reject_reason'] = reason
-
-                    save_record(record)
-                    index_entry['status'] = new_status
+                    index_entry['status'] = review_record(record, action, reason)
 
                 results['succeeded'] += 1
+                changed_entries.append(index_entry)
+                status_changes.append((index_entry, old_status, index_entry['status'] if action != 'delete' else None))
 
             except Exception as e:
                 results['errors'].append(f"{record_id}: {str(e)}")
                 results['failed'] += 1
 
-        # 保存索引（如果有删除或审核操作）
+        # 保存索引（如果有删除或审核操作），只重写涉及的应用分区
         if action in ['delete', 'approve', 'reject']:
-            save_records(index_records)
+            if action == 'delete':
+                update_index_entries(removed=changed_entries)
+            else:
+                update_index_entries(changed_entries)
+            notify_records_changed(changed_entries)
+            if status_changes:
+                notify_admin(status_changes)
+
+        for record in deleted_records:
+            get_media_gc().release_record(record)
+            get_duplicate_index().remove_record(record['id'])
 
         return jsonify({
             'success': True,
@@ -1240,14 +1717,1062 @@ def admin_batch_operation():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# ==================== 审核队列（多审核员租约） ====================
+
+def current_reviewer():
+    """当前审核员：(会话内的审核员标识, 显示名称)；同一账号在多个浏览器登录视为不同审核员"""
+    if 'reviewer_id' not in session:
+        session['reviewer_id'] = uuid.uuid4().hex
+    return session['reviewer_id'], session.get('username', 'admin')
+
+def pending_queue(app_id_filter=''):
+    """待审核队列中的索引条目，先提交的在前（只从紧凑索引中取出待审核的行，不解析整个索引）"""
+    app_id = app_id_filter or None
+    indexes = [load_index_view(app_id)] if app_id else load_index_view().indexes
+    partitions = []
+    for index in indexes:
+        rows = index.rows(STATUS_PENDING, app_id)
+        # 没有status字段的旧条目也视为待审核
+        missing = index.rows(INDEX_MISSING, app_id)
+        if len(missing):
+            rows = sorted([*rows, *missing])
+        partitions.append([entry for entry in index.entries(rows) if entry.get('app_id')])
+    return list(reversed(merge_partitions(partitions)))
+
+def pending_count():
+    """待审核队列的长度（由紧凑索引的计数得到）"""
+    return sum(count for status, app_id, count in load_index_view().counts()
+               if status in (STATUS_PENDING, INDEX_MISSING) and app_id and app_id != INDEX_MISSING)
+
+def load_queue_record(index_entry):
+    """加载队列中的完整记录，附带展示字段（封面、主预览）和近似重复信息，审核页面无需再逐条请求"""
+    record = load_record(index_entry['id'], index_entry['app_id'])
+    if not record:
+        return None
+    record['datetime'] = record.get('generation_time', '')
+    record['cover'] = get_cover_image(record)
+    record['preview'] = get_main_preview(record)
+    similar = get_duplicate_index().find_similar(record['id'])
+    record['possible_duplicate'] = bool(similar)
+    record['duplicates'] = similar[:5]
+    return record
+
+@manage_bp.route('/admin/api/queue')
+@login_required
+def admin_api_queue():
+    """API: 审核队列状态（待审核数、已被领取数、各审核员持有数）"""
+    try:
+        status = get_moderation_queue().status()
+        status['pending'] = pending_count()
+        status['available'] = max(0, status['pending'] - status['leased'])
+        return jsonify({'success': True, 'data': status})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@manage_bp.route('/admin/api/queue/claim', methods=['POST'])
+@login_required
+def admin_api_queue_claim():
+    """API: 领取待审核记录（续期已持有的租约并补足到count条），返回完整记录和预览数据"""
+    try:
+        data = request.get_json(silent=True) or {}
+        count = min(max(int(data.get('count', 10)), 0), current_app.config['REVIEW_CLAIM_MAX'])
+        app_id_filter = data.get('app_id', '')
+
+        pending = pending_queue()
+        candidates = pending_queue(app_id_filter) if app_id_filter else None
+        reviewer, name = current_reviewer()
+        leases, remaining = get_moderation_queue().claim(
+            reviewer, name, [entry['id'] for entry in pending], count,
+            candidates=[entry['id'] for entry in candidates] if candidates is not None else None)
+
+        entries = {entry['id']: entry for entry in pending}
+        records = []
+        missing = []
+        for lease in leases:
+            record = load_queue_record(entries[lease['record_id']])
+            if record:
+                record['lease_expires_at'] = lease['expires_at']
+                records.append(record)
+            else:
+                missing.append(lease['record_id'])
+        if missing:
+            # 索引中存在但记录文件缺失，不占用租约
+            get_moderation_queue().release(reviewer, missing)
+
+        return jsonify({
+            'success': True,
+            'data': records,
+            'queue': {
+                'remaining': remaining,
+                'lease_seconds': get_moderation_queue().lease_seconds
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@manage_bp.route('/admin/api/queue/decisions', methods=['POST'])
+@login_required
+def admin_api_queue_decisions():
+    """API: 批量提交审核结论（涉及的每个索引分区只保存一次），可同时归还跳过的记录"""
+    try:
+        data = request.get_json(silent=True) or {}
+        decisions = data.get('decisions') or []
+        release = data.get('release') or []
+
+        if not isinstance(decisions, list) or not isinstance(release, list):
+            return jsonify({'success': False, 'error': '参数格式错误'}), 400
+        for decision in decisions:
+            if (not isinstance(decision, dict) or not isinstance(decision.get('record_id'), str)
+                    or decision.get('action') not in ['approve', 'reject']):
+                return jsonify({'success': False, 'error': '无效的审核结论'}), 400
+
+        results = {
+            'total': len(decisions),
+            'succeeded': 0,
+            'failed': 0,
+            'errors': []
+        }
+        changed_entries = []
+        status_changes = []
+
+        def apply(accepted):
+            if not accepted:
+                return
+            for decision in accepted:
+                record_id = decision['record_id']
+                index_entry = find_index_entry(record_id)
+                try:
+                    if not index_entry or not index_entry.get('app_id'):
+                        results['errors'].append(f"{record_id}: 记录不存在")
+                    elif index_entry.get('status', STATUS_PENDING) != STATUS_PENDING:
+                        results['errors'].append(f"{record_id}: 已被审核")
+                    else:
+                        record = load_record(record_id, index_entry['app_id'])
+                        if not record:
+                            results['errors'].append(f"{record_id}: 无法加载记录")
+                        else:
+                            index_entry['status'] = review_record(record, decision['action'], decision.get('reason', ''))
+                            changed_entries.append(index_entry)
+                            status_changes.append((index_entry, STATUS_PENDING, index_entry['status']))
+                            continue
+                except Exception as e:
+                    results['errors'].append(f"{record_id}: {str(e)}")
+                results['failed'] += 1
+            if changed_entries:
+                update_index_entries(changed_entries)
+
+        reviewer, _ = current_reviewer()
+        queue = get_moderation_queue()
+        _, conflicts = queue.commit(reviewer, decisions, apply)
+        if release:
+            queue.release(reviewer, release)
+
+        results['succeeded'] = len(changed_entries)
+        results['failed'] += len(conflicts)
+        results['errors'].extend(f"{record_id}: 已被其他审核员领取" for record_id in conflicts)
+        results['conflicts'] = conflicts
+        if changed_entries:
+            notify_records_changed(changed_entries)
+            notify_admin(status_changes)
+
+        return jsonify({
+            'success': True,
+            'message': f'已提交：成功 {results["succeeded"]} 个，失败 {results["failed"]} 个',
+            'data': results
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# ==================== 近似重复检测 ====================
+
+@manage_bp.route('/admin/api/duplicates')
+@login_required
+def admin_api_duplicates():
+    """API: 近似重复的案例簇（status参数只从指定状态的案例出发查找）"""
+    try:
+        max_distance = int(request.args.get('distance', current_app.config['DUPLICATE_MAX_DISTANCE']))
+        status_filter = request.args.get('status', '')
+        if not 0 <= max_distance <= 64:
+            return jsonify({'success': False, 'error': 'distance必须在0到64之间'}), 400
+
+        index_records = load_records()
+        entries = {entry['id']: entry for entry in index_records}
+        record_ids = [entry['id'] for entry in index_records
+                      if entry.get('status') == status_filter] if status_filter else None
+
+        clusters = []
+        for group in get_duplicate_index().clusters(max_distance, record_ids):
+            members = [entries[record_id] for record_id in group if record_id in entries]
+            if len(members) < 2:
+                continue
+            clusters.append({
+                'size': len(members),
+                'records': [{
+                    'id': entry['id'],
+                    'title': entry.get('title'),
+                    'app_id': entry.get('app_id'),
+                    'status': entry.get('status', STATUS_PENDING),
+                    'created_at': entry.get('created_at')
+                } for entry in members]
+            })
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'clusters': clusters,
+                'status': get_duplicate_index().status()
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@manage_bp.cli.command('hash-media')
+@click.option('--limit', default=0, show_default=True, help='最多处理的记录数，0表示全部')
+@click.option('--compact', is_flag=True, help='处理完成后压缩哈希日志（去掉已删除记录）')
+def hash_media_command(limit, compact):
+    """为尚未计算感知哈希的历史记录补算哈希"""
+    duplicate_index = get_duplicate_index()
+    processed = hashed = 0
+    for index_entry in load_records():
+        if limit and processed >= limit:
+            break
+        if not index_entry.get('app_id') or duplicate_index.has_record(index_entry['id']):
+            continue
+        record = load_record(index_entry['id'], index_entry['app_id'])
+        if record:
+            hashed += duplicate_index.add_record(record, get_media_tiering().resolve)
+            processed += 1
+    click.echo(f"处理 {processed} 条记录，计算 {hashed} 个哈希")
+    if compact:
+        click.echo(f"哈希日志已压缩为 {duplicate_index.compact()} 行")
+
+# ==================== 孤立媒体文件回收 ====================
+
+@manage_bp.route('/admin/api/gc', methods=['GET', 'POST'])
+@login_required
+def admin_api_gc():
+    """API: 孤立媒体文件回收（GET查看状态和dry-run报告，POST执行一步增量回收）"""
+    try:
+        if request.method == 'GET':
+            return jsonify({
+                'success': True,
+                'data': {
+                    'status': get_media_gc().status(),
+                    'report': get_media_gc().collect(dry_run=True)
+                }
+            })
+
+        data = request.get_json(silent=True) or {}
+        dry_run = data.get('dry_run', True) is not False  # 只有明确传false才真正删除
+        budget = int(data.get('budget', 500))
+        if budget <= 0:
+            return jsonify({'success': False, 'error': 'budget必须为正整数'}), 400
+
+        report = get_media_gc().step(load_records(), find_record, budget=budget, dry_run=dry_run)
+        return jsonify({
+            'success': True,
+            'data': report
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@manage_bp.cli.command('gc-media')
+@click.option('--apply', 'apply_changes', is_flag=True, help='真正删除文件（默认只输出dry-run报告）')
+@click.option('--budget', default=500, show_default=True, help='每一步处理的记录/文件数')
+@click.option('--steps', default=1, show_default=True, help='执行的步数，0表示直到一轮扫描完成')
+def gc_media_command(apply_changes, budget, steps):
+    """增量回收不再被任何记录引用的媒体文件"""
+    step = 0
+    while True:
+        step += 1
+        report = get_media_gc().step(load_records(), find_record, budget=budget, dry_run=not apply_changes)
+        click.echo(f"[{step}] {report['phase']}: 检查 {report['scanned']} 项，"
+                   f"{'将删除' if report['dry_run'] else '已删除'} {len(report['deleted'])} 个文件 "
+                   f"({report['freed_bytes']} 字节)，等待宽限期 {report['waiting']} 个")
+        for key in report['deleted']:
+            click.echo(f"    {key}")
+        if report['blocked'] and report['phase'] != 'build_refs':
+            click.echo(f"    已阻止: {report['blocked']}")
+        if steps and step >= steps:
+            break
+        if not steps and (report['sweep_completed'] or report['phase'] == 'resolve'):
+            break  # 有无法读取记录文件的索引条目时不会继续，需要先修复
+
+# ==================== 媒体冷热分层 ====================
+
+def tiering_step(budget=500, dry_run=True):
+    """执行一步冷热分层（需要孤立文件回收的引用表已经构建完成）"""
+    refs = get_media_gc().refs()
+    if refs is None:
+        return {'dry_run': dry_run, 'blocked': '引用表尚未构建完成（先执行 flask gc-media）'}
+    statuses = {entry['id']: entry.get('status', STATUS_PENDING) for entry in load_records()}
+    return get_media_tiering().step(refs, statuses, budget=budget, dry_run=dry_run)
+
+@manage_bp.route('/admin/api/tiering', methods=['GET', 'POST'])
+@login_required
+def admin_api_tiering():
+    """API: 冷热分层状态（GET），执行一步分层（POST，默认dry-run）"""
+    try:
+        if request.method == 'GET':
+            return jsonify({'success': True, 'data': get_media_tiering().status()})
+
+        data = request.get_json(silent=True) or {}
+        dry_run = data.get('dry_run', True) is not False  # 只有明确传false才真正迁移
+        budget = int(data.get('budget', 500))
+        if budget <= 0:
+            return jsonify({'success': False, 'error': 'budget必须为正整数'}), 400
+
+        return jsonify({'success': True, 'data': tiering_step(budget=budget, dry_run=dry_run)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@manage_bp.cli.command('tier-media')
+@click.option('--apply', 'apply_changes', is_flag=True, help='真正迁移文件（默认只输出dry-run报告）')
+@click.option('--budget', default=500, show_default=True, help='每一步检查的文件数')
+@click.option('--steps', default=1, show_default=True, help='执行的步数，0表示直到检查完一轮')
+def tier_media_command(apply_changes, budget, steps):
+    """按访问时间和记录状态在热存储和冷存储之间迁移媒体文件"""
+    step = 0
+    while True:
+        report = tiering_step(budget=budget, dry_run=not apply_changes)
+        step += 1
+        if report.get('blocked'):
+            click.echo(report['blocked'])
+            return
+        action = '已' if apply_changes else '将'
+        click.echo(f"[{step}] 检查 {report['scanned']} 个文件，{action}迁回热存储 {len(report['promoted'])} 个，"
+                   f"{action}迁入冷存储 {len(report['demoted'])} 个")
+        for key in report['demoted']:
+            click.echo(f"  -> cold {key}")
+        for key in report['promoted']:
+            click.echo(f"  -> hot  {key}")
+        if not apply_changes or report['pass_completed'] or (steps and step >= steps):
+            return
+
+# ==================== 预览重建 ====================
+
+# 记录中的文件分组 -> 预览使用的路由前缀
+PREVIEW_GROUPS = (('materials', 'uploads'), ('results', 'generated'))
+
+def preview_source_path(file_info):
+    """生成预览使用的磁盘路径：热存储或原样保存在冷存储中的文件；压缩保存或不存在时返回None"""
+    key = media_key(file_info.get('path'))
+    if not key:
+        return None
+    tiering = get_media_tiering()
+    hot_path = tiering.hot_path(key)
+    if os.path.isfile(hot_path):
+        return hot_path
+    cold = tiering.locate_cold(key)
+    return cold[0] if cold and not cold[1] else None
+
+def load_rebuild_state():
+    """预览重建的进度：{'cursor': 最后处理完的记录id, 'completed_at'}"""
+    try:
+        with open(os.path.join(current_app.config['DATA_FOLDER'], 'preview_rebuild.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'cursor': '', 'completed_at': None}
+
+def save_rebuild_state(state):
+    write_json_atomic(os.path.join(current_app.config['DATA_FOLDER'], 'preview_rebuild.json'), state)
+
+def apply_rebuilt_previews(record_id, app_id, results):
+    """
+    把重新生成的预览合并到记录中并保存，返回新的索引条目（记录不存在或没有变化时返回None）
+
+    合并前重新加载记录，处理期间管理员修改的审核状态等字段不会被覆盖。
+    """
+    import media
+
+    record = load_record(record_id, app_id)
+    if not record:
+        return None
+    changed = False
+    for group, _ in PREVIEW_GROUPS:
+        for file_info in (record.get('files') or {}).get(group) or []:
+            result = results.get(file_info.get('id'))
+            if not result:
+                continue
+            if result['preview'] is not None:
+                file_info['preview'] = result['preview']
+                file_info['preview_version'] = media.PREVIEW_VERSION
+                changed = True
+            if (file_info.get('content_hash'), file_info.get('content_mtime')) != (result['content_hash'], result['content_mtime']):
+                file_info['content_hash'] = result['content_hash']
+                file_info['content_mtime'] = result['content_mtime']
+                changed = True
+    if not changed:
+        return None
+    save_record(record)
+    # 之前没有生成缩略图的视频可能有了新的缩略图
+    get_media_gc().add_record(record)
+    return build_index_entry(record)
+
+def rebuild_previews(workers=None, batch=50, limit=None, force=False, pause=0.0, restart=False, on_batch=None):
+    """
+    按记录id顺序重新生成所有记录文件的预览和视频缩略图，返回统计
+
+    文件在进程池中并行处理（默认每个CPU核一个进程）；内容摘要和预览流水线版本（media.PREVIEW_VERSION）
+    都没有变化的文件跳过。每批记录处理完后保存记录、一次性更新索引中的预览字段并保存进度，中断后从进度继续。
+    workers: 进程数；batch: 每批记录数；limit: 本次最多处理的记录数；pause: 每批之间暂停的秒数（限制IO压力）
+    force: 忽略摘要和版本，全部重新生成；restart: 忽略进度，从头开始
+    on_batch: 每批完成后以当前统计调用（CLI输出进度）
+    """
+    import media
+
+    state = {'cursor': '', 'completed_at': None} if restart else load_rebuild_state()
+    pending = sorted((entry['id'], entry.get('app_id')) for entry in load_records()
+                     if entry['id'] > state['cursor'] and entry.get('app_id'))
+    if limit:
+        pending, remaining = pending[:limit], len(pending) - limit
+    else:
+        remaining = 0
+    report = {'records': 0, 'files': 0, 'regenerated': 0, 'unchanged': 0, 'unavailable': 0, 'failed': 0,
+              'updated_records': 0, 'completed': False}
+    thumbnail_folder = current_app.config['THUMBNAIL_FOLDER']
+    rendition = rendition_settings()
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for start in range(0, len(pending), batch):
+            chunk = pending[start:start + batch]
+            futures = {}
+            for record_id, app_id in chunk:
+                record = load_record(record_id, app_id)
+                report['records'] += 1
+                for group, folder_type in PREVIEW_GROUPS:
+                    for file_info in ((record or {}).get('files') or {}).get(group) or []:
+                        path = preview_source_path(file_info)
+                        if path is None or not file_info.get('id'):
+                            report['unavailable'] += 1
+                            continue
+                        task = {
+                            'file_id': file_info['id'], 'category': file_info.get('category'),
+                            'filename': file_info.get('filename'), 'path': path, 'folder_type': folder_type,
+                            'thumbnail_folder': thumbnail_folder, 'content_hash': file_info.get('content_hash'),
+                            'content_mtime': file_info.get('content_mtime'),
+                            'preview_version': file_info.get('preview_version'), 'force': force,
+                            'rendition': rendition
+                        }
+                        futures[pool.submit(media.rebuild_preview, task)] = (record_id, app_id)
+
+            results = {}
+            for future in as_completed(futures):
+                record_id, app_id = futures[future]
+                report['files'] += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    report['failed'] += 1
+                    storage_log.warning('重新生成预览失败', extra=fields(record_id=record_id, error=e))
+                    continue
+                report['regenerated' if result['preview'] is not None else 'unchanged'] += 1
+                results.setdefault((record_id, app_id), {})[result['file_id']] = result
+
+            # 保存记录，索引中的预览字段每批只更新一次
+            updated = {}
+            for (record_id, app_id), file_results in results.items():
+                entry = apply_rebuilt_previews(record_id, app_id, file_results)
+                if entry:
+                    updated[record_id] = entry
+            report['updated_records'] += len(updated)
+            if updated:
+                index_records = load_records()
+                changed_entries = []
+                for index_entry in index_records:
+                    entry = updated.get(index_entry['id'])
+                    if entry and (index_entry.get('has_preview'), index_entry.get('preview_type')) != \
+                            (entry['has_preview'], entry['preview_type']):
+                        index_entry['has_preview'] = entry['has_preview']
+                        index_entry['preview_type'] = entry['preview_type']
+                        changed_entries.append(index_entry)
+                if changed_entries:
+                    update_index_entries(changed_entries)
+                notify_records_changed([entry for entry in index_records if entry['id'] in updated])
+
+            state['cursor'] = chunk[-1][0]
+            save_rebuild_state(state)
+            if on_batch:
+                on_batch(report)
+            if pause and start + batch < len(pending):
+                time.sleep(pause)
+
+    if not remaining:
+        state.update(cursor='', completed_at=time.time())
+        save_rebuild_state(state)
+        report['completed'] = True
+    return report
+
+@manage_bp.cli.command('rebuild-previews')
+@click.option('--workers', default=0, show_default=True, help='进程数，0表示CPU核数')
+@click.option('--batch', default=50, show_default=True, help='每批处理的记录数')
+@click.option('--limit', default=0, show_default=True, help='本次最多处理的记录数，0表示全部')
+@click.option('--pause', default=0.0, show_default=True, help='每批之间暂停的秒数，用于限制在线重建的IO压力')
+@click.option('--force', is_flag=True, help='忽略内容摘要和流水线版本，全部重新生成')
+@click.option('--restart', is_flag=True, help='忽略上次的进度，从第一条记录开始')
+def rebuild_previews_command(workers, batch, limit, pause, force, restart):
+    """重新生成存量记录的预览和视频缩略图（修改缩略图尺寸或预览逻辑后执行，可中断后继续）"""
+    def progress(report):
+        click.echo(f"已处理 {report['records']} 条记录、{report['files']} 个文件："
+                   f"重新生成 {report['regenerated']}，未变化 {report['unchanged']}，失败 {report['failed']}")
+
+    report = rebuild_previews(workers=workers or None, batch=max(batch, 1), limit=limit or None, force=force,
+                              pause=pause, restart=restart, on_batch=progress)
+    click.echo(f"更新 {report['updated_records']} 条记录，{report['unavailable']} 个文件不可用（已删除或压缩保存在冷存储）"
+               + ('，已完成一轮重建' if report['completed'] else '，下次执行从进度继续'))
+
+# ==================== 视频预览 ====================
+
+def rendition_settings():
+    """生成视频低码率预览的参数（未开启时为None）"""
+    if not current_app.config['VIDEO_RENDITIONS']:
+        return None
+    return {'max_width': current_app.config['RENDITION_MAX_WIDTH'], 'max_fps': current_app.config['RENDITION_MAX_FPS']}
+
+def schedule_renditions(record):
+    """在后台线程中为新记录的视频生成低码率预览，完成后合并到记录中（转码不阻塞提交请求）"""
+    import media
+
+    settings = rendition_settings()
+    jobs = [(file_info['id'], file_info['full_path'], file_info['filename'])
+            for group, _ in PREVIEW_GROUPS for file_info in record['files'][group]
+            if file_info['category'] == 'video']
+    if settings is None or not jobs:
+        return
+    media.run_in_background(current_app.config['RENDITION_WORKERS'], render_record_videos,
+                            current_app._get_current_object(), record['id'], record['app_id'], jobs, settings)
+
+def render_record_videos(app, record_id, app_id, jobs, settings):
+    """后台线程：转码记录中的视频并保存到记录（所有worker合计同时转码的数量受 ADMISSION_MEDIA_SLOTS 限制）"""
+    import media
+
+    try:
+        ticket = app.extensions['media_admission'].acquire()
+    except AdmissionRejected:
+        storage_log.warning('视频转码排队已满，由 flask rebuild-previews 补齐', extra=fields(record_id=record_id))
+        return
+    renditions = {}
+    with ticket:
+        for file_id, path, filename in jobs:
+            rendition = media.generate_video_rendition(path, filename, app.config['THUMBNAIL_FOLDER'], **settings)
+            if rendition:
+                renditions[file_id] = rendition
+    if renditions:
+        with app.app_context():
+            apply_renditions(record_id, app_id, renditions)
+
+def apply_renditions(record_id, app_id, renditions):
+    """把视频预览合并到记录的预览信息中（重新加载记录，转码期间的审核不会被覆盖）"""
+    record = load_record(record_id, app_id)
+    if not record:
+        # 转码期间记录已被删除，预览文件由孤立媒体回收清理
+        return
+    for group, _ in PREVIEW_GROUPS:
+        for file_info in record['files'].get(group) or []:
+            rendition = renditions.get(file_info.get('id'))
+            if rendition and isinstance(file_info.get('preview'), dict):
+                file_info['preview'].update(rendition)
+    save_record(record)
+    get_media_gc().add_record(record)
+    notify_records_changed([build_index_entry(record)])
+
+# ==================== 一致性检查 ====================
+
+def record_file_exists(index_entry):
+    """索引条目对应的记录文件是否存在（分片布局或旧布局）"""
+    app_id = index_entry.get('app_id')
+    if not app_id:
+        return False
+    return any(os.path.exists(path) for path in (record_file_path(index_entry['id'], app_id),
+                                                 legacy_record_file_path(index_entry['id'], app_id)))
+
+@manage_bp.cli.command('fsck')
+@click.option('--workers', default=0, show_default=True, help='进程数，0表示CPU核数')
+@click.option('--prune', is_flag=True, help='删除悬空和重复的索引条目，并用记录文件补全缺失的app_id/status')
+@click.option('--rebuild-index', is_flag=True, help='由记录文件重建索引（同时修正状态不一致和过期的投影字段）')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), help='把全部问题写入JSONL文件')
+@click.option('--samples', default=5, show_default=True, help='每类问题输出的示例数')
+def fsck_command(workers, prune, rebuild_index, output, samples):
+    """并行检查索引、记录文件和媒体文件的一致性，可选修复索引"""
+    if prune and rebuild_index:
+        raise click.UsageError('--prune 和 --rebuild-index 只能选择一个')
+    started = time.perf_counter()
+    media_folders = {folder: current_app.config[key] for folder, key in MEDIA_FOLDER_KEYS.items()}
+    media_keys = fsck.list_media(media_folders, current_app.config['COLD_FOLDER'])
+    report = fsck.check(read_index_file(), RECORDS_DIR, media_keys, build_index_entry, record_shard,
+                        workers=workers or None, rebuild=rebuild_index)
+
+    click.echo(f"索引 {report['records']} 条，记录文件 {report['files']} 个，媒体文件 {len(media_keys)} 个，"
+               f"耗时 {time.perf_counter() - started:.1f} 秒")
+    counts = fsck.summarize(report['issues'])
+    for issue_type, count in sorted(counts.items()):
+        click.echo(f"  {issue_type}: {count}")
+        for issue in [issue for issue in report['issues'] if issue['type'] == issue_type][:samples]:
+            click.echo(f"    {json.dumps(issue, ensure_ascii=False)}")
+    if not counts:
+        click.echo('没有发现问题')
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(issue, ensure_ascii=False) + '\n' for issue in report['issues'])
+        click.echo(f"全部问题已写入 {output}")
+
+    if prune:
+        # 重新读取索引：检查期间的提交和审核不会丢失
+        index_records, removed, filled = fsck.prune_index(read_index_file(), report['found'],
+                                                          lambda entry: not record_file_exists(entry))
+        if removed or filled:
+            save_records(index_records)
+            get_fragment_cache().invalidate()
+        click.echo(f"已删除 {removed} 个索引条目，补全 {filled} 个索引条目")
+    elif rebuild_index:
+        index_records = fsck.rebuild_index(report['entries'], read_index_file(), record_file_exists)
+        save_records(index_records)
+        get_fragment_cache().invalidate()
+        click.echo(f"已由记录文件重建索引：{len(index_records)} 条")
+    if (prune or rebuild_index) and current_app.config['STATIC_EXPORT']:
+        click.echo('已开启STATIC_EXPORT，请执行 flask export-static 重新导出静态站点')
+
+@manage_bp.cli.command('reshard-records')
+@click.option('--app-id', 'app_ids', multiple=True, help='只迁移指定的app_id（可重复，默认全部）')
+@click.option('--batch', default=1000, show_default=True, help='每批迁移的文件数')
+@click.option('--pause', default=0.0, show_default=True, help='每批之间暂停的秒数，用于限制在线迁移的IO压力')
+@click.option('--dry-run', is_flag=True, help='只统计需要迁移的文件数')
+def reshard_records_command(app_ids, batch, pause, dry_run):
+    """把平铺在 data/records/<app_id>/ 下的记录文件迁移到分片目录（可在服务运行时执行）"""
+    if not app_ids:
+        app_ids = sorted(entry.name for entry in os.scandir(RECORDS_DIR) if entry.is_dir())
+    for app_id in app_ids:
+        moved = skipped = unindexed = 0
+        while True:
+            result = reshard_app_records(app_id, limit=None if dry_run else batch, dry_run=dry_run)
+            moved += result['moved']
+            skipped += result['skipped']
+            unindexed = result['unindexed']
+            if dry_run or not result['remaining']:
+                break
+            if pause:
+                time.sleep(pause)
+        click.echo(f"{app_id}: {'需要迁移' if dry_run else '已迁移'} {moved} 个文件"
+                   f"{f'，{skipped} 个已存在于分片目录' if skipped else ''}")
+        if unindexed:
+            click.echo(f"{app_id}: {unindexed} 个文件不在索引中，未迁移（请先执行 flask fsck 检查）")
+
+@manage_bp.cli.command('compress-static')
+def compress_static_command():
+    """为static/下的文件生成.gz/.br预压缩版本（部署构建时执行，之后启动无需再压缩）"""
+    written = precompress_folder(current_app.static_folder)
+    click.echo(f"已生成 {written} 个预压缩文件")
+
+@manage_bp.cli.command('export-static')
+def export_static_command():
+    """全量导出已审核通过的案例到 OUTPUT_FOLDER（之后由 STATIC_EXPORT 增量更新）"""
+    report = publish_static_site()
+    click.echo(f"已导出 {report['pages']} 个详情页、{report['shards']} 个数据分片到 {current_app.config['OUTPUT_FOLDER']}")
+
+# ==================== 性能剖析 ====================
+
+def get_profiler():
+    """当前应用的请求剖析器"""
+    return current_app.extensions['profiler']
+
+@manage_bp.route('/admin/api/profiling', methods=['GET', 'POST', 'DELETE'])
+@login_required
+def admin_api_profiling():
+    """API: 剖析设置和已有结果（GET），修改设置/开关（POST），清空结果（DELETE）"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            try:
+                get_profiler().configure(**data)
+            except (TypeError, ValueError) as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        elif request.method == 'DELETE':
+            get_profiler().reset()
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'settings': get_profiler().settings(),
+                'profiles': get_profiler().profiles()
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@manage_bp.route('/admin/api/profiling/download')
+@login_required
+def admin_api_profiling_download():
+    """下载一个endpoint合并后的剖析结果：cprofile模式为pstats文件，sample模式为折叠栈"""
+    mode = request.args.get('mode', 'sample')
+    endpoint = request.args.get('endpoint', '')
+    if mode not in PROFILE_FORMATS:
+        return jsonify({'success': False, 'error': f"mode必须是 {' 或 '.join(PROFILE_FORMATS)}"}), 400
+    data = get_profiler().export(mode, endpoint)
+    if data is None:
+        return jsonify({'success': False, 'error': '没有该endpoint的剖析结果'}), 404
+    response = Response(data, mimetype='application/octet-stream' if mode == 'cprofile' else 'text/plain')
+    response.headers['Content-Disposition'] = f'attachment; filename="{endpoint}.{PROFILE_FORMATS[mode][0]}"'
+    return response
+
+# ==================== 只读副本 ====================
+
+# 副本数据过期时返回503的读接口
+REPLICA_READ_ENDPOINTS = {'api.gallery', 'api.record_detail', 'api.api_records', 'api.api_apps', 'api.api_record_detail',
+                          'api.api_records_batch'}
+
+def get_replica():
+    """副本的同步状态（不是副本时为None）"""
+    return current_app.extensions.get('replica')
+
+def replica_stale():
+    """副本超过 REPLICA_MAX_LAG 秒没有同步成功（不是副本时返回False）"""
+    replica = get_replica()
+    if replica is None:
+        return False
+    lag = replica.lag()
+    return lag is None or lag > current_app.config['REPLICA_MAX_LAG']
+
+def check_replica_lag():
+    """副本的读接口：数据过期时返回503，由负载均衡转到其他节点"""
+    if request.endpoint in REPLICA_READ_ENDPOINTS and replica_stale():
+        response = jsonify({'success': False, 'error': '副本数据尚未同步，请稍后重试'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+def apply_replicated_changes(entries):
+    """副本：把一批变更写入本地的索引和记录文件（每个索引分区每批只保存一次，记录文件在保存索引之后删除）"""
+    partitions = {}
+    deleted = {}
+
+    def save_partitions():
+        for key, records in partitions.items():
+            update_index_partition(key, lambda _, records=records: records)
+        partitions.clear()
+
+    for entry in entries:
+        data = entry['data']
+        if entry['op'] == 'record':
+            deleted.pop(data['id'], None)
+            save_record(data)
+        elif entry['op'] == 'delete':
+            deleted[data['id']] = data['app_id']
+        elif 'partition' not in data:
+            # 分区之前的主节点写入的变更作用于整个索引
+            save_partitions()
+            save_records(apply_index_delta(read_index_file(), entry['op'], data))
+        else:
+            key = data['partition']
+            if key not in partitions:
+                partitions[key] = load_partition(key)
+            partitions[key] = apply_index_delta(partitions[key], entry['op'], data)
+    save_partitions()
+    for record_id, app_id in deleted.items():
+        with record_files_locked(app_id):
+            remove_record_files(record_id, app_id)
+    get_fragment_cache().invalidate()
+
+def replication_authorized():
+    """/replication/ 接口的访问控制：校验Bearer令牌（反向代理之后对端地址不可信，不按地址放行）"""
+    token = current_app.config['REPLICATION_TOKEN']
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+
+def replication_changes():
+    """主节点：读取序号大于after的变更（segment/offset为上一次返回的位置）"""
+    if not replication_authorized():
+        return jsonify({'success': False, 'error': '无权访问'}), 403
+    try:
+        after = int(request.args.get('after', 0))
+        limit = min(max(int(request.args.get('limit', 500)), 1), 5000)
+        segment = request.args.get('segment')
+        position = [segment, int(request.args.get('offset', 0))] if segment else None
+    except ValueError:
+        return jsonify({'success': False, 'error': '参数必须是整数'}), 400
+    try:
+        return jsonify({'success': True, 'data': get_changelog().read(after, position, limit)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def replication_snapshot():
+    """主节点：索引和全部记录文件的快照（NDJSON流，第一行为快照开始时的序号）"""
+    if not replication_authorized():
+        return jsonify({'success': False, 'error': '无权访问'}), 403
+    lines = snapshot_lines(get_changelog(), current_app.config['DATA_FOLDER'])
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+@click.command('replicate')
+@click.option('--follow', is_flag=True, help='持续同步（默认只同步一次）')
+@with_appcontext
+def replicate_command(follow):
+    """副本：从REPLICA_SOURCE拉取并应用变更"""
+    replica = get_replica()
+    if replica is None:
+        raise click.ClickException('未配置REPLICA_SOURCE')
+    while True:
+        try:
+            report = replica.sync(apply_replicated_changes)
+            if report['applied'] or report['snapshot'] or not follow:
+                click.echo(f"同步到序号 {report['seq']}，应用 {report['applied']} 条变更"
+                           + ('（已复制快照）' if report['snapshot'] else ''))
+        except Exception as e:
+            if not follow:
+                raise
+            # 主节点暂时不可用：继续重试，超过REPLICA_MAX_LAG后读接口返回503
+            storage_log.error('副本同步失败', extra=fields(source=str(replica.source), error=e))
+        if not follow:
+            return
+        time.sleep(current_app.config['REPLICA_POLL_SECONDS'])
+
+# ==================== 应用工厂 ====================
+
+def configure_storage(config):
+    """根据配置设置认证文件、索引文件和记录目录的路径"""
+    global AUTH_FILE, DATA_FILE, INDEX_FILE, INDEX_PARTITIONS, RECORDS_DIR
+    AUTH_FILE = config['AUTH_FILE']
+    DATA_FILE = os.path.join(config['DATA_FOLDER'], 'records.json')
+    INDEX_FILE = os.path.join(config['DATA_FOLDER'], 'index.json')
+    # 按app_id分区的索引（各分区的紧凑索引也在该目录下，各worker通过mmap共享页缓存）
+    INDEX_PARTITIONS = IndexPartitions(os.path.join(config['DATA_FOLDER'], 'index'), legacy_file=INDEX_FILE)
+    RECORDS_DIR = os.path.join(config['DATA_FOLDER'], 'records')
+
+def get_media_gc():
+    """当前应用的孤立媒体文件回收器"""
+    return current_app.extensions['media_gc']
+
+def get_media_tiering():
+    """当前应用的媒体冷热分层"""
+    return current_app.extensions['media_tiering']
+
+def get_fragment_cache():
+    """当前应用的HTML片段缓存"""
+    return current_app.extensions['fragment_cache']
+
+def get_duplicate_index():
+    """当前应用的近似重复索引"""
+    return current_app.extensions['duplicate_index']
+
+def get_event_log():
+    """当前应用的管理后台事件日志"""
+    return current_app.extensions['event_log']
+
+def notify_admin(changes):
+    """
+    推送管理后台事件：新提交的记录、状态变化和统计增量（推送失败不影响请求）
+
+    changes: [(索引条目, 原状态, 新状态)]，原状态为None表示新提交，新状态为None表示已删除
+    """
+    events = [('record_submitted', {name: entry.get(name) for name in ('id', 'title', 'app_id', 'created_at')})
+              for entry, old_status, _ in changes if old_status is None]
+    statuses = [{'id': entry['id'], 'status': new_status} for entry, old_status, new_status in changes
+                if old_status is not None]
+    if statuses:
+        events.append(('record_status', {'records': statuses}))
+    events.append(('stats_delta', stats_delta(changes)))
+    try:
+        get_event_log().publish(events)
+    except Exception as e:
+        api_log.warning('推送管理后台事件失败', extra=fields(count=len(changes), error=e))
+
+def get_moderation_queue():
+    """当前应用的审核队列"""
+    return current_app.extensions['moderation_queue']
+
+def index_duplicates(record):
+    """在后台线程中计算新记录生成结果的感知哈希（解码图片不阻塞提交请求，失败不影响提交）"""
+    import media
+
+    media.run_in_background(current_app.config['RENDITION_WORKERS'], hash_record_media,
+                            current_app._get_current_object(), record)
+
+def hash_record_media(app, record):
+    """后台线程：计算记录的感知哈希（与视频转码共用 ADMISSION_MEDIA_SLOTS 槽位）"""
+    try:
+        ticket = app.extensions['media_admission'].acquire()
+    except AdmissionRejected:
+        storage_log.warning('感知哈希排队已满，由 flask hash-media 补算', extra=fields(record_id=record['id']))
+        return
+    with ticket, app.app_context():
+        try:
+            duplicate_index = get_duplicate_index()
+            duplicate_index.add_record(record, get_media_tiering().resolve)
+            if load_record(record['id'], record['app_id']) is None:
+                # 计算期间记录已被删除，删除时追加的remove可能早于本次的哈希
+                duplicate_index.remove_record(record['id'])
+        except Exception as e:
+            storage_log.warning('计算感知哈希失败', extra=fields(record_id=record['id'], error=e))
+
+def get_static_site():
+    """当前应用的静态站点发布器"""
+    return current_app.extensions['static_site']
+
+def render_static(template_name, **context):
+    """渲染静态站点页面（在请求之外调用时提供一个临时的请求上下文）"""
+    if has_request_context():
+        return render_template(template_name, **context)
+    with current_app.test_request_context('/'):
+        return render_template(template_name, **context)
+
+def publish_static_site(changed=None):
+    """更新静态站点：changed为发生变化的索引条目，为None时全量重建"""
+    # 增量发布只从紧凑索引中取出受影响日期的条目，不解析整个索引
+    return get_static_site().publish(IndexSource(load_index_view().indexes), load_display_record, render_static,
+                                     changed=changed)
+
+def notify_records_changed(entries):
+    """
+    公开可见的记录发生变化（审核通过/拒绝、删除）时调用：使服务端渲染的片段失效，
+    开启STATIC_EXPORT时增量更新静态站点
+
+    entries: 发生变化的索引条目（删除的记录传删除前的条目）
+    """
+    try:
+        get_fragment_cache().invalidate()
+    except OSError as e:
+        # 记录本身已经保存成功，失效失败只会让片段缓存晚一些更新
+        storage_log.error('片段缓存失效失败', extra=fields(count=len(entries), error=e))
+    if current_app.config['STATIC_EXPORT'] and entries:
+        try:
+            publish_static_site(entries)
+        except Exception as e:
+            # 记录本身已经保存成功，静态站点可以稍后用 flask export-static 重建
+            storage_log.exception('静态站点更新失败', extra=fields(count=len(entries), error=e))
+
+def create_app(config=None):
+    """
+    创建Flask应用
+
+    config: 覆盖 DEFAULT_CONFIG 的配置字典。相对目录按当前工作目录解析为绝对路径，
+    保证保存上传文件和 send_from_directory 读取文件使用同一个位置。
+    OpenCV和媒体处理流水线不在这里加载，而是在第一次处理上传时按需导入。
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    if config:
+        app.config.update(config)
+
+    role = app.config['APP_ROLE']
+    if role not in APP_ROLES:
+        raise ValueError(f"未知的APP_ROLE: {role}（可选: {', '.join(APP_ROLES)}）")
+    if app.config['REPLICA_SOURCE'] and role != 'api':
+        raise ValueError('只读副本（REPLICA_SOURCE）只能使用 APP_ROLE=api')
+
+    # 确保必要的文件夹存在
+    for key in ('UPLOAD_FOLDER', 'GENERATED_FOLDER', 'OUTPUT_FOLDER', 'DATA_FOLDER', 'THUMBNAIL_FOLDER', 'COLD_FOLDER'):
+        app.config[key] = os.path.abspath(app.config[key])
+        os.makedirs(app.config[key], exist_ok=True)
+    if not app.config['METRICS_DIR']:
+        app.config['METRICS_DIR'] = os.path.join(app.config['DATA_FOLDER'], 'metrics')
+
+    configure_storage(app.config)
+    os.makedirs(RECORDS_DIR, exist_ok=True)
+
+    # 日志：有界队列 + 后台线程写出，调试级别关闭时热点路径上的debug调用几乎没有开销
+    setup_from_env(app.config)
+    # 指标采集（多worker共享快照目录，/metrics汇总输出）
+    metrics.configure(app.config['METRICS_DIR'])
+    media_folders = {folder: app.config[key] for folder, key in MEDIA_FOLDER_KEYS.items()}
+    # 媒体冷热分层（访问日志和分层进度保存在data目录下）
+    app.extensions['media_tiering'] = MediaTiering(
+        app.config['DATA_FOLDER'], media_folders, app.config['COLD_FOLDER'],
+        idle_seconds=app.config['TIER_IDLE_SECONDS'],
+        rejected_idle_seconds=app.config['TIER_REJECTED_IDLE_SECONDS'],
+        promote_hits=app.config['TIER_PROMOTE_HITS'])
+    # 孤立媒体文件回收器（引用表和回收进度保存在data目录下，回收时同时删除冷存储中的副本）
+    app.extensions['media_gc'] = MediaGC(app.config['DATA_FOLDER'], media_folders,
+                                         grace_seconds=app.config['GC_GRACE_SECONDS'],
+                                         locate=app.extensions['media_tiering'].locate)
+    # 服务端渲染片段缓存（版本文件放在data目录下，所有worker共享失效信号）
+    app.extensions['fragment_cache'] = FragmentCache(os.path.join(app.config['DATA_FOLDER'], 'fragment_cache.version'))
+    # 近似重复索引（哈希日志保存在data目录下，所有worker共享）
+    app.extensions['duplicate_index'] = DuplicateIndex(app.config['DATA_FOLDER'],
+                                                       max_distance=app.config['DUPLICATE_MAX_DISTANCE'])
+    # 管理后台事件日志（SSE推送，所有worker共享）
+    app.extensions['event_log'] = EventLog(app.config['DATA_FOLDER'])
+    # 审核队列（租约保存在data目录下，所有worker共享）
+    app.extensions['moderation_queue'] = ModerationQueue(app.config['DATA_FOLDER'],
+                                                         lease_seconds=app.config['REVIEW_LEASE_SECONDS'])
+    # 静态站点发布器（导出到OUTPUT_FOLDER）
+    app.extensions['static_site'] = StaticSite(app.config['OUTPUT_FOLDER'], app.config['DATA_FOLDER'],
+                                               per_page=app.config['SSR_PER_PAGE'])
+
+    # 准入控制（槽位文件保存在data目录下，所有worker共享）：提交的并发数、排队和磁盘预留，视频转码的并发数
+    admission_folder = os.path.join(app.config['DATA_FOLDER'], 'admission')
+    app.extensions['ingest_admission'] = AdmissionController(
+        os.path.join(admission_folder, 'ingest'), app.config['ADMISSION_INGEST_SLOTS'], app.config['ADMISSION_QUEUE'],
+        wait_seconds=app.config['ADMISSION_WAIT_SECONDS'], disk_path=app.config['UPLOAD_FOLDER'],
+        min_free_bytes=app.config['ADMISSION_MIN_FREE_BYTES'], retry_after=app.config['ADMISSION_RETRY_AFTER'])
+    # 转码在后台线程中执行，排队上限和等待时间放宽（等待只占用后台线程）
+    app.extensions['media_admission'] = AdmissionController(
+        os.path.join(admission_folder, 'media'), app.config['ADMISSION_MEDIA_SLOTS'], 64, wait_seconds=3600,
+        name='media')
+
+    # 请求剖析（开关和结果保存在data目录下，管理员在 /admin/api/profiling 打开后所有worker生效）
+    app.extensions['profiler'] = Profiler(os.path.join(app.config['DATA_FOLDER'], 'profiling'),
+                                          poll_seconds=app.config['PROFILE_POLL_SECONDS'])
+
+    # 响应压缩（动态响应压缩结果按内容缓存，静态文件使用预压缩版本）
+    app.extensions['compressor'] = ResponseCompressor(app.config['COMPRESS_MIN_SIZE'],
+                                                      app.config['COMPRESS_CACHE_BYTES'])
+    if app.config['PRECOMPRESS_STATIC'] and app.static_folder and os.path.isdir(app.static_folder):
+        precompress_folder(app.static_folder)
+
+    # 只读副本：主节点发布变更日志，副本由 flask replicate --follow 同步
+    if app.config['REPLICATION_LOG']:
+        app.extensions['changelog'] = ChangeLog(os.path.join(app.config['DATA_FOLDER'], 'changelog'),
+                                                segment_bytes=app.config['CHANGELOG_SEGMENT_BYTES'],
+                                                keep_segments=app.config['CHANGELOG_KEEP_SEGMENTS'])
+        # 快照和变更日志包含待审核、已拒绝的记录：没有令牌时不注册HTTP接口
+        if app.config['REPLICATION_TOKEN']:
+            app.add_url_rule('/replication/changes', 'replication_changes', replication_changes)
+            app.add_url_rule('/replication/snapshot', 'replication_snapshot', replication_snapshot)
+        else:
+            storage_log.warning('未配置REPLICATION_TOKEN，不提供 /replication/ 接口（副本只能从data目录同步）')
+    if app.config['REPLICA_SOURCE']:
+        source = make_source(app.config['REPLICA_SOURCE'], app.config['REPLICATION_TOKEN'])
+        app.extensions['replica'] = Replica(app.config['DATA_FOLDER'], source)
+    app.cli.add_command(replicate_command)
+
+    app.before_request(start_request_timer)
+    app.before_request(start_profiling)
+    app.teardown_request(stop_profiling)
+    app.before_request(serve_precompressed_static)
+    if app.config['REPLICA_SOURCE']:
+        app.before_request(check_replica_lag)
+    app.before_request(admit_submission)
+    app.teardown_request(release_admission)
+    app.after_request(compress_response)
+    app.after_request(record_request_metrics)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    app.register_error_handler(RequestEntityTooLarge, handle_file_too_large)
+
+    if role in ('all', 'api'):
+        app.register_blueprint(api_bp)
+    if role in ('all', 'manage'):
+        app.register_blueprint(manage_bp)
+    return app
+
+_default_app = None
+
+def __getattr__(name):
+    """按需创建默认应用：gunicorn app:app、flask --app app 访问 app 属性时才初始化"""
+    global _default_app
+    if name == 'app':
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
+    app = create_app()
     print("AI内容生成记录系统启动中...")
     print(f"上传文件夹: {app.config['UPLOAD_FOLDER']}")
     print(f"生成结果文件夹: {app.config['GENERATED_FOLDER']}")
     print(f"输出文件夹: {app.config['OUTPUT_FOLDER']}")
     print(f"数据文件夹: {app.config['DATA_FOLDER']}")
     print(f"记录文件: {RECORDS_DIR}/")
-    print(f"索引文件: {INDEX_FILE}")
+    print(f"索引分区: {INDEX_PARTITIONS.folder}/")
     print(f"缩略图文件夹: {app.config['THUMBNAIL_FOLDER']}")
     print("\n访问 http://localhost:5000 查看案例画廊")
     print("访问 http://localhost:5000/form 提交新记录")
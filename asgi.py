@@ -0,0 +1,517 @@
+"""
+ASGI服务模式
+
+只读API（/api/records、/api/apps、/api/record/<id>）和媒体文件（/uploads、/generated、
+/thumbnails、/output）由asyncio协程直接处理：文件按块在线程池中读取后写给客户端，
+发送时等待客户端消费（背压），一个下载很慢的客户端只占用一个协程而不是一个线程。
+其余路由（画廊页面、表单提交、管理后台、/metrics）交给原有的Flask应用，在独立的线程池中执行。
+表单提交在接收请求体之前经过准入控制，排队在协程中等待，上传高峰时不会占满Flask的线程池。
+
+    pip install uvicorn
+    uvicorn --factory asgi:create_asgi_app --host 0.0.0.0 --port 5000
+    python asgi.py
+
+不依赖任何ASGI框架，可以运行在任意ASGI服务器上（uvicorn、hypercorn、daphne等）。
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import mimetypes
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import parse_qs
+
+from werkzeug.security import safe_join
+
+import metrics
+import app as app_module
+from admission import AdmissionRejected
+from compression import choose_encoding
+from media_gc import media_key
+
+log = logging.getLogger(__name__)
+
+# 媒体文件路由前缀 -> Flask配置中的目录
+MEDIA_PREFIXES = {
+    '/uploads/': 'UPLOAD_FOLDER',
+    '/generated/': 'GENERATED_FOLDER',
+    '/thumbnails/': 'THUMBNAIL_FOLDER',
+    '/output/': 'OUTPUT_FOLDER'
+}
+
+# 文件每次读取的块大小
+CHUNK_SIZE = 256 * 1024
+# 上传请求体超过该大小时转存到临时文件
+SPOOL_SIZE = 1024 * 1024
+
+
+def _parse_range(header, size):
+    """解析单段Range请求头，返回 (start, end)；不支持的格式返回None，无法满足返回False"""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            length = int(last)
+            if length <= 0:
+                return False
+            start, end = max(0, size - length), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, min(end, size - 1)
+
+
+class AsgiApp:
+    """ASGI应用：只读API和媒体文件用协程处理，其余请求交给Flask"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.native = flask_app.config['APP_ROLE'] in ('all', 'api')
+        # 文件读取、索引和记录访问（短任务）
+        self.io_pool = ThreadPoolExecutor(flask_app.config['ASGI_IO_THREADS'], thread_name_prefix='asgi-io')
+        # 交给Flask处理的请求（每个请求占用一个线程直到响应发送完毕）
+        self.wsgi_pool = ThreadPoolExecutor(flask_app.config['ASGI_WSGI_THREADS'], thread_name_prefix='asgi-wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        started = time.perf_counter()
+        route, handler = self._match(scope)
+        if handler is None:
+            ticket = None
+            if self._is_submission(scope):
+                ticket = await self._admit(scope, send)
+                if ticket is None:
+                    return
+            try:
+                await self._call_wsgi(scope, receive, send, ticket)
+            finally:
+                if ticket is not None:
+                    ticket.release()
+            return
+
+        status = 500
+        try:
+            # 处理函数在发送任何数据之前返回None表示交给Flask处理
+            status = await handler(scope, send)
+        except Exception:
+            log.exception('ASGI请求处理失败')
+            raise
+        finally:
+            if status is not None:
+                # 与Flask的after_request钩子使用相同的指标和路由模板
+                metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                                method=scope['method'], route=route)
+                metrics.inc('http_requests_total', method=scope['method'], route=route, status=str(status))
+        if status is None:
+            await self._call_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.io_pool.shutdown(wait=False)
+                self.wsgi_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _match(self, scope):
+        """返回 (路由模板, 协程处理函数)；不由协程处理的请求返回 (None, None)"""
+        if not self.native or scope['method'] not in ('GET', 'HEAD'):
+            return None, None
+        path = scope['path']
+        for prefix, folder_key in MEDIA_PREFIXES.items():
+            filename = path[len(prefix):]
+            # 导出的静态站点有子目录（/output/records/<id>.html），其余媒体目录只有一层
+            if path.startswith(prefix) and filename and (prefix == '/output/' or '/' not in filename):
+                if prefix == '/output/':
+                    return '/output/<path:filename>', lambda s, send: self._serve_file(s, send, folder_key, filename)
+                # 媒体文件可能已迁移到冷存储（scope['path']已经过百分号解码，不能再次解码）
+                key = media_key(prefix + filename)
+                return f"{prefix}<filename>", lambda s, send: self._serve_file(s, send, folder_key, filename, key)
+        if path == '/api/records':
+            return '/api/records', self._api_records
+        if path == '/api/apps':
+            return '/api/apps', self._api_apps
+        if path.startswith('/api/record/') and '/' not in path[len('/api/record/'):]:
+            record_id = path[len('/api/record/'):]
+            if record_id:
+                return '/api/record/<record_id>', lambda s, send: self._api_record_detail(s, send, record_id)
+        return None, None
+
+    # ==================== 响应辅助 ====================
+
+    async def _run(self, func, *args):
+        """在IO线程池中执行阻塞函数（带应用上下文）"""
+        def call():
+            with self.flask_app.app_context():
+                return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.io_pool, call)
+
+    async def _send_json(self, scope, send, data, status=200, headers=()):
+        # 与jsonify的输出一致（非调试模式下为紧凑格式）
+        body = self.flask_app.json.dumps(data, separators=(',', ':')).encode('utf-8') + b'\n'
+        headers = [(b'content-type', b'application/json'), (b'vary', b'Accept-Encoding')] + list(headers)
+        # 与Flask的compress_response使用同一个压缩器（和压缩结果缓存），压缩在线程池中执行
+        compressor = self.flask_app.extensions['compressor']
+        encoding = None
+        if status == 200 and len(body) >= compressor.min_size:
+            encoding = choose_encoding(self._header(scope, b'accept-encoding'))
+        if encoding:
+            compressed = await asyncio.get_running_loop().run_in_executor(
+                self.io_pool, compressor.compress, body, encoding)
+            if len(compressed) < len(body):
+                body = compressed
+                headers.append((b'content-encoding', encoding.encode()))
+        headers.append((b'content-length', str(len(body)).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+        return status
+
+    @staticmethod
+    def _header(scope, name):
+        for key, value in scope['headers']:
+            if key.lower() == name:
+                return value.decode('latin-1')
+        return None
+
+    @staticmethod
+    async def _send_empty(send, status, headers=()):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-length', b'0')] + list(headers)})
+        await send({'type': 'http.response.body', 'body': b''})
+        return status
+
+    # ==================== 只读API ====================
+
+    @staticmethod
+    def _query(scope):
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        return {key: values[0] for key, values in query.items()}
+
+    async def _replica_stale(self):
+        """副本数据过期时交给Flask（返回503）"""
+        if 'replica' not in self.flask_app.extensions:
+            return False
+        return await self._run(app_module.replica_stale)
+
+    async def _api_records(self, scope, send):
+        if await self._replica_stale():
+            return None
+        try:
+            args = self._query(scope)
+            page = int(args.get('page', 1))
+            per_page = int(args.get('per_page', 12))
+            records, total = await self._run(app_module.list_public_records, page, per_page,
+                                             args.get('app_id', ''))
+            return await self._send_json(scope, send, {
+                'success': True,
+                'data': records,
+                'pagination': {
+                    'page': page,
+                    'per_page': per_page,
+                    'total': total,
+                    'total_pages': (total + per_page - 1) // per_page
+                }
+            })
+        except Exception as e:
+            return await self._send_json(scope, send, {'success': False, 'error': str(e)}, 500)
+
+    async def _api_apps(self, scope, send):
+        if await self._replica_stale():
+            return None
+        try:
+            app_ids = await self._run(app_module.list_public_apps)
+            return await self._send_json(scope, send, {'success': True, 'data': app_ids})
+        except Exception as e:
+            return await self._send_json(scope, send, {'success': False, 'error': str(e)}, 500)
+
+    async def _api_record_detail(self, scope, send, record_id):
+        if await self._replica_stale():
+            return None
+        try:
+            record, status = await self._run(app_module.load_display_record, record_id)
+            if not record:
+                return await self._send_json(scope, send, {'success': False, 'error': '记录不存在'}, 404)
+            if status != app_module.STATUS_APPROVED:
+                # 未审核通过的案例只有管理员能看，需要读取session，交给Flask处理
+                return None
+            return await self._send_json(scope, send, {'success': True, 'data': record})
+        except Exception as e:
+            return await self._send_json(scope, send, {'success': False, 'error': str(e)}, 500)
+
+    # ==================== 媒体文件 ====================
+
+    async def _serve_file(self, scope, send, folder_key, filename, key=None):
+        """
+        以流的方式发送媒体文件，支持Range和If-None-Match/If-Modified-Since
+
+        key: 媒体文件的键（uploads/、generated/、thumbnails/），热存储中不存在时从冷存储读取并记录访问
+        """
+        path = safe_join(self.flask_app.config[folder_key], filename)
+        try:
+            stat = await self._run(os.stat, path) if path else None
+        except OSError:
+            stat = None
+        if (stat is None or not await self._run(os.path.isfile, path)) and key:
+            tiering = self.flask_app.extensions['media_tiering']
+            cold = await self._run(tiering.locate_cold, key)
+            if cold and cold[1]:
+                # 压缩保存的冷文件交给Flask（按Accept-Encoding发送压缩文件或解压，不支持Range和条件请求）
+                return None
+            if cold:
+                path = cold[0]
+                stat = await self._run(os.stat, path)
+        if stat is None or not await self._run(os.path.isfile, path):
+            return await self._send_empty(send, 404)
+        if key:
+            # 记录访问会写分层元数据，放到IO线程池中执行
+            await self._run(self.flask_app.extensions['media_tiering'].record_access, key)
+
+        headers = dict((name.decode('latin-1').lower(), value.decode('latin-1'))
+                       for name, value in scope['headers'])
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        common = [(b'etag', etag.encode()), (b'last-modified', last_modified.encode()),
+                  (b'accept-ranges', b'bytes')]
+
+        if etag in headers.get('if-none-match', ''):
+            return await self._send_empty(send, 304, common)
+        if 'if-modified-since' in headers and 'if-none-match' not in headers:
+            try:
+                if int(stat.st_mtime) <= parsedate_to_datetime(headers['if-modified-since']).timestamp():
+                    return await self._send_empty(send, 304, common)
+            except (TypeError, ValueError):
+                pass
+
+        size = stat.st_size
+        status, start, end = 200, 0, size - 1
+        byte_range = _parse_range(headers.get('range'), size) if 'if-range' not in headers or \
+            headers['if-range'] == etag else None
+        if byte_range is False:
+            return await self._send_empty(send, 416, common + [(b'content-range', f"bytes */{size}".encode())])
+        if byte_range:
+            status, (start, end) = 206, byte_range
+            common.append((b'content-range', f"bytes {start}-{end}/{size}".encode()))
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if mimetype.startswith('text/'):
+            mimetype += '; charset=utf-8'
+        await send({'type': 'http.response.start', 'status': status, 'headers': common + [
+            (b'content-type', mimetype.encode()),
+            (b'content-length', str(end - start + 1 if size else 0).encode())
+        ]})
+        if scope['method'] == 'HEAD' or size == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+            return status
+
+        f = await self._run(open, path, 'rb')
+        try:
+            remaining = end - start + 1
+            await self._run(f.seek, start)
+            while remaining > 0:
+                chunk = await self._run(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                # 服务器在客户端消费之前不会让send返回，慢客户端不会让数据堆积在内存中
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+            if remaining > 0:
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await self._run(f.close)
+        return status
+
+    # ==================== 交给Flask处理 ====================
+
+    def _is_submission(self, scope):
+        return (scope['method'] == 'POST' and scope['path'] == '/submit'
+                and self.flask_app.config['APP_ROLE'] in ('all', 'manage'))
+
+    async def _admit(self, scope, send):
+        """
+        表单提交：接收请求体之前申请上传槽位并预留磁盘空间，返回Ticket
+
+        没有空闲槽位时在协程中排队（不占用线程）；排队已满、等待超时或磁盘空间不足时直接返回429/507并返回None
+        """
+        controller = self.flask_app.extensions['ingest_admission']
+        try:
+            reserve_bytes = int(self._header(scope, b'content-length') or 0)
+        except ValueError:
+            reserve_bytes = 0
+        # 没有Content-Length（分块上传）时按上限预留
+        reserve_bytes = reserve_bytes or self.flask_app.config['MAX_CONTENT_LENGTH']
+        queued_at = time.monotonic()
+        try:
+            ticket = await self._run(controller.try_acquire, reserve_bytes)
+            if ticket is not None:
+                return controller.admitted(ticket)
+            waiter = await self._run(controller.enqueue)
+            try:
+                while time.monotonic() < queued_at + controller.wait_seconds:
+                    await asyncio.sleep(controller.poll_seconds)
+                    ticket = await self._run(controller.try_acquire, reserve_bytes, True)
+                    if ticket is not None:
+                        return controller.admitted(ticket, queued_at)
+            finally:
+                waiter.release()
+            raise controller.timed_out(queued_at)
+        except AdmissionRejected as e:
+            await self._send_json(scope, send, {'error': str(e)}, e.status,
+                                  headers=[(b'retry-after', str(e.retry_after).encode())])
+            metrics.inc('http_requests_total', method='POST', route='/submit', status=str(e.status))
+            return None
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def _call_wsgi(self, scope, receive, send, ticket=None):
+        """
+        在线程池中执行Flask应用，响应体经有界队列送回事件循环（队列满时Flask线程等待）
+
+        ticket: 准入控制已经分配的上传槽位，传给Flask的准入检查，不再重复申请
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(maxsize=8)
+        cancelled = threading.Event()
+        done = object()
+
+        async def watch_disconnect():
+            # 请求体读完之后receive()只会返回http.disconnect；客户端断开后send()不会报错，只能在这里发现
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            cancelled.set()
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        def run():
+            response = None
+            try:
+                def start_response(status, headers, exc_info=None):
+                    put(('start', int(status.split(' ', 1)[0]), headers))
+
+                environ = self._environ(scope, body)
+                # 长连接（SSE）等待期间检查该事件，客户端断开后尽快结束
+                environ[app_module.CLIENT_DISCONNECTED] = cancelled
+                if ticket is not None:
+                    environ['admission.ticket'] = ticket
+                response = self.flask_app.wsgi_app(environ, start_response)
+                for chunk in response:
+                    if cancelled.is_set():
+                        break
+                    if chunk:
+                        put(('body', chunk))
+            except Exception as e:
+                put(('error', e))
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+                body.close()
+                put(done)
+
+        loop.run_in_executor(self.wsgi_pool, run)
+        watcher = asyncio.ensure_future(watch_disconnect())
+        started = False
+        try:
+            while True:
+                item = await chunks.get()
+                if item is done:
+                    break
+                if cancelled.is_set():
+                    continue  # 客户端已断开：丢弃数据，等待Flask线程结束并关闭响应
+                if item[0] == 'error':
+                    if not started:
+                        raise item[1]
+                    break
+                if item[0] == 'start':
+                    headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in item[2]]
+                    await send({'type': 'http.response.start', 'status': item[1], 'headers': headers})
+                    started = True
+                else:
+                    await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        except BaseException:
+            # 客户端断开：通知Flask线程停止，并继续取出队列中的数据直到线程结束
+            cancelled.set()
+            while (await chunks.get()) is not done:
+                pass
+            raise
+        finally:
+            watcher.cancel()
+
+
+def create_asgi_app(config=None):
+    """创建ASGI应用（config 同 app.create_app）"""
+    return AsgiApp(app_module.create_app(config))
+
+
+def __getattr__(name):
+    """uvicorn asgi:app 访问 app 属性时才创建应用"""
+    if name == 'app':
+        global app
+        app = create_asgi_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        print('ASGI模式需要安装uvicorn: pip install uvicorn', file=sys.stderr)
+        sys.exit(1)
+    uvicorn.run(create_asgi_app(), host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,11 @@
+"""
+性能基准测试
+
+- datagen: 确定性的合成数据集生成器（记录、参数、文件条目）
+- run: 在不同数据规模下测量存储函数和API接口的耗时，输出JSON结果
+- compare: 比较两次运行的结果，发现性能回退
+
+用法:
+    python -m benchmarks.run --sizes 1000,10000 --output bench.json
+    python -m benchmarks.compare baseline.json bench.json
+"""
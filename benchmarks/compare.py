@@ -0,0 +1,65 @@
+"""
+比较两次基准测试结果
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.2
+
+按 (用例, 数据规模) 对齐两份结果，比较中位数耗时；任一用例变慢超过阈值时以退出码1结束，
+可直接用于CI中的回归检查。
+"""
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    return {(r['name'], r['size']): r for r in report['results']}
+
+
+def compare(baseline, current, threshold, metric='median_ms'):
+    """返回 (对比行列表, 是否存在回退)"""
+    rows = []
+    regressed = False
+    for key in sorted(set(baseline) | set(current), key=lambda k: (k[1], k[0])):
+        base = baseline.get(key, {}).get(metric)
+        new = current.get(key, {}).get(metric)
+        if base is None or new is None:
+            rows.append((key, base, new, None, '缺失'))
+            continue
+        ratio = new / base if base else float('inf')
+        if ratio > 1 + threshold:
+            verdict = '回退'
+            regressed = True
+        elif ratio < 1 - threshold:
+            verdict = '提升'
+        else:
+            verdict = ''
+        rows.append((key, base, new, ratio, verdict))
+    return rows, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='比较两次基准测试结果')
+    parser.add_argument('baseline', help='基线结果JSON')
+    parser.add_argument('current', help='当前结果JSON')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='判定回退的相对变化阈值（默认0.2，即慢20%%）')
+    parser.add_argument('--metric', default='median_ms', help='比较的统计量（默认median_ms）')
+    args = parser.parse_args(argv)
+
+    rows, regressed = compare(load_results(args.baseline), load_results(args.current),
+                              args.threshold, args.metric)
+
+    print(f"{'用例':<28}{'规模':>10}{'基线(ms)':>14}{'当前(ms)':>14}{'比值':>9}")
+    for (name, size), base, new, ratio, verdict in rows:
+        base_text = f"{base:.3f}" if base is not None else '-'
+        new_text = f"{new:.3f}" if new is not None else '-'
+        ratio_text = f"{ratio:.2f}x" if ratio is not None else '-'
+        print(f"{name:<28}{size:>10}{base_text:>14}{new_text:>14}{ratio_text:>9}  {verdict}")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
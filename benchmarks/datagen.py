@@ -0,0 +1,140 @@
+"""
+合成数据集生成器
+
+相同的 seed 和 size 总是生成完全相同的记录，便于在不同版本之间比较基准结果。
+记录结构与 submit_record() 保存的一致：参数、素材/结果文件条目、预览信息、审核状态。
+"""
+import random
+from datetime import datetime, timedelta
+
+# 应用ID按长尾分布出现：少数应用占据大部分记录
+APP_IDS = [
+    'stable_diffusion', 'midjourney', 'dalle3', 'sdxl_turbo', 'kling_video',
+    'runway_gen3', 'pika', 'flux_dev', 'comfyui_workflow', 'animatediff',
+    'svd_video', 'controlnet', 'ip_adapter', 'instantid', 'photomaker',
+    'lcm_lora', 'hunyuan_dit', 'cogvideox', 'playground_v2', 'kolors'
+]
+APP_WEIGHTS = [1.0 / (rank + 1) for rank in range(len(APP_IDS))]
+
+SAMPLERS = ['euler', 'euler_a', 'dpm++_2m', 'dpm++_sde', 'ddim', 'uni_pc']
+MODELS = ['sd_xl_base_1.0', 'v1-5-pruned', 'flux1-dev', 'realvisxl_v4', 'juggernaut_xl']
+RESOLUTIONS = ['512x512', '768x768', '1024x1024', '1024x576', '576x1024', '1920x1080']
+WORDS = ['portrait', 'landscape', 'cyberpunk', 'watercolor', 'city', 'night', 'forest',
+         'cinematic', 'lighting', 'detailed', 'anime', 'oil painting', 'sunset', 'robot',
+         'dragon', 'ocean', 'mountain', 'studio', 'macro', 'minimalist', 'neon', 'vintage']
+
+# 审核状态分布：大部分已通过，少量待审核和已拒绝
+STATUSES = [('approved', 0.7), ('pending', 0.2), ('rejected', 0.1)]
+
+FILE_KINDS = {
+    'image': [('.png', 'image/png'), ('.jpg', 'image/jpeg'), ('.webp', 'image/webp')],
+    'video': [('.mp4', 'video/mp4'), ('.mov', 'video/quicktime'), ('.webm', 'video/webm')],
+    'text': [('.txt', 'text/plain'), ('.json', 'application/json'), ('.csv', 'text/csv')]
+}
+
+
+def _make_file(rng, record_id, index, category, folder):
+    """生成一个文件条目（与submit_record中的file_info结构一致）"""
+    ext, mime_type = rng.choice(FILE_KINDS[category])
+    filename = f"{record_id}_{folder}_{index}{ext}"
+    size = {
+        'image': rng.randint(200 * 1024, 8 * 1024 * 1024),
+        'video': rng.randint(5 * 1024 * 1024, 500 * 1024 * 1024),
+        'text': rng.randint(200, 200 * 1024)
+    }[category]
+
+    file_info = {
+        'id': f"{record_id}-{folder}-{index}",
+        'filename': filename,
+        'category': category,
+        'mime_type': mime_type,
+        'size': size,
+        'path': f"/{folder}/{filename}",
+        'full_path': f"{folder}/{filename}"
+    }
+
+    preview = {'type': category, 'filename': filename}
+    if category == 'image':
+        preview['url'] = f"/{folder}/{filename}"
+    elif category == 'video':
+        preview['thumbnail'] = f"/thumbnails/thumb_{filename.rsplit('.', 1)[0]}.jpg"
+    else:
+        preview['text'] = ' '.join(rng.choice(WORDS) for _ in range(16))[:100]
+    file_info['preview'] = preview
+    return file_info
+
+
+def _pick_status(rng):
+    roll = rng.random()
+    cumulative = 0.0
+    for status, weight in STATUSES:
+        cumulative += weight
+        if roll < cumulative:
+            return status
+    return STATUSES[-1][0]
+
+
+def iter_records(size, seed=42, start=datetime(2025, 1, 1)):
+    """
+    逐条生成 size 条合成记录，按创建时间从旧到新（百万级数据集无需全部放在内存中）
+
+    每条记录的ID与submit_record()一样是精确到微秒的时间戳字符串。
+    """
+    rng = random.Random(seed)
+    created = start
+    for i in range(size):
+        created += timedelta(seconds=rng.randint(1, 600), microseconds=i % 1000000)
+        record_id = created.strftime('%Y%m%d%H%M%S%f')
+        status = _pick_status(rng)
+
+        prompt = ', '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 30)))
+        parameters = {
+            'prompt': prompt,
+            'negative_prompt': ', '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 8))),
+            'resolution': rng.choice(RESOLUTIONS),
+            'seed': rng.randint(0, 2 ** 32 - 1),
+            'steps': rng.choice([20, 25, 30, 40, 50]),
+            'cfg_scale': rng.choice([5.0, 6.5, 7.0, 7.5, 9.0]),
+            'sampler': rng.choice(SAMPLERS),
+            'model': rng.choice(MODELS),
+            'custom_params': {}
+        }
+        if rng.random() < 0.3:
+            parameters['custom_params']['lora'] = rng.choice(WORDS)
+
+        materials = [
+            _make_file(rng, record_id, n, rng.choice(['image', 'image', 'text']), 'uploads')
+            for n in range(rng.randint(0, 3))
+        ]
+        results = [
+            _make_file(rng, record_id, n, rng.choice(['image', 'image', 'video']), 'generated')
+            for n in range(rng.randint(1, 4))
+        ]
+
+        record = {
+            'id': record_id,
+            'created_at': created.isoformat(),
+            'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title(),
+            'app_id': rng.choices(APP_IDS, weights=APP_WEIGHTS)[0],
+            'generation_time': created.strftime('%Y-%m-%dT%H:%M'),
+            'parameters': parameters,
+            'files': {
+                'materials': materials,
+                'results': results
+            },
+            'statistics': {
+                'material_count': len(materials),
+                'result_count': len(results),
+                'total_size': sum(f['size'] for f in materials + results)
+            },
+            'status': status,
+            'review_status': status
+        }
+        yield record
+
+
+def generate_records(size, seed=42):
+    """生成 size 条合成记录，按创建时间从新到旧返回（与索引中的顺序一致）"""
+    records = list(iter_records(size, seed))
+    records.reverse()
+    return records
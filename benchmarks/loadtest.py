@@ -0,0 +1,365 @@
+"""
+端到端并发压测
+
+在真实的WSGI服务器（werkzeug多线程/多进程服务器，或通过 --url 指定的外部gunicorn等服务）上，
+按可配置的比例并发回放以下流量，并按接口统计 p50/p95/p99 延迟、吞吐量和错误率：
+
+- records: 画廊分页浏览 GET /api/records（部分请求带app_id筛选）
+- detail:  详情页 GET /api/record/<id>
+- media:   媒体范围请求 GET /generated/<file>（带Range头，模拟视频拖动播放）
+- submit:  提交新案例 POST /submit（multipart上传）
+- batch:   审核突发 POST /admin/api/batch
+
+    python -m benchmarks.loadtest --size 10000 --concurrency 32 --duration 30 \\
+        --mix records=50,detail=25,media=15,submit=5,batch=5 --output load.json
+
+压测会修改数据（提交、审核），因此使用独立的数据集目录，每次运行前重新生成（--reuse 可跳过）。
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from benchmarks.run import REPO_ROOT, create_dataset_app, import_app, prepare_dataset, _quiet
+
+DEFAULT_MIX = 'records=50,detail=25,media=15,submit=5,batch=5'
+MEDIA_FILE_SIZE = 4 * 1024 * 1024  # 压测用媒体文件大小
+DISCOVER_PAGES = 5  # 压测前通过API发现记录的页数（每页12条）
+
+
+# ==================== 服务端 ====================
+
+def serve(dataset_dir, host, port, processes):
+    """在数据集目录中以werkzeug WSGI服务器运行app（由压测主进程以子进程方式启动）"""
+    from werkzeug.serving import make_server
+
+    flask_app = create_dataset_app(import_app(), dataset_dir, LOG_LEVEL='WARNING')
+
+    # 关闭逐请求的访问日志，避免日志输出成为瓶颈
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server(host, port, flask_app,
+                         threaded=processes <= 1, processes=processes)
+    print(f"压测服务已启动: http://{host}:{port}（processes={processes}）", file=sys.stderr)
+    with _quiet():
+        server.serve_forever()
+
+
+def _wait_for_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# ==================== 数据准备 ====================
+
+def prepare(workdir, size, seed, reuse):
+    """生成压测数据集，并为会被压测到的已审核记录的结果文件创建真实的媒体文件"""
+    app_module = import_app()
+    dataset_dir = os.path.join(workdir, f"n{size}_s{seed}")
+    if not reuse and os.path.exists(dataset_dir):
+        shutil.rmtree(dataset_dir)
+    dataset_dir, flask_app = prepare_dataset(app_module, workdir, size, seed)
+
+    # 所有媒体文件硬链接到同一份随机数据，不额外占用磁盘
+    generated = flask_app.config['GENERATED_FOLDER']
+    os.makedirs(generated, exist_ok=True)
+    payload_path = os.path.join(dataset_dir, 'media_payload.bin')
+    if not os.path.exists(payload_path):
+        with open(payload_path, 'wb') as f:
+            f.write(os.urandom(MEDIA_FILE_SIZE))
+    with _quiet():
+        approved = [e for e in app_module.load_records() if e.get('status') == app_module.STATUS_APPROVED]
+        for entry in approved[:DISCOVER_PAGES * 12]:
+            record = app_module.load_record(entry['id'], entry['app_id'])
+            for result in (record or {}).get('files', {}).get('results', []):
+                path = os.path.join(generated, result['filename'])
+                if not os.path.exists(path):
+                    os.link(payload_path, path)
+
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    admin_cookie = f"{flask_app.config['SESSION_COOKIE_NAME']}=" \
+                   f"{serializer.dumps({'logged_in': True, 'username': 'loadtest'})}"
+    return dataset_dir, admin_cookie
+
+
+# ==================== 客户端 ====================
+
+class Target:
+    """一次压测的目标服务和可用的请求对象（记录ID、媒体路径等）"""
+
+    def __init__(self, base_url, admin_cookie=None):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.admin_cookie = admin_cookie
+        self.record_ids = []
+        self.media_paths = []
+        self.pending_ids = []
+        self.app_ids = []
+        self.total_pages = 1
+
+    def connect(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+    def discover(self, pages=DISCOVER_PAGES):
+        """通过公开API发现可访问的记录和媒体文件"""
+        conn = self.connect()
+        try:
+            for page in range(1, pages + 1):
+                status, body = _request(conn, 'GET', f'/api/records?page={page}&per_page=12')
+                data = json.loads(body)
+                self.total_pages = max(1, data['pagination']['total_pages'])
+                for record in data['data']:
+                    self.record_ids.append(record['id'])
+                    for result in record.get('files', {}).get('results', []):
+                        self.media_paths.append(result['path'])
+                if page >= self.total_pages:
+                    break
+            status, body = _request(conn, 'GET', '/api/apps')
+            self.app_ids = json.loads(body).get('data', [])
+            if self.admin_cookie:
+                status, body = _request(conn, 'GET', '/admin/api/records?status=pending&per_page=200',
+                                        headers={'Cookie': self.admin_cookie})
+                if status == 200:
+                    self.pending_ids = [r['id'] for r in json.loads(body)['data']]
+        finally:
+            conn.close()
+
+
+def _request(conn, method, path, body=None, headers=None):
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, data
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields.items():
+        lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content in files:
+        lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    lines.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(lines), f'multipart/form-data; boundary={boundary}'
+
+
+def build_scenarios(target, rng_seed):
+    """每个场景返回 (method, path, body, headers, 期望状态码集合)"""
+    rng = random.Random(rng_seed)
+    submit_payload = os.urandom(256 * 1024)
+
+    def records():
+        page = rng.randint(1, min(target.total_pages, 50))
+        path = f'/api/records?page={page}&per_page=12'
+        if target.app_ids and rng.random() < 0.3:
+            path += f'&app_id={rng.choice(target.app_ids)}'
+        return 'GET', path, None, {}, {200}
+
+    def detail():
+        return 'GET', f'/api/record/{rng.choice(target.record_ids)}', None, {}, {200}
+
+    def media():
+        start = rng.randint(0, MEDIA_FILE_SIZE - 1)
+        end = min(MEDIA_FILE_SIZE - 1, start + rng.choice([64, 256, 1024]) * 1024)
+        return 'GET', rng.choice(target.media_paths), None, {'Range': f'bytes={start}-{end}'}, {206}
+
+    def submit():
+        token = uuid.uuid4().hex[:12]
+        body, content_type = _multipart(
+            {'title': f'loadtest {token}', 'app_id': 'loadtest',
+             'datetime': datetime.now().strftime('%Y-%m-%dT%H:%M'),
+             'prompt': f'prompt: load test {token}\nseed: {rng.randint(0, 99999)}'},
+            [('results', f'lt_{token}.png', submit_payload)]
+        )
+        return 'POST', '/submit', body, {'Content-Type': content_type}, {200}
+
+    def batch():
+        ids = rng.sample(target.pending_ids, min(20, len(target.pending_ids))) or target.record_ids[:1]
+        body = json.dumps({'action': rng.choice(['approve', 'reject']), 'record_ids': ids}).encode()
+        headers = {'Content-Type': 'application/json', 'Cookie': target.admin_cookie or ''}
+        return 'POST', '/admin/api/batch', body, headers, {200}
+
+    return {'records': records, 'detail': detail, 'media': media, 'submit': submit, 'batch': batch}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_load(target, mix, concurrency, duration, seed):
+    """以concurrency个并发客户端（闭环）运行duration秒，返回按场景汇总的原始样本"""
+    samples = {name: {'latencies': [], 'statuses': {}, 'errors': 0} for name in mix}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        scenarios = build_scenarios(target, seed * 1000 + index)
+        conn = target.connect()
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights=weights)[0]
+            method, path, body, headers, expected = scenarios[name]()
+            started = time.perf_counter()
+            try:
+                status, _ = _request(conn, method, path, body, headers)
+            except (OSError, http.client.HTTPException):
+                status = 'exception'
+                conn.close()
+                conn = target.connect()
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                bucket = samples[name]
+                bucket['latencies'].append(elapsed)
+                bucket['statuses'][str(status)] = bucket['statuses'].get(str(status), 0) + 1
+                if status not in expected:
+                    bucket['errors'] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+def summarize(samples, elapsed):
+    summary = {}
+    for name, bucket in samples.items():
+        latencies = sorted(bucket['latencies'])
+        count = len(latencies)
+        summary[name] = {
+            'requests': count,
+            'throughput_rps': round(count / elapsed, 2) if elapsed else 0,
+            'error_rate': round(bucket['errors'] / count, 4) if count else 0,
+            'p50_ms': _percentile(latencies, 0.50),
+            'p95_ms': _percentile(latencies, 0.95),
+            'p99_ms': _percentile(latencies, 0.99),
+            'max_ms': round(latencies[-1], 3) if latencies else None,
+            'statuses': bucket['statuses']
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='端到端并发压测')
+    parser.add_argument('--url', help='压测已运行的外部服务（如gunicorn），不启动内置服务器')
+    parser.add_argument('--admin-cookie', help='外部服务的管理员session cookie（name=value）')
+    parser.add_argument('--size', type=int, default=10000, help='数据集规模（默认10000）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', default=os.path.join(REPO_ROOT, '.bench', 'loadtest'))
+    parser.add_argument('--reuse', action='store_true', help='复用上次的数据集（默认重新生成）')
+    parser.add_argument('--processes', type=int, default=1, help='内置服务器的进程数（1表示多线程模式）')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发客户端数')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长（秒）')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'流量比例（默认 {DEFAULT_MIX}）')
+    parser.add_argument('--output', help='结果JSON文件')
+    parser.add_argument('--serve', metavar='DATASET_DIR', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, '127.0.0.1', args.port, args.processes)
+        return
+
+    mix = parse_mix(args.mix)
+    output = os.path.abspath(args.output) if args.output else None
+    server = None
+    if args.url:
+        base_url, admin_cookie = args.url, args.admin_cookie
+    else:
+        dataset_dir, admin_cookie = prepare(os.path.abspath(args.workdir), args.size, args.seed, args.reuse)
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.loadtest', '--serve', dataset_dir, '--port', str(port),
+             '--processes', str(args.processes)],
+            cwd=REPO_ROOT
+        )
+        if not _wait_for_port('127.0.0.1', port):
+            server.terminate()
+            sys.exit('压测服务启动失败')
+        base_url = f'http://127.0.0.1:{port}'
+
+    try:
+        target = Target(base_url, admin_cookie)
+        target.discover()
+        if not target.record_ids:
+            sys.exit('没有可用的已审核记录，无法压测')
+        if 'batch' in mix and not target.admin_cookie:
+            print('未提供管理员cookie，batch场景将全部失败', file=sys.stderr)
+
+        print(f"压测 {base_url}: 并发 {args.concurrency}，时长 {args.duration}s，比例 {mix}", file=sys.stderr)
+        samples, elapsed = run_load(target, mix, args.concurrency, args.duration, args.seed)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    summary = summarize(samples, elapsed)
+    print(f"{'接口':<10}{'请求数':>8}{'RPS':>10}{'错误率':>9}{'p50(ms)':>11}{'p95(ms)':>11}{'p99(ms)':>11}",
+          file=sys.stderr)
+    for name, row in summary.items():
+        print(f"{name:<10}{row['requests']:>8}{row['throughput_rps']:>10}{row['error_rate']:>9.2%}"
+              f"{row['p50_ms'] or 0:>11.1f}{row['p95_ms'] or 0:>11.1f}{row['p99_ms'] or 0:>11.1f}",
+              file=sys.stderr)
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'url': base_url,
+            'size': args.size,
+            'concurrency': args.concurrency,
+            'duration_s': round(elapsed, 3),
+            'processes': args.processes,
+            'mix': mix
+        },
+        'endpoints': summary
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+存储函数和API接口的基准测试
+
+每个数据规模在独立的工作目录中生成数据集（data/index/ + data/records/），
+在该目录下计时 load_records、save_records、load_record，并通过Flask测试客户端计时
+/api/records、/admin/api/stats、/admin/api/batch。结果以JSON输出，可用 benchmarks.compare 比较。
+
+    python -m benchmarks.run --sizes 1000,10000,100000,1000000 --output bench.json
+
+生成好的数据集会保留在 --workdir 中，重复运行时直接复用。
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.datagen import APP_IDS, iter_records
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+@contextlib.contextmanager
+def _quiet():
+    """屏蔽被测代码中的调试输出（输出本身的开销仍然计入耗时）"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def import_app():
+    """导入app模块（不创建应用，数据目录由每个数据集的create_app()决定）"""
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import app
+    return app
+
+
+def create_dataset_app(app_module, dataset_dir, **config):
+    """以数据集目录为工作目录创建应用，所有数据和媒体目录都位于该目录下"""
+    os.makedirs(dataset_dir, exist_ok=True)
+    os.chdir(dataset_dir)
+    return app_module.create_app(config)
+
+
+def prepare_dataset(app_module, workdir, size, seed):
+    """生成（或复用）指定规模的数据集，返回 (数据集目录, 应用)"""
+    dataset_dir = os.path.join(workdir, f"n{size}_s{seed}")
+    marker = os.path.join(dataset_dir, '.complete')
+    flask_app = create_dataset_app(app_module, dataset_dir, LOG_LEVEL='WARNING')
+    if os.path.exists(marker):
+        return dataset_dir, flask_app
+
+    print(f"生成数据集: {size} 条记录 -> {dataset_dir}", file=sys.stderr)
+    started = time.perf_counter()
+    index_entries = []
+    with _quiet():
+        for record in iter_records(size, seed):
+            app_module.save_record(record)
+            index_entries.append(app_module.build_index_entry(record))
+        index_entries.reverse()
+        app_module.save_records(index_entries)
+
+    with open(marker, 'w') as f:
+        f.write(datetime.now().isoformat())
+    print(f"数据集生成完成，用时 {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return dataset_dir, flask_app
+
+
+def measure(fn, repeat, warmup=1, setup=None):
+    """多次执行fn，返回耗时统计（毫秒）；setup在每次执行前调用，不计入耗时"""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'repeat': repeat,
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'max_ms': round(samples[-1], 3)
+    }
+
+
+def _get(client, url):
+    def fn():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} 返回 {response.status_code}")
+    return fn
+
+
+def _save_changed(app_module, index_records, partitions):
+    """
+    返回 (setup, fn)：setup修改partitions个app_id分区中各一个条目的标题，fn保存整个索引
+
+    save_records跳过内容没有变化的分区，每次保存前必须真的修改条目，否则计时的是空操作。
+    """
+    positions = {}
+    for position, entry in enumerate(index_records):
+        positions.setdefault(entry.get('app_id'), position)
+    targets = list(positions.values())[:partitions]
+    state = {'records': index_records, 'round': 0}
+
+    def setup():
+        state['round'] += 1
+        records = list(index_records)
+        for position in targets:
+            records[position] = dict(records[position], title=f"{records[position]['title']} #{state['round']}")
+        state['records'] = records
+
+    return setup, lambda: app_module.save_records(state['records'])
+
+
+def run_size(app_module, flask_app, size, seed, repeat):
+    """在当前数据集上执行全部基准用例"""
+    results = []
+
+    def record(name, stats, **extra):
+        stats.update(name=name, size=size, **extra)
+        results.append(stats)
+        print(f"  {name:<36} median {stats['median_ms']:>10.3f} ms", file=sys.stderr)
+
+    with _quiet():
+        index_records = app_module.load_records()
+    rng = random.Random(seed)
+
+    with _quiet():
+        # ---------- 存储函数 ----------
+        record('storage.load_records', measure(app_module.load_records, repeat))
+        # 只修改一个分区（单条审核/提交）和修改所有分区（批量导入）两种场景
+        partition_count = len({e.get('app_id') for e in index_records})
+        for scenario, partitions in (('one_partition', 1), ('all_partitions', partition_count)):
+            setup, save = _save_changed(app_module, index_records, partitions)
+            record(f'storage.save_records.{scenario}', measure(save, repeat, setup=setup),
+                   scenario=f'{partitions}/{partition_count} partitions changed')
+        app_module.save_records(index_records)
+
+        sample = rng.sample(index_records, min(200, len(index_records)))
+        stats = measure(lambda: [app_module.load_record(e['id'], e['app_id']) for e in sample], repeat)
+        per_call = {key: round(value / len(sample), 3) if key.endswith('_ms') else value
+                    for key, value in stats.items()}
+        record('storage.load_record', per_call, calls_per_sample=len(sample))
+
+        # ---------- 公开API ----------
+        client = flask_app.test_client()
+        approved = sum(1 for e in index_records if e.get('status') == app_module.STATUS_APPROVED)
+        middle_page = max(1, approved // 12 // 2)
+        record('api.records.first_page', measure(_get(client, '/api/records?page=1&per_page=12'), repeat))
+        record('api.records.deep_page',
+               measure(_get(client, f'/api/records?page={middle_page}&per_page=12'), repeat))
+        record('api.records.app_filter',
+               measure(_get(client, f'/api/records?page=1&per_page=12&app_id={APP_IDS[3]}'), repeat))
+
+        # ---------- 管理API ----------
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+            sess['username'] = 'benchmark'
+        record('admin.stats', measure(_get(client, '/admin/api/stats'), repeat))
+
+        # 批量审核会修改数据，计时结束后恢复原始记录和索引
+        pending = [e for e in index_records if e.get('status') == app_module.STATUS_PENDING]
+        batch = rng.sample(pending, min(50, len(pending)))
+        originals = [app_module.load_record(e['id'], e['app_id']) for e in batch]
+        actions = iter(['approve', 'reject'] * (repeat + 1))
+
+        def batch_operation():
+            response = client.post('/admin/api/batch', json={
+                'action': next(actions),
+                'record_ids': [e['id'] for e in batch]
+            })
+            if response.status_code != 200:
+                raise RuntimeError(f"POST /admin/api/batch 返回 {response.status_code}")
+
+        record('admin.batch', measure(batch_operation, repeat), batch_size=len(batch))
+        for original in originals:
+            if original:
+                app_module.save_record(original)
+        app_module.save_records(index_records)
+
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='存储函数和API接口的基准测试')
+    parser.add_argument('--sizes', default=','.join(str(n) for n in DEFAULT_SIZES),
+                        help='数据规模列表，逗号分隔（默认 1000,10000,100000,1000000）')
+    parser.add_argument('--seed', type=int, default=42, help='数据集随机种子')
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例的重复次数')
+    parser.add_argument('--workdir', default=os.path.join(REPO_ROOT, '.bench'),
+                        help='数据集和运行目录（默认 .bench/）')
+    parser.add_argument('--output', help='结果JSON文件（默认输出到stdout）')
+    args = parser.parse_args(argv)
+
+    sizes = [int(n) for n in args.sizes.split(',') if n.strip()]
+    workdir = os.path.abspath(args.workdir)
+    output = os.path.abspath(args.output) if args.output else None
+    app_module = import_app()
+
+    results = []
+    for size in sizes:
+        print(f"数据规模 {size}:", file=sys.stderr)
+        _, flask_app = prepare_dataset(app_module, workdir, size, args.seed)
+        results.extend(run_size(app_module, flask_app, size, args.seed, args.repeat))
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'sizes': sizes
+        },
+        'results': results
+    }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"结果已保存到 {output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+启动耗时基准测试
+
+在全新的子进程中分别测量：导入app模块、create_app()（不同APP_ROLE）、第一个请求的耗时，
+以及处理完只读请求后OpenCV是否被加载。输出格式与 benchmarks.run 相同，可用 benchmarks.compare 比较。
+
+    python -m benchmarks.startup --repeat 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from benchmarks.run import REPO_ROOT, _git_revision
+
+# 在子进程中执行的测量脚本
+CHILD_SCRIPT = r'''
+import json, sys, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+flask_app = app_module.create_app({'APP_ROLE': sys.argv[1], 'LOG_LEVEL': 'WARNING'})
+created = time.perf_counter()
+response = flask_app.test_client().get('/api/records' if sys.argv[1] != 'manage' else '/form')
+first_request = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (first_request - created) * 1000,
+    'total_ms': (first_request - started) * 1000,
+    'status': response.status_code,
+    'cv2_loaded': 'cv2' in sys.modules
+}))
+'''
+
+OPENCV_SCRIPT = r'''
+import json, time
+started = time.perf_counter()
+import cv2
+print(json.dumps({'import_ms': (time.perf_counter() - started) * 1000}))
+'''
+
+
+def _run_child(script, args, cwd):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    output = subprocess.check_output([sys.executable, '-c', script] + args, cwd=cwd, env=env,
+                                     stderr=subprocess.DEVNULL, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _stats(samples):
+    samples = sorted(samples)
+    return {
+        'repeat': len(samples),
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'max_ms': round(samples[-1], 3)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='启动耗时基准测试')
+    parser.add_argument('--repeat', type=int, default=10, help='每种角色启动的次数')
+    parser.add_argument('--roles', default='api,all,manage', help='要测量的APP_ROLE，逗号分隔')
+    parser.add_argument('--output', help='结果JSON文件（默认输出到stdout）')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for role in [r.strip() for r in args.roles.split(',') if r.strip()]:
+            runs = [_run_child(CHILD_SCRIPT, [role], workdir) for _ in range(args.repeat)]
+            for metric in ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms'):
+                stats = _stats([run[metric] for run in runs])
+                stats.update(name=f"startup.{role}.{metric[:-3]}", size=0,
+                             cv2_loaded=any(run['cv2_loaded'] for run in runs))
+                results.append(stats)
+                print(f"  {stats['name']:<32} median {stats['median_ms']:>9.1f} ms"
+                      f"{'  (已加载OpenCV)' if stats['cv2_loaded'] else ''}", file=sys.stderr)
+
+        try:
+            runs = [_run_child(OPENCV_SCRIPT, [], workdir) for _ in range(args.repeat)]
+            stats = _stats([run['import_ms'] for run in runs])
+            stats.update(name='startup.opencv_import', size=0)
+            results.append(stats)
+            print(f"  {stats['name']:<32} median {stats['median_ms']:>9.1f} ms（参考：按需加载节省的时间）",
+                  file=sys.stderr)
+        except subprocess.CalledProcessError:
+            print('  OpenCV不可用，跳过参考测量', file=sys.stderr)
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'revision': _git_revision(),
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+"""
+常驻内存的紧凑索引
+
+索引文件解析成字典列表后，每条记录是一个带8个字符串键的dict，百万条记录在每个worker中占用数百MB，
+而且每个请求都要重新解析一次。紧凑索引把同样的数据按列保存在一个二进制文件中（每个索引分区一个，
+data/index/<分区>.compact，见index_partitions）：
+
+- id、title、generation_time：UTF-8拼接成一个字节块 + 偏移数组
+- app_id、status、preview_type：取值很少，保存为编码（取值表在文件头中）
+- created_at：整数微秒时间戳（无法原样还原的值保存在文件头的例外表中）
+- 按状态、按应用、按 (状态, 应用) 预先分好的行号列表（画廊、管理后台的筛选和分页直接切片）
+- 按id排序的行号（按id查找时二分）
+
+文件通过mmap只读映射，所有worker进程共享同一份页缓存，不论是否由同一个父进程fork；
+每个请求只会为当前页的记录生成dict。保存索引分区时同时写紧凑索引，
+其他方式修改了分区文件时（文件签名与紧凑索引中记录的不一致），第一个读取的进程负责重建。
+"""
+import os
+import json
+import mmap
+import struct
+import bisect
+import logging
+import threading
+from array import array
+from contextlib import contextmanager
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from logging_setup import fields
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'CIDX1\n'
+# 字段不存在（与值为None区分）
+MISSING = {'missing': True}
+_MISSING_KEY = object()
+# 编码保存的字段
+CODED_FIELDS = ('app_id', 'status', 'preview_type')
+# 拼接保存的字符串字段
+TEXT_FIELDS = ('id', 'title', 'generation_time')
+# 条目字段的原始顺序
+FIELD_ORDER = ('id', 'created_at', 'title', 'app_id', 'generation_time', 'has_preview', 'preview_type', 'status')
+EPOCH = datetime(1970, 1, 1)
+
+
+def file_signature(stat):
+    """索引文件的签名：文件被替换或修改后一定会变化"""
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _encode_time(value):
+    """created_at -> 微秒整数；不能原样还原时返回None"""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None or parsed.isoformat() != value:
+        return None
+    delta = parsed - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _regular(entry):
+    """字段齐全的条目各字段的类型都可以直接编码时返回created_at的时间戳，否则返回None"""
+    if (type(entry['id']) is str and type(entry['title']) is str and type(entry['generation_time']) is str
+            and type(entry['has_preview']) is bool and (entry['app_id'] is None or type(entry['app_id']) is str)
+            and (entry['status'] is None or type(entry['status']) is str)
+            and (entry['preview_type'] is None or type(entry['preview_type']) is str)):
+        return _encode_time(entry['created_at'])
+    return None
+
+
+def _posting():
+    return array('I')
+
+
+def created_key(entry):
+    """条目按创建时间排序（合并分区）的键：created_at字符串，缺失或不是字符串时为''"""
+    value = entry.get('created_at')
+    return value if isinstance(value, str) else ''
+
+
+def _narrow(codes, distinct):
+    """按取值数量选择最小的整数类型保存编码"""
+    typecode = 'B' if distinct <= 0x100 else 'H' if distinct <= 0x10000 else 'I'
+    return codes if typecode == 'I' else array(typecode, codes)
+
+
+def _decode_time(value):
+    return (EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+def _split(entry):
+    """不规则的条目（缺少字段、类型不对、有额外字段、字段顺序不同） -> (可编码的字段值, 例外信息)"""
+    values = {'id': '', 'created_at': None, 'title': '', 'app_id': None, 'generation_time': '',
+              'has_preview': False, 'preview_type': None, 'status': None}
+    special = {name: value for name, value in entry.items() if name not in FIELD_ORDER}
+    for name in FIELD_ORDER:
+        if name not in entry:
+            if name in CODED_FIELDS:
+                values[name] = MISSING
+            continue
+        value = entry[name]
+        if name in CODED_FIELDS:
+            valid = value is None or isinstance(value, str)
+        elif name in TEXT_FIELDS:
+            valid = isinstance(value, str)
+        elif name == 'has_preview':
+            valid = isinstance(value, bool)
+        else:
+            valid = _encode_time(value) is not None
+        if valid:
+            values[name] = value
+        else:
+            special[name] = value
+    missing = [name for name in FIELD_ORDER if name not in entry and name not in CODED_FIELDS]
+    return values, {'set': special, 'missing': missing, 'order': list(entry)}
+
+
+def build(records, signature):
+    """把索引条目列表编码为紧凑索引文件的内容（bytes）"""
+    count = len(records)
+    tables = {name: [] for name in CODED_FIELDS}
+    codes = {name: {} for name in CODED_FIELDS}
+    columns = {name: array('I') for name in CODED_FIELDS}
+    created = array('q')
+    has_preview = array('B')
+    texts = {name: (bytearray(), array('I', [0])) for name in TEXT_FIELDS}
+    overflow = {}
+    status_rows, app_rows, pair_rows = defaultdict(_posting), defaultdict(_posting), defaultdict(_posting)
+
+    def code_of(name, value):
+        # MISSING（dict）不能作为键，用None以外的占位对象代替
+        key = _MISSING_KEY if value is MISSING else value
+        code = codes[name].get(key)
+        if code is None:
+            code = codes[name][key] = len(tables[name])
+            tables[name].append(value)
+        return code
+
+    for row, entry in enumerate(records):
+        values = entry
+        timestamp = _regular(entry) if tuple(entry) == FIELD_ORDER else None
+        if timestamp is None:
+            values, overflow[row] = _split(entry)
+            timestamp = _encode_time(values['created_at']) or 0
+        codes_row = []
+        for name in CODED_FIELDS:
+            code = code_of(name, values[name])
+            columns[name].append(code)
+            codes_row.append(code)
+        for name in TEXT_FIELDS:
+            blob, offsets = texts[name]
+            blob += values[name].encode('utf-8')
+            offsets.append(len(blob))
+        created.append(timestamp)
+        has_preview.append(1 if values['has_preview'] else 0)
+
+        # 按状态、应用、(状态, 应用) 分组的行号（保持索引中的顺序）
+        app, status, _ = codes_row
+        status_rows[status].append(row)
+        app_rows[app].append(row)
+        pair_rows[(status, app)].append(row)
+
+    postings = {f"s{status}": rows for status, rows in status_rows.items()}
+    postings.update((f"a{app}", rows) for app, rows in app_rows.items())
+    postings.update((f"s{status}a{app}", rows) for (status, app), rows in pair_rows.items())
+    id_blob, id_offsets = texts['id']
+    by_id = array('I', sorted(range(count), key=lambda row: (id_blob[id_offsets[row]:id_offsets[row + 1]], row)))
+
+    sections = [('created', created), ('has_preview', has_preview), ('by_id', by_id)]
+    sections += [(f"code_{name}", _narrow(columns[name], len(tables[name]))) for name in CODED_FIELDS]
+    for name in TEXT_FIELDS:
+        sections += [(f"text_{name}", array('B', texts[name][0])), (f"offsets_{name}", texts[name][1])]
+    sections += [(f"posting_{key}", rows) for key, rows in postings.items()]
+
+    header = {'signature': signature, 'count': count, 'tables': tables,
+              'overflow': {str(row): value for row, value in overflow.items()}, 'sections': {},
+              'newest_first': all(created[row] >= created[row + 1] for row in range(count - 1))}
+    body = bytearray()
+    for name, values in sections:
+        body += b'\0' * (-len(body) % 8)
+        header['sections'][name] = [len(body), len(values), values.typecode]
+        body += values.tobytes()
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    prefix = MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes
+    prefix += b'\0' * (-len(prefix) % 8)
+    return prefix + bytes(body)
+
+
+class CompactIndex:
+    """紧凑索引的只读视图（行号即记录在索引文件中的位置，0为最新的记录）"""
+
+    def __init__(self, data):
+        """data: build() 生成的内容（mmap 或 bytes）"""
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('不是紧凑索引文件')
+        header_size = struct.unpack_from('<Q', data, len(MAGIC))[0]
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(data[start:start + header_size]).decode('utf-8'))
+        base = start + header_size + (-(start + header_size) % 8)
+        view = memoryview(data)
+        self.signature = header['signature']
+        self.count = header['count']
+        self.tables = header['tables']
+        self.overflow = {int(row): value for row, value in header['overflow'].items()}
+        # 时间戳按行号从新到旧排列（正常提交的索引都是这样），合并分区时可以按时间戳二分定位
+        self.newest_first = header.get('newest_first', False)
+        self._data = data
+        self._columns = {}
+        for name, (offset, length, typecode) in header['sections'].items():
+            size = array(typecode).itemsize
+            self._columns[name] = view[base + offset:base + offset + length * size].cast(typecode)
+        self._codes = {name: {json.dumps(value, sort_keys=True): code for code, value in enumerate(table)}
+                       for name, table in self.tables.items()}
+        # 所有created_at都能原样编码为时间戳：按时间戳比较与按字符串比较的顺序相同
+        self.regular_created = not any('created_at' in special['set'] or 'created_at' in special['missing']
+                                       for special in self.overflow.values())
+
+    def __len__(self):
+        return self.count
+
+    def _text(self, name, row):
+        offsets = self._columns[f"offsets_{name}"]
+        return bytes(self._columns[f"text_{name}"][offsets[row]:offsets[row + 1]]).decode('utf-8')
+
+    def record_id(self, row):
+        return self._text('id', row)
+
+    def timestamp(self, row):
+        """第row条记录created_at的整数时间戳（regular_created时与按created_key()比较的顺序相同）"""
+        return self._columns['created'][row]
+
+    def created(self, row):
+        """第row条记录的created_key()"""
+        special = self.overflow.get(row)
+        if special is not None and ('created_at' in special['set'] or 'created_at' in special['missing']):
+            value = special['set'].get('created_at')
+            return value if isinstance(value, str) else ''
+        return _decode_time(self._columns['created'][row])
+
+    def entry(self, row):
+        """还原第row条索引条目（与索引文件中的dict相同）"""
+        values = {
+            'id': self._text('id', row),
+            'created_at': _decode_time(self._columns['created'][row]),
+            'title': self._text('title', row),
+            'generation_time': self._text('generation_time', row),
+            'has_preview': bool(self._columns['has_preview'][row])
+        }
+        for name in CODED_FIELDS:
+            value = self.tables[name][self._columns[f"code_{name}"][row]]
+            if value != MISSING:
+                values[name] = value
+        special = self.overflow.get(row)
+        if special is None:
+            return {name: values[name] for name in FIELD_ORDER}
+        values.update(special['set'])
+        for name in special['missing']:
+            values.pop(name, None)
+        return {name: values[name] for name in special['order'] if name in values}
+
+    def entries(self, rows):
+        return [self.entry(row) for row in rows]
+
+    def _code(self, name, value):
+        return self._codes[name].get(json.dumps(value, sort_keys=True))
+
+    def rows(self, status=None, app_id=None):
+        """状态和/或app_id等于给定值的行号（按索引顺序，支持len和切片）；都为None时返回全部行"""
+        if status is None and app_id is None:
+            return range(self.count)
+        key = ''
+        if status is not None:
+            code = self._code('status', status)
+            if code is None:
+                return range(0)
+            key += f"s{code}"
+        if app_id is not None:
+            code = self._code('app_id', app_id)
+            if code is None:
+                return range(0)
+            key += f"a{code}"
+        return self._columns.get(f"posting_{key}", range(0))
+
+    def find(self, record_id):
+        """id对应的行号（有重复时为第一条），不存在时返回None"""
+        by_id = self._columns['by_id']
+        target = record_id.encode('utf-8')
+        offsets, blob = self._columns['offsets_id'], self._columns['text_id']
+        position = bisect.bisect_left(by_id, target, key=lambda row: blob[offsets[row]:offsets[row + 1]].tobytes())
+        if position < len(by_id) and self._text('id', by_id[position]) == record_id:
+            return by_id[position]
+        return None
+
+    def counts(self):
+        """[(status, app_id, 记录数)]，字段不存在时为MISSING"""
+        result = []
+        for status_code, status in enumerate(self.tables['status']):
+            for app_code, app_id in enumerate(self.tables['app_id']):
+                rows = self._columns.get(f"posting_s{status_code}a{app_code}")
+                if rows is not None:
+                    result.append((status, app_id, len(rows)))
+        return result
+
+    def app_ids(self, status=None):
+        """有记录（指定状态的记录）的app_id"""
+        result = []
+        for app_code, app_id in enumerate(self.tables['app_id']):
+            key = f"posting_a{app_code}" if status is None else f"posting_s{self._code('status', status)}a{app_code}"
+            if key in self._columns:
+                result.append(app_id)
+        return result
+
+
+def empty():
+    """没有任何记录的紧凑索引（分区还不存在时使用）"""
+    return CompactIndex(build([], None))
+
+
+class ResidentIndex:
+    """按索引文件的签名映射（必要时重建）紧凑索引，每个进程一个"""
+
+    def __init__(self, index_file, compact_file):
+        self.index_file = index_file
+        self.compact_file = compact_file
+        self.lock_file = f"{compact_file}.lock"
+        self._lock = threading.Lock()
+        self._current = None
+
+    @contextmanager
+    def _locked(self):
+        """跨进程互斥（只有一个进程重建紧凑索引）"""
+        with open(self.lock_file, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _map(self):
+        """映射紧凑索引文件，文件不存在或已损坏时返回None"""
+        try:
+            with open(self.compact_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                return CompactIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except FileNotFoundError:
+            return None
+        except (ValueError, struct.error) as e:
+            log.warning('紧凑索引文件无法读取，重新生成', extra=fields(error=e))
+            return None
+
+    def write(self, records, signature):
+        """写入紧凑索引（写完索引文件后调用）"""
+        data = build(records, signature)
+        tmp_path = f"{self.compact_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.compact_file)
+
+    def get(self):
+        """与当前索引文件一致的紧凑索引；索引文件不存在时返回None"""
+        try:
+            signature = file_signature(os.stat(self.index_file))
+        except FileNotFoundError:
+            return None
+        current = self._current
+        if current is not None and current.signature == signature:
+            return current
+
+        with self._lock:
+            current = self._current
+            if current is not None and current.signature == signature:
+                return current
+            mapped = self._map()
+            if mapped is None or mapped.signature != signature:
+                with self._locked():
+                    # 等待锁期间其他进程可能已经重建
+                    mapped = self._map()
+                    if mapped is None or mapped.signature != signature:
+                        mapped = self._rebuild()
+            self._current = mapped
+            return mapped
+
+    def _rebuild(self):
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            # 签名取自已打开的文件，读取期间索引文件被替换也不会标错版本
+            signature = file_signature(os.fstat(f.fileno()))
+            records = json.load(f).get('records', [])
+        self.write(records, signature)
+        log.info('紧凑索引已重建', extra=fields(records=len(records)))
+        return self._map()
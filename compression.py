@@ -0,0 +1,201 @@
+"""
+HTTP响应压缩
+
+- 动态响应：JSON和HTML超过 min_size 时按客户端的Accept-Encoding压缩（brotli优先，其次gzip），
+  压缩结果按 (编码, 内容摘要) 缓存在进程内，同样的响应（画廊首页、热门的列表页）只压缩一次
+- 静态文件：static/ 下的文件在启动时（或 flask compress-static）生成 .gz/.br 预压缩版本，
+  请求时直接发送预压缩文件，不在请求中压缩
+
+brotli是可选依赖（pip install brotli），未安装时只使用gzip。
+"""
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+import threading
+from collections import OrderedDict
+
+import metrics
+from logging_setup import fields
+
+try:
+    import brotli
+except ImportError:  # 未安装brotli时只提供gzip
+    brotli = None
+
+# 值得压缩的内容类型（图片、视频等已经是压缩格式）
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml',
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript', 'text/xml',
+    'image/svg+xml'
+}
+# 预压缩文件的扩展名
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+log = logging.getLogger(__name__)
+
+
+def supported_encodings():
+    """按优先级排列的可用编码"""
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def choose_encoding(accept_encoding, available=None):
+    """根据Accept-Encoding选择编码，客户端不接受任何可用编码时返回None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    for encoding in supported_encodings() if available is None else available:
+        if weights.get(encoding, weights.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding, static=False):
+    """压缩数据；static=True 时使用最高压缩级别（只在生成预压缩文件时使用）"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else 5)
+    return gzip.compress(data, compresslevel=9 if static else 6, mtime=0)
+
+
+def is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+class ResponseCompressor:
+    """动态响应压缩，压缩结果按内容摘要缓存（LRU，按字节数限制）"""
+
+    def __init__(self, min_size=1024, cache_bytes=32 * 1024 * 1024):
+        """
+        min_size: 小于该字节数的响应不压缩（压缩收益抵不上开销）
+        cache_bytes: 压缩结果缓存的最大字节数
+        """
+        self.min_size = min_size
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def compress(self, data, encoding):
+        """返回压缩后的数据（命中缓存时不再压缩）"""
+        key = (encoding, hashlib.blake2b(data, digest_size=16).digest())
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        metrics.count_cache('compression', hit=cached is not None)
+        if cached is not None:
+            return cached
+
+        compressed = compress(data, encoding)
+        if len(compressed) <= self.cache_bytes // 8:
+            with self._lock:
+                if key not in self._cache:
+                    self._cache[key] = compressed
+                    self._size += len(compressed)
+                while self._size > self.cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._size -= len(evicted)
+        return compressed
+
+    def process(self, response, accept_encoding):
+        """压缩Flask响应（after_request中调用），不满足条件的响应原样返回"""
+        if response.status_code != 200 or not is_compressible(response.mimetype):
+            return response
+        # 文件（包括没有预压缩版本的静态文件）和流式响应（SSE）不压缩，但表示可能随Accept-Encoding变化
+        response.vary.add('Accept-Encoding')
+        if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+            return response
+        encoding = choose_encoding(accept_encoding)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        compressed = self.compress(data, encoding)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if response.headers.get('ETag'):
+            # 压缩后的表示与原始内容不同，使用不同的ETag
+            etag, weak = response.get_etag()
+            response.set_etag(f"{etag}-{encoding}", weak=weak)
+        return response
+
+
+# ==================== 预压缩静态文件 ====================
+
+def variant_path(path, encoding):
+    return path + SUFFIXES[encoding]
+
+
+def precompress_folder(folder, encodings=None, min_size=1024):
+    """
+    为目录中可压缩的文件生成 .gz/.br 预压缩版本，返回新生成的文件数
+
+    已存在且不比原文件旧的预压缩文件不会重新生成；压缩后没有变小的文件不生成预压缩版本。
+    """
+    written = 0
+    for root, _, filenames in os.walk(folder):
+        for filename in filenames:
+            if filename.endswith(tuple(SUFFIXES.values())) or filename.endswith('.tmp'):
+                continue
+            path = os.path.join(root, filename)
+            if not is_compressible(mimetypes.guess_type(filename)[0]):
+                continue
+            try:
+                stat = os.stat(path)
+                if stat.st_size < min_size:
+                    continue
+                data = None
+                for encoding in encodings or supported_encodings():
+                    target = variant_path(path, encoding)
+                    if os.path.exists(target) and os.path.getmtime(target) >= stat.st_mtime:
+                        continue
+                    if data is None:
+                        with open(path, 'rb') as f:
+                            data = f.read()
+                    compressed = compress(data, encoding, static=True)
+                    if len(compressed) >= len(data):
+                        continue
+                    tmp_path = f"{target}.{os.getpid()}.tmp"
+                    with open(tmp_path, 'wb') as f:
+                        f.write(compressed)
+                    os.replace(tmp_path, target)
+                    written += 1
+            except OSError as e:
+                log.warning('生成预压缩文件失败', extra=fields(path=path, error=e))
+    return written
+
+
+def find_precompressed(path, accept_encoding):
+    """返回 (预压缩文件路径, 编码)；没有可用的（或比原文件旧的）预压缩文件时返回None"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    # 预压缩文件可能在安装了brotli的构建环境中生成，发送时不需要brotli模块
+    available = [encoding for encoding in ('br', 'gzip') if os.path.exists(variant_path(path, encoding))]
+    encoding = choose_encoding(accept_encoding, available)
+    if encoding is None:
+        return None
+    target = variant_path(path, encoding)
+    try:
+        if os.path.getmtime(target) < mtime:
+            return None
+    except OSError:
+        return None
+    return target, encoding
@@ -0,0 +1,322 @@
+"""
+生成结果的近似重复检测（感知哈希）
+
+- 对每个生成结果的图片、视频缩略图（海报帧）计算64位dHash和pHash（NumPy向量化计算，
+  图片用OpenCV按1/4分辨率解码，视频直接使用已缓存的缩略图）
+- 哈希保存在只追加的日志 data/media_hashes.jsonl 中，每个进程在内存中维护一个多索引哈希表，
+  查询前只读取日志中新增的行，多个worker之间不需要重建
+- 多索引哈希表把64位pHash分成4段16位分别建表，查找相似结果只需检查少量候选，不需要遍历全部哈希
+  （汉明距离半径为8时BK树几乎要访问所有节点，实测比线性扫描还慢，因此没有采用）
+
+NumPy和OpenCV只在计算哈希时导入，只查询的进程不会加载它们。
+"""
+import os
+import json
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+from logging_setup import fields
+from media_gc import media_key
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+_dct_matrix = None
+
+
+def _dct(size=32):
+    """pHash使用的DCT-II变换矩阵（只计算一次）"""
+    global _dct_matrix
+    if _dct_matrix is None:
+        import numpy as np
+        k = np.arange(size)
+        matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size)) * np.sqrt(2 / size)
+        matrix[0] /= np.sqrt(2)
+        _dct_matrix = matrix
+    return _dct_matrix
+
+
+def _to_int(bits):
+    """64个布尔值 -> 64位整数"""
+    import numpy as np
+    return int.from_bytes(np.packbits(bits.astype(np.uint8)).tobytes(), 'big')
+
+
+def compute_hashes(path):
+    """计算图片的 (dHash, pHash)，OpenCV不可用或图片无法解码时返回None"""
+    import numpy as np
+    from media import get_cv2
+
+    cv2 = get_cv2()
+    if cv2 is None:
+        return None
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return None
+
+    # dHash：9x8缩略图中相邻像素的明暗关系
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    dhash = _to_int((small[:, 1:] > small[:, :-1]).ravel())
+
+    # pHash：32x32图像DCT变换后左上角8x8低频系数与中位数（不含直流分量）比较
+    pixels = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float64)
+    matrix = _dct()
+    low = (matrix @ pixels @ matrix.T)[:8, :8].ravel()
+    phash = _to_int(low > np.median(low[1:]))
+    return dhash, phash
+
+
+def iter_hash_sources(record):
+    """记录中需要计算哈希的生成结果：图片本身和视频的缩略图"""
+    for file_info in (record.get('files') or {}).get('results') or []:
+        if file_info.get('category') == 'image':
+            key = media_key(file_info.get('path'))
+        elif file_info.get('category') == 'video':
+            key = media_key((file_info.get('preview') or {}).get('thumbnail'))
+        else:
+            key = None
+        if key:
+            yield key
+
+
+def distance(a, b):
+    """两个64位哈希的汉明距离"""
+    return (a ^ b).bit_count()
+
+
+@functools.lru_cache(maxsize=None)
+def _flip_masks(bits):
+    """16位中最多翻转bits位的所有掩码"""
+    return tuple(mask for mask in range(1 << 16) if mask.bit_count() <= bits)
+
+
+class MultiIndexHash:
+    """
+    多索引哈希表
+
+    64位哈希分成4段16位，每段一张表。两个哈希的距离不超过r时，
+    至少有一段的距离不超过 r // 4（抽屉原理），所以只需在每张表中查找该段附近的桶。
+    """
+
+    CHUNKS = 4
+
+    def __init__(self):
+        self.tables = [{} for _ in range(self.CHUNKS)]
+
+    @staticmethod
+    def _chunks(value):
+        return [(value >> (16 * i)) & 0xFFFF for i in range(MultiIndexHash.CHUNKS)]
+
+    def add(self, value, item):
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            table.setdefault(chunk, []).append((value, item))
+
+    def search(self, value, radius):
+        """返回距离不超过radius的 (距离, 条目) 列表"""
+        results = []
+        checked = set()
+        masks = _flip_masks(radius // self.CHUNKS)
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            for mask in masks:
+                for stored, item in table.get(chunk ^ mask, ()):
+                    if item in checked:
+                        continue
+                    checked.add(item)
+                    d = distance(value, stored)
+                    if d <= radius:
+                        results.append((d, item))
+        return results
+
+
+class DuplicateIndex:
+    """基于只追加日志和多索引哈希表的近似重复索引"""
+
+    def __init__(self, data_folder, max_distance=8):
+        """
+        data_folder: 存放哈希日志的目录
+        max_distance: pHash汉明距离不超过该值视为近似重复
+        """
+        self.log_file = os.path.join(data_folder, 'media_hashes.jsonl')
+        self.lock_file = os.path.join(data_folder, '.hashes.lock')
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._table = MultiIndexHash()
+        self._hashes = {}     # record_id -> [(媒体键, dhash, phash)]
+        self._seen = set()    # 已处理过（包括没有可计算哈希的结果）的记录
+        self._removed = set()
+        self._offset = 0
+        self._inode = None
+
+    @contextmanager
+    def _locked(self):
+        """跨进程互斥（追加日志和压缩日志）"""
+        with open(self.lock_file, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _append(self, entries):
+        with self._locked():
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+
+    def _apply(self, entry):
+        record_id = entry['record_id']
+        if entry['op'] == 'add':
+            self._hashes.setdefault(record_id, []).append((entry['key'], entry['dhash'], entry['phash']))
+            self._table.add(entry['phash'], (record_id, entry['key']))
+            self._seen.add(record_id)
+        elif entry['op'] == 'seen':
+            self._seen.add(record_id)
+        elif entry['op'] == 'remove':
+            self._removed.add(record_id)
+            self._hashes.pop(record_id, None)
+            self._seen.add(record_id)
+
+    def refresh(self):
+        """读取日志中新增的行（其他进程写入的哈希）；日志被压缩后重新加载"""
+        with self._lock:
+            try:
+                stat = os.stat(self.log_file)
+            except FileNotFoundError:
+                if self._inode is not None:
+                    self._reset()
+                return
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                self._reset()
+                self._inode = stat.st_ino
+            if stat.st_size == self._offset:
+                return
+            with open(self.log_file, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read(stat.st_size - self._offset)
+            # 只处理完整的行，写了一半的行留到下次
+            complete = data[:data.rfind(b'\n') + 1]
+            for line in complete.splitlines():
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError) as e:
+                    log.warning('跳过无法解析的哈希日志行', extra=fields(error=e))
+            self._offset += len(complete)
+
+    # ---------- 登记 ----------
+
+    def add_record(self, record, resolve):
+        """计算记录中生成结果的哈希并写入日志，resolve(媒体键) -> 磁盘路径；返回计算的哈希数"""
+        entries = []
+        for key in iter_hash_sources(record):
+            try:
+                hashes = compute_hashes(resolve(key))
+            except Exception as e:
+                log.warning('计算感知哈希失败', extra=fields(key=key, error=e))
+                hashes = None
+            if hashes:
+                entries.append({'op': 'add', 'record_id': record['id'], 'key': key,
+                                'dhash': hashes[0], 'phash': hashes[1]})
+        self._append(entries or [{'op': 'seen', 'record_id': record['id']}])
+        self.refresh()
+        return len(entries)
+
+    def remove_record(self, record_id):
+        """记录被删除后不再参与重复检测"""
+        self._append([{'op': 'remove', 'record_id': record_id}])
+
+    def has_record(self, record_id):
+        self.refresh()
+        return record_id in self._seen
+
+    # ---------- 查询 ----------
+
+    def _matches(self, record_id, max_distance):
+        """{其他记录id: (pHash距离, dHash距离)}，只保留每条记录最近的一个结果"""
+        matches = {}
+        for key, dhash, phash in self._hashes.get(record_id, []):
+            for d, (other_id, other_key) in self._table.search(phash, max_distance):
+                if other_id == record_id or other_id in self._removed or other_id not in self._hashes:
+                    continue
+                other_dhash = next(h[1] for h in self._hashes[other_id] if h[0] == other_key)
+                pair = (d, distance(dhash, other_dhash))
+                if other_id not in matches or pair < matches[other_id]:
+                    matches[other_id] = pair
+        return matches
+
+    def find_similar(self, record_id, max_distance=None):
+        """与指定记录近似重复的记录，按距离排序：[{'id', 'phash_distance', 'dhash_distance'}]"""
+        self.refresh()
+        with self._lock:
+            matches = self._matches(record_id, self.max_distance if max_distance is None else max_distance)
+        return [{'id': other_id, 'phash_distance': pair[0], 'dhash_distance': pair[1]}
+                for other_id, pair in sorted(matches.items(), key=lambda item: item[1])]
+
+    def clusters(self, max_distance=None, record_ids=None):
+        """
+        近似重复的记录簇（并查集合并所有近似重复对），按簇大小降序
+
+        record_ids: 只从这些记录出发查找（如只看待审核的记录），簇中仍会包含与之重复的其他记录
+        """
+        self.refresh()
+        max_distance = self.max_distance if max_distance is None else max_distance
+        parent = {}
+
+        def find(x):
+            parent.setdefault(x, x)
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        with self._lock:
+            sources = self._hashes.keys() if record_ids is None else [r for r in record_ids if r in self._hashes]
+            for record_id in list(sources):
+                for other_id in self._matches(record_id, max_distance):
+                    parent[find(other_id)] = find(record_id)
+
+        groups = {}
+        for record_id in parent:
+            groups.setdefault(find(record_id), []).append(record_id)
+        return sorted((sorted(group) for group in groups.values() if len(group) > 1), key=len, reverse=True)
+
+    # ---------- 维护 ----------
+
+    def compact(self):
+        """重写日志，去掉已删除记录的哈希"""
+        self.refresh()
+        with self._locked():
+            with self._lock:
+                entries = []
+                for record_id in sorted(self._seen - self._removed):
+                    hashes = self._hashes.get(record_id)
+                    if not hashes:
+                        entries.append({'op': 'seen', 'record_id': record_id})
+                    for key, dhash, phash in hashes or []:
+                        entries.append({'op': 'add', 'record_id': record_id, 'key': key,
+                                        'dhash': dhash, 'phash': phash})
+            tmp_path = f"{self.log_file}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+            os.replace(tmp_path, self.log_file)
+        self.refresh()
+        return len(entries)
+
+    def status(self):
+        self.refresh()
+        with self._lock:
+            return {
+                'records': len(self._hashes),
+                'hashes': sum(len(hashes) for hashes in self._hashes.values()),
+                'removed': len(self._removed),
+                'max_distance': self.max_distance
+            }
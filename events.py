@@ -0,0 +1,134 @@
+"""
+管理后台的实时事件（Server-Sent Events）
+
+提交、审核、删除记录的代码路径把事件追加到共享的事件日志 data/events.jsonl，
+每个SSE连接从日志末尾开始读取新增的行并推送给浏览器。事件可能由任意一个worker写入，
+所以通过文件而不是进程内队列传递；读取方每次检查只是一次stat和一次从当前位置开始的read，
+没有新事件时几乎没有开销，也不需要扫描索引。
+
+日志超过 max_bytes 后轮转为 events.jsonl.1，读取方会先读完旧文件剩余的事件再切换到新文件
+（两次读取之间轮转两次时中间的事件会丢失，SSE连接定期发送的完整统计会校正计数）。
+"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from logging_setup import fields
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+class EventLog:
+    """多进程共享的只追加事件日志"""
+
+    def __init__(self, data_folder, max_bytes=1024 * 1024):
+        """
+        data_folder: 存放事件日志的目录
+        max_bytes: 日志轮转的大小
+        """
+        self.log_file = os.path.join(data_folder, 'events.jsonl')
+        self.lock_file = os.path.join(data_folder, '.events.lock')
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """进程内 + 跨进程互斥（追加和轮转）"""
+        with self._lock:
+            with open(self.lock_file, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def publish(self, events):
+        """追加事件：events 为 [(事件类型, 数据)]"""
+        if not events:
+            return
+        now = time.time()
+        lines = ''.join(json.dumps({'type': event_type, 'data': data, 'time': now}, ensure_ascii=False) + '\n'
+                        for event_type, data in events)
+        with self._locked():
+            try:
+                if os.path.getsize(self.log_file) > self.max_bytes:
+                    os.replace(self.log_file, f"{self.log_file}.1")
+            except FileNotFoundError:
+                pass
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(lines)
+
+    def reader(self):
+        """从日志当前末尾开始读取新事件的读取器"""
+        return EventReader(self.log_file)
+
+
+class EventReader:
+    """单个SSE连接的事件日志读取位置"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._inode = None
+        self._buffer = b''
+        self._open(at_end=True)
+
+    def _open(self, at_end):
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            self._file = None
+            return
+        if at_end:
+            self._file.seek(0, os.SEEK_END)
+        self._inode = os.fstat(self._file.fileno()).st_ino
+
+    def _drain(self):
+        data = self._buffer + self._file.read()
+        # 只处理完整的行，写了一半的行留到下次
+        end = data.rfind(b'\n') + 1
+        self._buffer = data[end:]
+        events = []
+        for line in data[:end].splitlines():
+            try:
+                events.append(json.loads(line))
+            except ValueError as e:
+                log.warning('跳过无法解析的事件', extra=fields(error=e))
+        return events
+
+    def read(self):
+        """返回自上次读取以来的新事件"""
+        if self._file is None:
+            # 连接建立时日志还不存在，之后创建的日志从头读取
+            self._open(at_end=False)
+            if self._file is None:
+                return []
+        events = self._drain()
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode != self._inode:
+            # 日志已轮转：轮转后旧文件不会再有写入，读完剩余部分后从新文件开头继续
+            events.extend(self._drain())
+            self._file.close()
+            self._buffer = b''
+            self._open(at_end=False)
+            if self._file is not None:
+                events.extend(self._drain())
+        return events
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,64 @@
+"""
+HTML片段缓存
+
+服务端渲染的画廊首屏卡片、应用筛选列表和详情页数据被缓存在进程内（LRU）。
+缓存失效通过共享目录中的版本文件实现：审核通过/拒绝、删除记录时递增版本号，
+所有worker进程在下一次读取时发现版本变化，旧片段随之失效。
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import metrics
+
+
+class FragmentCache:
+    """按版本号失效的进程内片段缓存"""
+
+    def __init__(self, version_file, max_entries=256):
+        self.version_file = version_file
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def version(self):
+        """当前版本号（版本文件不存在时为'0'）"""
+        try:
+            with open(self.version_file, 'r', encoding='utf-8') as f:
+                return f.read().strip() or '0'
+        except OSError:
+            return '0'
+
+    def invalidate(self):
+        """递增版本号，使所有进程中的缓存片段失效"""
+        # 每次调用使用不同的临时文件：同一进程的多个线程可能同时失效缓存
+        tmp_path = f"{self.version_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(str(time.time_ns()))
+            os.replace(tmp_path, self.version_file)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_render(self, key, render):
+        """返回缓存的片段，未命中或版本已变化时调用render()生成并缓存"""
+        version = self.version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                metrics.count_cache('fragment', hit=True)
+                return entry[1]
+
+        metrics.count_cache('fragment', hit=False)
+        value = render()
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
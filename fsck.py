@@ -0,0 +1,270 @@
+"""
+索引、记录文件和媒体文件的一致性检查（fsck）
+
+- 记录目录按 <app_id>/<分片>/ 拆成任务，在进程池中并行读取和解析记录文件；索引和媒体文件名集合
+  在创建进程池之前加载，子进程通过fork继承（不需要为每个任务序列化），每个任务只返回找到的记录id和问题
+- 媒体目录（热存储和冷存储）各列出一次，检查记录引用的文件是否存在时只查集合，不逐个stat
+- 修复由调用方根据报告执行：删除悬空的索引条目并补全缺失的字段，或从记录文件重建索引
+
+问题类型：
+    invalid_json          记录文件无法解析
+    id_mismatch           记录中的id与文件名不一致
+    app_id_mismatch       记录中的app_id与所在目录不一致
+    wrong_shard           记录文件不在id对应的分片目录中
+    duplicate_file        同一个id有多个记录文件（不同app_id目录或新旧布局）
+    record_missing_fields 记录缺少必需字段
+    unindexed             记录文件不在索引中
+    index_missing_fields  索引条目缺少id/app_id/status
+    index_duplicate       索引中重复的id
+    dangling              索引条目没有对应的记录文件
+    status_mismatch       索引中的状态与记录文件不一致
+    index_stale           索引中的其他投影字段与记录文件不一致
+    missing_media         记录引用的媒体文件不存在（热存储和冷存储中都没有）
+"""
+import os
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from logging_setup import fields
+from media_gc import iter_record_media
+
+log = logging.getLogger(__name__)
+
+# 记录文件必需的字段
+REQUIRED_FIELDS = ('id', 'created_at', 'title', 'app_id', 'generation_time', 'status')
+# 索引条目必需的字段
+INDEX_FIELDS = ('id', 'app_id', 'status')
+# 冷存储中压缩保存的文件后缀
+COMPRESSED_SUFFIX = '.gz'
+
+# 扫描所需的上下文（索引、媒体文件集合、投影函数），在创建进程池之前设置，子进程fork时继承
+_context = {}
+
+
+def _executor(workers):
+    """进程池（fork，继承_context）；不支持fork的平台使用线程池"""
+    try:
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    except ValueError:
+        return ThreadPoolExecutor(workers)
+
+
+def _list_folder(route, folder, compressed):
+    keys = set()
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                name = entry.name
+                if compressed and name.endswith(COMPRESSED_SUFFIX):
+                    name = name[:-len(COMPRESSED_SUFFIX)]
+                keys.add(f"{route}/{name}")
+    except FileNotFoundError:
+        pass
+    return keys
+
+
+def list_media(media_folders, cold_folder=None):
+    """热存储和冷存储中所有媒体文件的键（uploads/a.png）"""
+    jobs = [(route, folder, False) for route, folder in media_folders.items()]
+    if cold_folder:
+        jobs += [(route, os.path.join(cold_folder, route), True) for route in media_folders]
+    with ThreadPoolExecutor(len(jobs)) as pool:
+        results = pool.map(lambda job: _list_folder(*job), jobs)
+    keys = set()
+    for result in results:
+        keys |= result
+    return keys
+
+
+def _scan_tasks(records_dir):
+    """[(app_id, 目录, 是否为旧的平铺布局)]：每个app_id的平铺文件一个任务，每个分片目录一个任务"""
+    tasks = []
+    with os.scandir(records_dir) as app_dirs:
+        for app_dir in app_dirs:
+            if not app_dir.is_dir():
+                continue
+            tasks.append((app_dir.name, app_dir.path, True))
+            with os.scandir(app_dir.path) as shard_dirs:
+                tasks.extend((app_dir.name, shard.path, False) for shard in shard_dirs if shard.is_dir())
+    return tasks
+
+
+def scan_directory(task):
+    """
+    检查一个目录中的记录文件（在进程池中执行）
+
+    返回 {'found': [(id, app_id, 路径)], 'issues': [问题], 'entries': {id: 索引条目}（重建索引时）, 'files': 文件数}
+    """
+    app_id, folder, legacy = task
+    index = _context['index']
+    media = _context['media']
+    build_entry = _context['build_entry']
+    shard_of = _context['shard_of']
+    result = {'found': [], 'issues': [], 'entries': {}, 'files': 0}
+    issues = result['issues']
+
+    with os.scandir(folder) as entries:
+        for dir_entry in entries:
+            name = dir_entry.name
+            if not name.endswith('.json') or '.tmp' in name or not dir_entry.is_file():
+                continue
+            result['files'] += 1
+            path = dir_entry.path
+            file_id = name[:-len('.json')]
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                if not isinstance(record, dict):
+                    raise ValueError('记录不是JSON对象')
+            except (OSError, ValueError) as e:
+                issues.append({'type': 'invalid_json', 'path': path, 'error': str(e)})
+                continue
+
+            record_id = record.get('id')
+            if record_id != file_id:
+                issues.append({'type': 'id_mismatch', 'path': path, 'id': record_id})
+                continue
+            result['found'].append((record_id, app_id, path))
+            if record.get('app_id') != app_id:
+                issues.append({'type': 'app_id_mismatch', 'id': record_id, 'path': path, 'app_id': record.get('app_id')})
+            if not legacy and os.path.basename(folder) != shard_of(record_id):
+                issues.append({'type': 'wrong_shard', 'id': record_id, 'path': path})
+            missing = [name for name in REQUIRED_FIELDS if name not in record]
+            if missing:
+                issues.append({'type': 'record_missing_fields', 'id': record_id, 'fields': missing})
+
+            for key in iter_record_media(record):
+                if key not in media:
+                    issues.append({'type': 'missing_media', 'id': record_id, 'key': key})
+
+            try:
+                projection = build_entry(record)
+            except (KeyError, TypeError, ValueError):
+                projection = None  # 缺少必需字段，已作为record_missing_fields报告
+            if projection is not None and _context['rebuild']:
+                result['entries'][record_id] = projection
+
+            index_entry = index.get(record_id)
+            if index_entry is None:
+                issues.append({'type': 'unindexed', 'id': record_id, 'app_id': app_id})
+            elif projection is not None:
+                if index_entry.get('status') != projection['status']:
+                    issues.append({'type': 'status_mismatch', 'id': record_id,
+                                   'index': index_entry.get('status'), 'record': projection['status']})
+                stale = [name for name, value in projection.items()
+                         if name != 'status' and name in index_entry and index_entry[name] != value]
+                if stale:
+                    issues.append({'type': 'index_stale', 'id': record_id, 'fields': stale})
+    return result
+
+
+def check(index_records, records_dir, media_keys, build_entry, shard_of, workers=None, rebuild=False):
+    """
+    并行检查索引、记录文件和媒体文件，返回报告
+
+    index_records: 索引条目列表
+    media_keys: list_media() 的结果
+    build_entry: 由记录生成索引条目的函数；shard_of: 记录id对应的分片目录名
+    rebuild: 同时返回每个记录文件生成的索引条目（用于重建索引）
+    报告: {'records', 'files', 'issues': [问题], 'found': {id: (app_id, 路径)}, 'entries': {id: 索引条目}}
+    """
+    issues = []
+    index = {}
+    for position, entry in enumerate(index_records):
+        record_id = entry.get('id')
+        missing = [name for name in INDEX_FIELDS if not entry.get(name)]
+        if missing:
+            issues.append({'type': 'index_missing_fields', 'id': record_id, 'position': position, 'fields': missing})
+        if not record_id:
+            continue
+        if record_id in index:
+            issues.append({'type': 'index_duplicate', 'id': record_id, 'position': position})
+            continue
+        index[record_id] = entry
+
+    _context.update(index=index, media=media_keys, build_entry=build_entry, shard_of=shard_of, rebuild=rebuild)
+    tasks = _scan_tasks(records_dir) if os.path.isdir(records_dir) else []
+    found = {}
+    entries = {}
+    files = 0
+    try:
+        with _executor(workers or os.cpu_count()) as pool:
+            # 分片目录数量多、每个目录的文件数相近，按顺序分块提交即可均衡
+            for result in pool.map(scan_directory, tasks, chunksize=max(1, len(tasks) // ((workers or os.cpu_count()) * 8))):
+                files += result['files']
+                issues.extend(result['issues'])
+                entries.update(result['entries'])
+                for record_id, app_id, path in result['found']:
+                    if record_id in found:
+                        issues.append({'type': 'duplicate_file', 'id': record_id,
+                                       'paths': [found[record_id][1], path]})
+                        continue
+                    found[record_id] = (app_id, path)
+    finally:
+        _context.clear()
+
+    for record_id in index:
+        if record_id not in found:
+            issues.append({'type': 'dangling', 'id': record_id, 'app_id': index[record_id].get('app_id')})
+
+    log.info('一致性检查完成', extra=fields(index=len(index_records), files=files, issues=len(issues)))
+    return {'records': len(index_records), 'files': files, 'issues': issues, 'found': found, 'entries': entries}
+
+
+def summarize(issues):
+    """按问题类型计数"""
+    counts = {}
+    for issue in issues:
+        counts[issue['type']] = counts.get(issue['type'], 0) + 1
+    return counts
+
+
+def prune_index(index_records, found, still_missing):
+    """
+    删除悬空和重复的索引条目，并用记录文件补全缺失的app_id/status，返回 (新的索引, 删除数, 补全数)
+
+    found: check() 报告中的 {id: (app_id, 路径)}
+    still_missing: still_missing(索引条目) -> bool，删除前再次确认记录文件不存在（检查期间新提交的记录不会被删除）
+    """
+    pruned = []
+    seen = set()
+    removed = filled = 0
+    for entry in index_records:
+        record_id = entry.get('id')
+        if not record_id or record_id in seen:
+            removed += 1
+            continue
+        if record_id not in found and still_missing(entry):
+            removed += 1
+            continue
+        seen.add(record_id)
+        if record_id in found and (not entry.get('app_id') or not entry.get('status')):
+            app_id, path = found[record_id]
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                record = {}
+            entry = dict(entry)
+            entry['app_id'] = entry.get('app_id') or app_id
+            entry['status'] = entry.get('status') or record.get('status') or 'pending'
+            filled += 1
+        pruned.append(entry)
+    return pruned, removed, filled
+
+
+def rebuild_index(entries, current_records, exists):
+    """
+    由记录文件生成的索引条目重建索引（最新的记录在前），返回新的索引
+
+    current_records: 重建时的索引；其中不在entries中、但记录文件存在的条目（检查期间新提交的记录）会保留
+    exists: exists(索引条目) -> bool
+    """
+    merged = dict(entries)
+    for entry in current_records:
+        record_id = entry.get('id')
+        if record_id and record_id not in merged and entry.get('app_id') and exists(entry):
+            merged[record_id] = entry
+    return sorted(merged.values(), key=lambda entry: (entry.get('created_at') or '', entry['id']), reverse=True)
@@ -0,0 +1,331 @@
+"""
+按app_id分区的记录索引
+
+所有记录的索引原来保存在一个 data/index.json 中，按应用筛选的查询和任何应用的提交都要读写整个文件、
+争用同一把锁。现在每个app_id的索引条目保存在各自的分区文件中（格式与原来的index.json相同，最新的在前），
+另有一个很小的清单记录有哪些分区：
+
+    data/index/
+        manifest.json           {'version': 1, 'partitions': {分区键: {'file': 文件名}}, 'updated_at'}
+        app-<app_id>.json       该应用的索引条目（app_id按URL编码）
+        app-<app_id>.compact    该分区的紧凑索引（见compact_index）
+        unassigned.json         没有app_id（或app_id不是字符串）的旧条目，分区键为''
+
+- 按应用筛选的读取只映射该应用分区的紧凑索引；不筛选时按创建时间合并各分区（MergedIndex）
+- 修改一个分区时只持有该分区的锁（data/index/<文件名>.lock），不同应用的提交互不等待；
+  清单只在新建分区时修改，持有清单锁的时间很短
+- 旧的 data/index.json 在第一次访问时拆分为分区，原文件重命名为 index.json.migrated
+"""
+import os
+import json
+import heapq
+import bisect
+import logging
+import threading
+from itertools import islice
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote
+
+from compact_index import ResidentIndex, created_key, file_signature, empty as empty_index
+from logging_setup import fields
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+# 没有app_id的条目所在分区的分区键
+UNASSIGNED = ''
+
+
+def partition_key(app_id):
+    """app_id对应的分区键（None、缺失或不是字符串时为UNASSIGNED）"""
+    return app_id if isinstance(app_id, str) else UNASSIGNED
+
+
+def partition_name(key):
+    """分区文件名（不含扩展名）"""
+    return f"app-{quote(key, safe='')}" if key else 'unassigned'
+
+
+def split(records):
+    """按分区键分组（保持每个分区内的顺序），返回 {分区键: [条目]}"""
+    groups = {}
+    for entry in records:
+        groups.setdefault(partition_key(entry.get('app_id')), []).append(entry)
+    return groups
+
+
+def merge(partitions):
+    """各分区的条目按创建时间（新的在前）合并为一个列表；创建时间相同时按分区的顺序"""
+    return list(heapq.merge(*partitions, key=created_key, reverse=True))
+
+
+def _write_json(path, data):
+    """先写临时文件再原子替换，返回写入文件的stat"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            stat = os.fstat(f.fileno())
+        os.replace(tmp_path, path)
+        return stat
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class MergedRows:
+    """多个分区中的行号按创建时间合并后的序列（支持len和切片，切片时只合并到切片的末尾）"""
+
+    def __init__(self, indexes, rows):
+        self.indexes = indexes
+        self.parts = [(part, part_rows) for part, part_rows in enumerate(rows) if len(part_rows)]
+        self.count = sum(len(part_rows) for _, part_rows in self.parts)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            raise TypeError('只支持切片')
+        start, stop, step = item.indices(self.count)
+        if len(self.parts) == 1:
+            part, part_rows = self.parts[0]
+            return [(part, row) for row in part_rows[start:stop:step]]
+        # 有无法编码的created_at（旧数据）时按字符串比较，与merge()的顺序相同
+        regular = all(self.indexes[part].regular_created for part, _ in self.parts)
+        skip = [0] * len(self.parts)
+        if regular and start and all(self.indexes[part].newest_first for part, _ in self.parts):
+            # 深分页：按时间戳二分找到每个分区中跳过的行数，不逐行合并前面的页
+            skip, stop, start = self._seek(start), stop - start, 0
+        merged = heapq.merge(*(self._refs(part, part_rows, offset) for (part, part_rows), offset in zip(self.parts, skip)),
+                             key=self._timestamp if regular else self._created, reverse=True)
+        return list(islice(merged, start, max(start, stop), step))
+
+    def _seek(self, count):
+        """合并顺序中的前count行在每个分区中的行数（各分区的时间戳都从新到旧排列时使用）"""
+        def newer(timestamp):
+            # 每个分区中时间戳大于timestamp的行数
+            return [bisect.bisect_left(part_rows, -timestamp, key=lambda row, index=self.indexes[part]: -index.timestamp(row))
+                    for part, part_rows in self.parts]
+
+        # 找到最小的时间戳T，使得比T新的行不超过count行；其余的行按分区顺序从时间戳等于T的行中取
+        low = min(self.indexes[part].timestamp(part_rows[-1]) for part, part_rows in self.parts) - 1
+        high = max(self.indexes[part].timestamp(part_rows[0]) for part, part_rows in self.parts)
+        while low < high:
+            middle = (low + high) // 2
+            if sum(newer(middle)) <= count:
+                high = middle
+            else:
+                low = middle + 1
+        skip = newer(high)
+        remaining = count - sum(skip)
+        for position, at_least in enumerate(newer(high - 1)):
+            taken = min(remaining, at_least - skip[position])
+            skip[position] += taken
+            remaining -= taken
+        return skip
+
+    def _timestamp(self, ref):
+        return self.indexes[ref[0]].timestamp(ref[1])
+
+    def _created(self, ref):
+        return self.indexes[ref[0]].created(ref[1])
+
+    @staticmethod
+    def _refs(part, part_rows, offset=0):
+        for position in range(offset, len(part_rows)):
+            yield part, part_rows[position]
+
+
+class MergedIndex:
+    """所有分区紧凑索引的合并视图（接口与CompactIndex相同，行号为 (分区序号, 分区内行号)）"""
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    def __len__(self):
+        return sum(len(index) for index in self.indexes)
+
+    def record_id(self, ref):
+        return self.indexes[ref[0]].record_id(ref[1])
+
+    def entry(self, ref):
+        return self.indexes[ref[0]].entry(ref[1])
+
+    def entries(self, refs):
+        return [self.entry(ref) for ref in refs]
+
+    def rows(self, status=None, app_id=None):
+        return MergedRows(self.indexes, [index.rows(status, app_id) for index in self.indexes])
+
+    def find(self, record_id):
+        for part, index in enumerate(self.indexes):
+            row = index.find(record_id)
+            if row is not None:
+                return part, row
+        return None
+
+    def counts(self):
+        return [count for index in self.indexes for count in index.counts()]
+
+    def app_ids(self, status=None):
+        result = []
+        for index in self.indexes:
+            result.extend(app_id for app_id in index.app_ids(status) if app_id not in result)
+        return result
+
+
+class IndexPartitions:
+    """分区文件、清单和各分区紧凑索引的管理（每个进程一个）"""
+
+    def __init__(self, folder, legacy_file=None):
+        """
+        folder: 分区目录（data/index）
+        legacy_file: 旧的单文件索引（data/index.json），存在时在第一次访问时拆分为分区
+        """
+        self.folder = folder
+        self.legacy_file = legacy_file
+        self.manifest_file = os.path.join(folder, MANIFEST)
+        self._lock = threading.Lock()
+        self._manifest_lock = threading.Lock()
+        # 分区键 -> 进程内的线程锁；分区键 -> ResidentIndex
+        self._partition_locks = {}
+        self._resident = {}
+        # (清单文件的inode和mtime, 分区表)
+        self._manifest = (None, {})
+        os.makedirs(folder, exist_ok=True)
+
+    @contextmanager
+    def _flocked(self, path, thread_lock):
+        """线程之间和进程之间互斥"""
+        with thread_lock:
+            with open(path, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def locked(self, key):
+        """修改一个分区期间持有的锁（读取、修改、写入之间其他写入方等待）"""
+        with self._lock:
+            thread_lock = self._partition_locks.setdefault(key, threading.Lock())
+        return self._flocked(self.path(key, '.lock'), thread_lock)
+
+    def path(self, key, suffix='.json'):
+        return os.path.join(self.folder, partition_name(key) + suffix)
+
+    def exists(self):
+        """已经有分区清单（旧的index.json已拆分或已经写过索引）"""
+        return os.path.exists(self.manifest_file)
+
+    def _partitions(self):
+        """清单中的分区表（清单不存在时先迁移旧索引）"""
+        try:
+            stat = os.stat(self.manifest_file)
+        except FileNotFoundError:
+            self.migrate()
+            stat = os.stat(self.manifest_file)
+        signature, partitions = self._manifest
+        if signature == (stat.st_ino, stat.st_mtime_ns):
+            return partitions
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            stat = os.fstat(f.fileno())
+            partitions = json.load(f).get('partitions', {})
+        self._manifest = ((stat.st_ino, stat.st_mtime_ns), partitions)
+        return partitions
+
+    def keys(self):
+        """所有分区的分区键（排序，合并时按这个顺序）"""
+        return sorted(self._partitions())
+
+    def _write_manifest(self, keys):
+        _write_json(self.manifest_file, {
+            'version': 1,
+            'partitions': {key: {'file': partition_name(key) + '.json'} for key in sorted(keys)},
+            'updated_at': datetime.now().isoformat()
+        })
+
+    def _register(self, key):
+        """新建分区时把它加入清单（已经存在时不修改清单）"""
+        if key in self._partitions():
+            return
+        with self._flocked(os.path.join(self.folder, '.manifest.lock'), self._manifest_lock):
+            keys = set(self._partitions())
+            if key not in keys:
+                self._write_manifest(keys | {key})
+
+    def read(self, key):
+        """分区中的条目（最新的在前），分区不存在时返回空列表"""
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                return json.load(f).get('records', [])
+        except FileNotFoundError:
+            return []
+
+    def read_all(self):
+        """所有分区的条目按创建时间合并"""
+        return merge([self.read(key) for key in self.keys()])
+
+    def _store(self, key, records):
+        """写分区文件，同时写该分区的紧凑索引（失败时由第一个读取的进程重建）"""
+        stat = _write_json(self.path(key), {
+            'records': records,
+            'updated_at': datetime.now().isoformat(),
+            'total_count': len(records)
+        })
+        try:
+            self.resident(key).write(records, file_signature(stat))
+        except Exception as e:
+            log.warning('写入紧凑索引失败', extra=fields(partition=key, error=e))
+
+    def write(self, key, records):
+        """保存一个分区（调用方持有该分区的锁）"""
+        # 先登记再写文件：读取方只会看到内容为空的分区，不会漏掉已经写入的分区
+        self._register(key)
+        self._store(key, records)
+
+    def migrate(self):
+        """没有清单时：把旧的单文件索引拆分为分区（没有旧索引时创建空清单），只执行一次"""
+        with self._flocked(os.path.join(self.folder, '.manifest.lock'), self._manifest_lock):
+            if os.path.exists(self.manifest_file):
+                return
+            records = []
+            if self.legacy_file and os.path.exists(self.legacy_file):
+                with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                    records = json.load(f).get('records', [])
+            groups = split(records)
+            for key, entries in groups.items():
+                self._store(key, entries)
+            self._write_manifest(groups)
+            if self.legacy_file and os.path.exists(self.legacy_file):
+                backup_file = f"{self.legacy_file}.migrated"
+                os.replace(self.legacy_file, backup_file)
+                log.info('索引已拆分为按应用的分区', extra=fields(records=len(records), partitions=len(groups),
+                                                                backup=backup_file))
+
+    def resident(self, key):
+        """分区的紧凑索引管理对象"""
+        resident = self._resident.get(key)
+        if resident is None:
+            with self._lock:
+                resident = self._resident.setdefault(key, ResidentIndex(self.path(key), self.path(key, '.compact')))
+        return resident
+
+    def view(self, key):
+        """一个分区的紧凑索引（分区不存在时为空索引）"""
+        index = self.resident(key).get() if key in self._partitions() else None
+        return index if index is not None else empty_index()
+
+    def merged_view(self):
+        """所有分区的合并视图"""
+        return MergedIndex([self.view(key) for key in self.keys()])
@@ -0,0 +1,172 @@
+"""
+结构化日志
+
+- 基于标准库logging：按logger名称（如 app.media、app.api、media_gc）分别设置级别
+- 结构化字段通过 extra=fields(...) 传入，输出为 key=value 文本或JSON行
+- 高频事件可以带采样键（fields(sample='preview', ...)），按 LOG_SAMPLE_RATES 中的比例保留
+- 日志记录只在调用线程中放入有界队列，由后台线程写出；队列满时直接丢弃并计数，请求线程不会阻塞在控制台或日志管道上
+
+调试级别关闭时，logger.debug() 在级别检查处即返回，参数不会被格式化。
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_QUEUE_SIZE = 10000
+
+_listener = None
+_handler = None
+
+
+def fields(sample=None, **values):
+    """构造结构化字段：logger.info('msg', extra=fields(record_id=...))"""
+    extra = {'fields': values}
+    if sample:
+        extra['sample'] = sample
+    return extra
+
+
+def parse_levels(text):
+    """解析 'app.media=DEBUG,media_gc=WARNING' 形式的按模块级别配置"""
+    levels = {}
+    for part in (text or '').split(','):
+        name, _, level = part.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class StructuredFormatter(logging.Formatter):
+    """输出 时间 级别 logger 消息 key=value... 或JSON行"""
+
+    def __init__(self, fmt='text'):
+        super().__init__()
+        self.json = fmt == 'json'
+
+    def format(self, record):
+        values = getattr(record, 'fields', None) or {}
+        timestamp = datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')
+        if self.json:
+            data = {'ts': timestamp, 'level': record.levelname, 'logger': record.name,
+                    'msg': record.getMessage()}
+            data.update(values)
+            if record.exc_info:
+                data['exc'] = self.formatException(record.exc_info)
+            return json.dumps(data, ensure_ascii=False, default=str)
+
+        text = f"{timestamp} {record.levelname:<7} {record.name} {record.getMessage()}"
+        if values:
+            text += ' ' + ' '.join(f"{key}={value}" for key, value in values.items())
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """按采样键保留一定比例的日志（确定性：比例0.01即每100条保留1条）"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.intervals = {key: max(1, round(1 / rate)) if rate > 0 else None for key, rate in rates.items()}
+        self.counters = {key: itertools.count() for key in rates}
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None or key not in self.intervals:
+            return True
+        interval = self.intervals[key]
+        if interval is None:
+            return False
+        return next(self.counters[key]) % interval == 0
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列满时丢弃日志而不是阻塞调用线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+def setup_logging(level='INFO', module_levels=None, sample_rates=None, fmt='text', stream=None):
+    """
+    配置根logger：有界队列 + 后台写出线程
+
+    level: 默认级别
+    module_levels: 按logger名称设置级别，如 {'app.media': 'DEBUG'}
+    sample_rates: 采样键到保留比例的映射，如 {'preview': 0.01}
+    fmt: 'text' 或 'json'
+    """
+    global _listener, _handler
+    shutdown()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(StructuredFormatter(fmt))
+
+    _handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(SamplingFilter(sample_rates or {}))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, DroppingQueueHandler):
+            root.removeHandler(existing)
+    root.addHandler(_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level.upper() if isinstance(module_level, str) else module_level)
+
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _handler
+
+
+def shutdown():
+    """停止后台线程并写出队列中剩余的日志"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+        if _handler and _handler.dropped:
+            print(f"[Logging] 日志队列已满，共丢弃 {_handler.dropped} 条日志", file=sys.stderr)
+
+
+def setup_from_env(config):
+    """从应用配置和环境变量（LOG_LEVEL、LOG_LEVELS、LOG_FORMAT）初始化日志"""
+    module_levels = dict(config.get('LOG_LEVELS') or {})
+    module_levels.update(parse_levels(os.environ.get('LOG_LEVELS')))
+    return setup_logging(
+        level=os.environ.get('LOG_LEVEL', config.get('LOG_LEVEL', 'INFO')),
+        module_levels=module_levels,
+        sample_rates=config.get('LOG_SAMPLE_RATES'),
+        fmt=os.environ.get('LOG_FORMAT', config.get('LOG_FORMAT', 'text'))
+    )
+
+
+def _restart_after_fork():
+    """fork出的子进程（如gunicorn worker）中后台线程不存在，需要重新启动"""
+    global _listener
+    if _listener:
+        handlers = _listener.handlers
+        _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        _listener = QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(shutdown)
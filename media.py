@@ -0,0 +1,350 @@
+"""
+媒体处理流水线：视频缩略图、视频低码率预览、文本预览、文件预览信息
+
+OpenCV体积大、导入慢，只在第一次需要处理视频时才导入；
+只提供读取API的worker进程（APP_ROLE=api）不会导入本模块，也就不会加载OpenCV。
+"""
+import os
+import sys
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+import metrics
+import text_preview
+from logging_setup import fields
+
+log = logging.getLogger('app.media')
+
+# 预览流水线的版本：修改缩略图尺寸或预览逻辑后加1，flask rebuild-previews 会重新生成所有文件的预览
+# 2: 视频增加低码率预览（rendition）
+PREVIEW_VERSION = 2
+
+# 视频预览的编码，按优先级尝试：(fourcc, 扩展名, MIME类型)；都是浏览器可以直接播放的格式
+RENDITION_CODECS = (('avc1', '.mp4', 'video/mp4'), ('VP80', '.webm', 'video/webm'))
+
+_cv2 = None
+_cv2_checked = False
+_cv2_lock = threading.Lock()
+
+
+def get_cv2():
+    """按需导入OpenCV，不可用时返回None（只在第一次调用时尝试导入并输出诊断信息）"""
+    global _cv2, _cv2_checked
+    if _cv2_checked:
+        return _cv2
+    with _cv2_lock:
+        if _cv2_checked:
+            return _cv2
+        started = time.perf_counter()
+        try:
+            import cv2
+            _cv2 = cv2
+            log.info('OpenCV导入成功', extra=fields(
+                version=cv2.__version__, duration_ms=round((time.perf_counter() - started) * 1000, 1)))
+        except ImportError as e:
+            import importlib.util
+            try:
+                spec = importlib.util.find_spec('cv2')
+                location = spec.origin if spec else '未找到'
+            except Exception as e2:
+                location = f'查找失败: {e2}'
+            log.warning('OpenCV导入失败，视频缩略图功能将被禁用', extra=fields(
+                error=e, python=sys.version.split()[0], cv2_location=location))
+        _cv2_checked = True
+    return _cv2
+
+
+def cv2_available():
+    """OpenCV是否可用（会触发按需导入）"""
+    return get_cv2() is not None
+
+
+def generate_video_thumbnail(video_path, filename, thumbnail_folder=None, overwrite=False):
+    """
+    从视频中提取第一帧作为缩略图
+
+    thumbnail_folder: 缩略图目录，默认为当前应用的THUMBNAIL_FOLDER（在应用上下文之外调用时必须传入）
+    overwrite: 重新生成已存在的缩略图（先写临时文件再替换，正在读取的请求不受影响）
+    """
+    cv2 = get_cv2()
+    if cv2 is None:
+        log.debug('OpenCV不可用，跳过视频缩略图', extra=fields(filename=filename))
+        return None
+
+    try:
+        # 生成缩略图文件名
+        thumbnail_name = f"thumb_{os.path.splitext(filename)[0]}.jpg"
+        thumbnail_path = os.path.join(thumbnail_folder or current_app.config['THUMBNAIL_FOLDER'], thumbnail_name)
+
+        # 如果缩略图已存在，直接返回
+        if not overwrite and os.path.exists(thumbnail_path):
+            metrics.count_cache('thumbnail', hit=True)
+            log.debug('缩略图已存在', extra=fields(sample='thumbnail', thumbnail=thumbnail_name))
+            return f"/thumbnails/{thumbnail_name}"
+        metrics.count_cache('thumbnail', hit=False)
+        started = time.perf_counter()
+
+        # 使用OpenCV读取视频第一帧
+        video = cv2.VideoCapture(video_path)
+        success, frame = video.read()
+
+        if success:
+            # 调整大小为宽度300px
+            height, width = frame.shape[:2]
+            new_width = 300
+            new_height = int(height * (new_width / width))
+            resized_frame = cv2.resize(frame, (new_width, new_height))
+
+            # 保存为JPEG（OpenCV按扩展名选择格式，临时文件也以.jpg结尾）
+            tmp_path = f"{thumbnail_path[:-len('.jpg')]}.{os.getpid()}.tmp.jpg"
+            cv2.imwrite(tmp_path, resized_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            os.replace(tmp_path, thumbnail_path)
+            video.release()
+            elapsed = time.perf_counter() - started
+            metrics.observe('thumbnail_generation_seconds', elapsed)
+            log.debug('视频缩略图已生成', extra=fields(
+                sample='thumbnail', video=filename, thumbnail=thumbnail_name,
+                frame=f"{width}x{height}", duration_ms=round(elapsed * 1000, 1)))
+            return f"/thumbnails/{thumbnail_name}"
+
+        opened = video.isOpened()
+        video.release()
+        log.warning('无法读取视频帧，未生成缩略图', extra=fields(video=filename, opened=opened))
+        return None
+    except Exception:
+        log.exception('生成视频缩略图失败', extra=fields(video=filename))
+        return None
+
+
+_rendition_codec = None
+_background = None
+_background_lock = threading.Lock()
+
+
+def _open_rendition_writer(cv2, base_path, fps, size):
+    """按优先级打开VideoWriter，返回 (writer, 编码)；没有可用的编码器时返回 (None, None)"""
+    global _rendition_codec
+    if _rendition_codec is False:
+        return None, None
+    for codec in [_rendition_codec] if _rendition_codec else RENDITION_CODECS:
+        fourcc, ext, _ = codec
+        writer = cv2.VideoWriter(f"{base_path}{ext}", cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if writer.isOpened():
+            _rendition_codec = codec
+            return writer, codec
+        writer.release()
+        if os.path.exists(f"{base_path}{ext}"):
+            os.remove(f"{base_path}{ext}")
+    if _rendition_codec is None:
+        # OpenCV没有编译H.264/VP8编码器时不再每次尝试
+        _rendition_codec = False
+        log.warning('没有可用的视频编码器（H.264/VP8），不生成视频预览',
+                    extra=fields(codecs=','.join(codec[0] for codec in RENDITION_CODECS)))
+    return None, None
+
+
+def generate_video_rendition(video_path, filename, thumbnail_folder=None, max_width=640, max_fps=15, overwrite=False):
+    """
+    把视频转码为缩小尺寸、降低帧率的预览（H.264 MP4，编码器不可用时为VP8 WebM，不含音轨），保存在缩略图目录中
+
+    max_width: 预览的最大宽度（更小的视频保持原尺寸）；max_fps: 预览的最大帧率（多余的帧均匀丢弃）
+    返回 {'rendition': 预览URL, 'rendition_type': MIME类型}；OpenCV或编码器不可用、视频无法读取、
+    预览不比原文件小时返回None（继续播放原文件）
+    """
+    cv2 = get_cv2()
+    if cv2 is None:
+        return None
+
+    folder = thumbnail_folder or current_app.config['THUMBNAIL_FOLDER']
+    # 保留原扩展名，a.mov 和 a.mp4 的预览不会互相覆盖
+    stem = f"preview_{filename}"
+    if not overwrite:
+        for _, ext, mime_type in RENDITION_CODECS:
+            if os.path.exists(os.path.join(folder, stem + ext)):
+                metrics.count_cache('rendition', hit=True)
+                return {'rendition': f"/thumbnails/{stem}{ext}", 'rendition_type': mime_type}
+    metrics.count_cache('rendition', hit=False)
+
+    started = time.perf_counter()
+    video = cv2.VideoCapture(video_path)
+    writer = None
+    tmp_path = None
+    try:
+        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if not video.isOpened() or not width or not height:
+            log.warning('无法读取视频，未生成预览', extra=fields(video=filename, opened=video.isOpened()))
+            return None
+        source_fps = video.get(cv2.CAP_PROP_FPS)
+        if not 0 < source_fps < 1000:
+            source_fps = 25.0  # 容器中没有帧率信息
+        fps = min(source_fps, max_fps)
+        # H.264要求宽高为偶数
+        scale = min(1.0, max_width / width)
+        size = (max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2))
+
+        base_path = os.path.join(folder, f"{stem}.{os.getpid()}.tmp")
+        writer, codec = _open_rendition_writer(cv2, base_path, fps, size)
+        if writer is None:
+            return None
+        tmp_path = base_path + codec[1]
+
+        # 按时间均匀取帧：只有需要保留的帧才转换颜色空间和缩放
+        step = source_fps / fps
+        next_frame = 0.0
+        position = written = 0
+        while video.grab():
+            if position >= next_frame:
+                success, frame = video.retrieve()
+                if not success:
+                    break
+                if (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                writer.write(frame)
+                written += 1
+                next_frame += step
+            position += 1
+        writer.release()
+        writer = None
+
+        if not written:
+            log.warning('无法读取视频帧，未生成预览', extra=fields(video=filename))
+            return None
+        rendition_size = os.path.getsize(tmp_path)
+        source_size = os.path.getsize(video_path)
+        if rendition_size >= source_size:
+            log.info('预览不比原视频小，继续播放原文件', extra=fields(
+                video=filename, size=source_size, rendition_size=rendition_size))
+            return None
+        os.replace(tmp_path, os.path.join(folder, stem + codec[1]))
+        tmp_path = None
+
+        elapsed = time.perf_counter() - started
+        metrics.observe('rendition_generation_seconds', elapsed)
+        log.info('视频预览已生成', extra=fields(
+            video=filename, codec=codec[0], frames=f"{written}/{position}", size=f"{size[0]}x{size[1]}",
+            fps=round(fps, 2), bytes=f"{rendition_size}/{source_size}", duration_ms=round(elapsed * 1000, 1)))
+        return {'rendition': f"/thumbnails/{stem}{codec[1]}", 'rendition_type': codec[2]}
+    except Exception:
+        log.exception('生成视频预览失败', extra=fields(video=filename))
+        return None
+    finally:
+        video.release()
+        if writer is not None:
+            writer.release()
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def run_in_background(workers, fn, *args):
+    """
+    在本进程的后台线程池中执行fn（视频转码等耗时步骤，不阻塞提交请求）
+
+    线程池在第一次使用时创建，fork出的子进程重新创建；进程退出时未完成的任务会丢失，
+    由 flask rebuild-previews 补齐。
+    """
+    global _background
+    with _background_lock:
+        if _background is None:
+            _background = ThreadPoolExecutor(max(1, workers), thread_name_prefix='media-background')
+        return _background.submit(fn, *args)
+
+
+def _reset_after_fork():
+    global _background, _background_lock
+    _background = None
+    _background_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def extract_text_preview(file_path, filename=None):
+    """生成文本类文件的预览（开头文本、编码、行数，CSV表格或JSON结构摘要），读取量有上限"""
+    try:
+        with metrics.timer('text_preview_seconds'):
+            return text_preview.build_preview(file_path, filename or file_path)
+    except Exception as e:
+        log.warning('提取文本预览失败', extra=fields(path=file_path, error=e))
+        return None
+
+
+def generate_preview_info(file_info, folder_type, thumbnail_folder=None, overwrite=False, rendition=None):
+    """
+    为文件生成预览信息（thumbnail_folder、overwrite 见 generate_video_thumbnail）
+
+    rendition: 同时生成视频的低码率预览，值为 generate_video_rendition 的 max_width/max_fps 参数；
+    提交表单时为None，预览由后台线程生成
+    """
+    preview = {
+        'type': file_info['category'],
+        'filename': file_info['filename']
+    }
+
+    if file_info['category'] == 'image':
+        # 图像直接使用文件路径
+        preview['url'] = f"/{folder_type}/{file_info['filename']}"
+    elif file_info['category'] == 'video':
+        # 视频生成缩略图
+        thumbnail_url = generate_video_thumbnail(file_info['full_path'], file_info['filename'],
+                                                 thumbnail_folder, overwrite)
+        if thumbnail_url:
+            preview['thumbnail'] = thumbnail_url
+        else:
+            preview['thumbnail'] = None
+        if rendition is not None:
+            preview.update(generate_video_rendition(file_info['full_path'], file_info['filename'],
+                                                    thumbnail_folder, overwrite=overwrite, **rendition) or {})
+    elif file_info['category'] == 'text':
+        # 文本提取预览（读取磁盘上的文件，而不是对外的URL）
+        text_info = extract_text_preview(file_info['full_path'], file_info['filename'])
+        if text_info:
+            preview.update(text_info)
+        else:
+            preview['text'] = ''
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('预览信息已生成', extra=fields(
+            sample='preview', filename=file_info['filename'], category=file_info['category'],
+            keys=','.join(sorted(preview))))
+    return preview
+
+
+def file_content_hash(path):
+    """文件内容的BLAKE2b摘要（按块读取，大视频也不会占用大量内存）"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def rebuild_preview(task):
+    """
+    重新生成单个文件的预览（在进程池中执行，不依赖应用上下文）
+
+    task: {'file_id', 'category', 'filename', 'path'（磁盘路径）, 'folder_type', 'thumbnail_folder',
+           'content_hash', 'content_mtime'（上次生成预览时的摘要和修改时间）, 'preview_version', 'force',
+           'rendition'（视频预览参数，None表示不生成）}
+    返回 {'file_id', 'content_hash', 'content_mtime', 'preview'}；内容和流水线版本都没有变化时preview为None
+    """
+    stat = os.stat(task['path'])
+    # 修改时间没有变化时沿用已有的摘要，不再读取整个文件
+    if task['content_hash'] and task['content_mtime'] == stat.st_mtime:
+        content_hash = task['content_hash']
+    else:
+        content_hash = file_content_hash(task['path'])
+    result = {'file_id': task['file_id'], 'content_hash': content_hash, 'content_mtime': stat.st_mtime,
+              'preview': None}
+    if task['force'] or content_hash != task['content_hash'] or task['preview_version'] != PREVIEW_VERSION:
+        file_info = {'category': task['category'], 'filename': task['filename'], 'full_path': task['path']}
+        result['preview'] = generate_preview_info(file_info, task['folder_type'],
+                                                  thumbnail_folder=task['thumbnail_folder'], overwrite=True,
+                                                  rendition=task['rendition'])
+    return result
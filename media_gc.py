@@ -0,0 +1,477 @@
+"""
+孤立媒体文件的增量垃圾回收
+
+删除案例只会移除记录JSON和索引条目，uploads/、generated/、thumbnails/ 中的文件会一直留在磁盘上。
+本模块维护一张 “媒体文件 -> 引用它的记录ID” 的引用表：
+
+- 提交记录时登记引用，删除记录时释放引用，引用数归零的文件进入候选队列
+- 登记和释放只向引用日志（data/media_refs.log）追加一行，提交和删除的开销与文件总数无关；
+  日志在回收的每一步之前、以及超过compact_bytes时在后台线程中合并到引用表和候选队列
+- 引用表建立之前的历史数据，通过按记录ID游标分批补建引用表、按文件名游标分批扫描目录来补齐
+- 候选文件超过宽限期后才会被删除，dry-run 模式只生成报告不删除文件
+- 补建引用表时读不到记录文件的索引条目（缺少app_id时由调用方按id查找）记为未解析，
+  未解析的条目存在时不扫描、不回收（它们引用的文件可能被误删），每一步重试直到条目被修复或删除
+
+所有进度都保存在 data/ 目录下，任何一步都可以中断后继续，不需要一次性遍历全部文件。
+"""
+import os
+import json
+import time
+import heapq
+import logging
+import threading
+from contextlib import contextmanager
+
+from logging_setup import fields
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+# 对外提供媒体文件的路由前缀（与 /uploads/<f>、/generated/<f>、/thumbnails/<f> 对应）
+MEDIA_ROUTES = ('uploads', 'generated', 'thumbnails')
+
+log = logging.getLogger(__name__)
+
+
+def media_key(url):
+    """将 /uploads/a.png 形式的URL转换为引用表中的键 uploads/a.png，非媒体URL返回None"""
+    if not isinstance(url, str) or not url.startswith('/'):
+        return None
+    parts = url[1:].split('/', 1)
+    if len(parts) != 2 or parts[0] not in MEDIA_ROUTES:
+        return None
+    filename = parts[1]
+    if not filename or '/' in filename or filename in ('.', '..'):
+        return None
+    return f"{parts[0]}/{filename}"
+
+
+def iter_record_media(record):
+    """遍历记录引用的所有媒体文件键（原始文件以及预览中的缩略图等衍生文件）"""
+    files = record.get('files') or {}
+    for group in ('materials', 'results'):
+        for file_info in files.get(group) or []:
+            key = media_key(file_info.get('path'))
+            if key:
+                yield key
+            preview = file_info.get('preview')
+            if isinstance(preview, dict):
+                for value in preview.values():
+                    key = media_key(value)
+                    if key:
+                        yield key
+
+
+class MediaGC:
+    """基于引用表的增量媒体垃圾回收器"""
+
+    def __init__(self, data_folder, media_folders, grace_seconds=24 * 3600, locate=None,
+                 compact_bytes=1024 * 1024):
+        """
+        data_folder: 存放引用表和回收进度的目录
+        media_folders: 路由前缀到实际目录的映射，如 {'uploads': 'uploads', ...}
+        grace_seconds: 文件成为候选后需要等待的宽限期（秒）
+        locate: locate(键) -> 文件当前所在的所有路径（启用冷热分层时包括冷存储），默认只查热存储
+        compact_bytes: 引用日志超过该大小时在后台线程中合并到引用表
+        """
+        self.refs_file = os.path.join(data_folder, 'media_refs.json')
+        self.log_file = os.path.join(data_folder, 'media_refs.log')
+        self.state_file = os.path.join(data_folder, 'gc_state.json')
+        self.lock_file = os.path.join(data_folder, '.gc.lock')
+        self.log_lock_file = os.path.join(data_folder, '.media_refs_log.lock')
+        self.media_folders = dict(media_folders)
+        self.grace_seconds = grace_seconds
+        self.locate = locate
+        self.compact_bytes = compact_bytes
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        # 本进程是否已经有合并日志的后台线程
+        self._compacting = threading.Lock()
+
+    # ---------- 持久化 ----------
+
+    @contextmanager
+    def _flocked(self, path, thread_lock):
+        """进程内 + 跨进程互斥"""
+        with thread_lock:
+            with open(path, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _locked(self):
+        """引用表和回收进度的锁（多个worker共享同一份引用表；登记和释放引用不需要）"""
+        return self._flocked(self.lock_file, self._lock)
+
+    @staticmethod
+    def _read_json(path, default):
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                log.error('读取回收状态失败', extra=fields(path=path, error=e))
+        return default
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _load_refs(self):
+        refs = self._read_json(self.refs_file, {'complete': False, 'cursor': '', 'refs': {}})
+        # 记录id -> 原因：补建引用表时无法读取记录文件的索引条目
+        refs.setdefault('unresolved', {})
+        return refs
+
+    def _load_state(self):
+        state = self._read_json(self.state_file, {})
+        state.setdefault('candidates', {})
+        state.setdefault('sweep', {'folder': MEDIA_ROUTES[0], 'after': ''})
+        state.setdefault('last_sweep_completed_at', None)
+        return state
+
+    def resolve(self, key):
+        """将引用键解析为磁盘路径"""
+        folder, filename = key.split('/', 1)
+        return os.path.join(self.media_folders[folder], filename)
+
+    def paths(self, key):
+        """文件当前所在的所有路径"""
+        if self.locate:
+            return self.locate(key)
+        path = self.resolve(key)
+        return [path] if os.path.exists(path) else []
+
+    def refs(self):
+        """媒体键 -> 引用它的记录id列表；引用表尚未构建完成时返回None"""
+        with self._locked():
+            refs = self._compact()
+        return refs['refs'] if refs.get('complete') else None
+
+    # ---------- 引用登记 ----------
+
+    def add_record(self, record):
+        """登记记录引用的媒体文件（提交记录后调用）"""
+        keys = set(iter_record_media(record))
+        if keys:
+            self._append('+', record['id'], keys)
+
+    def release_record(self, record):
+        """释放记录对媒体文件的引用（删除记录后调用），引用归零的文件在合并日志时进入候选队列"""
+        keys = set(iter_record_media(record))
+        if keys:
+            self._append('-', record['id'], keys)
+
+    def _append(self, op, record_id, keys):
+        """向引用日志追加一行（只持有日志锁，与引用表的大小无关）"""
+        line = json.dumps({'op': op, 'id': record_id, 'keys': sorted(keys), 'at': time.time()},
+                          ensure_ascii=False) + '\n'
+        with self._flocked(self.log_lock_file, self._log_lock):
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(line)
+                size = f.tell()
+        if size >= self.compact_bytes and self._compacting.acquire(blocking=False):
+            threading.Thread(target=self._compact_in_background, name='media-refs-compact', daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            with self._locked():
+                self._compact()
+        except Exception as e:
+            log.error('合并引用日志失败', extra=fields(error=e))
+        finally:
+            self._compacting.release()
+
+    def _compact(self):
+        """
+        把引用日志合并到引用表和候选队列（调用方持有回收锁），返回合并后的引用表
+
+        先在日志锁内把日志改名为 .compacting（之后的登记写入新的日志），再在日志锁外合并；
+        中途退出时下次重新合并 .compacting，重复应用同一段日志的结果不变。
+        """
+        pending = f"{self.log_file}.compacting"
+        refs = self._load_refs()
+        state = None
+        for rotate in (False, True):
+            if rotate:
+                with self._flocked(self.log_lock_file, self._log_lock):
+                    if os.path.exists(self.log_file):
+                        os.replace(self.log_file, pending)
+            if not os.path.exists(pending):
+                continue
+            state = state or self._load_state()
+            self._apply_log(pending, refs['refs'], state['candidates'])
+            self._write_json(self.refs_file, refs)
+            self._write_json(self.state_file, state)
+            os.remove(pending)
+        return refs
+
+    @staticmethod
+    def _apply_log(path, refs, candidates):
+        """按顺序应用一段引用日志"""
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    log.warning('跳过无法解析的引用日志行', extra=fields(path=path))
+                    continue
+                record_id = entry['id']
+                for key in entry['keys']:
+                    if entry['op'] == '+':
+                        owners = refs.setdefault(key, [])
+                        if record_id not in owners:
+                            owners.append(record_id)
+                        # 同名文件被重新上传时，不能再回收
+                        candidates.pop(key, None)
+                        continue
+                    owners = [rid for rid in refs.get(key, []) if rid != record_id]
+                    if owners:
+                        refs[key] = owners
+                    else:
+                        refs.pop(key, None)
+                        candidates.setdefault(key, entry['at'])
+
+    def build_refs_step(self, index_records, load_record, budget=500):
+        """
+        从索引中按记录ID顺序补建一批引用（用于引用表建立之前的历史数据）
+
+        游标是记录ID而不是列表下标，期间新增或删除记录都不会导致遗漏。
+        返回本批处理的记录数。
+        """
+        refs = self._load_refs()
+        if refs.get('complete'):
+            return 0
+
+        cursor = refs.get('cursor') or ''
+        batch = heapq.nsmallest(
+            budget,
+            (entry for entry in index_records if entry.get('id', '') > cursor),
+            key=lambda entry: entry['id']
+        )
+
+        # 在锁外读取记录文件，避免阻塞提交和删除
+        found, unresolved = self._read_media(batch, load_record)
+
+        with self._locked():
+            refs = self._compact()
+            self._add_found(refs, found)
+            refs['unresolved'].update(unresolved)
+            if unresolved:
+                log.warning('索引条目的记录文件无法读取，回收暂停', extra=fields(count=len(unresolved)))
+            if batch:
+                refs['cursor'] = batch[-1]['id']
+            if len(batch) < budget:
+                refs['complete'] = True
+                log.info('引用表构建完成', extra=fields(files=len(refs['refs'])))
+            self._write_json(self.refs_file, refs)
+        return len(batch)
+
+    @staticmethod
+    def _read_media(entries, load_record):
+        """读取一批索引条目的记录，返回 ({媒体键: {记录id}}, {无法读取的记录id: 原因})"""
+        found, unresolved = {}, {}
+        for entry in entries:
+            try:
+                record = load_record(entry['id'], entry.get('app_id'))
+            except (OSError, ValueError) as e:
+                unresolved[entry['id']] = f"读取失败: {e}"
+                continue
+            if not record:
+                unresolved[entry['id']] = '记录文件不存在' if entry.get('app_id') else '缺少app_id且找不到记录文件'
+                continue
+            for key in iter_record_media(record):
+                found.setdefault(key, set()).add(entry['id'])
+        return found, unresolved
+
+    @staticmethod
+    def _add_found(refs, found):
+        for key, record_ids in found.items():
+            owners = refs['refs'].setdefault(key, [])
+            owners.extend(rid for rid in record_ids if rid not in owners)
+
+    def resolve_step(self, index_records, load_record):
+        """
+        重试未解析的索引条目：已从索引中删除的不再阻塞，能读到记录的补登引用
+
+        返回仍未解析的条目数。
+        """
+        unresolved = self._load_refs()['unresolved']
+        if not unresolved:
+            return 0
+        entries = [entry for entry in index_records if entry.get('id') in unresolved]
+        found, still = self._read_media(entries, load_record)
+        with self._locked():
+            refs = self._compact()
+            self._add_found(refs, found)
+            retried = set(unresolved)
+            refs['unresolved'] = {record_id: reason for record_id, reason in refs['unresolved'].items()
+                                  if record_id not in retried}
+            refs['unresolved'].update(still)
+            self._write_json(self.refs_file, refs)
+            return len(refs['unresolved'])
+
+    def _blocked(self, refs):
+        """回收被阻止的原因，可以继续时返回None"""
+        if not refs.get('complete'):
+            # 引用表不完整时，候选文件仍可能被历史记录引用
+            return '引用表尚未构建完成'
+        if refs['unresolved']:
+            sample = ', '.join(sorted(refs['unresolved'])[:5])
+            return (f"{len(refs['unresolved'])} 个索引条目的记录文件无法读取（{sample}），"
+                    f"修复（flask fsck --prune）或删除这些条目后才会继续回收")
+        return None
+
+    # ---------- 扫描与回收 ----------
+
+    def sweep_step(self, budget=1000):
+        """
+        扫描一批媒体目录中的文件，把未被引用的文件加入候选队列
+
+        按文件名游标推进，每次只处理 budget 个文件；一个目录扫描完后进入下一个目录。
+        返回本批检查的文件数。
+        """
+        with self._locked():
+            refs = self._compact()
+            if self._blocked(refs):
+                return 0
+            state = self._load_state()
+            sweep = state['sweep']
+            folder = sweep['folder'] if sweep['folder'] in MEDIA_ROUTES else MEDIA_ROUTES[0]
+            directory = self.media_folders[folder]
+
+            names = []
+            if os.path.isdir(directory):
+                with os.scandir(directory) as entries:
+                    names = heapq.nsmallest(
+                        budget,
+                        (e.name for e in entries if e.name > sweep['after'] and e.is_file())
+                    )
+
+            now = time.time()
+            for name in names:
+                key = f"{folder}/{name}"
+                if key not in refs['refs']:
+                    state['candidates'].setdefault(key, now)
+
+            if len(names) < budget:
+                # 当前目录已扫描完毕，进入下一个目录
+                next_index = MEDIA_ROUTES.index(folder) + 1
+                if next_index >= len(MEDIA_ROUTES):
+                    state['last_sweep_completed_at'] = now
+                    next_index = 0
+                state['sweep'] = {'folder': MEDIA_ROUTES[next_index], 'after': ''}
+            else:
+                state['sweep'] = {'folder': folder, 'after': names[-1]}
+
+            self._write_json(self.state_file, state)
+            return len(names)
+
+    def collect(self, dry_run=True, budget=None):
+        """
+        回收超过宽限期且仍未被引用的候选文件
+
+        dry_run=True 时只返回报告，不删除文件也不修改候选队列。
+        """
+        now = time.time()
+        report = {
+            'dry_run': dry_run,
+            'grace_seconds': self.grace_seconds,
+            'deleted': [],
+            'freed_bytes': 0,
+            'waiting': 0,
+            'blocked': None
+        }
+
+        with self._locked():
+            refs = self._compact()
+            state = self._load_state()
+            report['blocked'] = self._blocked(refs)
+            if report['blocked']:
+                report['waiting'] = len(state['candidates'])
+                return report
+
+            changed = False
+            for key, since in sorted(state['candidates'].items(), key=lambda item: item[1]):
+                if budget is not None and len(report['deleted']) >= budget:
+                    report['waiting'] += 1
+                    continue
+                if key in refs['refs']:
+                    if not dry_run:
+                        del state['candidates'][key]
+                        changed = True
+                    continue
+                if now - since < self.grace_seconds:
+                    report['waiting'] += 1
+                    continue
+
+                paths = self.paths(key)
+                if not paths:
+                    if not dry_run:
+                        del state['candidates'][key]
+                        changed = True
+                    continue
+
+                size = sum(os.path.getsize(path) for path in paths)
+                if not dry_run:
+                    try:
+                        for path in paths:
+                            os.remove(path)
+                    except OSError as e:
+                        log.error('删除媒体文件失败', extra=fields(path=path, error=e))
+                        continue
+                    del state['candidates'][key]
+                    changed = True
+                report['deleted'].append(key)
+                report['freed_bytes'] += size
+
+            if changed:
+                self._write_json(self.state_file, state)
+
+        if not dry_run and report['deleted']:
+            log.info('已回收孤立媒体文件', extra=fields(files=len(report['deleted']), bytes=report['freed_bytes']))
+        return report
+
+    def step(self, index_records, load_record, budget=500, dry_run=True):
+        """执行一步增量回收：先补建引用表，完成后重试未解析的条目、扫描目录，最后回收候选文件"""
+        sweep_completed = False
+        if not self._load_refs().get('complete'):
+            scanned = self.build_refs_step(index_records, load_record, budget)
+            phase = 'build_refs'
+        elif self.resolve_step(index_records, load_record):
+            scanned = 0
+            phase = 'resolve'
+        else:
+            last_completed = self._load_state()['last_sweep_completed_at']
+            scanned = self.sweep_step(budget)
+            phase = 'sweep'
+            sweep_completed = self._load_state()['last_sweep_completed_at'] != last_completed
+        report = self.collect(dry_run=dry_run, budget=budget)
+        report['phase'] = phase
+        report['scanned'] = scanned
+        report['sweep_completed'] = sweep_completed
+        return report
+
+    def status(self):
+        """返回引用表和候选队列的概况"""
+        with self._locked():
+            refs = self._compact()
+            state = self._load_state()
+        return {
+            'refs_complete': bool(refs.get('complete')),
+            'referenced_files': len(refs['refs']),
+            'unresolved': refs['unresolved'],
+            'candidates': len(state['candidates']),
+            'sweep': state['sweep'],
+            'last_sweep_completed_at': state['last_sweep_completed_at'],
+            'grace_seconds': self.grace_seconds
+        }
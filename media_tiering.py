@@ -0,0 +1,325 @@
+"""
+媒体文件的冷热分层存储
+
+uploads/、generated/、thumbnails/ 是热存储（快盘）；长时间没有被访问、或所属记录都已被拒绝的文件
+被迁移到冷存储目录（可以是另一块盘或网络卷），布局与热存储相同：
+
+    <cold_folder>/<uploads|generated|thumbnails>/<文件名>       原样保存（图片、视频本身已是压缩格式）
+    <cold_folder>/<uploads|generated|thumbnails>/<文件名>.gz    文本类文件用gzip压缩后保存
+
+- 读取：先查热存储，不存在时查冷存储，路由和记录中的URL都不需要改变
+- 访问统计：每个进程在内存中累计访问次数，定期追加到 data/media_access.jsonl，由分层步骤合并
+- 降级：待审核记录的文件始终留在热存储；其余文件超过空闲时间（所属记录都已被拒绝时使用更短的时间）后迁移到冷存储
+- 升级：冷存储中的文件被访问达到一定次数后迁回热存储
+
+迁移时先写好目标位置再删除源文件，任何时刻至少有一个位置可以读到文件；
+和孤立文件回收一样，每一步只处理有限数量的文件，进度保存在 data/tiering_state.json 中。
+"""
+import os
+import gzip
+import json
+import time
+import shutil
+import logging
+import mimetypes
+import threading
+from contextlib import contextmanager
+
+from logging_setup import fields
+from compression import is_compressible
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_REJECTED = 'rejected'
+
+# 冷存储中压缩保存的文件后缀
+COMPRESSED_SUFFIX = '.gz'
+# 压缩后至少减小这个比例才保存压缩版本
+MIN_SAVING = 0.1
+
+
+class MediaTiering:
+    """基于访问统计和记录状态的冷热分层"""
+
+    def __init__(self, data_folder, media_folders, cold_folder, idle_seconds=30 * 86400,
+                 rejected_idle_seconds=86400, promote_hits=3, flush_seconds=30):
+        """
+        data_folder: 存放访问日志和分层进度的目录
+        media_folders: 路由前缀到热存储目录的映射，如 {'uploads': 'uploads', ...}
+        cold_folder: 冷存储根目录
+        idle_seconds: 超过该时间没有被访问的文件迁移到冷存储
+        rejected_idle_seconds: 所属记录都已被拒绝的文件使用的空闲时间
+        promote_hits: 冷存储中的文件被访问这么多次后迁回热存储
+        flush_seconds: 进程内访问计数写入访问日志的间隔
+        """
+        self.access_file = os.path.join(data_folder, 'media_access.jsonl')
+        self.state_file = os.path.join(data_folder, 'tiering_state.json')
+        self.lock_file = os.path.join(data_folder, '.tiering.lock')
+        self.media_folders = dict(media_folders)
+        self.cold_folder = cold_folder
+        self.idle_seconds = idle_seconds
+        self.rejected_idle_seconds = rejected_idle_seconds
+        self.promote_hits = promote_hits
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._hits = {}  # 媒体键 -> [访问次数, 最后访问时间]（尚未写入访问日志）
+        self._hits_lock = threading.Lock()
+        self._last_flush = time.time()
+
+    @contextmanager
+    def _locked(self):
+        """进程内 + 跨进程互斥（多个worker共享访问日志和分层进度）"""
+        with self._lock:
+            with open(self.lock_file, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_state(self):
+        state = {}
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                log.error('读取分层进度失败', extra=fields(error=e))
+        state.setdefault('access', {})  # 媒体键 -> 最后访问时间
+        state.setdefault('cold_hits', {})  # 冷存储中的媒体键 -> 降级后的访问次数
+        state.setdefault('cursor', '')
+        state.setdefault('last_pass_completed_at', None)
+        return state
+
+    def _write_state(self, state):
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_file)
+
+    # ---------- 位置 ----------
+
+    def hot_path(self, key):
+        folder, filename = key.split('/', 1)
+        return os.path.join(self.media_folders[folder], filename)
+
+    def cold_path(self, key, compressed=False):
+        return os.path.join(self.cold_folder, key) + (COMPRESSED_SUFFIX if compressed else '')
+
+    def locate_cold(self, key):
+        """冷存储中的位置：(路径, 是否压缩)，不在冷存储中时返回None"""
+        for compressed in (False, True):
+            path = self.cold_path(key, compressed)
+            if os.path.isfile(path):
+                return path, compressed
+        return None
+
+    def locate(self, key):
+        """文件当前所在的所有位置（迁移过程中可能短暂地同时存在于两层）"""
+        paths = [path for path in (self.hot_path(key), self.cold_path(key), self.cold_path(key, True))
+                 if os.path.isfile(path)]
+        return paths
+
+    def resolve(self, key):
+        """可以直接读取的未压缩路径：热存储优先，其次冷存储中未压缩的副本（都不存在时返回热存储路径）"""
+        path = self.hot_path(key)
+        if os.path.isfile(path):
+            return path
+        cold = self.locate_cold(key)
+        if cold and not cold[1]:
+            return cold[0]
+        return path
+
+    # ---------- 访问统计 ----------
+
+    def record_access(self, key):
+        """记录一次访问（媒体路由中调用，只更新内存计数，定期写入访问日志）"""
+        now = time.time()
+        with self._hits_lock:
+            hit = self._hits.setdefault(key, [0, now])
+            hit[0] += 1
+            hit[1] = now
+            due = now - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush_access()
+
+    def flush_access(self):
+        """把进程内的访问计数追加到访问日志"""
+        with self._hits_lock:
+            hits, self._hits = self._hits, {}
+            self._last_flush = time.time()
+        if not hits:
+            return
+        lines = ''.join(json.dumps({'key': key, 'hits': count, 'last': last}, ensure_ascii=False) + '\n'
+                        for key, (count, last) in hits.items())
+        try:
+            with self._locked():
+                with open(self.access_file, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+        except OSError as e:
+            log.warning('写入媒体访问日志失败', extra=fields(error=e))
+
+    def _merge_access(self, state):
+        """把访问日志合并到分层进度中并清空日志（在锁内调用）"""
+        try:
+            with open(self.access_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            key = entry['key']
+            state['access'][key] = max(state['access'].get(key, 0), entry['last'])
+            if key in state['cold_hits']:
+                state['cold_hits'][key] += entry['hits']
+        open(self.access_file, 'w').close()
+
+    # ---------- 迁移 ----------
+
+    @staticmethod
+    def _copy(source, target, compress=False, decompress=False):
+        """复制到目标位置（先写临时文件再替换），可以同时压缩或解压"""
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        try:
+            with (gzip.open if decompress else open)(source, 'rb') as src:
+                with (gzip.open(tmp_path, 'wb', compresslevel=6) if compress else open(tmp_path, 'wb')) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            shutil.copystat(source, tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def demote(self, key):
+        """迁移到冷存储，返回冷存储中的字节数"""
+        source = self.hot_path(key)
+        size = os.path.getsize(source)
+        compressed = False
+        if size >= 1024 and is_compressible(mimetypes.guess_type(key)[0]):
+            target = self.cold_path(key, compressed=True)
+            self._copy(source, target, compress=True)
+            if os.path.getsize(target) <= size * (1 - MIN_SAVING):
+                compressed = True
+            else:
+                os.remove(target)
+        if not compressed:
+            target = self.cold_path(key)
+            self._copy(source, target)
+        os.remove(source)
+        return os.path.getsize(target)
+
+    def promote(self, key):
+        """迁回热存储，返回字节数；冷存储中不存在时返回None"""
+        cold = self.locate_cold(key)
+        if cold is None:
+            return None
+        path, compressed = cold
+        target = self.hot_path(key)
+        if not os.path.exists(target):
+            self._copy(path, target, decompress=compressed)
+        os.remove(path)
+        return os.path.getsize(target)
+
+    # ---------- 分层步骤 ----------
+
+    def _idle_limit(self, statuses):
+        """按所属记录的状态返回空闲时间上限，不应降级时返回None"""
+        if not statuses or STATUS_PENDING in statuses:
+            return None
+        if all(status == STATUS_REJECTED for status in statuses):
+            return min(self.rejected_idle_seconds, self.idle_seconds)
+        return self.idle_seconds
+
+    def step(self, refs, statuses, budget=500, dry_run=True):
+        """
+        执行一步分层：合并访问日志，升级访问频繁的冷文件，再按媒体键顺序检查一批热文件是否应降级
+
+        refs: 媒体键 -> 引用它的记录id列表（来自孤立文件回收的引用表）
+        statuses: 记录id -> 审核状态
+        dry_run=True 时只返回报告，不迁移文件
+        """
+        self.flush_access()
+        now = time.time()
+        report = {'dry_run': dry_run, 'promoted': [], 'demoted': [], 'demoted_bytes': 0, 'scanned': 0,
+                  'pass_completed': False}
+        with self._locked():
+            state = self._load_state()
+            self._merge_access(state)
+
+            # 1. 升级：降级后被访问达到次数的文件
+            for key, hits in list(state['cold_hits'].items()):
+                if hits < self.promote_hits:
+                    continue
+                if not dry_run:
+                    try:
+                        if self.promote(key) is None:
+                            log.warning('冷存储中找不到待升级的文件', extra=fields(key=key))
+                    except OSError as e:
+                        log.error('迁回热存储失败', extra=fields(key=key, error=e))
+                        continue
+                    del state['cold_hits'][key]
+                report['promoted'].append(key)
+
+            # 2. 降级：从游标开始检查一批被引用的文件
+            keys = sorted(key for key in refs if key > state['cursor'])[:budget]
+            for key in keys:
+                report['scanned'] += 1
+                limit = self._idle_limit([statuses.get(record_id) for record_id in refs[key]])
+                path = self.hot_path(key)
+                if limit is None or not os.path.isfile(path):
+                    continue
+                # 没有访问记录的文件以最后修改时间（上传时间）为准
+                last_access = state['access'].get(key) or os.path.getmtime(path)
+                if now - last_access < limit:
+                    continue
+                if not dry_run:
+                    try:
+                        report['demoted_bytes'] += self.demote(key)
+                    except OSError as e:
+                        log.error('迁移到冷存储失败', extra=fields(key=key, error=e))
+                        continue
+                    state['cold_hits'][key] = 0
+                report['demoted'].append(key)
+
+            report['pass_completed'] = len(keys) < budget
+            if not dry_run:
+                if report['pass_completed']:
+                    state['cursor'] = ''
+                    state['last_pass_completed_at'] = now
+                else:
+                    state['cursor'] = keys[-1]
+            # 已经不再被引用的文件（记录已删除，由孤立文件回收处理）不需要保留统计
+            state['access'] = {key: last for key, last in state['access'].items() if key in refs}
+            state['cold_hits'] = {key: hits for key, hits in state['cold_hits'].items() if key in refs}
+            # dry-run 也要保存合并后的访问统计，访问日志已经清空
+            self._write_state(state)
+
+        if not dry_run and (report['promoted'] or report['demoted']):
+            log.info('媒体分层迁移完成', extra=fields(promoted=len(report['promoted']),
+                                                    demoted=len(report['demoted']), bytes=report['demoted_bytes']))
+        return report
+
+    def status(self):
+        """分层概况"""
+        state = self._load_state()
+        return {
+            'cold_files': len(state['cold_hits']),
+            'tracked_files': len(state['access']),
+            'cursor': state['cursor'],
+            'last_pass_completed_at': state['last_pass_completed_at'],
+            'idle_seconds': self.idle_seconds,
+            'rejected_idle_seconds': self.rejected_idle_seconds,
+            'promote_hits': self.promote_hits
+        }
@@ -0,0 +1,343 @@
+"""
+进程内指标采集与Prometheus文本格式输出
+
+- 计数器（counter）和直方图（histogram）在进程内用锁保护，多线程安全
+- 每个进程定期把自己的快照写入共享目录（<dir>/<pid>.json），/metrics 汇总所有进程的快照，
+  因此在gunicorn等多worker部署下看到的是全部进程的合计值
+- fork出的子进程会清空从父进程继承的数值，避免重复计数
+- 已退出进程的快照在删除之前把计数器和直方图累加到 <dir>/retired.json，worker重启后合计值不会下降
+  （Prometheus的计数器保持单调，rate()不会出现虚假的重置）；其他类型（如gauge）直接丢弃
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+from logging_setup import fields
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+# 默认的延迟直方图分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 字节数直方图分桶
+BYTES_BUCKETS = (1024, 16 * 1024, 256 * 1024, 1024 ** 2, 16 * 1024 ** 2, 128 * 1024 ** 2,
+                 512 * 1024 ** 2, 1024 ** 3, 2 * 1024 ** 3)
+
+log = logging.getLogger(__name__)
+
+# 快照写入共享目录的最小间隔（秒）
+FLUSH_INTERVAL = 1.0
+
+_lock = threading.Lock()
+# 同一时刻只有一个线程写本进程的快照
+_flush_lock = threading.Lock()
+_definitions = {}   # name -> {'type', 'help', 'buckets'}
+_values = {}        # name -> {label_key: 数值 或 直方图状态}
+_directory = None
+_last_flush = 0.0
+# 本进程还没有写过快照：先把同一pid的旧进程留下的快照归档，避免被覆盖
+_check_stale = True
+# 累加已退出进程快照的文件
+RETIRED_FILE = 'retired.json'
+
+
+def _label_key(labels):
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+def define_counter(name, help_text):
+    """声明计数器"""
+    _definitions[name] = {'type': 'counter', 'help': help_text}
+
+
+def define_histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """声明直方图"""
+    _definitions[name] = {'type': 'histogram', 'help': help_text, 'buckets': list(buckets)}
+
+
+def configure(directory):
+    """设置多进程共享的快照目录（为None时只输出本进程的数据）"""
+    global _directory
+    _directory = directory
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def inc(name, amount=1, **labels):
+    """计数器加amount"""
+    key = _label_key(labels)
+    with _lock:
+        series = _values.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+    _maybe_flush()
+
+
+def observe(name, value, **labels):
+    """向直方图记录一个观测值"""
+    buckets = _definitions[name]['buckets']
+    key = _label_key(labels)
+    with _lock:
+        series = _values.setdefault(name, {})
+        state = series.get(key)
+        if state is None:
+            state = series[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                state['buckets'][i] += 1
+                break
+        state['sum'] += value
+        state['count'] += 1
+    _maybe_flush()
+
+
+def count_cache(cache, hit):
+    """记录一次缓存命中或未命中"""
+    inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+@contextmanager
+def timer(name, **labels):
+    """统计代码块耗时（秒）到直方图"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def timed(name, **labels):
+    """统计函数耗时的装饰器"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ==================== 多进程汇总 ====================
+
+def _snapshot():
+    with _lock:
+        return json.loads(json.dumps(_values))
+
+
+def flush():
+    """把本进程的快照写入共享目录"""
+    if not _directory:
+        return
+    with _flush_lock:
+        _write_snapshot()
+
+
+def _write_snapshot():
+    """写快照（调用方持有_flush_lock）"""
+    global _last_flush, _check_stale
+    _last_flush = time.monotonic()
+    path = os.path.join(_directory, f"{os.getpid()}.json")
+    if _check_stale:
+        # pid被复用：旧进程的快照还没有被归档
+        _retire(path)
+        _check_stale = False
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(_snapshot(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _maybe_flush():
+    # 到了写快照的时间时只由一个线程写，其他线程不等待
+    if not _directory or time.monotonic() - _last_flush < FLUSH_INTERVAL:
+        return
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+            _write_snapshot()
+    except OSError as e:
+        log.warning('写入指标快照失败', extra=fields(error=e))
+    finally:
+        _flush_lock.release()
+
+
+def _reset_after_fork():
+    """fork出的子进程从零开始计数（父进程的数值仍由父进程自己的快照文件提供）"""
+    global _lock, _flush_lock, _last_flush, _check_stale
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _values.clear()
+    _last_flush = 0.0
+    _check_stale = True
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(lambda: _directory and flush())
+
+
+def _merge(target, snapshot):
+    for name, series in snapshot.items():
+        merged = target.setdefault(name, {})
+        for key, value in series.items():
+            if isinstance(value, dict):
+                state = merged.get(key)
+                if state is None:
+                    merged[key] = {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+                elif len(state['buckets']) == len(value['buckets']):
+                    state['buckets'] = [a + b for a, b in zip(state['buckets'], value['buckets'])]
+                    state['sum'] += value['sum']
+                    state['count'] += value['count']
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+
+@contextmanager
+def _retired_locked():
+    """归档已退出进程的快照期间互斥（多个进程可能同时汇总）"""
+    with open(os.path.join(_directory, '.retired.lock'), 'a') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning('读取指标快照失败', extra=fields(path=path, error=e))
+        return None
+
+
+def _retire(path):
+    """把已退出进程的快照中的计数器和直方图累加到retired.json，然后删除快照"""
+    with _retired_locked():
+        snapshot = _read_snapshot(path)
+        if snapshot is None:
+            return  # 已被其他进程归档
+        retired_path = os.path.join(_directory, RETIRED_FILE)
+        retired = _read_snapshot(retired_path) or {}
+        _merge(retired, {name: series for name, series in snapshot.items()
+                         if _definitions.get(name, {}).get('type') in ('counter', 'histogram')})
+        tmp_path = f"{retired_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(retired, f, ensure_ascii=False)
+        os.replace(tmp_path, retired_path)
+        # 写入归档和删除快照之间进程崩溃时，这个快照会被重复计入一次
+        os.remove(path)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def collect():
+    """汇总所有进程（共享目录中的快照 + 已退出进程的归档 + 本进程的实时数据）"""
+    merged = {}
+    own_file = f"{os.getpid()}.json"
+    if _directory and os.path.isdir(_directory):
+        filenames = []
+        for filename in os.listdir(_directory):
+            if not filename.endswith('.json') or filename in (own_file, RETIRED_FILE):
+                continue
+            pid = filename[:-5]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                # 已退出进程的快照先归档到retired.json，合计值不下降
+                try:
+                    _retire(os.path.join(_directory, filename))
+                except OSError as e:
+                    log.warning('归档指标快照失败', extra=fields(file=filename, error=e))
+                continue
+            filenames.append(filename)
+        # 读取期间不允许归档：否则刚退出的进程可能在它的快照和retired.json中各被计入一次
+        with _retired_locked():
+            for filename in filenames + [RETIRED_FILE]:
+                snapshot = _read_snapshot(os.path.join(_directory, filename))
+                if snapshot is not None:
+                    _merge(merged, snapshot)
+    _merge(merged, _snapshot())
+    return merged
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus():
+    """输出Prometheus文本格式（text/plain; version=0.0.4）"""
+    merged = collect()
+    lines = []
+    for name in sorted(_definitions):
+        definition = _definitions[name]
+        lines.append(f"# HELP {name} {definition['help']}")
+        lines.append(f"# TYPE {name} {definition['type']}")
+        for key, value in sorted(merged.get(name, {}).items()):
+            pairs = [tuple(pair) for pair in json.loads(key)]
+            if definition['type'] == 'counter':
+                lines.append(f"{name}{_format_labels(pairs)} {_format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(definition['buckets'], value['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(pairs + [('le', _format_number(float(bound)))])} "
+                             f"{cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(pairs)} {_format_number(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(pairs)} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+# ==================== 指标定义 ====================
+
+define_histogram('http_request_duration_seconds', '按路由统计的请求延迟')
+define_counter('http_requests_total', '按路由和状态码统计的请求数')
+define_histogram('index_load_seconds', '加载索引文件的耗时')
+define_histogram('index_save_seconds', '保存索引文件的耗时')
+define_histogram('record_io_seconds', '读写单个记录文件的耗时')
+define_histogram('thumbnail_generation_seconds', '生成视频缩略图的耗时')
+define_histogram('rendition_generation_seconds', '生成视频低码率预览的耗时')
+define_histogram('text_preview_seconds', '生成文本/CSV/JSON预览的耗时')
+define_histogram('upload_size_bytes', '单个上传文件的大小', buckets=BYTES_BUCKETS)
+define_counter('upload_bytes_total', '上传文件的总字节数')
+define_counter('cache_requests_total', '缓存命中/未命中次数')
+define_counter('replication_changes_total', '主节点写入/副本应用的变更条数')
+define_counter('admission_requests_total', '准入控制的结果（接收、排队后接收、排队已满、超时、磁盘空间不足）')
+define_histogram('admission_wait_seconds', '请求排队等待槽位的时间')
@@ -0,0 +1,152 @@
+"""
+多审核员并发审核的租约队列
+
+多个审核员同时翻阅待审核列表时会拿到同样的记录、重复审核。审核队列给每个审核员分配
+接下来的N条待审核记录并加上有时限的租约：
+
+- 租约保存在 data/review_leases.json 中，所有worker共享；过期的租约在下一次领取时自动回到队列
+- 审核员再次领取时续期自己持有的租约，并补足到请求的数量（领取即心跳）
+- 审核结论按批提交：一批决定只加载、保存一次索引；提交在同一把跨进程锁内串行执行，
+  多个审核员同时提交也不会互相覆盖索引
+"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from logging_setup import fields
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+class ModerationQueue:
+    """基于租约的待审核队列"""
+
+    def __init__(self, data_folder, lease_seconds=300):
+        """
+        data_folder: 存放租约文件的目录
+        lease_seconds: 租约时长（秒），审核员在此期间没有续期或提交，记录回到队列
+        """
+        self.lease_file = os.path.join(data_folder, 'review_leases.json')
+        self.lock_file = os.path.join(data_folder, '.review.lock')
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """进程内 + 跨进程互斥（多个worker共享同一份租约表）"""
+        with self._lock:
+            with open(self.lock_file, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self, now):
+        """读取租约表并去掉已过期的租约：{record_id: {'reviewer', 'name', 'expires_at'}}"""
+        try:
+            with open(self.lease_file, 'r', encoding='utf-8') as f:
+                leases = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.error('读取审核租约失败', extra=fields(error=e))
+            return {}
+        return {record_id: lease for record_id, lease in leases.items() if lease['expires_at'] > now}
+
+    def _save(self, leases):
+        tmp_path = f"{self.lease_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(leases, f, ensure_ascii=False)
+        os.replace(tmp_path, self.lease_file)
+
+    def claim(self, reviewer, name, pending_ids, count, candidates=None):
+        """
+        领取待审核记录，返回 (租约列表, 队列中其他可领取的记录数)
+
+        reviewer: 审核员标识（每个登录会话一个）
+        name: 显示用的审核员名称
+        pending_ids: 当前所有待审核记录的id（按队列顺序）
+        count: 审核员希望持有的记录数；已持有的租约全部续期，不足时从队列中补足
+        candidates: 可以补充领取的记录id（如只审核某个应用），默认为pending_ids
+        """
+        now = time.time()
+        with self._locked():
+            leases = self._load(now)
+            pending = set(pending_ids)
+            # 已经不是待审核状态（被其他途径审核或删除）的记录不再占用租约
+            leases = {record_id: lease for record_id, lease in leases.items() if record_id in pending}
+
+            mine = [record_id for record_id in pending_ids if leases.get(record_id, {}).get('reviewer') == reviewer]
+            free = [record_id for record_id in (pending_ids if candidates is None else candidates)
+                    if record_id in pending and record_id not in leases]
+            claimed = mine + free[:max(0, count - len(mine))]
+
+            expires_at = now + self.lease_seconds
+            for record_id in claimed:
+                leases[record_id] = {'reviewer': reviewer, 'name': name, 'expires_at': expires_at}
+            self._save(leases)
+
+        remaining = len(free) - (len(claimed) - len(mine))
+        return [{'record_id': record_id, 'expires_at': expires_at} for record_id in claimed], remaining
+
+    def release(self, reviewer, record_ids):
+        """归还租约（审核员跳过记录或离开队列）"""
+        with self._locked():
+            leases = self._load(time.time())
+            for record_id in record_ids:
+                if leases.get(record_id, {}).get('reviewer') == reviewer:
+                    del leases[record_id]
+            self._save(leases)
+
+    def commit(self, reviewer, decisions, apply):
+        """
+        提交一批审核结论，返回 (apply的返回值, 冲突的记录id列表)
+
+        decisions: [{'record_id', 'action', 'reason'}]
+        apply: apply(被接受的决定) -> 结果，负责一次性更新记录和索引；在锁内调用
+        租约被其他审核员持有的记录视为冲突，不会被应用；租约已过期但没有被他人领取的记录仍然接受。
+        """
+        with self._locked():
+            leases = self._load(time.time())
+            accepted = []
+            conflicts = []
+            for decision in decisions:
+                lease = leases.get(decision['record_id'])
+                if lease and lease['reviewer'] != reviewer:
+                    conflicts.append(decision['record_id'])
+                else:
+                    accepted.append(decision)
+
+            result = apply(accepted)
+
+            for decision in accepted:
+                leases.pop(decision['record_id'], None)
+            self._save(leases)
+
+        if conflicts:
+            log.info('审核结论与其他审核员的租约冲突', extra=fields(reviewer=reviewer, count=len(conflicts)))
+        return result, conflicts
+
+    def status(self):
+        """当前有效租约数和每个审核员持有的记录数"""
+        leases = self._load(time.time())
+        reviewers = {}
+        for lease in leases.values():
+            entry = reviewers.setdefault(lease['reviewer'], {'name': lease['name'], 'leased': 0})
+            entry['leased'] += 1
+        return {
+            'leased': len(leases),
+            'reviewers': list(reviewers.values()),
+            'lease_seconds': self.lease_seconds
+        }
@@ -0,0 +1,386 @@
+"""
+按请求采样的性能剖析（管理后台开关）
+
+线上接口变慢时不需要重新部署就能看到时间花在哪里：管理员打开开关后，按比例（或只对匹配的路由）
+剖析一部分请求，各worker把结果累加后写到data目录，可以下载pstats文件或火焰图使用的折叠栈。
+
+两种模式：
+- cprofile: 用cProfile记录请求线程中的每次函数调用（精确但较慢），下载为pstats（python -m pstats、snakeviz）
+- sample: 后台线程每隔interval秒读取被剖析线程的调用栈（开销小），下载为折叠栈
+  （每行 "根帧;...;叶帧 次数"，可直接交给flamegraph.pl、speedscope）
+
+目录结构（所有worker共享）：
+
+    data/profiling/
+        settings.json                    开关和参数，修改时原子替换
+        gen-<n>/<模式>/<endpoint>/<pid>.prof|.txt   各进程累加的结果（reset时n加一，旧目录删除）
+        gen-<n>/<pid>.json               各进程每个endpoint被剖析的请求数和耗时
+
+关闭时每个请求只比较一次时间：各worker最多每poll_seconds秒检查一次settings.json是否变化。
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import pstats
+import random
+import shutil
+import marshal
+import logging
+import cProfile
+import threading
+from fnmatch import fnmatch
+from collections import Counter
+from datetime import datetime
+
+from logging_setup import fields
+
+log = logging.getLogger(__name__)
+
+SETTINGS_FILE = 'settings.json'
+MODES = ('cprofile', 'sample')
+# 每种模式的下载格式和结果文件扩展名
+FORMATS = {'cprofile': ('pstats', '.prof'), 'sample': ('collapsed', '.txt')}
+
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'mode': 'sample',
+    'rate': 0.1,        # 匹配的请求中被剖析的比例（0-1）
+    'endpoints': [],    # endpoint名称的通配符（如 manage.admin_api_stats、api_records、api.*），为空时匹配所有请求
+    'interval': 0.005,  # sample模式的采样间隔（秒）
+    'generation': 1,    # reset时加一，结果写到新的目录
+}
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _write_bytes(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def frame_label(code):
+    """折叠栈中的一帧：函数名 (文件名:行号)"""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame):
+    """从最外层到frame的调用栈，用 ; 连接"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Sampler(threading.Thread):
+    """定时读取被剖析线程的调用栈；没有被剖析的线程一段时间后退出"""
+
+    def __init__(self, profiler, interval, idle_seconds=1.0):
+        super().__init__(name='profiling-sampler', daemon=True)
+        self.profiler = profiler
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+
+    def run(self):
+        idle_since = None
+        while True:
+            time.sleep(self.interval)
+            with self.profiler._lock:
+                threads = dict(self.profiler._sampled)
+                if not threads:
+                    idle_since = idle_since or time.monotonic()
+                    if time.monotonic() - idle_since >= self.idle_seconds:
+                        self.profiler._sampler = None
+                        return
+                    continue
+            idle_since = None
+            frames = sys._current_frames()
+            stacks = [(thread_id, marker, endpoint, collapse(frames[thread_id]))
+                      for thread_id, (endpoint, marker) in threads.items() if thread_id in frames]
+            with self.profiler._lock:
+                for thread_id, marker, endpoint, stack in stacks:
+                    if self.profiler._sampled.get(thread_id, (None, None))[1] is not marker:
+                        continue  # 请求在读取调用栈期间已经结束
+                    self.profiler._stacks.setdefault(endpoint, Counter())[f"{endpoint};{stack}"] += 1
+                    self.profiler._dirty.add(('sample', endpoint))
+
+
+class Profiler:
+    """一个进程中的剖析开关、结果累加和写出（每个应用一个）"""
+
+    def __init__(self, folder, poll_seconds=1.0, flush_seconds=1.0):
+        """
+        folder: 设置和结果所在目录（data/profiling）
+        poll_seconds: 检查settings.json是否变化的最小间隔
+        flush_seconds: 把本进程累加的结果写到磁盘的最小间隔
+        """
+        self.folder = folder
+        self.settings_file = os.path.join(folder, SETTINGS_FILE)
+        self.poll_seconds = poll_seconds
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._settings = dict(DEFAULT_SETTINGS)
+        self._signature = None
+        self._next_poll = 0.0
+        self._last_flush = 0.0
+        self._sampler = None
+        self._reset_state()
+        os.makedirs(folder, exist_ok=True)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.flush)
+
+    def _reset_state(self):
+        # endpoint -> pstats.Stats；endpoint -> Counter(折叠栈)；(模式, endpoint) -> [请求数, 秒数]
+        self._stats = {}
+        self._stacks = {}
+        self._requests = {}
+        # 尚未写出的 (模式, endpoint)
+        self._dirty = set()
+        # 正在采样的线程：线程id -> (endpoint, 本次请求的标记)
+        self._sampled = {}
+        self._generation = self._settings['generation']
+
+    def _after_fork(self):
+        """fork出的子进程不继承父进程累加的结果和采样线程"""
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._reset_state()
+
+    # ==================== 设置 ====================
+
+    def _refresh(self):
+        """settings.json变化时重新读取（由调用方限制频率）"""
+        try:
+            stat = os.stat(self.settings_file)
+        except FileNotFoundError:
+            settings, signature = dict(DEFAULT_SETTINGS), None
+        else:
+            signature = (stat.st_ino, stat.st_mtime_ns)
+            if signature == self._signature:
+                return self._settings
+            try:
+                with open(self.settings_file, 'r', encoding='utf-8') as f:
+                    settings = {**DEFAULT_SETTINGS, **json.load(f)}
+            except (OSError, ValueError) as e:
+                log.warning('读取剖析设置失败', extra=fields(error=e))
+                return self._settings
+        with self._lock:
+            self._settings, self._signature = settings, signature
+            if settings['generation'] != self._generation:
+                # 结果已被清空：丢弃本进程中还没有写出的旧结果
+                self._reset_state()
+        return settings
+
+    def settings(self):
+        """当前设置（立即从磁盘读取）"""
+        return dict(self._refresh())
+
+    def configure(self, **changes):
+        """修改设置（所有worker在poll_seconds内生效），返回新的设置；参数不合法时抛出ValueError"""
+        settings = self.settings()
+        for name, value in changes.items():
+            if name not in DEFAULT_SETTINGS or name == 'generation':
+                raise ValueError(f"未知的设置: {name}")
+            settings[name] = value
+        settings['enabled'] = bool(settings['enabled'])
+        if settings['mode'] not in MODES:
+            raise ValueError(f"mode必须是 {' 或 '.join(MODES)}")
+        settings['rate'] = float(settings['rate'])
+        if not 0 < settings['rate'] <= 1:
+            raise ValueError('rate必须在0到1之间（不含0）')
+        settings['interval'] = float(settings['interval'])
+        if not 0.001 <= settings['interval'] <= 1:
+            raise ValueError('interval必须在0.001到1秒之间')
+        endpoints = settings['endpoints']
+        if isinstance(endpoints, str):
+            endpoints = [name.strip() for name in endpoints.split(',')]
+        if not isinstance(endpoints, list) or not all(isinstance(name, str) for name in endpoints):
+            raise ValueError('endpoints必须是endpoint名称的列表')
+        settings['endpoints'] = [name for name in endpoints if name]
+        settings['updated_at'] = datetime.now().isoformat()
+        _write_json(self.settings_file, settings)
+        self._next_poll = 0.0
+        log.info('剖析设置已修改', extra=fields(enabled=settings['enabled'], mode=settings['mode'],
+                                                rate=settings['rate'], endpoints=','.join(settings['endpoints'])))
+        return self.settings()
+
+    def reset(self):
+        """清空所有结果（设置不变）"""
+        settings = self.settings()
+        settings['generation'] += 1
+        _write_json(self.settings_file, settings)
+        self._next_poll = 0.0
+        for name in os.listdir(self.folder):
+            if name.startswith('gen-') and name != f"gen-{settings['generation']}":
+                shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
+        return self.settings()
+
+    def _matches(self, settings, endpoint):
+        patterns = settings['endpoints']
+        if not patterns:
+            return True
+        view = endpoint.rsplit('.', 1)[-1]
+        return any(fnmatch(endpoint, pattern) or fnmatch(view, pattern) for pattern in patterns)
+
+    # ==================== 请求钩子 ====================
+
+    def begin(self, endpoint):
+        """请求开始时调用：需要剖析时开始记录并返回句柄，否则返回None"""
+        now = time.monotonic()
+        if now >= self._next_poll:
+            self._next_poll = now + self.poll_seconds
+            self._refresh()
+            self._maybe_flush(now)
+        settings = self._settings
+        if not settings['enabled'] or endpoint is None:
+            return None
+        if not self._matches(settings, endpoint) or random.random() >= settings['rate']:
+            return None
+
+        if settings['mode'] == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                return None  # 本线程已经有其他剖析器在运行
+            return ('cprofile', endpoint, now, profile)
+
+        marker = object()
+        with self._lock:
+            self._sampled[threading.get_ident()] = (endpoint, marker)
+            if self._sampler is None:
+                self._sampler = Sampler(self, settings['interval'])
+                self._sampler.start()
+        return ('sample', endpoint, now, marker)
+
+    def end(self, handle):
+        """请求结束时调用（teardown）：停止记录并累加到本进程的结果"""
+        mode, endpoint, started, state = handle
+        if mode == 'cprofile':
+            state.disable()
+        elapsed = time.monotonic() - started
+        with self._lock:
+            if mode == 'cprofile':
+                stats = pstats.Stats(state)
+                if endpoint in self._stats:
+                    self._stats[endpoint].add(stats)
+                else:
+                    self._stats[endpoint] = stats
+            else:
+                self._sampled.pop(threading.get_ident(), None)
+            totals = self._requests.setdefault((mode, endpoint), [0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed
+            self._dirty.add((mode, endpoint))
+        self._maybe_flush(time.monotonic())
+
+    # ==================== 结果 ====================
+
+    def _generation_folder(self, generation=None):
+        if generation is None:
+            generation = self._settings['generation']
+        return os.path.join(self.folder, f"gen-{generation}")
+
+    def _maybe_flush(self, now):
+        if self._dirty and now - self._last_flush >= self.flush_seconds:
+            try:
+                self.flush()
+            except OSError as e:
+                log.warning('写入剖析结果失败', extra=fields(error=e))
+
+    def flush(self):
+        """把本进程累加的结果写到磁盘"""
+        self._last_flush = time.monotonic()
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            generation = self._generation
+            outputs = []
+            for mode, endpoint in dirty:
+                if mode == 'cprofile' and endpoint in self._stats:
+                    outputs.append((mode, endpoint, marshal.dumps(self._stats[endpoint].stats)))
+                elif mode == 'sample' and endpoint in self._stacks:
+                    outputs.append((mode, endpoint, ''.join(
+                        f"{stack} {count}\n" for stack, count in self._stacks[endpoint].items()).encode('utf-8')))
+            requests = {}
+            for (mode, endpoint), (count, seconds) in self._requests.items():
+                requests.setdefault(mode, {})[endpoint] = {'requests': count, 'seconds': round(seconds, 6)}
+        folder = self._generation_folder(generation)
+        pid = os.getpid()
+        for mode, endpoint, data in outputs:
+            _write_bytes(os.path.join(folder, mode, endpoint, f"{pid}{FORMATS[mode][1]}"), data)
+        os.makedirs(folder, exist_ok=True)
+        _write_json(os.path.join(folder, f"{pid}.json"), {'pid': pid, 'updated_at': datetime.now().isoformat(),
+                                                          'profiles': requests})
+
+    def profiles(self):
+        """当前结果的汇总：[{mode, endpoint, format, requests, seconds, processes}]（所有进程合计）"""
+        self.flush()
+        folder = self._generation_folder(self.settings()['generation'])
+        totals = {}
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(folder, name), 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for mode, endpoints in snapshot.get('profiles', {}).items():
+                for endpoint, values in endpoints.items():
+                    total = totals.setdefault((mode, endpoint), {'mode': mode, 'endpoint': endpoint,
+                                                                 'format': FORMATS[mode][0], 'requests': 0,
+                                                                 'seconds': 0.0, 'processes': 0})
+                    total['requests'] += values['requests']
+                    total['seconds'] = round(total['seconds'] + values['seconds'], 6)
+                    total['processes'] += 1
+        return sorted(totals.values(), key=lambda total: -total['seconds'])
+
+    def _result_files(self, mode, endpoint):
+        folder = os.path.join(self._generation_folder(self.settings()['generation']), mode, endpoint)
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(folder, name) for name in sorted(names) if name.endswith(FORMATS[mode][1])]
+
+    def export(self, mode, endpoint):
+        """
+        合并所有进程的结果，返回下载内容（bytes）：cprofile模式为pstats文件，sample模式为折叠栈文本
+
+        没有该endpoint的结果时返回None；mode不合法时抛出ValueError
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode必须是 {' 或 '.join(MODES)}")
+        if endpoint not in {total['endpoint'] for total in self.profiles() if total['mode'] == mode}:
+            return None  # 同时保证endpoint是已有的目录名，不会拼出其他路径
+        paths = self._result_files(mode, endpoint)
+        if not paths:
+            return None
+        if mode == 'cprofile':
+            stats = pstats.Stats(*paths)
+            return marshal.dumps(stats.stats)
+        stacks = Counter()
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack:
+                        stacks[stack] += int(count)
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(stacks.items())).encode('utf-8')
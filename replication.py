@@ -0,0 +1,464 @@
+"""
+只读副本：主节点发布有序的变更日志，副本应用变更后提供画廊和公开API的读取
+
+主节点（REPLICATION_LOG=True）：
+    save_records()、save_record()、delete_record_file() 在同一把跨进程锁内写文件并追加变更，
+    变更日志中的顺序与文件的写入顺序一致。日志按大小分段保存在 data/changelog/<起始序号>.jsonl，
+    只保留最近的若干段。每条变更是一行JSON：
+
+        {"seq": 序号, "op": "record" | "delete" | "index" | "index_snapshot", "data": ..., "time": 时间戳}
+
+    - record：完整记录；delete：{'id', 'app_id'}
+    - index：一个索引分区的增量 {'partition': 分区键, 'add': 新增条目（按顺序插入最前面）,
+      'update': 修改的条目, 'remove': 删除的id}
+    - index_snapshot：分区的顺序无法用增量表示时（如旧数据迁移）发送完整分区 {'partition', 'records'}
+    （没有partition的 index / index_snapshot 是分区之前的版本写入的，作用于整个索引）
+
+副本（REPLICA_SOURCE）：
+    flask replicate --follow 持续从来源拉取变更并写入副本自己的data目录，副本的api角色worker
+    按原有方式读取本地文件。来源可以是主节点的data目录（同一台机器或共享目录），也可以是主节点的
+    HTTP地址（/replication/changes、/replication/snapshot）。首次启动或落后超过日志保留范围时先复制快照。
+    所有变更都是幂等的：快照之后从快照开始时的序号重放，结果与主节点一致。
+"""
+import os
+import json
+import time
+import logging
+import threading
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+
+from werkzeug.security import safe_join
+
+import metrics
+from logging_setup import fields
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.jsonl'
+# 快照包含的文件：索引分区目录和记录目录
+SNAPSHOT_INDEX = 'index'
+SNAPSHOT_MANIFEST = 'index/manifest.json'
+SNAPSHOT_RECORDS = 'records'
+
+
+# ==================== 索引增量 ====================
+
+def index_delta(old, new):
+    """
+    计算索引的变更，返回 (op, data)；没有变化时返回None
+
+    新增的条目必须按顺序位于最前面、其余条目保持原有顺序（提交、审核、删除都满足），
+    否则返回完整索引。
+    """
+    old_entries = {entry['id']: entry for entry in old}
+    new_ids = {entry['id'] for entry in new}
+    added = 0
+    while added < len(new) and new[added]['id'] not in old_entries:
+        added += 1
+    kept = [entry['id'] for entry in old if entry['id'] in new_ids]
+    if len(kept) + added != len(new) or any(entry['id'] != record_id for entry, record_id in zip(new[added:], kept)):
+        return 'index_snapshot', {'records': new}
+
+    data = {
+        'add': new[:added],
+        'update': [entry for entry in new[added:] if entry != old_entries[entry['id']]],
+        'remove': [entry['id'] for entry in old if entry['id'] not in new_ids]
+    }
+    if not any(data.values()):
+        return None
+    return 'index', data
+
+
+def apply_index_delta(records, op, data):
+    """把 index / index_snapshot 变更应用到索引条目列表，返回新的列表（重复应用结果不变）"""
+    if op == 'index_snapshot':
+        return list(data['records'])
+    removed = set(data['remove'])
+    updates = {entry['id']: entry for entry in data['update']}
+    records = [updates.get(entry['id'], entry) for entry in records if entry['id'] not in removed]
+    existing = {entry['id'] for entry in records}
+    return [entry for entry in data['add'] if entry['id'] not in existing] + records
+
+
+# ==================== 主节点：变更日志 ====================
+
+class ChangeLog:
+    """按大小分段的只追加变更日志"""
+
+    def __init__(self, folder, segment_bytes=8 * 1024 * 1024, keep_segments=8):
+        """
+        folder: 日志目录（data/changelog）
+        segment_bytes: 单个日志段的大小，超过后开始新的一段
+        keep_segments: 保留的日志段数；落后更多的副本需要重新复制快照
+        """
+        self.folder = folder
+        self.lock_file = os.path.join(folder, '.lock')
+        self.segment_bytes = segment_bytes
+        self.keep_segments = keep_segments
+        self._lock = threading.Lock()
+        self._tail = None  # 本进程最后一次写入后的 (日志段, 大小, 序号)
+        os.makedirs(folder, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """进程内 + 跨进程互斥（所有worker按同一个顺序写文件和追加变更）"""
+        with self._lock:
+            with open(self.lock_file, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _segments(self):
+        """[(起始序号, 文件名)]，按序号排序"""
+        segments = []
+        for name in os.listdir(self.folder):
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                segments.append((int(name[:-len(SEGMENT_SUFFIX)]), name))
+        return sorted(segments)
+
+    def _last_seq(self, segments):
+        """最后一条变更的序号（调用方持有锁）"""
+        if not segments:
+            return 0
+        start, name = segments[-1]
+        path = os.path.join(self.folder, name)
+        size = os.path.getsize(path)
+        if self._tail and self._tail[:2] == (name, size):
+            return self._tail[2]
+        # 其他进程写入过：从文件末尾向前找到最后一行
+        with open(path, 'rb') as f:
+            position = size
+            data = b''
+            while position > 0 and data.count(b'\n') < 2:
+                step = min(64 * 1024, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+        lines = data.rstrip(b'\n').rsplit(b'\n', 1)
+        if not lines[-1]:
+            return start - 1
+        return json.loads(lines[-1])['seq']
+
+    @contextmanager
+    def transaction(self):
+        """
+        在锁内写数据文件并追加对应的变更：
+
+            with changelog.transaction() as changes:
+                write_json_atomic(...)
+                changes.append((op, data))
+
+        代码块抛出异常时不追加任何变更。
+        """
+        with self._locked():
+            changes = []
+            yield changes
+            if changes:
+                self._append(changes)
+
+    def _append(self, changes):
+        segments = self._segments()
+        seq = self._last_seq(segments)
+        if segments and os.path.getsize(os.path.join(self.folder, segments[-1][1])) < self.segment_bytes:
+            name = segments[-1][1]
+        else:
+            name = f"{seq + 1:020d}{SEGMENT_SUFFIX}"
+            segments.append((seq + 1, name))
+        now = time.time()
+        lines = []
+        for op, data in changes:
+            seq += 1
+            lines.append(json.dumps({'seq': seq, 'op': op, 'data': data, 'time': now}, ensure_ascii=False) + '\n')
+        path = os.path.join(self.folder, name)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+        self._tail = (name, os.path.getsize(path), seq)
+        metrics.inc('replication_changes_total', len(changes), role='primary')
+
+        for _, old_name in segments[:-self.keep_segments]:
+            try:
+                os.remove(os.path.join(self.folder, old_name))
+            except FileNotFoundError:
+                pass
+
+    def head(self):
+        """最后一条变更的序号"""
+        with self._locked():
+            return self._last_seq(self._segments())
+
+    def read(self, after, position=None, limit=500, max_bytes=4 * 1024 * 1024):
+        """
+        读取序号大于after的变更，返回 {'entries', 'position', 'oldest'}
+
+        position: 上一次读取返回的位置 [日志段, 偏移]，从这里继续读取，不需要从段首扫描
+        oldest: 日志中最早的序号（日志为空时为None）；after + 1 < oldest 说明需要的变更已被删除
+        """
+        segments = self._segments()
+        result = {'entries': [], 'position': position, 'oldest': segments[0][0] if segments else None}
+        if not segments or after + 1 < segments[0][0]:
+            return result
+
+        names = [name for _, name in segments]
+        if position and position[0] in names:
+            index, offset = names.index(position[0]), position[1]
+        else:
+            index = max(i for i, (start, _) in enumerate(segments) if start <= after + 1)
+            offset = 0
+
+        size = 0
+        entries = result['entries']
+        while index < len(names) and len(entries) < limit and size < max_bytes:
+            try:
+                with open(os.path.join(self.folder, names[index]), 'rb') as f:
+                    f.seek(offset)
+                    while len(entries) < limit and size < max_bytes:
+                        line = f.readline()
+                        # 写了一半的行留到下次
+                        if not line.endswith(b'\n'):
+                            break
+                        offset += len(line)
+                        entry = json.loads(line)
+                        if entry['seq'] <= after:
+                            continue
+                        if entry['seq'] != after + len(entries) + 1:
+                            if position:
+                                # 位置已失效（不会发生在正常的日志上），从段首重新查找
+                                return self.read(after, None, limit, max_bytes)
+                            raise ValueError(f"变更日志不连续: 期望 {after + len(entries) + 1}，实际 {entry['seq']}")
+                        entries.append(entry)
+                        size += len(line)
+            except FileNotFoundError:
+                # 日志段刚被删除，副本下次读取时会发现落后于oldest
+                break
+            result['position'] = [names[index], offset]
+            if len(entries) < limit and size < max_bytes and index + 1 < len(names):
+                index, offset = index + 1, 0
+            else:
+                break
+        return result
+
+
+def snapshot_files(data_folder):
+    """
+    快照包含的文件：[(相对路径, 绝对路径)]
+
+    分区清单排在最后：复制快照期间新建的分区已经在清单中（分区文件缺失时按空分区读取，
+    之后重放变更时补齐），不会出现有文件而清单中没有的分区。
+    """
+    files = []
+    for folder in (SNAPSHOT_INDEX, SNAPSHOT_RECORDS):
+        for root, _, filenames in os.walk(os.path.join(data_folder, folder)):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                relative = os.path.relpath(path, data_folder).replace(os.sep, '/')
+                if filename.endswith('.json') and relative != SNAPSHOT_MANIFEST:
+                    files.append((relative, path))
+    manifest_path = os.path.join(data_folder, SNAPSHOT_MANIFEST)
+    if os.path.exists(manifest_path):
+        files.append((SNAPSHOT_MANIFEST, manifest_path))
+    return files
+
+
+def snapshot_lines(changelog, data_folder):
+    """HTTP快照的内容（NDJSON）：第一行为快照开始时的序号，之后每个文件一行"""
+    yield json.dumps({'seq': changelog.head()}) + '\n'
+    for relative, path in snapshot_files(data_folder):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            continue
+        yield json.dumps({'path': relative, 'content': content}, ensure_ascii=False) + '\n'
+
+
+# ==================== 副本：变更来源 ====================
+
+class DirectorySource:
+    """直接读取主节点的data目录（同一台机器或共享目录）"""
+
+    def __init__(self, data_folder):
+        self.data_folder = data_folder
+        self.changelog = ChangeLog(os.path.join(data_folder, 'changelog'))
+
+    def changes(self, after, position, limit):
+        return self.changelog.read(after, position, limit)
+
+    def snapshot(self):
+        """返回 (快照开始时的序号, [(相对路径, 内容读取函数)])"""
+        seq = self.changelog.head()
+
+        def reader(path):
+            def read():
+                with open(path, 'rb') as f:
+                    return f.read()
+            return read
+
+        return seq, ((relative, reader(path)) for relative, path in snapshot_files(self.data_folder))
+
+    def __str__(self):
+        return self.data_folder
+
+
+class HttpSource:
+    """通过主节点的 /replication/ 接口拉取"""
+
+    def __init__(self, base_url, token=None, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def _open(self, path, params):
+        request = urllib.request.Request(f"{self.base_url}{path}?{urllib.parse.urlencode(params)}")
+        if self.token:
+            request.add_header('Authorization', f"Bearer {self.token}")
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def changes(self, after, position, limit):
+        params = {'after': after, 'limit': limit}
+        if position:
+            params.update(segment=position[0], offset=position[1])
+        with self._open('/replication/changes', params) as response:
+            return json.load(response)['data']
+
+    def snapshot(self):
+        response = self._open('/replication/snapshot', {})
+        seq = json.loads(response.readline())['seq']
+
+        def files():
+            with response:
+                for line in response:
+                    item = json.loads(line)
+                    content = item['content'].encode('utf-8')
+                    yield item['path'], lambda content=content: content
+
+        return seq, files()
+
+    def __str__(self):
+        return self.base_url
+
+
+def make_source(spec, token=None):
+    """REPLICA_SOURCE：http(s)地址或主节点的data目录"""
+    if spec.startswith(('http://', 'https://')):
+        return HttpSource(spec, token)
+    return DirectorySource(os.path.abspath(spec))
+
+
+# ==================== 副本：同步 ====================
+
+class Replica:
+    """副本的同步进度和数据目录"""
+
+    def __init__(self, data_folder, source):
+        """
+        data_folder: 副本自己的data目录
+        source: DirectorySource 或 HttpSource
+        """
+        self.data_folder = data_folder
+        self.source = source
+        self.state_file = os.path.join(data_folder, 'replica_state.json')
+        self._cached = None  # (状态文件mtime, 状态)
+
+    def load_state(self):
+        """{'seq', 'position', 'synced_at', 'snapshot_at'}；seq为None表示还没有复制过快照"""
+        try:
+            mtime = os.stat(self.state_file).st_mtime_ns
+        except FileNotFoundError:
+            return {'seq': None, 'position': None, 'synced_at': None, 'snapshot_at': None}
+        if self._cached and self._cached[0] == mtime:
+            return dict(self._cached[1])
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            log.error('读取副本同步进度失败', extra=fields(error=e))
+            return {'seq': None, 'position': None, 'synced_at': None, 'snapshot_at': None}
+        self._cached = (mtime, state)
+        return dict(state)
+
+    def _save_state(self, state):
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_file)
+
+    def lag(self):
+        """距离上一次成功同步的秒数（从未同步时为None）"""
+        synced_at = self.load_state()['synced_at']
+        return None if synced_at is None else max(0.0, time.time() - synced_at)
+
+    def _snapshot(self, state):
+        """复制快照：写入索引和记录文件，删除快照中不存在的记录文件"""
+        seq, files = self.source.snapshot()
+        written = set()
+        for relative, read in files:
+            target = safe_join(self.data_folder, relative)
+            if target is None or not relative.startswith((SNAPSHOT_INDEX + '/', SNAPSHOT_RECORDS + '/')):
+                log.warning('跳过快照中的非法路径', extra=fields(path=relative))
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f"{target}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(read())
+            os.replace(tmp_path, target)
+            written.add(os.path.normpath(target))
+
+        # 主节点上已经删除的记录
+        removed = 0
+        for _, path in snapshot_files(self.data_folder):
+            if os.path.normpath(path) not in written:
+                os.remove(path)
+                removed += 1
+
+        state.update(seq=seq, position=None, snapshot_at=time.time())
+        self._save_state(state)
+        log.info('副本快照复制完成', extra=fields(source=str(self.source), seq=seq, files=len(written), removed=removed))
+
+    def sync(self, apply, limit=500):
+        """
+        拉取并应用新的变更，返回 {'snapshot', 'applied', 'seq'}
+
+        apply: apply(变更列表)，把一批变更写入副本的data目录
+        每应用一批就保存进度；应用之后、保存进度之前中断时重新应用同一批变更（变更是幂等的）。
+        """
+        state = self.load_state()
+        report = {'snapshot': False, 'applied': 0, 'seq': state['seq']}
+        if state['seq'] is None:
+            self._snapshot(state)
+            report['snapshot'] = True
+
+        while True:
+            batch = self.source.changes(state['seq'], state['position'], limit)
+            if batch['oldest'] is not None and state['seq'] + 1 < batch['oldest']:
+                if report['snapshot']:
+                    raise RuntimeError('变更日志保留的范围不足以完成快照复制，请增大 CHANGELOG_KEEP_SEGMENTS')
+                log.warning('副本落后超过变更日志保留范围，重新复制快照',
+                            extra=fields(seq=state['seq'], oldest=batch['oldest']))
+                self._snapshot(state)
+                report['snapshot'] = True
+                continue
+            entries = batch['entries']
+            if entries:
+                apply(entries)
+                state.update(seq=entries[-1]['seq'], position=batch['position'])
+                report['applied'] += len(entries)
+                metrics.inc('replication_changes_total', len(entries), role='replica')
+                self._save_state(state)
+            if len(entries) < limit:
+                break
+
+        state['synced_at'] = time.time()
+        self._save_state(state)
+        report['seq'] = state['seq']
+        return report
@@ -0,0 +1,374 @@
+"""
+静态站点导出
+
+把已审核通过的案例导出到 output/ 目录，由CDN或nginx直接提供，公开画廊不再经过Python：
+
+    output/index.html                          画廊首页（首屏卡片已渲染）
+    output/records/<id>.html                   详情页（内嵌记录数据）
+    output/data/manifest.json                  分片列表、应用列表
+    output/data/shards/<日期>.json              按创建日期分片的卡片数据（新的在前）
+    output/data/apps/<app>/manifest.json       按应用筛选时使用的分片列表
+    output/data/apps/<app>/shards/<日期>.json
+
+分片按记录的创建日期划分而不是按页码，审核或删除一条记录只需要重写它所在日期的分片、
+清单文件和它自己的详情页；首页只有在首屏卡片或应用列表变化时才重新渲染。
+增量发布从各索引分区的紧凑索引中只取出受影响日期的已审核条目（按时间戳二分），
+其余分片的条数沿用上一次发布的清单，开销与记录总数无关。
+"""
+import os
+import re
+import json
+import bisect
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from index_partitions import merge
+from logging_setup import fields
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只使用进程内锁
+    fcntl = None
+
+STATUS_APPROVED = 'approved'
+
+# 卡片（画廊列表）需要的字段
+CARD_FIELDS = ('id', 'title', 'app_id', 'datetime', 'status', 'cover', 'preview')
+
+log = logging.getLogger(__name__)
+
+_SAFE_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+def shard_key(entry):
+    """索引条目所在的分片（创建日期）"""
+    created_at = entry.get('created_at') or ''
+    return created_at[:10] if re.match(r'^\d{4}-\d{2}-\d{2}', created_at) else 'unknown'
+
+
+def app_path(app_id):
+    """app_id对应的目录名（含特殊字符的app_id使用哈希，避免路径穿越）"""
+    if _SAFE_NAME.match(app_id) and app_id not in ('.', '..'):
+        return app_id
+    return 'app-' + hashlib.md5(app_id.encode('utf-8')).hexdigest()[:12]
+
+
+def _day_range(key):
+    """分片日期对应的 [开始, 结束) 微秒时间戳（与紧凑索引的时间戳相同），无法解析时返回None"""
+    try:
+        start = datetime.fromisoformat(key) - datetime(1970, 1, 1)
+    except ValueError:
+        return None
+    start //= timedelta(microseconds=1)
+    return start, start + 86400 * 1000000
+
+
+class IndexSource:
+    """从紧凑索引（每个分区一个）读取已审核通过的条目"""
+
+    def __init__(self, indexes):
+        """indexes: 各分区的紧凑索引（CompactIndex接口），按合并顺序排列"""
+        self.indexes = indexes
+        self._shards = {}
+
+    def _day_rows(self, index, rows, key):
+        """rows中创建日期为key的行；时间戳从新到旧排列时二分定位，否则逐行检查"""
+        day = _day_range(key) if index.newest_first and index.regular_created else None
+        if day is None:
+            return [row for row in rows if shard_key({'created_at': index.created(row)}) == key]
+        start, end = day
+        left = bisect.bisect_left(rows, 1 - end, key=lambda row: -index.timestamp(row))
+        right = bisect.bisect_left(rows, 1 - start, key=lambda row: -index.timestamp(row))
+        return rows[left:right]
+
+    def approved(self):
+        """所有已审核通过的条目（新的在前，全量重建时使用）"""
+        return merge([index.entries(index.rows(status=STATUS_APPROVED)) for index in self.indexes])
+
+    def shard(self, key):
+        """创建日期为key的已审核条目（新的在前）"""
+        if key not in self._shards:
+            self._shards[key] = merge([index.entries(self._day_rows(index, index.rows(status=STATUS_APPROVED), key))
+                                       for index in self.indexes])
+        return self._shards[key]
+
+    def app_shard(self, app_id, key):
+        """app_id下创建日期为key的已审核条目"""
+        return merge([index.entries(self._day_rows(index, index.rows(status=STATUS_APPROVED, app_id=app_id), key))
+                      for index in self.indexes])
+
+    def app_counts(self, app_id):
+        """{日期: 条数}：app_id下全部已审核条目（应用清单不存在时使用）"""
+        counts = {}
+        for index in self.indexes:
+            for row in index.rows(status=STATUS_APPROVED, app_id=app_id):
+                key = shard_key({'created_at': index.created(row)})
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def apps(self):
+        """有已审核条目的app_id（排序）"""
+        return sorted({app_id for index in self.indexes for app_id in index.app_ids(STATUS_APPROVED)
+                       if isinstance(app_id, str) and app_id})
+
+
+class _Grouped:
+    """全量重建：内存中按日期分组的全部已审核条目（接口与IndexSource相同）"""
+
+    def __init__(self, approved):
+        self.shards = {}
+        self.app_shards = {}
+        for entry in approved:
+            key = shard_key(entry)
+            self.shards.setdefault(key, []).append(entry)
+            if entry.get('app_id'):
+                self.app_shards.setdefault(entry['app_id'], {}).setdefault(key, []).append(entry)
+
+    def shard(self, key):
+        return self.shards.get(key, [])
+
+    def app_shard(self, app_id, key):
+        return self.app_shards.get(app_id, {}).get(key, [])
+
+    def app_counts(self, app_id):
+        return {key: len(entries) for key, entries in self.app_shards.get(app_id, {}).items()}
+
+    def apps(self):
+        return sorted(self.app_shards)
+
+
+class StaticSite:
+    """增量静态站点发布器"""
+
+    def __init__(self, output_folder, data_folder, per_page=12):
+        """
+        output_folder: 导出目录
+        data_folder: 存放锁文件的目录（多个worker共享）
+        per_page: 首页渲染的卡片数
+        """
+        self.output_folder = output_folder
+        self.data_dir = os.path.join(output_folder, 'data')
+        self.records_dir = os.path.join(output_folder, 'records')
+        self.lock_file = os.path.join(data_folder, '.static.lock')
+        self.per_page = per_page
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """进程内 + 跨进程互斥（多个worker可能同时审核记录）"""
+        with self._lock:
+            with open(self.lock_file, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # ---------- 文件 ----------
+
+    @staticmethod
+    def _write(path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _write_json(self, path, data):
+        self._write(path, json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.data_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # ---------- 发布 ----------
+
+    def publish(self, source, load_record, render, changed=None):
+        """
+        发布静态站点，返回统计信息
+
+        source: IndexSource（各分区的紧凑索引）
+        load_record: load_record(record_id) -> (带展示字段的完整记录, 状态)
+        render: render(template_name, **context) -> HTML
+        changed: 发生变化的索引条目（删除的记录传删除前的条目）；为None时全量重建，
+                 还没有发布过（没有清单）时也全量重建
+        """
+        with self._locked():
+            return self._publish(source, load_record, render, changed)
+
+    def _read_app_counts(self, app_id):
+        """上一次发布的应用清单中的 {日期: 条数}，不存在时返回None"""
+        try:
+            with open(os.path.join(self.data_dir, 'apps', app_path(app_id), 'manifest.json'), 'r',
+                      encoding='utf-8') as f:
+                return {shard['key']: shard['count'] for shard in json.load(f)['shards']}
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _publish(self, source, load_record, render, changed):
+        old_manifest = self._read_manifest()
+        full = changed is None or not isinstance(old_manifest.get('shards'), list)
+        if full:
+            # 全量：所有已审核条目按日期分组，每个分片和应用都重写
+            approved = source.approved()
+            source = _Grouped(approved)
+            changed = approved
+            shard_counts = {key: len(entries) for key, entries in source.shards.items()}
+        else:
+            # 增量：只重新计算受影响日期的条数，其余沿用上一次的清单
+            shard_counts = {shard['key']: shard['count'] for shard in old_manifest['shards']}
+        affected = {shard_key(entry) for entry in changed}
+        affected_apps = {}
+        for entry in changed:
+            if entry.get('app_id'):
+                affected_apps.setdefault(entry['app_id'], set()).add(shard_key(entry))
+        for key in affected:
+            count = len(source.shard(key))
+            if count:
+                shard_counts[key] = count
+            else:
+                shard_counts.pop(key, None)
+        approved_ids = {entry['id'] for key in affected for entry in source.shard(key)}
+
+        cards = {}
+
+        def card(entry):
+            if entry['id'] not in cards:
+                record, _ = load_record(entry['id'])
+                if record is None:
+                    # 完整记录不存在（旧格式），与公开API一样使用索引数据，保证分片条数与清单一致
+                    record = dict(entry, datetime=entry.get('generation_time', ''),
+                                  title=entry.get('title') or '未命名记录')
+                    cards[entry['id']] = (None, {name: record.get(name) for name in CARD_FIELDS})
+                else:
+                    cards[entry['id']] = (record, {name: record.get(name) for name in CARD_FIELDS})
+            return cards[entry['id']]
+
+        def shard_cards(entries):
+            return [card(entry)[1] for entry in entries]
+
+        # 1. 详情页
+        pages = 0
+        for entry in changed:
+            html_file = os.path.join(self.records_dir, f"{entry['id']}.html")
+            record = card(entry)[0] if entry['id'] in approved_ids else None
+            if record:
+                self._write(html_file, render('detail.html', record_id=entry['id'],
+                                              initial_record=record, home_url='../index.html'))
+                pages += 1
+            else:
+                self._remove(html_file)
+
+        # 2. 分片
+        written = 0
+        for key in affected:
+            path = os.path.join(self.data_dir, 'shards', f"{key}.json")
+            if key in shard_counts:
+                self._write_json(path, shard_cards(source.shard(key)))
+                written += 1
+            else:
+                self._remove(path)
+        apps = source.apps()
+        for app_id, keys in affected_apps.items():
+            app_dir = os.path.join(self.data_dir, 'apps', app_path(app_id))
+            if app_id not in apps:
+                shutil.rmtree(app_dir, ignore_errors=True)
+                continue
+            app_counts = None if full else self._read_app_counts(app_id)
+            if app_counts is None:
+                app_counts = source.app_counts(app_id)
+            for key in keys:
+                path = os.path.join(app_dir, 'shards', f"{key}.json")
+                entries = source.app_shard(app_id, key)
+                if entries:
+                    self._write_json(path, shard_cards(entries))
+                    app_counts[key] = len(entries)
+                    written += 1
+                else:
+                    self._remove(path)
+                    app_counts.pop(key, None)
+            self._write_json(os.path.join(app_dir, 'manifest.json'), {
+                'app_id': app_id,
+                'total': sum(app_counts.values()),
+                'shards': [{'key': key, 'count': app_counts[key]} for key in sorted(app_counts, reverse=True)]
+            })
+
+        # 3. 清单和首页
+        shard_keys = sorted(shard_counts, reverse=True)
+        first_page = []
+        for key in shard_keys:
+            if len(first_page) >= self.per_page:
+                break
+            first_page.extend(source.shard(key)[:self.per_page - len(first_page)])
+        manifest = {
+            'updated_at': datetime.now().isoformat(),
+            'total': sum(shard_counts.values()),
+            'per_page': self.per_page,
+            'apps': apps,
+            'app_paths': {app_id: app_path(app_id) for app_id in apps},
+            'first_page': [entry['id'] for entry in first_page],
+            'shards': [{'key': key, 'count': shard_counts[key]} for key in shard_keys]
+        }
+        index_file = os.path.join(self.output_folder, 'index.html')
+        first_page_changed = (full or not os.path.exists(index_file)
+                              or old_manifest.get('first_page') != manifest['first_page']
+                              or old_manifest.get('apps') != apps
+                              or bool(approved_ids & {entry['id'] for entry in changed}
+                                      & set(manifest['first_page'])))
+        if first_page_changed:
+            first_cards = shard_cards(first_page)
+            self._write(index_file, render('gallery.html', static_base='./', ssr={
+                'cards_html': render('_gallery_cards.html', records=first_cards, static_base='./'),
+                'filters_html': render('_app_filters.html', app_ids=apps),
+                'state': {'count': len(first_cards), 'total': manifest['total'], 'per_page': self.per_page}
+            }))
+        self._write_json(os.path.join(self.data_dir, 'manifest.json'), manifest)
+        if full:
+            self._remove_stale(approved_ids, source.shards, source.app_shards)
+
+        report = {
+            'full': full,
+            'changed': len(changed),
+            'pages': pages,
+            'shards': written,
+            'index_rebuilt': first_page_changed
+        }
+        log.info('静态站点已更新', extra=fields(**report))
+        return report
+
+    def _remove_stale(self, approved_ids, shards, app_shards):
+        """全量重建后删除不再需要的文件（先写新文件再删除，重建期间站点始终可用）"""
+        def listdir(path):
+            return os.listdir(path) if os.path.isdir(path) else []
+
+        for filename in listdir(self.records_dir):
+            if filename[:-len('.html')] not in approved_ids:
+                self._remove(os.path.join(self.records_dir, filename))
+        for filename in listdir(os.path.join(self.data_dir, 'shards')):
+            if filename[:-len('.json')] not in shards:
+                self._remove(os.path.join(self.data_dir, 'shards', filename))
+        app_dirs = {app_path(app_id): app_id for app_id in app_shards}
+        for dirname in listdir(os.path.join(self.data_dir, 'apps')):
+            app_dir = os.path.join(self.data_dir, 'apps', dirname)
+            if dirname not in app_dirs:
+                shutil.rmtree(app_dir, ignore_errors=True)
+                continue
+            for filename in listdir(os.path.join(app_dir, 'shards')):
+                if filename[:-len('.json')] not in app_shards[app_dirs[dirname]]:
+                    self._remove(os.path.join(app_dir, 'shards', filename))
@@ -0,0 +1,76 @@
+"""
+测试夹具：每个测试在独立的临时目录中创建应用（数据、媒体和认证文件都不写入仓库目录）
+
+    python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """make_app(**config) -> Flask应用；相对目录都位于tmp_path下"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('APP_ROLE', raising=False)
+
+    def factory(**config):
+        settings = {
+            'AUTH_FILE': str(tmp_path / '.auth'),
+            'PRECOMPRESS_STATIC': False,
+            'ADMISSION_MIN_FREE_BYTES': 0,
+            'LOG_LEVEL': 'WARNING'
+        }
+        settings.update(config)
+        return app_module.create_app(settings)
+    return factory
+
+
+@pytest.fixture
+def flask_app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def login():
+    """login(flask_app, username='admin') -> 已登录管理后台的测试客户端"""
+    def client_for(flask_app, username='admin'):
+        client = flask_app.test_client()
+        with client.session_transaction() as session:
+            session['logged_in'] = True
+            session['username'] = username
+        return client
+    return client_for
+
+
+@pytest.fixture
+def add_record():
+    """add_record(record_id, app_id='demo', status='pending', results=()) -> 保存记录文件和索引条目（需要应用上下文）"""
+    def add(record_id, app_id='demo', status=app_module.STATUS_PENDING, results=()):
+        record = {
+            'id': record_id,
+            'created_at': f"2026-01-01T00:00:{len(app_module.read_index_file()):02d}",
+            'title': f"记录 {record_id}",
+            'app_id': app_id,
+            'datetime': '2026-01-01T00:00',
+            'parameters': {},
+            'generation_time': 1.0,
+            'files': {
+                'materials': [],
+                'results': [{'id': name, 'filename': name, 'category': 'image', 'path': f"/generated/{name}"}
+                            for name in results]
+            },
+            'status': status
+        }
+        app_module.save_record(record)
+        entry = app_module.build_index_entry(record)
+        app_module.update_index_partition(app_id, lambda records: [entry] + records)
+        return record
+    return add
@@ -0,0 +1,88 @@
+"""提交准入控制：没有空闲槽位时排队，排队已满或超时返回429，磁盘空间不足返回507"""
+import io
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+FORM = {'title': '标题', 'app_id': 'demo', 'datetime': '2026-01-01T00:00', 'prompt': 'seed: 1'}
+
+
+def submit(client):
+    return client.post('/submit', data=dict(FORM, results=(io.BytesIO(b'hello'), 'a.txt')),
+                       content_type='multipart/form-data')
+
+
+def test_submission_is_rejected_when_slots_and_queue_are_full(make_app):
+    flask_app = make_app(ADMISSION_INGEST_SLOTS=1, ADMISSION_QUEUE=0, ADMISSION_RETRY_AFTER=7)
+    client = flask_app.test_client()
+
+    with flask_app.extensions['ingest_admission'].acquire():
+        response = submit(client)
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '7'
+
+    # 槽位释放后正常接收，请求结束时释放自己的槽位
+    assert submit(client).status_code == 200
+    assert submit(client).status_code == 200
+
+
+def test_queued_submission_times_out(make_app):
+    flask_app = make_app(ADMISSION_INGEST_SLOTS=1, ADMISSION_QUEUE=1, ADMISSION_WAIT_SECONDS=0.3)
+
+    with flask_app.extensions['ingest_admission'].acquire():
+        assert submit(flask_app.test_client()).status_code == 429
+
+
+def test_submission_is_rejected_when_the_disk_is_full(make_app):
+    flask_app = make_app(ADMISSION_MIN_FREE_BYTES=1 << 62)
+
+    response = submit(flask_app.test_client())
+
+    assert response.status_code == 507
+    assert 'Retry-After' in response.headers
+    status = flask_app.extensions['ingest_admission'].status()
+    assert (status['active'], status['reserved_bytes']) == (0, 0)
+
+
+def test_queued_requests_are_not_overtaken(tmp_path):
+    controller = AdmissionController(str(tmp_path), slots=1, queue_size=2, wait_seconds=0, poll_seconds=0.01)
+    held = controller.acquire()
+    waiting = controller.enqueue()
+
+    # 槽位空出时，不在队列中的请求不能插队
+    held.release()
+    assert controller.try_acquire() is None
+    with controller.try_acquire(queued=True) as ticket:
+        assert ticket is not None
+        waiting.release()
+
+        # 等待超时和队列已满都返回429
+        with pytest.raises(AdmissionRejected) as timed_out:
+            controller.acquire()
+        assert timed_out.value.status == 429
+        with controller.enqueue(), controller.enqueue():
+            with pytest.raises(AdmissionRejected) as queue_full:
+                controller.enqueue()
+        assert queue_full.value.status == 429
+
+
+def test_written_bytes_are_not_reserved_twice(tmp_path, monkeypatch):
+    disk = {'free': 1000}
+    monkeypatch.setattr('admission.shutil.disk_usage', lambda path: type('Usage', (), disk)())
+    controller = AdmissionController(str(tmp_path / 'slots'), slots=2, queue_size=0, disk_path=str(tmp_path))
+
+    with controller.try_acquire(600) as uploading:
+        # 除去预留只剩400字节，500字节的上传要等待
+        assert controller.try_acquire(500) is None
+        # 上传写入磁盘后空闲空间减少，写入的部分不再计入预留
+        disk['free'] -= 600
+        assert controller.try_acquire(300) is None
+        uploading.consume(600)
+        with controller.try_acquire(300) as ticket:
+            assert ticket is not None
+            assert controller.status()['reserved_bytes'] == 300
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.try_acquire(500)
+    assert rejected.value.status == 507
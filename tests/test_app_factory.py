@@ -0,0 +1,41 @@
+"""应用工厂：按APP_ROLE只注册对应的路由，创建应用和处理读请求时不加载媒体处理流水线"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import REPO_ROOT
+
+
+def test_roles_register_their_own_routes(make_app):
+    api = make_app(APP_ROLE='api').test_client()
+    manage = make_app(APP_ROLE='manage').test_client()
+    everything = make_app().test_client()
+
+    assert api.get('/api/records').status_code == 200
+    assert api.get('/form').status_code == 404
+    assert manage.get('/api/records').status_code == 404
+    assert manage.get('/form').status_code == 200
+    assert everything.get('/api/records').status_code == everything.get('/form').status_code == 200
+
+
+def test_invalid_roles_are_rejected(make_app):
+    with pytest.raises(ValueError):
+        make_app(APP_ROLE='worker')
+    with pytest.raises(ValueError):
+        make_app(APP_ROLE='manage', REPLICA_SOURCE='data')
+
+
+def test_media_pipeline_is_loaded_lazily(tmp_path):
+    script = (
+        "import sys, app\n"
+        "client = app.create_app({'AUTH_FILE': '.auth', 'PRECOMPRESS_STATIC': False}).test_client()\n"
+        "assert client.get('/api/records').status_code == 200\n"
+        "print(sorted(name for name in ('media', 'cv2') if name in sys.modules))\n"
+    )
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, APP_ROLE='api', LOG_LEVEL='WARNING')
+
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=tmp_path, env=env, text=True)
+
+    assert output.strip() == '[]'
@@ -0,0 +1,105 @@
+"""ASGI模式：Range解析、协程发送媒体文件、只读API与Flask的输出一致、其余路由交给Flask"""
+import asyncio
+import json
+import os
+
+import pytest
+
+import app as app_module
+from asgi import AsgiApp, _parse_range
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 10239)),
+    ('bytes=-100', (10140, 10239)),
+    ('bytes=10000-20000', (10000, 10239)),
+    ('bytes=-20000', (0, 10239)),
+    ('bytes=20000-', False),
+    ('bytes=5-1', False),
+    ('bytes=-0', False),
+    (None, None),
+    ('items=0-1', None),
+    ('bytes=0-1,5-6', None),
+    ('bytes=a-b', None),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, len(CONTENT)) == expected
+
+
+def call(asgi_app, path, method='GET', headers=(), query=b''):
+    """执行一个ASGI请求，返回 (状态码, 响应头, 响应体)"""
+    messages = []
+
+    async def receive():
+        if not messages:
+            messages.append(None)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'raw_path': path.encode(), 'query_string': query,
+             'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+             'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+             'http_version': '1.1', 'root_path': ''}
+    asyncio.run(asgi_app(scope, receive, send))
+    start = next(m for m in messages if m and m['type'] == 'http.response.start')
+    body = b''.join(m.get('body', b'') for m in messages if m and m['type'] == 'http.response.body')
+    return start['status'], {name.decode(): value.decode() for name, value in start['headers']}, body
+
+
+@pytest.fixture
+def asgi_app(flask_app):
+    with open(os.path.join(flask_app.config['GENERATED_FOLDER'], 'clip.bin'), 'wb') as f:
+        f.write(CONTENT)
+    asgi_app = AsgiApp(flask_app)
+    yield asgi_app
+    asgi_app.io_pool.shutdown()
+    asgi_app.wsgi_pool.shutdown()
+
+
+def test_media_files_support_ranges_and_conditional_requests(asgi_app):
+    status, headers, body = call(asgi_app, '/generated/clip.bin')
+    assert (status, body) == (200, CONTENT)
+    assert headers['accept-ranges'] == 'bytes'
+
+    status, headers, body = call(asgi_app, '/generated/clip.bin', headers=[('Range', 'bytes=-10')])
+    assert (status, body, headers['content-range']) == (206, CONTENT[-10:], f"bytes 10230-10239/{len(CONTENT)}")
+    status, headers, _ = call(asgi_app, '/generated/clip.bin', headers=[('Range', 'bytes=99999-')])
+    assert (status, headers['content-range']) == (416, f"bytes */{len(CONTENT)}")
+    # If-Range与当前版本不一致时返回完整文件
+    status, _, body = call(asgi_app, '/generated/clip.bin', headers=[('Range', 'bytes=0-9'), ('If-Range', '"old"')])
+    assert (status, body) == (200, CONTENT)
+
+    etag = headers['etag']
+    assert call(asgi_app, '/generated/clip.bin', headers=[('If-None-Match', etag)])[0] == 304
+    status, headers, body = call(asgi_app, '/generated/clip.bin', method='HEAD')
+    assert (status, headers['content-length'], body) == (200, str(len(CONTENT)), b'')
+    assert call(asgi_app, '/generated/missing.bin')[0] == 404
+
+
+def test_read_apis_match_flask(asgi_app, flask_app, add_record):
+    with flask_app.app_context():
+        add_record('r1', status=app_module.STATUS_APPROVED)
+        add_record('r2')
+    client = flask_app.test_client()
+
+    status, headers, body = call(asgi_app, '/api/records', query=b'per_page=5')
+    assert (status, headers['content-type']) == (200, 'application/json')
+    assert json.loads(body) == client.get('/api/records?per_page=5').get_json()
+    assert json.loads(call(asgi_app, '/api/record/r1')[2])['data']['id'] == 'r1'
+    assert call(asgi_app, '/api/record/missing')[0] == 404
+    # 未审核通过的记录交给Flask判断权限
+    assert call(asgi_app, '/api/record/r2')[0] == client.get('/api/record/r2').status_code
+
+
+def test_other_routes_are_handled_by_flask(asgi_app):
+    status, headers, body = call(asgi_app, '/form')
+
+    assert status == 200
+    assert headers['content-type'].startswith('text/html')
+    assert body
@@ -0,0 +1,52 @@
+"""基准测试：相同的seed生成完全相同的数据集，compare按中位数判定回退"""
+import json
+
+from benchmarks.compare import compare, load_results
+from benchmarks.datagen import APP_IDS, generate_records, iter_records
+
+
+def test_dataset_is_deterministic():
+    first = generate_records(50, seed=7)
+
+    assert generate_records(50, seed=7) == first
+    assert generate_records(50, seed=8) != first
+    # 前缀相同：小数据集是大数据集最早的一部分
+    assert list(iter_records(20, seed=7)) == list(reversed(first))[:20]
+
+
+def test_records_match_the_submitted_structure():
+    records = generate_records(200)
+
+    # 从新到旧排列，ID唯一
+    assert [record['created_at'] for record in records] == sorted(
+        (record['created_at'] for record in records), reverse=True)
+    assert len({record['id'] for record in records}) == len(records)
+    for record in records:
+        assert record['app_id'] in APP_IDS
+        assert record['status'] in ('approved', 'pending', 'rejected')
+        files = record['files']['materials'] + record['files']['results']
+        assert record['files']['results']
+        assert record['statistics']['total_size'] == sum(f['size'] for f in files)
+        assert all(f['path'] == f"/{f['full_path']}" for f in files)
+
+
+def write_report(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'meta': {}, 'results': [dict(name=name, size=size, median_ms=ms)
+                                           for name, size, ms in results]}, f)
+    return load_results(str(path))
+
+
+def test_compare_flags_regressions(tmp_path):
+    baseline = write_report(tmp_path / 'base.json', [('load', 1000, 10.0), ('save', 1000, 10.0),
+                                                     ('stats', 1000, 10.0)])
+    current = write_report(tmp_path / 'new.json', [('load', 1000, 11.0), ('save', 1000, 7.0),
+                                                   ('api', 1000, 1.0)])
+
+    rows, regressed = compare(baseline, current, threshold=0.2)
+    verdicts = {key[0]: verdict for key, _, _, _, verdict in rows}
+    assert not regressed
+    assert verdicts == {'load': '', 'save': '提升', 'stats': '缺失', 'api': '缺失'}
+
+    _, regressed = compare(baseline, current, threshold=0.05)
+    assert regressed
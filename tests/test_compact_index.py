@@ -0,0 +1,96 @@
+"""紧凑索引：还原的条目与索引文件完全相同，筛选和查找与线性扫描一致，索引文件变化后按签名重建"""
+import json
+import os
+
+from compact_index import MISSING, CompactIndex, ResidentIndex, build, file_signature
+
+
+def entry(n, app_id='demo', status='approved', **changes):
+    values = {'id': f"r{n:03d}", 'created_at': f"2026-01-01T00:{59 - n:02d}:00.{n + 1:06d}", 'title': f"标题 {n}",
+              'app_id': app_id, 'generation_time': '2026-01-01T00:00', 'has_preview': n % 2 == 0,
+              'preview_type': 'image' if n % 2 == 0 else None, 'status': status}
+    values.update(changes)
+    return values
+
+
+def sample_entries():
+    entries = [entry(n, app_id=('demo', 'sd/xl', None)[n % 3], status=('approved', 'pending')[n % 4 == 0])
+               for n in range(30)]
+    # 旧版本和手工修改留下的不规则条目
+    entries[3] = {key: value for key, value in entries[3].items() if key not in ('app_id', 'status')}
+    entries[5] = dict(entries[5], extra={'note': '额外字段'}, has_preview=1)
+    entries[7] = dict(reversed(list(entries[7].items())))
+    entries[9] = dict(entries[9], created_at='2026/01/01', title=None)
+    entries[11] = dict(entries[11], created_at='2026-01-01T00:48:00+08:00', app_id=42)
+    return entries
+
+
+def test_entries_round_trip():
+    entries = sample_entries()
+    index = CompactIndex(build(entries, None))
+
+    assert len(index) == len(entries)
+    assert index.entries(range(len(entries))) == entries
+    assert [list(index.entry(row)) for row in range(len(entries))] == [list(e) for e in entries]
+    assert not index.regular_created
+
+
+def test_filters_and_lookup_match_a_linear_scan():
+    entries = sample_entries()
+    index = CompactIndex(build(entries, None))
+
+    for status in ('approved', 'pending', 'rejected'):
+        for app_id in ('demo', 'sd/xl', 'missing'):
+            expected = [row for row, e in enumerate(entries) if e.get('status', MISSING) == status
+                        and e.get('app_id', MISSING) == app_id]
+            assert list(index.rows(status=status, app_id=app_id)) == expected
+        assert list(index.rows(status=status)) == [row for row, e in enumerate(entries) if e.get('status') == status]
+    assert list(index.rows(app_id='sd/xl')) == [row for row, e in enumerate(entries) if e.get('app_id') == 'sd/xl']
+
+    for row, e in enumerate(entries):
+        assert index.find(e['id']) == row
+    assert index.find('r999') is None
+    assert sum(count for _, _, count in index.counts()) == len(entries)
+    assert (MISSING, MISSING, 1) in index.counts()
+    assert index.app_ids(status='pending') == ['demo', 'sd/xl', None]
+
+
+def test_regular_indexes_are_newest_first():
+    index = CompactIndex(build([entry(n) for n in range(10)], None))
+
+    assert index.newest_first and index.regular_created
+    assert [index.timestamp(row) for row in range(10)] == sorted((index.timestamp(row) for row in range(10)),
+                                                                  reverse=True)
+    assert index.created(0) == entry(0)['created_at']
+
+
+def write_index(path, entries):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'records': entries, 'total_count': len(entries)}, f)
+
+
+def test_resident_index_follows_the_index_file(tmp_path):
+    index_file = str(tmp_path / 'demo.json')
+    compact_file = str(tmp_path / 'demo.compact')
+    resident = ResidentIndex(index_file, compact_file)
+    assert resident.get() is None
+
+    write_index(index_file, [entry(1), entry(2)])
+    first = resident.get()
+    assert [first.record_id(row) for row in range(len(first))] == ['r001', 'r002']
+    assert first.signature == file_signature(os.stat(index_file))
+    assert resident.get() is first
+
+    # 另一个进程直接映射已生成的紧凑索引，不再重建
+    built_at = os.stat(compact_file).st_mtime_ns
+    assert len(ResidentIndex(index_file, compact_file).get()) == 2
+    assert os.stat(compact_file).st_mtime_ns == built_at
+
+    # 索引文件被其他方式修改后签名不一致，第一个读取的进程重建
+    write_index(index_file, [entry(3)])
+    assert resident.get().entry(0) == entry(3)
+
+    # 损坏的紧凑索引文件重新生成
+    with open(compact_file, 'wb') as f:
+        f.write(b'garbage')
+    assert ResidentIndex(index_file, compact_file).get().entry(0) == entry(3)
@@ -0,0 +1,84 @@
+"""响应压缩：按Accept-Encoding的q值选择编码，JSON响应压缩后缓存，静态文件发送预压缩版本"""
+import gzip
+import os
+
+import pytest
+
+import app as app_module
+from compression import ResponseCompressor, choose_encoding, find_precompressed, precompress_folder
+
+BOTH = ('br', 'gzip')
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, None),
+    ('', None),
+    ('gzip, deflate, br', 'br'),
+    ('GZIP', 'gzip'),
+    ('br;q=0, gzip;q=0.5', 'gzip'),
+    ('br;q=0', None),
+    ('*', 'br'),
+    ('*;q=0', None),
+    ('gzip;q=0, *', 'br'),
+    ('br;q=0, *;q=0.1', 'gzip'),
+    ('deflate, identity', None),
+    ('gzip;q=abc', None),
+])
+def test_choose_encoding(accept_encoding, expected):
+    assert choose_encoding(accept_encoding, BOTH) == expected
+
+
+def test_json_responses_are_compressed_and_cached(make_app, add_record):
+    flask_app = make_app(COMPRESS_MIN_SIZE=200)
+    with flask_app.app_context():
+        for n in range(5):
+            add_record(f"r{n}", status=app_module.STATUS_APPROVED)
+    client = flask_app.test_client()
+
+    plain = client.get('/api/records')
+    compressed = client.get('/api/records', headers={'Accept-Encoding': 'gzip'})
+    client.get('/api/records', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+    # 同样的响应只压缩一次
+    assert len(flask_app.extensions['compressor']._cache) == 1
+    small = client.get('/api/apps', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+
+def test_compression_cache_is_bounded():
+    compressor = ResponseCompressor(cache_bytes=8 * 1024)
+    for n in range(50):
+        compressor.compress(os.urandom(512) * 2, 'gzip')
+
+    assert compressor._size <= compressor.cache_bytes
+    assert compressor._size == sum(len(value) for value in compressor._cache.values())
+
+
+def test_precompressed_static_files(make_app, tmp_path):
+    static = tmp_path / 'static'
+    static.mkdir()
+    (static / 'site.css').write_text('body { color: red; }\n' * 200)
+    (static / 'tiny.css').write_text('a{}')
+    (static / 'logo.png').write_bytes(b'\x89PNG' + b'\0' * 4096)
+
+    assert precompress_folder(str(static), encodings=['gzip']) == 1
+    assert sorted(os.listdir(static)) == ['logo.png', 'site.css', 'site.css.gz', 'tiny.css']
+    # 已是最新的预压缩文件不会重新生成
+    assert precompress_folder(str(static), encodings=['gzip']) == 0
+
+    flask_app = make_app()
+    flask_app.static_folder = str(static)
+    client = flask_app.test_client()
+    response = client.get('/static/site.css', headers={'Accept-Encoding': 'br;q=1, gzip;q=0.8'})
+    assert (response.headers['Content-Encoding'], response.mimetype) == ('gzip', 'text/css')
+    assert gzip.decompress(response.get_data()) == (static / 'site.css').read_bytes()
+    assert 'Content-Encoding' not in client.get('/static/site.css').headers
+
+    # 原文件更新后，旧的预压缩文件不再使用
+    stale = os.path.getmtime(static / 'site.css.gz') - 10
+    os.utime(static / 'site.css.gz', (stale, stale))
+    assert find_precompressed(str(static / 'site.css'), 'gzip') is None
@@ -0,0 +1,77 @@
+"""近似重复检测：多索引哈希表的半径查询与线性扫描一致，删除的记录不再匹配，多个进程共享哈希日志"""
+import random
+
+import pytest
+
+from duplicates import DuplicateIndex, MultiIndexHash, compute_hashes, distance
+
+
+def test_radius_queries_match_a_linear_scan():
+    rng = random.Random(3)
+    base = rng.getrandbits(64)
+    # 一半哈希在base附近，一半随机分布
+    values = [base ^ sum(1 << bit for bit in rng.sample(range(64), rng.randint(0, 14))) for _ in range(300)]
+    values += [rng.getrandbits(64) for _ in range(300)]
+    table = MultiIndexHash()
+    for item, value in enumerate(values):
+        table.add(value, item)
+
+    for query in (base, values[7], rng.getrandbits(64)):
+        for radius in (0, 3, 8, 12):
+            expected = sorted((distance(query, value), item) for item, value in enumerate(values)
+                              if distance(query, value) <= radius)
+            assert sorted(table.search(query, radius)) == expected
+
+
+def record(record_id, *names):
+    return {'id': record_id, 'files': {'results': [
+        {'category': 'image', 'path': f"/generated/{name}"} for name in names]}}
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    """媒体路径 -> (dHash, pHash)，代替真实图片的感知哈希"""
+    values = {}
+    monkeypatch.setattr('duplicates.compute_hashes', lambda path: values.get(path))
+    return values
+
+
+def test_similar_records_and_removal(tmp_path, hashes):
+    hashes.update({'generated/a.png': (0, 0), 'generated/b.png': (0b111, 0b1111),
+                   'generated/c.png': (0, (1 << 20) - 1), 'generated/d.png': (5, 0b1)})
+    index = DuplicateIndex(str(tmp_path), max_distance=8)
+    other_worker = DuplicateIndex(str(tmp_path), max_distance=8)
+    for record_id, name in (('r1', 'a.png'), ('r2', 'b.png'), ('r3', 'c.png'), ('r4', 'd.png')):
+        index.add_record(record(record_id, name), lambda key: key)
+    index.add_record(record('r5', 'missing.png'), lambda key: key)
+
+    assert index.find_similar('r1') == [{'id': 'r4', 'phash_distance': 1, 'dhash_distance': 2},
+                                        {'id': 'r2', 'phash_distance': 4, 'dhash_distance': 3}]
+    assert index.find_similar('r3') == []
+    assert [item['id'] for item in index.find_similar('r3', max_distance=20)] == ['r2', 'r4', 'r1']
+    assert other_worker.clusters() == [['r1', 'r2', 'r4']]
+    assert other_worker.has_record('r5') and not other_worker.has_record('r6')
+
+    # 其他worker删除的记录在下次查询时不再匹配，压缩日志后结果不变
+    other_worker.remove_record('r4')
+    assert [item['id'] for item in index.find_similar('r1')] == ['r2']
+    assert index.compact() == 4
+    assert other_worker.clusters() == [['r1', 'r2']]
+    assert other_worker.status() == {'records': 3, 'hashes': 3, 'removed': 0, 'max_distance': 8}
+
+
+def test_perceptual_hashes_survive_resizing(tmp_path):
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+    rng = np.random.default_rng(1)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (256, 256), dtype=np.uint8), (31, 31), 0)
+    other = cv2.GaussianBlur(rng.integers(0, 256, (256, 256), dtype=np.uint8), (31, 31), 0)
+    cv2.imwrite(str(tmp_path / 'a.png'), image)
+    cv2.imwrite(str(tmp_path / 'b.jpg'), cv2.resize(image, (200, 200)))
+    cv2.imwrite(str(tmp_path / 'c.png'), other)
+
+    a, b, c = (compute_hashes(str(tmp_path / name)) for name in ('a.png', 'b.jpg', 'c.png'))
+
+    assert distance(a[1], b[1]) <= 8
+    assert distance(a[1], c[1]) > 8
+    assert compute_hashes(str(tmp_path / 'missing.png')) is None
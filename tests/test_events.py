@@ -0,0 +1,69 @@
+"""管理后台事件：读取方只读取新增的完整行并跟随日志轮转，SSE连接先发送完整统计再推送审核事件"""
+import json
+
+import app as app_module
+from events import EventLog
+
+
+def event_types(events):
+    return [event['type'] for event in events]
+
+
+def test_reader_follows_appends_and_rotation(tmp_path):
+    log = EventLog(str(tmp_path), max_bytes=200)
+    # 日志还不存在时建立的连接，之后从头读取
+    early = log.reader()
+    log.publish([('a', {'n': 1})])
+    reader = log.reader()
+    assert event_types(early.read()) == ['a']
+    assert reader.read() == []
+
+    # 写了一半的行留到下次读取
+    with open(log.log_file, 'a', encoding='utf-8') as f:
+        f.write('{"type": "b", "data": {}')
+    assert reader.read() == []
+    with open(log.log_file, 'a', encoding='utf-8') as f:
+        f.write(', "time": 0}\n')
+    assert event_types(reader.read()) == ['b']
+
+    # 超过max_bytes后轮转，旧文件剩余的事件先读完
+    log.publish([('c', {'text': 'x' * 200})])
+    log.publish([('d', {}), ('e', {})])
+    assert event_types(reader.read()) == ['c', 'd', 'e']
+    assert event_types(early.read()) == ['b', 'c', 'd', 'e']
+    reader.close()
+    early.close()
+
+
+def parse_sse(chunks):
+    messages = []
+    for block in ''.join(chunks).split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines() if line.startswith(('event', 'data')))
+        if 'event' in lines:
+            messages.append((lines['event'], json.loads(lines['data'])))
+    return messages
+
+
+def test_stream_sends_stats_then_review_events(make_app, add_record, login):
+    flask_app = make_app(SSE_POLL_SECONDS=0.01, SSE_MAX_SECONDS=0.5, SSE_RESYNC_SECONDS=60)
+    with flask_app.app_context():
+        add_record('r1')
+        add_record('r2', status=app_module.STATUS_APPROVED)
+    client = login(flask_app)
+
+    response = client.get('/admin/api/events', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = response.iter_encoded()
+    first = [next(chunks), next(chunks)]
+    assert client.post('/admin/api/review/r1', json={'action': 'approve'}).get_json()['success']
+    messages = parse_sse([chunk.decode() for chunk in first + list(chunks)])
+
+    assert messages[0][0] == 'stats'
+    assert (messages[0][1]['total'], messages[0][1]['pending']) == (2, 1)
+    types = [event_type for event_type, _ in messages]
+    assert types[1:] == ['record_status', 'stats_delta']
+    assert messages[1][1] == {'records': [{'id': 'r1', 'status': 'approved'}]}
+
+
+def test_stream_requires_login(flask_app):
+    assert flask_app.test_client().get('/admin/api/events').status_code == 302
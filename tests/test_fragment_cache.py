@@ -0,0 +1,66 @@
+"""片段缓存：版本文件变化时所有实例的缓存失效，并发失效不会出错"""
+import threading
+
+from fragment_cache import FragmentCache
+
+
+def test_invalidation_is_seen_by_other_processes(tmp_path):
+    version_file = str(tmp_path / 'fragments.version')
+    cache, other = FragmentCache(version_file), FragmentCache(version_file)
+    renders = []
+
+    def render():
+        renders.append(1)
+        return f"html-{len(renders)}"
+
+    assert cache.get_or_render('cards', render) == 'html-1'
+    assert cache.get_or_render('cards', render) == 'html-1'
+    # 另一个worker递增版本号后，本进程的片段重新渲染
+    other.invalidate()
+    assert cache.get_or_render('cards', render) == 'html-2'
+
+
+def test_least_recently_used_fragments_are_evicted(tmp_path):
+    cache = FragmentCache(str(tmp_path / 'fragments.version'), max_entries=2)
+    cache.get_or_render('a', lambda: 'a1')
+    cache.get_or_render('b', lambda: 'b1')
+    cache.get_or_render('a', lambda: 'a2')
+    cache.get_or_render('c', lambda: 'c1')
+
+    assert cache.get_or_render('a', lambda: 'a3') == 'a1'
+    assert cache.get_or_render('b', lambda: 'b2') == 'b2'
+
+
+def test_concurrent_invalidation(tmp_path):
+    cache = FragmentCache(str(tmp_path / 'fragments.version'))
+    errors = []
+
+    def invalidate():
+        for _ in range(200):
+            try:
+                cache.invalidate()
+            except OSError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=invalidate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert [path.name for path in tmp_path.iterdir()] == ['fragments.version']
+
+
+def test_failed_invalidation_does_not_fail_the_review(flask_app, add_record, login, monkeypatch):
+    with flask_app.app_context():
+        add_record('r1')
+
+    def fail():
+        raise OSError('磁盘已满')
+    monkeypatch.setattr(flask_app.extensions['fragment_cache'], 'invalidate', fail)
+
+    response = login(flask_app).post('/admin/api/review/r1', json={'action': 'approve'})
+
+    assert response.status_code == 200
+    assert flask_app.test_client().get('/api/records').get_json()['data'][0]['id'] == 'r1'
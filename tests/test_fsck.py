@@ -0,0 +1,79 @@
+"""一致性检查：报告索引、记录文件和媒体文件之间的各类问题，--prune 和 --rebuild-index 修复索引"""
+import json
+import os
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def damaged(flask_app, add_record):
+    """r1正常；r2状态与索引不一致；r3记录文件丢失；orphan不在索引中；broken无法解析；r4引用的媒体文件不存在"""
+    with flask_app.app_context():
+        add_record('r1', status=app_module.STATUS_APPROVED, results=('r1.png',))
+        with open(os.path.join(flask_app.config['GENERATED_FOLDER'], 'r1.png'), 'wb') as f:
+            f.write(b'png')
+        record = add_record('r2')
+        app_module.write_json_atomic(app_module.record_file_path('r2', 'demo'),
+                                     dict(record, status=app_module.STATUS_APPROVED))
+        add_record('r3')
+        os.remove(app_module.record_file_path('r3', 'demo'))
+        add_record('r4', results=('missing.png',))
+        orphan = dict(app_module.load_record('r1', 'demo'), id='orphan', files={'materials': [], 'results': []})
+        app_module.save_record(orphan)
+        broken = app_module.record_file_path('broken', 'demo')
+        os.makedirs(os.path.dirname(broken), exist_ok=True)
+        with open(broken, 'w', encoding='utf-8') as f:
+            f.write('{"id": ')
+    return flask_app
+
+
+def fsck(flask_app, *args):
+    result = flask_app.test_cli_runner().invoke(args=['fsck', '--workers', '2', *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def issue_counts(output):
+    counts = {}
+    for line in output.splitlines():
+        name, _, count = line.strip().partition(': ')
+        if line.startswith('  ') and not line.startswith('    ') and count.isdigit():
+            counts[name] = int(count)
+    return counts
+
+
+def test_report(damaged, tmp_path):
+    output = fsck(damaged, '--output', str(tmp_path / 'issues.jsonl'))
+
+    assert issue_counts(output) == {'dangling': 1, 'invalid_json': 1, 'missing_media': 1, 'status_mismatch': 1,
+                                    'unindexed': 1}
+    with open(tmp_path / 'issues.jsonl', encoding='utf-8') as f:
+        issues = {issue['type']: issue for issue in map(json.loads, f)}
+    assert issues['dangling']['id'] == 'r3'
+    assert issues['unindexed']['id'] == 'orphan'
+    assert issues['missing_media'] == {'type': 'missing_media', 'id': 'r4', 'key': 'generated/missing.png'}
+
+
+def test_prune_removes_dangling_entries(damaged):
+    assert '已删除 1 个索引条目' in fsck(damaged, '--prune')
+
+    with damaged.app_context():
+        assert [entry['id'] for entry in app_module.read_index_file()] == ['r4', 'r2', 'r1']
+    assert 'dangling' not in issue_counts(fsck(damaged))
+
+
+def test_rebuild_index_from_record_files(damaged):
+    assert '已由记录文件重建索引：4 条' in fsck(damaged, '--rebuild-index')
+
+    with damaged.app_context():
+        index = {entry['id']: entry for entry in app_module.read_index_file()}
+        assert sorted(index) == ['orphan', 'r1', 'r2', 'r4']
+        assert index['r2']['status'] == app_module.STATUS_APPROVED
+    assert issue_counts(fsck(damaged)) == {'invalid_json': 1, 'missing_media': 1}
+
+
+def test_prune_and_rebuild_are_exclusive(damaged):
+    result = damaged.test_cli_runner().invoke(args=['fsck', '--prune', '--rebuild-index'])
+    assert result.exit_code == 2
@@ -0,0 +1,76 @@
+"""索引分区：旧的单文件索引拆分为分区后内容和顺序不变，保存时只重写有变化的分区"""
+import json
+import os
+
+import app as app_module
+from index_partitions import IndexPartitions, UNASSIGNED, merge, split
+
+
+def legacy_entries():
+    """旧索引中的条目（最新的在前），包括没有app_id和app_id不是字符串的旧条目"""
+    app_ids = ['midjourney', 'sd/xl', None, 'midjourney', 42, 'dalle', 'sd/xl']
+    entries = [{'id': f"r{n}", 'created_at': f"2026-01-{n + 1:02d}T00:00:00", 'title': f"t{n}", 'app_id': app_id,
+                'status': app_module.STATUS_APPROVED if n % 2 else app_module.STATUS_PENDING}
+               for n, app_id in enumerate(app_ids)]
+    # 创建时间相同的条目保持原来的相对顺序
+    entries.append(dict(entries[3], id='r3b'))
+    entries.sort(key=lambda entry: entry['created_at'], reverse=True)
+    return entries
+
+
+def write_legacy_index(path, entries):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'records': entries, 'total_count': len(entries)}, f)
+
+
+def test_split_and_merge_round_trip():
+    entries = legacy_entries()
+    groups = split(entries)
+
+    assert sorted(groups) == [UNASSIGNED, 'dalle', 'midjourney', 'sd/xl']
+    assert [entry['id'] for entry in groups[UNASSIGNED]] == ['r4', 'r2']
+    assert merge([groups[key] for key in sorted(groups)]) == entries
+
+
+def test_legacy_index_is_migrated_once(tmp_path):
+    entries = legacy_entries()
+    legacy_file = str(tmp_path / 'index.json')
+    write_legacy_index(legacy_file, entries)
+    partitions = IndexPartitions(str(tmp_path / 'index'), legacy_file=legacy_file)
+
+    assert partitions.read_all() == entries
+    assert not os.path.exists(legacy_file) and os.path.exists(f"{legacy_file}.migrated")
+    assert partitions.read('sd/xl') == [entry for entry in entries if entry['app_id'] == 'sd/xl']
+
+    # 其他进程看到的是同一份分区，不会再次迁移
+    other = IndexPartitions(str(tmp_path / 'index'), legacy_file=legacy_file)
+    assert other.read_all() == entries
+    view = other.view('midjourney')
+    assert view.entry(view.find('r3b'))['title'] == 't3'
+    assert other.merged_view().find('r5') is not None
+
+
+def test_app_migrates_and_saves_only_changed_partitions(make_app, tmp_path):
+    entries = legacy_entries()
+    os.makedirs(tmp_path / 'data')
+    write_legacy_index(str(tmp_path / 'data' / 'index.json'), entries)
+    flask_app = make_app()
+
+    with flask_app.app_context():
+        assert app_module.load_records() == entries
+        assert [entry['id'] for entry in app_module.load_index_view('midjourney').entries(
+            app_module.load_index_view('midjourney').rows())] == ['r3', 'r3b', 'r0']
+
+        partition_files = {key: app_module.INDEX_PARTITIONS.path(key) for key in app_module.INDEX_PARTITIONS.keys()}
+        before = {key: os.stat(path).st_mtime_ns for key, path in partition_files.items()}
+        changed = [dict(entry, title='新标题') if entry['id'] == 'r5' else entry for entry in entries]
+        app_module.save_records(changed)
+        after = {key: os.stat(path).st_mtime_ns for key, path in partition_files.items()}
+
+        assert [key for key in sorted(before) if before[key] != after[key]] == ['dalle']
+        assert app_module.load_records() == changed
+        assert app_module.read_index_file() == changed
+
+    client = flask_app.test_client()
+    response = client.get('/api/records?app_id=sd/xl').get_json()
+    assert [record['id'] for record in response['data']] == ['r1']
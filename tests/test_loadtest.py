@@ -0,0 +1,47 @@
+"""压测工具：流量比例解析、延迟汇总，以及对真实WSGI服务器的一次短时间回放"""
+import threading
+
+from werkzeug.serving import make_server
+
+import app as app_module
+from benchmarks.loadtest import Target, parse_mix, run_load, summarize
+
+
+def test_parse_mix():
+    assert parse_mix('records=50, detail=25,media') == {'records': 50.0, 'detail': 25.0, 'media': 1.0}
+
+
+def test_summarize_reports_percentiles_and_errors():
+    samples = {
+        'records': {'latencies': [float(n) for n in range(1, 101)], 'statuses': {'200': 99, '500': 1}, 'errors': 1},
+        'batch': {'latencies': [], 'statuses': {}, 'errors': 0}
+    }
+
+    summary = summarize(samples, elapsed=2.0)
+
+    records = summary['records']
+    assert (records['requests'], records['throughput_rps'], records['error_rate']) == (100, 50.0, 0.01)
+    assert (records['p50_ms'], records['p95_ms'], records['p99_ms'], records['max_ms']) == (51.0, 95.0, 99.0, 100.0)
+    assert summary['batch']['requests'] == 0 and summary['batch']['p99_ms'] is None
+
+
+def test_run_load_against_a_live_server(flask_app, add_record):
+    with flask_app.app_context():
+        for n in range(3):
+            add_record(f"r{n}", status=app_module.STATUS_APPROVED)
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        target = Target(f"http://127.0.0.1:{server.server_port}")
+        target.discover(pages=2)
+        assert sorted(target.record_ids) == ['r0', 'r1', 'r2']
+
+        samples, elapsed = run_load(target, {'records': 2, 'detail': 1}, concurrency=2, duration=0.3, seed=1)
+    finally:
+        server.shutdown()
+        thread.join()
+
+    summary = summarize(samples, elapsed)
+    assert summary['records']['requests'] > 0 and summary['detail']['requests'] > 0
+    assert summary['records']['error_rate'] == summary['detail']['error_rate'] == 0
@@ -0,0 +1,63 @@
+"""结构化日志：字段输出为key=value或JSON行，采样键按比例保留，队列满时丢弃而不阻塞"""
+import io
+import json
+import logging
+import queue
+
+import pytest
+
+import logging_setup
+from logging_setup import DroppingQueueHandler, SamplingFilter, fields, parse_levels, setup_logging
+
+
+@pytest.fixture
+def output():
+    stream = io.StringIO()
+    yield stream
+    logging_setup.shutdown()
+
+
+def lines(stream):
+    logging_setup.shutdown()
+    return stream.getvalue().splitlines()
+
+
+def test_parse_levels():
+    assert parse_levels('app.media=debug, media_gc=WARNING,,broken') == {'app.media': 'DEBUG', 'media_gc': 'WARNING'}
+    assert parse_levels(None) == {}
+
+
+def test_text_and_json_lines(output):
+    setup_logging('INFO', stream=output)
+    logging.getLogger('test.text').info('保存记录', extra=fields(record_id='r1', count=2))
+    assert lines(output)[0].endswith('INFO    test.text 保存记录 record_id=r1 count=2')
+
+    output.seek(0)
+    output.truncate()
+    setup_logging('INFO', fmt='json', stream=output)
+    logging.getLogger('test.json').warning('失败', extra=fields(error=OSError('磁盘已满')))
+    data = json.loads(lines(output)[0])
+    assert (data['level'], data['logger'], data['msg'], data['error']) == ('WARNING', 'test.json', '失败', '磁盘已满')
+
+
+def test_module_levels_and_sampling(output):
+    setup_logging('WARNING', module_levels={'test.verbose': 'DEBUG'}, sample_rates={'preview': 0.25, 'off': 0},
+                  stream=output)
+    logging.getLogger('test.quiet').info('不输出')
+    logging.getLogger('test.verbose').debug('输出')
+    for n in range(8):
+        logging.getLogger('test.verbose').debug('预览', extra=fields(sample='preview', n=n))
+        logging.getLogger('test.verbose').debug('关闭', extra=fields(sample='off', n=n))
+
+    assert [line.split(' ', 1)[1] for line in lines(output)] == [
+        'DEBUG   test.verbose 输出', 'DEBUG   test.verbose 预览 n=0', 'DEBUG   test.verbose 预览 n=4']
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(2))
+    handler.addFilter(SamplingFilter({}))
+    for n in range(5):
+        handler.handle(logging.makeLogRecord({'msg': f"m{n}"}))
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
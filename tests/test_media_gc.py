@@ -0,0 +1,132 @@
+"""孤立媒体回收：被引用的文件、无法解析的索引条目引用的文件都不会被删除"""
+import os
+
+import pytest
+
+from media_gc import MediaGC
+
+
+@pytest.fixture
+def media(tmp_path):
+    folders = {}
+    for name in ('uploads', 'generated', 'thumbnails'):
+        folders[name] = str(tmp_path / name)
+        os.makedirs(folders[name])
+    return folders
+
+
+def make_gc(tmp_path, media, **options):
+    data_folder = tmp_path / 'data'
+    data_folder.mkdir(exist_ok=True)
+    return MediaGC(str(data_folder), media, grace_seconds=0, **options)
+
+
+def write_media(media, key):
+    folder, name = key.split('/', 1)
+    path = os.path.join(media[folder], name)
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    return path
+
+
+def record_with(record_id, *keys, app_id='demo'):
+    return {'id': record_id, 'app_id': app_id,
+            'files': {'materials': [], 'results': [{'path': f"/{key}"} for key in keys]}}
+
+
+def run_until_swept(gc, index_records, load_record, dry_run=False, limit=20):
+    """执行增量回收直到完成一轮扫描，返回所有步骤删除的文件"""
+    deleted = []
+    for _ in range(limit):
+        report = gc.step(index_records, load_record, budget=100, dry_run=dry_run)
+        deleted.extend(report['deleted'])
+        if report['sweep_completed'] or report['phase'] == 'resolve':
+            # 回收在扫描完成后的下一步执行
+            deleted.extend(gc.collect(dry_run=dry_run)['deleted'])
+            return deleted, report
+    raise AssertionError('回收没有完成一轮扫描')
+
+
+def test_referenced_media_survive_and_orphans_are_collected(tmp_path, media):
+    records = {'r1': record_with('r1', 'generated/kept.png')}
+    kept = write_media(media, 'generated/kept.png')
+    orphan = write_media(media, 'generated/orphan.png')
+    gc = make_gc(tmp_path, media)
+
+    deleted, _ = run_until_swept(gc, [{'id': 'r1', 'app_id': 'demo'}], lambda rid, app_id: records.get(rid))
+
+    assert deleted == ['generated/orphan.png']
+    assert os.path.exists(kept)
+    assert not os.path.exists(orphan)
+
+
+def test_media_of_new_records_are_protected_by_the_log(tmp_path, media):
+    gc = make_gc(tmp_path, media, compact_bytes=1)
+    run_until_swept(gc, [], lambda rid, app_id: None)
+    # 引用表建立之后提交的记录只追加到引用日志
+    path = write_media(media, 'uploads/new.png')
+    gc.add_record(record_with('r2', 'uploads/new.png'))
+
+    deleted, _ = run_until_swept(gc, [], lambda rid, app_id: None)
+
+    assert deleted == []
+    assert os.path.exists(path)
+    assert gc.refs() == {'uploads/new.png': ['r2']}
+
+
+def test_released_media_are_collected(tmp_path, media):
+    record = record_with('r1', 'generated/a.png')
+    path = write_media(media, 'generated/a.png')
+    gc = make_gc(tmp_path, media)
+    run_until_swept(gc, [{'id': 'r1', 'app_id': 'demo'}], lambda rid, app_id: record)
+    assert os.path.exists(path)
+
+    gc.release_record(record)
+    deleted, _ = run_until_swept(gc, [], lambda rid, app_id: None)
+
+    assert deleted == ['generated/a.png']
+    assert not os.path.exists(path)
+
+
+def test_unresolved_entries_block_the_sweep(tmp_path, media):
+    path = write_media(media, 'generated/legacy.png')
+    orphan = write_media(media, 'generated/orphan.png')
+    gc = make_gc(tmp_path, media)
+    # 旧的索引条目没有app_id，记录文件也找不到：它引用的文件未知，不能回收任何文件
+    index_records = [{'id': 'old'}]
+
+    deleted, report = run_until_swept(gc, index_records, lambda rid, app_id: None)
+
+    assert deleted == []
+    assert report['phase'] == 'resolve'
+    assert 'old' in report['blocked']
+    assert list(gc.status()['unresolved']) == ['old']
+    assert os.path.exists(path) and os.path.exists(orphan)
+
+    # 条目被修复（能找到记录文件）后补登引用，回收继续
+    records = {'old': record_with('old', 'generated/legacy.png', app_id=None)}
+    deleted, _ = run_until_swept(gc, index_records, lambda rid, app_id: records.get(rid))
+
+    assert deleted == ['generated/orphan.png']
+    assert os.path.exists(path)
+
+
+def test_app_id_less_entries_resolved_through_the_app(flask_app, add_record):
+    import app as app_module
+
+    with flask_app.app_context():
+        add_record('r1', results=['kept.png'])
+        kept = os.path.join(flask_app.config['GENERATED_FOLDER'], 'kept.png')
+        orphan = os.path.join(flask_app.config['GENERATED_FOLDER'], 'orphan.png')
+        for path in (kept, orphan):
+            with open(path, 'wb') as f:
+                f.write(b'x')
+        # 索引条目缺少app_id：find_record在所有app_id目录中查找记录文件
+        index_records = [dict(entry, app_id=None) for entry in app_module.load_records()]
+        gc = app_module.get_media_gc()
+        gc.grace_seconds = 0
+
+        deleted, _ = run_until_swept(gc, index_records, app_module.find_record)
+
+    assert deleted == ['generated/orphan.png']
+    assert os.path.exists(kept)
@@ -0,0 +1,61 @@
+"""媒体冷热分层：降级后URL不变，压缩保存的冷文件不按gzip流的字节范围响应Range请求"""
+import gzip
+import os
+
+import pytest
+
+TEXT = ('第一行,数据\n' * 400).encode('utf-8')
+
+
+@pytest.fixture
+def tiered(flask_app):
+    """热存储中的一个文本文件和一个图片文件，都已降级到冷存储"""
+    tiering = flask_app.extensions['media_tiering']
+    files = {'uploads/table.csv': TEXT, 'generated/image.png': os.urandom(4096)}
+    for key, data in files.items():
+        with open(tiering.hot_path(key), 'wb') as f:
+            f.write(data)
+        tiering.demote(key)
+    return flask_app, files
+
+
+def test_compressible_files_are_stored_compressed(tiered):
+    flask_app, files = tiered
+    tiering = flask_app.extensions['media_tiering']
+
+    assert tiering.locate_cold('uploads/table.csv')[1] is True
+    assert tiering.locate_cold('generated/image.png')[1] is False
+    assert not os.path.exists(tiering.hot_path('uploads/table.csv'))
+
+    assert tiering.promote('uploads/table.csv') == len(TEXT)
+    with open(tiering.hot_path('uploads/table.csv'), 'rb') as f:
+        assert f.read() == TEXT
+    assert tiering.locate_cold('uploads/table.csv') is None
+
+
+def test_gzip_cold_files_ignore_range_and_conditional_requests(tiered):
+    client = tiered[0].test_client()
+
+    response = client.get('/uploads/table.csv', headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-9'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Accept-Ranges'] == 'none'
+    assert 'ETag' not in response.headers and 'Last-Modified' not in response.headers
+    assert gzip.decompress(response.data) == TEXT
+
+    response = client.get('/uploads/table.csv', headers={'Range': 'bytes=0-9', 'If-None-Match': '"x"'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Accept-Ranges'] == 'none'
+    assert response.data == TEXT
+
+
+def test_uncompressed_cold_files_support_ranges(tiered):
+    flask_app, files = tiered
+    client = flask_app.test_client()
+
+    response = client.get('/generated/image.png', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == files['generated/image.png'][10:20]
+    etag = response.headers['ETag']
+    assert client.get('/generated/image.png', headers={'If-None-Match': etag}).status_code == 304
@@ -0,0 +1,95 @@
+"""多进程指标：worker退出、重启后计数器和直方图的合计值不下降"""
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import metrics
+from conftest import REPO_ROOT
+
+WORKER = """
+import sys
+import threading
+import metrics
+metrics.define_counter('test_requests_total', '')
+metrics.define_histogram('test_latency_seconds', '')
+metrics.configure(sys.argv[1])
+for _ in range(int(sys.argv[2])):
+    metrics.inc('test_requests_total', route='/')
+    metrics.observe('test_latency_seconds', 0.01, route='/')
+metrics.flush()
+"""
+
+
+@pytest.fixture
+def metrics_dir(tmp_path):
+    directory = str(tmp_path / 'metrics')
+    metrics.define_counter('test_requests_total', '')
+    metrics.define_histogram('test_latency_seconds', '')
+    metrics.configure(directory)
+    yield directory
+    metrics.configure(None)
+
+
+def run_worker(directory, requests):
+    """在子进程中计数并写快照（子进程退出后快照留在目录中）"""
+    subprocess.run([sys.executable, '-c', WORKER, directory, str(requests)],
+                   env=dict(os.environ, PYTHONPATH=REPO_ROOT), check=True)
+
+
+def totals():
+    collected = metrics.collect()
+    requests = sum(collected.get('test_requests_total', {}).values())
+    latency = collected.get('test_latency_seconds', {})
+    return requests, sum(state['count'] for state in latency.values())
+
+
+def test_counters_stay_monotonic_across_worker_restarts(metrics_dir):
+    run_worker(metrics_dir, 3)
+    assert totals() == (3, 3)
+    # 已退出进程的快照被归档，不再单独保留
+    assert [name for name in os.listdir(metrics_dir) if name.endswith('.json')] == [metrics.RETIRED_FILE]
+
+    # 重启的worker从零开始计数，合计值在之前的基础上增加
+    run_worker(metrics_dir, 2)
+    assert totals() == (5, 5)
+    # 重复汇总不会重复计入归档
+    assert totals() == (5, 5)
+
+
+def test_stale_snapshot_of_a_reused_pid_is_retired(metrics_dir):
+    # 当前进程的pid之前属于一个已退出的进程，它留下的快照不能被本进程的第一次flush覆盖
+    with open(os.path.join(metrics_dir, f"{os.getpid()}.json"), 'w', encoding='utf-8') as f:
+        f.write('{"test_requests_total": {"[]": 7}}')
+    metrics._check_stale = True
+    metrics.flush()
+
+    assert totals()[0] == 7
+
+
+def test_concurrent_flushes_publish_complete_snapshots(metrics_dir, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, 'FLUSH_INTERVAL', 0)
+    snapshot_file = os.path.join(metrics_dir, f"{os.getpid()}.json")
+    metrics.flush()
+    errors = []
+
+    def count():
+        for _ in range(300):
+            metrics.inc('test_requests_total', route='/threads')
+            # 快照一直存在且完整（读取失败时返回None）
+            if metrics._read_snapshot(snapshot_file) is None:
+                errors.append('快照不完整')
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.flush()
+
+    assert errors == []
+    assert not [record for record in caplog.records if record.name == 'metrics']
+    assert metrics.collect()['test_requests_total']['[["route", "/threads"]]'] == 2400
+    assert not [name for name in os.listdir(metrics_dir) if name.endswith('.tmp')]
@@ -0,0 +1,81 @@
+"""审核队列：多个审核员领取到不同的记录，别人持有租约的记录提交时视为冲突"""
+import time
+
+import pytest
+
+from moderation_queue import ModerationQueue
+
+PENDING = ['r1', 'r2', 'r3', 'r4']
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return ModerationQueue(str(tmp_path), lease_seconds=60)
+
+
+def claimed_ids(leases):
+    return [lease['record_id'] for lease in leases]
+
+
+def test_reviewers_claim_disjoint_records(queue):
+    alice, remaining = queue.claim('a', 'alice', PENDING, 2)
+    bob, _ = queue.claim('b', 'bob', PENDING, 2)
+
+    assert claimed_ids(alice) == ['r1', 'r2']
+    assert remaining == 2
+    assert claimed_ids(bob) == ['r3', 'r4']
+    # 再次领取续期自己的租约，不会拿到别人的记录
+    assert claimed_ids(queue.claim('a', 'alice', PENDING, 3)[0]) == ['r1', 'r2']
+
+
+def test_decisions_on_records_leased_by_others_conflict(queue):
+    queue.claim('a', 'alice', PENDING, 2)
+    applied = []
+
+    _, conflicts = queue.commit('b', [{'record_id': 'r1', 'action': 'approve'},
+                                      {'record_id': 'r3', 'action': 'approve'}], applied.extend)
+
+    assert conflicts == ['r1']
+    assert [decision['record_id'] for decision in applied] == ['r3']
+    # 冲突的记录仍由原审核员持有
+    assert claimed_ids(queue.claim('a', 'alice', PENDING, 2)[0]) == ['r1', 'r2']
+
+
+def test_expired_and_released_leases_return_to_the_queue(queue, monkeypatch):
+    queue.claim('a', 'alice', PENDING, 2)
+    queue.release('a', ['r2'])
+    assert claimed_ids(queue.claim('b', 'bob', PENDING, 1)[0]) == ['r2']
+
+    # 租约过期后记录回到队列，原审核员的结论与新的持有者冲突
+    now = time.time()
+    monkeypatch.setattr('moderation_queue.time.time', lambda: now + 120)
+    assert claimed_ids(queue.claim('c', 'carol', PENDING, 4)[0]) == PENDING
+    _, conflicts = queue.commit('a', [{'record_id': 'r1', 'action': 'reject'}], lambda accepted: None)
+    assert conflicts == ['r1']
+
+
+def test_queue_api_reports_conflicts(flask_app, add_record, login):
+    with flask_app.app_context():
+        for record_id in ('r1', 'r2', 'r3'):
+            add_record(record_id, app_id='demo' if record_id != 'r2' else 'other')
+    alice = login(flask_app, 'alice')
+    bob = login(flask_app, 'bob')
+
+    claimed = alice.post('/admin/api/queue/claim', json={'count': 2}).get_json()
+    bob_claimed = bob.post('/admin/api/queue/claim', json={'count': 2}).get_json()
+
+    # 先提交的在前，两个审核员的记录互不重叠
+    assert [record['id'] for record in claimed['data']] == ['r1', 'r2']
+    assert [record['id'] for record in bob_claimed['data']] == ['r3']
+    assert alice.get('/admin/api/queue').get_json()['data']['available'] == 0
+
+    response = bob.post('/admin/api/queue/decisions', json={'decisions': [
+        {'record_id': 'r1', 'action': 'approve'}, {'record_id': 'r3', 'action': 'approve'}]}).get_json()
+    assert response['data']['conflicts'] == ['r1']
+    assert response['data']['succeeded'] == 1
+
+    response = alice.post('/admin/api/queue/decisions', json={'decisions': [
+        {'record_id': 'r1', 'action': 'reject'}], 'release': ['r2']}).get_json()
+    assert response['data']['succeeded'] == 1
+    status = bob.get('/admin/api/queue').get_json()['data']
+    assert (status['pending'], status['leased'], status['available']) == (1, 0, 1)
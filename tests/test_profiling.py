@@ -0,0 +1,91 @@
+"""请求剖析：设置校验，按endpoint和比例剖析请求，下载合并后的pstats和折叠栈，清空结果"""
+import marshal
+import time
+
+import pytest
+
+from profiling import Profiler
+
+
+@pytest.mark.parametrize('changes', [
+    {'unknown': 1},
+    {'generation': 5},
+    {'mode': 'trace'},
+    {'rate': 0},
+    {'rate': 1.5},
+    {'rate': 'abc'},
+    {'interval': 0.0001},
+    {'interval': 2},
+    {'endpoints': {'api.*': True}},
+    {'endpoints': ['api.*', 3]},
+])
+def test_invalid_settings_are_rejected(tmp_path, changes):
+    profiler = Profiler(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        profiler.configure(**changes)
+    assert profiler.settings()['enabled'] is False
+
+
+def test_settings_are_normalized_and_shared(tmp_path):
+    profiler = Profiler(str(tmp_path))
+
+    settings = profiler.configure(enabled=1, rate='0.5', endpoints='api.*, , manage.admin_api_stats')
+
+    assert (settings['enabled'], settings['rate']) == (True, 0.5)
+    assert settings['endpoints'] == ['api.*', 'manage.admin_api_stats']
+    # 其他worker读取同一个设置文件
+    assert Profiler(str(tmp_path)).settings() == settings
+
+
+@pytest.fixture
+def profiled_app(make_app):
+    flask_app = make_app(PROFILE_POLL_SECONDS=0)
+    flask_app.add_url_rule('/slow', 'slow', lambda: time.sleep(0.05) or 'ok')
+    return flask_app
+
+
+def test_cprofile_results_for_matching_endpoints(profiled_app, login):
+    admin = login(profiled_app)
+    client = profiled_app.test_client()
+    response = admin.post('/admin/api/profiling', json={'enabled': True, 'mode': 'cprofile', 'rate': 1,
+                                                         'endpoints': ['api_records']})
+    assert response.get_json()['data']['settings']['enabled'] is True
+
+    for _ in range(3):
+        client.get('/api/records')
+    client.get('/api/apps')
+    admin.post('/admin/api/profiling', json={'enabled': False})
+
+    profiles = admin.get('/admin/api/profiling').get_json()['data']['profiles']
+    assert [(p['mode'], p['endpoint'], p['requests'], p['format']) for p in profiles] == [
+        ('cprofile', 'api.api_records', 3, 'pstats')]
+    download = admin.get('/admin/api/profiling/download?mode=cprofile&endpoint=api.api_records')
+    assert download.headers['Content-Disposition'] == 'attachment; filename="api.api_records.pstats"'
+    functions = {name for _, _, name in marshal.loads(download.get_data())}
+    assert 'api_records' in functions
+
+    assert admin.get('/admin/api/profiling/download?mode=cprofile&endpoint=api.api_apps').status_code == 404
+    assert admin.get('/admin/api/profiling/download?mode=cprofile&endpoint=../settings.json').status_code == 404
+    assert admin.get('/admin/api/profiling/download?mode=trace&endpoint=api.api_records').status_code == 400
+    assert admin.post('/admin/api/profiling', json={'rate': 2}).status_code == 400
+
+    # 清空结果后设置不变
+    response = admin.delete('/admin/api/profiling').get_json()['data']
+    assert response['profiles'] == []
+    assert response['settings']['endpoints'] == ['api_records']
+
+
+def test_sampled_stacks(profiled_app, login):
+    admin = login(profiled_app)
+    admin.post('/admin/api/profiling', json={'enabled': True, 'mode': 'sample', 'rate': 1, 'interval': 0.001,
+                                             'endpoints': ['slow']})
+
+    for _ in range(3):
+        assert profiled_app.test_client().get('/slow').status_code == 200
+
+    download = admin.get('/admin/api/profiling/download?mode=sample&endpoint=slow')
+    assert download.status_code == 200
+    lines = download.get_data(as_text=True).splitlines()
+    assert lines and all(line.rpartition(' ')[2].isdigit() for line in lines)
+    assert any('<lambda> (test_profiling.py' in line for line in lines)
@@ -0,0 +1,66 @@
+"""预览重建：内容和流水线版本没有变化的文件跳过，分批保存进度，中断后从进度继续"""
+import os
+
+import pytest
+
+import app as app_module
+import media
+
+
+@pytest.fixture
+def records(flask_app, add_record):
+    """两条记录，各有一个文本素材；返回 {记录id: 素材路径}"""
+    paths = {}
+    with flask_app.app_context():
+        for record_id in ('r1', 'r2'):
+            record = add_record(record_id)
+            filename = f"{record_id}.txt"
+            paths[record_id] = os.path.join(flask_app.config['UPLOAD_FOLDER'], filename)
+            with open(paths[record_id], 'w', encoding='utf-8') as f:
+                f.write(f"{record_id} 的提示词\n")
+            record['files']['materials'] = [{'id': f"{record_id}-m", 'filename': filename, 'category': 'text',
+                                             'path': f"/uploads/{filename}"}]
+            app_module.save_record(record)
+    return paths
+
+
+def material(record_id):
+    return app_module.load_record(record_id, 'demo')['files']['materials'][0]
+
+
+def test_unchanged_files_are_skipped(flask_app, records):
+    with flask_app.app_context():
+        first = app_module.rebuild_previews(workers=2)
+        assert (first['files'], first['regenerated'], first['updated_records'], first['completed']) == (2, 2, 2, True)
+        assert material('r1')['preview']['text'] == 'r1 的提示词\n'
+        assert material('r1')['preview_version'] == media.PREVIEW_VERSION
+
+        second = app_module.rebuild_previews(workers=2)
+        assert (second['regenerated'], second['unchanged'], second['updated_records']) == (0, 2, 0)
+
+        with open(records['r2'], 'w', encoding='utf-8') as f:
+            f.write('新的内容\n')
+        os.utime(records['r2'], (1, 1))
+        third = app_module.rebuild_previews(workers=2)
+        assert (third['regenerated'], third['unchanged']) == (1, 1)
+        assert material('r2')['preview']['text'] == '新的内容\n'
+        assert app_module.rebuild_previews(workers=2, force=True)['regenerated'] == 2
+
+
+def test_interrupted_rebuild_resumes_from_the_cursor(flask_app, records):
+    runner = flask_app.test_cli_runner()
+
+    result = runner.invoke(args=['rebuild-previews', '--workers', '1', '--batch', '1', '--limit', '1'])
+    assert result.exit_code == 0
+    assert result.output.splitlines()[-1] == '更新 1 条记录，0 个文件不可用（已删除或压缩保存在冷存储），下次执行从进度继续'
+    with flask_app.app_context():
+        assert app_module.load_rebuild_state()['cursor'] == 'r1'
+        assert 'preview' not in material('r2')
+
+        report = app_module.rebuild_previews(workers=1)
+        assert (report['records'], report['updated_records'], report['completed']) == (1, 1, True)
+        assert app_module.load_rebuild_state()['cursor'] == ''
+
+        os.remove(records['r1'])
+        report = app_module.rebuild_previews(workers=1, restart=True)
+        assert (report['records'], report['unavailable'], report['unchanged']) == (2, 1, 1)
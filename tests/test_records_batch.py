@@ -0,0 +1,53 @@
+"""批量获取记录详情：按请求顺序返回，不存在和无权查看的记录单独列出，超过上限返回400"""
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def batch_app(make_app, add_record):
+    flask_app = make_app(BATCH_FETCH_MAX=4)
+    with flask_app.app_context():
+        add_record('r1', status=app_module.STATUS_APPROVED)
+        add_record('r2', app_id='other', status=app_module.STATUS_APPROVED)
+        add_record('r3')
+    return flask_app
+
+
+def test_records_keep_the_requested_order(batch_app):
+    client = batch_app.test_client()
+
+    response = client.post('/api/records/batch', json={'ids': ['r2', 'missing', 'r1', 'r2', 'r3']})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [record['id'] for record in body['data']] == ['r2', 'r1']
+    # 与单条接口返回相同的记录
+    assert body['data'][0] == client.get('/api/record/r2').get_json()['data']
+    assert body['errors'] == {'missing': {'status': 404, 'error': '记录不存在'},
+                              'r3': {'status': 403, 'error': '该案例正在审核中，暂不可查看'}}
+
+
+def test_admins_see_pending_records(batch_app, login):
+    body = login(batch_app).post('/api/records/batch', json={'ids': ['r3', 'r1']}).get_json()
+
+    assert [record['id'] for record in body['data']] == ['r3', 'r1']
+    assert body['errors'] == {}
+
+
+@pytest.mark.parametrize('payload', [None, {}, {'ids': 'r1'}, {'ids': ['r1', 2]}, {'ids': ['r1', 'r2', 'r3', 'r4', 'r5']}])
+def test_invalid_requests(batch_app, payload):
+    client = batch_app.test_client()
+
+    response = client.post('/api/records/batch', json=payload) if payload is not None else \
+        client.post('/api/records/batch', data='not json', content_type='application/json')
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_duplicates_do_not_count_toward_the_limit(batch_app):
+    response = batch_app.test_client().post('/api/records/batch', json={'ids': ['r1'] * 10 + ['r2', 'r3']})
+
+    assert response.status_code == 200
+    assert [record['id'] for record in response.get_json()['data']] == ['r1', 'r2']
@@ -0,0 +1,75 @@
+"""视频预览：缩小尺寸、降低帧率后比原视频小才使用，提交后在后台生成并合并到记录中"""
+import io
+import os
+
+import pytest
+
+import app as app_module
+import media
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+FORM = {'title': '视频', 'app_id': 'demo', 'datetime': '2026-01-01T00:00', 'prompt': 'seed: 1'}
+
+
+def write_video(path, frames=45, fps=30, size=(640, 360)):
+    """MJPG编码的测试视频（体积大，预览一定更小）"""
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    rng = np.random.default_rng(0)
+    for n in range(frames):
+        frame = rng.integers(0, 30, (size[1], size[0], 3), dtype=np.uint8)
+        cv2.circle(frame, (10 * n, size[1] // 2), 40, (0, 255, 0), -1)
+        writer.write(frame)
+    writer.release()
+    return str(path)
+
+
+def test_rendition_is_scaled_and_resampled(tmp_path):
+    source = write_video(tmp_path / 'clip.avi')
+    rendition = media.generate_video_rendition(source, 'clip.avi', str(tmp_path), max_width=320, max_fps=10)
+    if rendition is None:
+        pytest.skip('OpenCV没有可用的H.264/VP8编码器')
+
+    path = tmp_path / os.path.basename(rendition['rendition'])
+    assert rendition['rendition'].startswith('/thumbnails/preview_clip.avi.')
+    assert os.path.getsize(path) < os.path.getsize(source)
+    video = cv2.VideoCapture(str(path))
+    assert (video.get(cv2.CAP_PROP_FRAME_WIDTH), video.get(cv2.CAP_PROP_FRAME_HEIGHT)) == (320, 180)
+    assert video.get(cv2.CAP_PROP_FPS) == 10
+    assert video.get(cv2.CAP_PROP_FRAME_COUNT) == 15
+    video.release()
+    assert sorted(os.listdir(tmp_path)) == ['clip.avi', path.name]
+
+    # 已有预览时直接复用
+    assert media.generate_video_rendition(source, 'clip.avi', str(tmp_path)) == rendition
+
+
+def test_unreadable_videos_have_no_rendition(tmp_path):
+    (tmp_path / 'broken.mp4').write_bytes(b'not a video')
+
+    assert media.generate_video_rendition(str(tmp_path / 'broken.mp4'), 'broken.mp4', str(tmp_path)) is None
+    assert os.listdir(tmp_path) == ['broken.mp4']
+
+
+@pytest.mark.parametrize('enabled', [True, False])
+def test_submitted_videos_get_renditions_in_the_background(make_app, tmp_path, monkeypatch, enabled):
+    flask_app = make_app(VIDEO_RENDITIONS=enabled, RENDITION_MAX_WIDTH=320)
+    scheduled = []
+    # 在请求线程中直接执行后台任务
+    monkeypatch.setattr(media, 'run_in_background', lambda workers, fn, *args: scheduled.append(fn) or fn(*args))
+    with open(write_video(tmp_path / 'source.avi'), 'rb') as f:
+        content = f.read()
+
+    response = flask_app.test_client().post('/submit', data=dict(FORM, results=(io.BytesIO(content), 'clip.avi')),
+                                            content_type='multipart/form-data')
+
+    assert response.get_json()['success']
+    record_id = response.get_json()['record_id']
+    with flask_app.app_context():
+        preview = app_module.load_record(record_id, 'demo')['files']['results'][0]['preview']
+    assert (app_module.render_record_videos in scheduled) == enabled
+    if enabled and 'rendition' not in preview:
+        pytest.skip('OpenCV没有可用的H.264/VP8编码器')
+    assert ('rendition' in preview) == enabled
+    assert 'thumbnail' in preview
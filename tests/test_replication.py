@@ -0,0 +1,58 @@
+"""只读副本：/replication/ 接口必须使用令牌，副本从主节点的变更日志同步索引和记录"""
+import json
+
+import app as app_module
+
+TOKEN = 'secret-token'
+
+
+def replica_folders(tmp_path):
+    root = tmp_path / 'replica'
+    return {key: str(root / name) for key, name in (
+        ('DATA_FOLDER', 'data'), ('UPLOAD_FOLDER', 'uploads'), ('GENERATED_FOLDER', 'generated'),
+        ('OUTPUT_FOLDER', 'output'), ('THUMBNAIL_FOLDER', 'thumbnails'), ('COLD_FOLDER', 'cold'))}
+
+
+def test_replication_endpoints_are_not_served_without_a_token(make_app):
+    client = make_app(REPLICATION_LOG=True).test_client()
+
+    # 本机请求同样不放行
+    assert client.get('/replication/changes').status_code == 404
+    assert client.get('/replication/snapshot').status_code == 404
+
+
+def test_replication_endpoints_require_the_token(make_app, add_record):
+    flask_app = make_app(REPLICATION_LOG=True, REPLICATION_TOKEN=TOKEN)
+    with flask_app.app_context():
+        add_record('r1', status=app_module.STATUS_APPROVED)
+    client = flask_app.test_client()
+
+    assert client.get('/replication/changes').status_code == 403
+    assert client.get('/replication/changes', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get('/replication/snapshot').status_code == 403
+
+    headers = {'Authorization': f"Bearer {TOKEN}"}
+    changes = client.get('/replication/changes', headers=headers).get_json()['data']
+    assert {entry['op'] for entry in changes['entries']} >= {'record'}
+    snapshot = client.get('/replication/snapshot', headers=headers)
+    assert snapshot.status_code == 200
+    assert 'seq' in json.loads(snapshot.get_data(as_text=True).splitlines()[0])
+
+
+def test_replica_follows_the_primary(make_app, add_record, tmp_path):
+    primary = make_app(REPLICATION_LOG=True)
+    with primary.app_context():
+        add_record('r1', status=app_module.STATUS_APPROVED)
+        add_record('r2', app_id='other', status=app_module.STATUS_APPROVED)
+        add_record('r3')
+        primary_data = primary.config['DATA_FOLDER']
+
+    replica = make_app(APP_ROLE='api', REPLICA_SOURCE=primary_data, **replica_folders(tmp_path))
+    with replica.app_context():
+        report = app_module.get_replica().sync(app_module.apply_replicated_changes)
+        assert report['seq'] > 0
+        assert [entry['id'] for entry in app_module.load_records()] == ['r3', 'r2', 'r1']
+        assert app_module.load_record('r2', 'other')['title'] == '记录 r2'
+
+    response = replica.test_client().get('/api/records').get_json()
+    assert [record['id'] for record in response['data']] == ['r2', 'r1']
@@ -0,0 +1,101 @@
+"""记录文件分片：旧的平铺布局在迁移前后都能读取，迁移不覆盖更新的版本，也不迁移不在索引中的文件"""
+import os
+
+import app as app_module
+
+
+def flatten(record_id, app_id='demo'):
+    """把记录文件移回旧的平铺布局"""
+    legacy_file = app_module.legacy_record_file_path(record_id, app_id)
+    os.replace(app_module.record_file_path(record_id, app_id), legacy_file)
+    return legacy_file
+
+
+def test_records_are_sharded_by_hash(flask_app, add_record):
+    with flask_app.app_context():
+        add_record('r1')
+        record_file = app_module.record_file_path('r1', 'demo')
+
+        assert os.path.exists(record_file)
+        assert os.path.basename(os.path.dirname(record_file)) == app_module.record_shard('r1')
+        assert app_module.load_record('r1', 'demo')['title'] == '记录 r1'
+
+
+def test_reshard_in_batches(flask_app, add_record):
+    with flask_app.app_context():
+        for n in range(5):
+            add_record(f"r{n}")
+            flatten(f"r{n}")
+        orphan = app_module.legacy_record_file_path('orphan', 'demo')
+        with open(orphan, 'w', encoding='utf-8') as f:
+            f.write('{}')
+
+        # 迁移前从旧布局读取
+        assert app_module.load_record('r3', 'demo')['id'] == 'r3'
+        assert app_module.reshard_app_records('demo', dry_run=True) == {
+            'moved': 5, 'skipped': 0, 'unindexed': 1, 'remaining': 0}
+        first = app_module.reshard_app_records('demo', limit=3)
+        assert (first['moved'], first['remaining'], first['unindexed']) == (3, 2, 1)
+        assert app_module.reshard_app_records('demo')['moved'] == 2
+
+        for n in range(5):
+            assert os.path.exists(app_module.record_file_path(f"r{n}", 'demo'))
+            assert not os.path.exists(app_module.legacy_record_file_path(f"r{n}", 'demo'))
+            assert app_module.load_record(f"r{n}", 'demo')['id'] == f"r{n}"
+        assert os.path.exists(orphan)
+
+
+def test_reshard_keeps_newer_sharded_versions(flask_app, add_record):
+    with flask_app.app_context():
+        record = add_record('r1')
+        flatten('r1')
+        # 分片目录中已有save_record写入的新版本（直接写入，保留旧布局下的副本）
+        app_module.write_json_atomic(app_module.record_file_path('r1', 'demo'), dict(record, title='新标题'))
+
+        assert app_module.reshard_app_records('demo') == {'moved': 0, 'skipped': 1, 'unindexed': 0, 'remaining': 0}
+        assert app_module.load_record('r1', 'demo')['title'] == '新标题'
+        assert not os.path.exists(app_module.legacy_record_file_path('r1', 'demo'))
+
+
+def test_reshard_copies_when_hard_links_are_unsupported(flask_app, add_record, monkeypatch):
+    with flask_app.app_context():
+        add_record('r1')
+        flatten('r1')
+
+        def unsupported(source, target):
+            raise PermissionError(1, '不支持硬链接')
+        monkeypatch.setattr(app_module.os, 'link', unsupported)
+
+        assert app_module.reshard_app_records('demo')['moved'] == 1
+        assert app_module.load_record('r1', 'demo')['title'] == '记录 r1'
+        assert not [name for name in os.listdir(os.path.dirname(app_module.record_file_path('r1', 'demo')))
+                    if name.endswith('.tmp')]
+
+
+def test_saving_and_deleting_legacy_records(flask_app, add_record):
+    with flask_app.app_context():
+        record = add_record('r1')
+        add_record('r2')
+        legacy_r1 = flatten('r1')
+        legacy_r2 = flatten('r2')
+
+        # 保存后只剩分片文件；删除时两种布局下的文件都删除
+        app_module.save_record(dict(record, title='新标题'))
+        assert not os.path.exists(legacy_r1)
+        assert app_module.load_record('r1', 'demo')['title'] == '新标题'
+        app_module.delete_record_file('r2', 'demo')
+        assert not os.path.exists(legacy_r2)
+        assert app_module.load_record('r2', 'demo') is None
+
+
+def test_reshard_command(flask_app, add_record):
+    with flask_app.app_context():
+        add_record('r1')
+        add_record('r2', app_id='other')
+        flatten('r1')
+        flatten('r2', 'other')
+
+    result = flask_app.test_cli_runner().invoke(args=['reshard-records', '--batch', '1'])
+
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ['demo: 已迁移 1 个文件', 'other: 已迁移 1 个文件']
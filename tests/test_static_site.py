@@ -0,0 +1,75 @@
+"""静态站点导出：全量导出只包含已审核通过的案例，审核后只重写受影响日期的分片和详情页"""
+import json
+import os
+
+import pytest
+
+import app as app_module
+from static_site import app_path
+
+
+@pytest.fixture
+def site(make_app, add_record):
+    flask_app = make_app(STATIC_EXPORT=True)
+
+    def add(record_id, day, app_id='demo', status=app_module.STATUS_APPROVED):
+        record = add_record(record_id, app_id=app_id, status=status)
+        record['created_at'] = f"2026-01-{day:02d}T12:00:00"
+        app_module.save_record(record)
+        app_module.update_index_partition(app_id, lambda records: [
+            app_module.build_index_entry(record) if entry['id'] == record_id else entry for entry in records])
+
+    with flask_app.app_context():
+        add('r1', 1)
+        add('r2', 2, app_id='sd/xl')
+        add('r3', 2, status=app_module.STATUS_PENDING)
+        add('r4', 3)
+    result = flask_app.test_cli_runner().invoke(args=['export-static'])
+    assert result.exit_code == 0
+    return flask_app
+
+
+def read_json(flask_app, *parts):
+    with open(os.path.join(flask_app.config['OUTPUT_FOLDER'], 'data', *parts), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def output_files(flask_app):
+    root = flask_app.config['OUTPUT_FOLDER']
+    return {os.path.relpath(os.path.join(folder, name), root): os.stat(os.path.join(folder, name)).st_mtime_ns
+            for folder, _, names in os.walk(root) for name in names}
+
+
+def test_full_export(site):
+    manifest = read_json(site, 'manifest.json')
+
+    assert manifest['total'] == 3
+    assert manifest['shards'] == [{'key': '2026-01-03', 'count': 1}, {'key': '2026-01-02', 'count': 1},
+                                  {'key': '2026-01-01', 'count': 1}]
+    assert manifest['first_page'] == ['r4', 'r2', 'r1']
+    assert [card['id'] for card in read_json(site, 'shards', '2026-01-02.json')] == ['r2']
+    # 含特殊字符的app_id使用哈希目录名
+    assert manifest['app_paths']['sd/xl'] == app_path('sd/xl') != 'sd/xl'
+    assert read_json(site, 'apps', app_path('sd/xl'), 'manifest.json')['total'] == 1
+    assert sorted(name for name in output_files(site) if name.startswith('records')) == [
+        'records/r1.html', 'records/r2.html', 'records/r4.html']
+
+
+def test_review_updates_only_the_affected_day(site, login):
+    before = output_files(site)
+    client = login(site)
+
+    assert client.post('/admin/api/review/r3', json={'action': 'approve'}).get_json()['success']
+
+    after = output_files(site)
+    changed = sorted(name for name in after if before.get(name) != after[name])
+    assert changed == ['data/apps/demo/manifest.json', 'data/apps/demo/shards/2026-01-02.json',
+                       'data/manifest.json', 'data/shards/2026-01-02.json', 'index.html', 'records/r3.html']
+    assert [card['id'] for card in read_json(site, 'shards', '2026-01-02.json')] == ['r3', 'r2']
+
+    # 拒绝某一天唯一的记录时删除该日期的分片和详情页
+    assert client.post('/admin/api/review/r1', json={'action': 'reject'}).get_json()['success']
+    files = output_files(site)
+    assert 'records/r1.html' not in files and 'data/shards/2026-01-01.json' not in files
+    manifest = read_json(site, 'manifest.json')
+    assert (manifest['total'], [shard['key'] for shard in manifest['shards']]) == (3, ['2026-01-03', '2026-01-02'])
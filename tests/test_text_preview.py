@@ -0,0 +1,82 @@
+"""文本预览：编码检测、CSV表格、JSON结构摘要，大文件只读取开头并估算行数和元素数"""
+import codecs
+import json
+
+import pytest
+
+import text_preview
+from text_preview import build_preview, decode
+
+
+def write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+@pytest.mark.parametrize('content, encoding', [
+    ('你好，世界'.encode('utf-8'), 'utf-8'),
+    (codecs.BOM_UTF8 + '你好'.encode('utf-8'), 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE + '你好'.encode('utf-16-le'), 'utf-16-le'),
+    ('你好，世界'.encode('gbk'), 'gb18030'),
+    (b'caf\xe9 \x81\x30', 'latin-1'),
+])
+def test_encoding_detection(content, encoding):
+    detected, text = decode(content, truncated=False)
+
+    assert detected == encoding
+    if encoding != 'latin-1':
+        assert text in ('你好，世界', '你好')
+
+
+def test_multibyte_character_cut_at_the_read_limit_is_still_utf8():
+    assert decode('预览'.encode('utf-8')[:-1], truncated=True) == ('utf-8', '预')
+
+
+def test_small_files_are_counted_exactly(tmp_path):
+    path = write(tmp_path, 'notes.txt', ('第一行\n' * 5 + '最后一行').encode('gbk'))
+
+    preview = build_preview(path, 'notes.txt')
+
+    assert (preview['encoding'], preview['lines'], preview['lines_estimated']) == ('gb18030', 6, False)
+    assert preview['text'].startswith('第一行\n')
+
+
+def test_csv_table(tmp_path):
+    rows = ['名称;数量'] + [f"item{n};{n}" for n in range(30)]
+    path = write(tmp_path, 'table.csv', '\n'.join(rows).encode('utf-8'))
+
+    preview = build_preview(path, 'table.csv')
+
+    table = preview['table']
+    assert (table['header'], table['delimiter'], table['columns']) == (['名称', '数量'], ';', 2)
+    assert len(table['rows']) == text_preview.CSV_ROWS
+    assert (preview['rows'], preview['rows_estimated']) == (30, False)
+
+
+def test_json_shape(tmp_path):
+    path = write(tmp_path, 'data.json', json.dumps({'items': [{'id': 1, 'ok': True}], 'name': None}).encode())
+
+    shape = build_preview(path, 'data.json')['json']
+
+    assert shape['keys'] == ['items', 'name']
+    assert shape['fields']['items'] == {'type': 'array', 'length': 1,
+                                        'item': {'type': 'object', 'key_count': 2, 'keys': ['id', 'ok']}}
+    assert shape['fields']['name'] == {'type': 'null'}
+    assert build_preview(write(tmp_path, 'bad.json', b'{"a": '), 'bad.json')['json']['valid'] is False
+
+
+def test_large_files_read_a_bounded_prefix(tmp_path):
+    items = [{'id': n, 'title': f"记录 {n}"} for n in range(40000)]
+    content = json.dumps(items, ensure_ascii=False, indent=1).encode('utf-8')
+    assert len(content) > 10 * text_preview.PREVIEW_BYTES
+    path = write(tmp_path, 'big.json', content)
+
+    preview = build_preview(path, 'big.json')
+
+    assert len(preview['text']) == text_preview.TEXT_CHARS
+    assert preview['lines_estimated'] is True
+    assert preview['lines'] == pytest.approx(content.count(b'\n') + 1, rel=0.1)
+    shape = preview['json']
+    assert shape['estimated'] is True and shape['item']['keys'] == ['id', 'title']
+    assert shape['length'] == pytest.approx(len(items), rel=0.1)
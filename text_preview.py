@@ -0,0 +1,214 @@
+"""
+文本、CSV、JSON素材的预览
+
+通过mmap只读取文件开头的有限字节（PREVIEW_BYTES），大文件另外读取中间和末尾两个小窗口用来估算行数，
+无论文件多大，生成预览的IO、耗时和内存都是有界的：
+
+- 编码：BOM -> UTF-8 -> GB18030（兼容GBK/GB2312）-> latin-1，文件只读取一次，
+  UTF-8在第一个非法字节处即失败，非UTF-8文件最多再解码一次
+- CSV：表头和前几行组成的表格，数据行数（大文件为估算值）
+- JSON：结构摘要（顶层类型、键、数组长度、元素结构），被截断的大文件逐个解码顶层元素并估算总数
+"""
+import io
+import os
+import csv
+import json
+import mmap
+import codecs
+
+# 读取的文件开头字节数
+PREVIEW_BYTES = 64 * 1024
+# 估算行数时在文件中间和末尾各读取的字节数
+SAMPLE_WINDOW = 16 * 1024
+# 预览文本（卡片和详情页显示）的字符数
+TEXT_CHARS = 100
+# CSV表格的行数、列数和单元格字符数上限
+CSV_ROWS = 10
+CSV_COLUMNS = 20
+CELL_CHARS = 80
+# JSON摘要中每个对象列出的键数和展开的层数
+JSON_KEYS = 20
+JSON_DEPTH = 2
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be')
+)
+
+
+def read_windows(path):
+    """返回 (文件大小, 开头字节, [中间和末尾的抽样字节])"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0, b'', []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        head = mm[:PREVIEW_BYTES]
+        samples = []
+        if size > PREVIEW_BYTES:
+            for start in (size // 2, size - SAMPLE_WINDOW):
+                start = max(PREVIEW_BYTES, start)
+                samples.append(mm[start:start + SAMPLE_WINDOW])
+    return size, head, samples
+
+
+def decode(head, truncated):
+    """检测编码并解码开头字节，返回 (编码, 文本)"""
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, head[len(bom):].decode(encoding.replace('-sig', ''), errors='replace')
+    for encoding in ('utf-8', 'gb18030'):
+        # 增量解码器：被截断在末尾的多字节字符不算解码失败
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            return encoding, decoder.decode(head, final=not truncated)
+        except UnicodeDecodeError:
+            continue
+    return 'latin-1', head.decode('latin-1')
+
+
+def count_lines(size, head, samples, text):
+    """行数，返回 (行数, 是否为估算值)；完整读取的文件按解码后的文本计数，大文件按抽样窗口中的换行密度估算"""
+    if not samples:
+        return text.count('\n') + (1 if text and not text.endswith('\n') else 0), False
+    window = len(head) + sum(len(sample) for sample in samples)
+    newlines = head.count(b'\n') + sum(sample.count(b'\n') for sample in samples)
+    return max(1, round(newlines * size / window)), True
+
+
+def csv_table(text, truncated):
+    """CSV表头和前几行"""
+    lines = text.splitlines(keepends=True)
+    if truncated and len(lines) > 1:
+        lines = lines[:-1]  # 最后一行可能不完整
+    sample = ''.join(lines[:CSV_ROWS * 4 + 1])
+    try:
+        dialect = csv.Sniffer().sniff(sample[:8192], delimiters=',;\t|')
+    except csv.Error:
+        dialect = csv.excel
+
+    rows = []
+    for row in csv.reader(io.StringIO(sample), dialect):
+        if row:
+            rows.append([cell[:CELL_CHARS] for cell in row[:CSV_COLUMNS]])
+        if len(rows) > CSV_ROWS:
+            break
+    if not rows:
+        return None
+    return {
+        'header': rows[0],
+        'rows': rows[1:],
+        'columns': len(rows[0]),
+        'delimiter': dialect.delimiter
+    }
+
+
+def json_shape(value, depth=0):
+    """JSON值的结构摘要"""
+    if isinstance(value, dict):
+        shape = {'type': 'object', 'key_count': len(value), 'keys': list(value)[:JSON_KEYS]}
+        if depth < JSON_DEPTH:
+            shape['fields'] = {key: json_shape(item, depth + 1) for key, item in list(value.items())[:JSON_KEYS]}
+        return shape
+    if isinstance(value, list):
+        shape = {'type': 'array', 'length': len(value)}
+        if value and depth < JSON_DEPTH:
+            shape['item'] = json_shape(value[0], depth + 1)
+        return shape
+    if isinstance(value, bool):
+        return {'type': 'boolean'}
+    if isinstance(value, (int, float)):
+        return {'type': 'number'}
+    if value is None:
+        return {'type': 'null'}
+    return {'type': 'string'}
+
+
+def _skip(text, index):
+    while index < len(text) and text[index] in ' \t\r\n':
+        index += 1
+    return index
+
+
+def truncated_json_shape(text, size, head_bytes):
+    """
+    被截断的JSON（只有开头部分）的结构摘要
+
+    逐个解码顶层数组元素或对象成员，直到遇到不完整的值为止，
+    再按已解码部分占开头字节的比例估算元素总数。
+    """
+    decoder = json.JSONDecoder()
+    index = _skip(text, 0)
+    if index >= len(text) or text[index] not in '[{':
+        return {'type': 'unknown', 'valid': False}
+    is_array = text[index] == '['
+    index += 1
+    items = {} if not is_array else []
+    count = 0
+    try:
+        while True:
+            index = _skip(text, index)
+            if text[index] in ']}':
+                break
+            if is_array:
+                value, index = decoder.raw_decode(text, index)
+                if count == 0:
+                    items.append(value)
+            else:
+                key, index = decoder.raw_decode(text, index)
+                index = _skip(text, index)
+                if text[index] != ':':
+                    break
+                value, index = decoder.raw_decode(text, _skip(text, index + 1))
+                if len(items) < JSON_KEYS:
+                    items[key] = value
+            count += 1
+            index = _skip(text, index)
+            if text[index] == ',':
+                index += 1
+    except (ValueError, IndexError):
+        pass  # 到达截断位置
+
+    shape = json_shape(items)
+    consumed = head_bytes * index / max(1, len(text))
+    estimate = max(count, round(count * size / consumed)) if consumed else count
+    if is_array:
+        shape['length'] = estimate
+    else:
+        shape['key_count'] = estimate
+    shape['estimated'] = True
+    return shape
+
+
+def build_preview(path, filename):
+    """生成文本类文件的预览字段（合并到文件的preview中）"""
+    size, head, samples = read_windows(path)
+    truncated = size > len(head)
+    encoding, text = decode(head, truncated)
+    lines, lines_estimated = count_lines(size, head, samples, text)
+    preview = {
+        'text': text[:TEXT_CHARS],
+        'encoding': encoding,
+        'size': size,
+        'lines': lines,
+        'lines_estimated': lines_estimated
+    }
+
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.csv':
+        table = csv_table(text, truncated)
+        if table:
+            preview['format'] = 'csv'
+            preview['table'] = table
+            preview['rows'] = max(0, lines - 1)
+            preview['rows_estimated'] = lines_estimated
+    elif ext == '.json':
+        preview['format'] = 'json'
+        if truncated:
+            preview['json'] = truncated_json_shape(text, size, len(head))
+        else:
+            try:
+                preview['json'] = json_shape(json.loads(text))
+            except ValueError:
+                preview['json'] = {'type': 'unknown', 'valid': False}
+    return preview